@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+归档基准：若干 run 的随机命中事件经 ColumnarAgg + write_aggregates 写库（同 bench_report 管线）后归档并清理明细
+- 占用：KEY_TIME_BUCKET LOG_MATCH_SUMMARY 在 SQLite 中的体积（含索引 清理并 VACUUM 前后文件大小之差）对比归档目录大小
+- 扫描：前 k 个模板 小时趋势 run 差异 直接查 SQLite 明细 与 ArchiveReader 从内存映射列查询
+核对：两者结果完全一致 归档体积至少小 --ratio 倍 重复归档不产生新分区
+用法：python -m benchmarks.bench_archive [--runs 4] [--events 300000] [--templates 2000] [--ratio 10]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_report import T0, fill_runs, timed
+from logsys.archive import ArchiveReader, archive_runs
+from logsys.db import Database
+from logsys.main import init_db
+from logsys.utils import epoch_iso
+
+TOP_SQL = ("SELECT template_id, SUM(count_in_bucket) n FROM KEY_TIME_BUCKET WHERE bucket_granularity=? "
+           "AND bucket_start >= ? AND bucket_start < ?{} GROUP BY template_id ORDER BY n DESC, template_id LIMIT 20")
+TREND_SQL = ("SELECT bucket_start, SUM(count_in_bucket) FROM KEY_TIME_BUCKET WHERE bucket_granularity='hour' "
+             "AND bucket_start >= ? AND bucket_start < ?{} GROUP BY bucket_start ORDER BY bucket_start")
+DIFF_SQL = ("SELECT template_id, SUM(CASE WHEN run_id=? THEN line_count ELSE 0 END) a, "
+            "SUM(CASE WHEN run_id=? THEN line_count ELSE 0 END) b FROM LOG_MATCH_SUMMARY WHERE run_id IN (?, ?) "
+            "GROUP BY template_id ORDER BY abs(b - a) DESC, template_id LIMIT 20")
+
+
+def dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(r, f)) for r, _, fs in os.walk(path) for f in fs)
+
+
+def queries(runs, tid):
+    """(名称, SQL, 参数, 归档查询)；时间范围跨多天分区"""
+    start, end, mod = epoch_iso(T0 + 86400)[:10], epoch_iso(T0 + 9 * 86400)[:10], "M3"
+    return [
+        ("top day all", TOP_SQL.format(""), ("day", start, end), lambda r: r.top_templates(start, end)),
+        ("top day mod", TOP_SQL.format(" AND mod = ?"), ("day", start, end, mod),
+         lambda r: r.top_templates(start, end, mod)),
+        ("top 5min mod", TOP_SQL.format(" AND mod = ?"), ("5min", start, end, mod),
+         lambda r: r.top_templates(start, end, mod, gran="5min")),
+        ("trend mod", TREND_SQL.format(" AND mod = ?"), (start, end, mod), lambda r: r.trend(start, end, mod=mod)),
+        ("trend tpl+mod", TREND_SQL.format(" AND mod = ? AND template_id = ?"), (start, end, mod, tid),
+         lambda r: r.trend(start, end, tid, mod)),
+        ("run diff", DIFF_SQL, (runs[0], runs[1]) * 2, lambda r: r.run_diff(runs[0], runs[1])),
+    ]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=4)
+    ap.add_argument("--events", type=int, default=300000, help="每个 run 的命中事件数")
+    ap.add_argument("--templates", type=int, default=2000)
+    ap.add_argument("--ratio", type=float, default=10.0, help="要求的 SQLite / 归档 体积比")
+    a = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "pipe.db")
+        db = Database(path)
+        init_db(db)
+        runs = fill_runs(db, a, np.random.default_rng(23), {})
+        c = db.conn
+        n_bucket = c.execute("SELECT COUNT(*) FROM KEY_TIME_BUCKET").fetchone()[0]
+        n_summary = c.execute("SELECT COUNT(*) FROM LOG_MATCH_SUMMARY").fetchone()[0]
+        tid = c.execute("SELECT template_id FROM LOG_MATCH_SUMMARY GROUP BY 1 ORDER BY SUM(line_count) DESC "
+                        "LIMIT 1").fetchone()[0]
+        qs = queries(runs, tid)
+        q: dict = {}
+        raw = {}
+        for name, sql, args, _ in qs:
+            with timed(q, "sql " + name):
+                raw[name] = [tuple(r) for r in c.execute(sql, args)]
+        if c.in_transaction:
+            c.commit()
+        c.execute("VACUUM")
+        before = os.path.getsize(path)
+
+        root = os.path.join(d, "archive")
+        cfg = {"app": {"archive_dir": root}}
+        t = time.perf_counter()
+        st = archive_runs(cfg, db, purge=True)
+        t_arch = time.perf_counter() - t
+        assert st["runs"] == a.runs and st["buckets"] == n_bucket and st["summary"] == n_summary, st
+        assert archive_runs(cfg, db)["runs"] == 0, "重复归档"
+        c.execute("VACUUM")
+        sqlite_bytes = before - os.path.getsize(path)
+        arch_bytes = dir_size(root)
+        n_days = len(os.listdir(os.path.join(root, "buckets")))
+        c.close()
+
+        reader = ArchiveReader(root)
+        for name, _, _, fn in qs:
+            with timed(q, "arc " + name):
+                got = fn(reader)
+            want = raw[name]
+            if name == "run diff":
+                want = [(t, x, y, y - x) for t, x, y in want]
+            assert got == want, (name, got[:3], want[:3])
+        shutil.rmtree(root)
+
+    ratio = sqlite_bytes / arch_bytes
+    print(f"{a.runs} 个 run KEY_TIME_BUCKET {n_bucket} 行 LOG_MATCH_SUMMARY {n_summary} 行 归档 {n_days} 个日分区 "
+          f"耗时 {t_arch:.2f}s")
+    print(f"SQLite {sqlite_bytes / 2 ** 20:.1f} MiB（{sqlite_bytes / (n_bucket + n_summary):.0f} B/行） 归档 "
+          f"{arch_bytes / 2 ** 20:.1f} MiB（{arch_bytes / (n_bucket + n_summary):.1f} B/行） x{ratio:.1f}")
+    print(f"{'query':<16}{'sqlite ms':>12}{'archive ms':>12}")
+    for name, *_ in qs:
+        s, r = q["sql " + name], q["arc " + name]
+        print(f"{name:<16}{s * 1000:>12.1f}{r * 1000:>12.1f}   x{s / max(r, 1e-9):.0f}")
+    assert ratio >= a.ratio, f"体积比 {ratio:.1f} < {a.ratio}"
+    print(f"归档查询与 SQLite 明细一致 体积小 {a.ratio:g} 倍以上 重复归档无新增 核对通过")
+
+
+if __name__ == "__main__":
+    main()
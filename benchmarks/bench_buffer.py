@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+未命中缓冲基准：合成未命中（bench_miner 的事件 分布到若干 (mod, smod)）
+- 吞吐：逐条入缓冲（原实现 每条 查收集中缓冲 插入 BUFFER_ITEM 更新 current_size 各一次往返并提交）
+  与 BufferManager 内存分片 + 批量写出
+- 分片：每个缓冲只含一个 (mod, smod) 满 threshold 即换新缓冲 BUFFER_ITEM 条数与 current_size 一致
+- 崩溃：不 close 时另一连接可见的行数不少于 总数 - buffer_flush_rows
+- 后台：BufferScheduler + 本地挖掘 处理满的缓冲 报告 add 的单次延迟（不等待挖掘）
+用法：python -m benchmarks.bench_buffer [--lines 200000] [--legacy 20000] [--shards 16] [--threshold 2000]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from benchmarks.bench_miner import make_lines
+from logsys.buffer_mgr import SCOPE, BufferManager, BufferScheduler
+from logsys.db import Database, write_transaction
+from logsys.main import init_db
+
+MODS = ["planning", "perception", "control", "localization"]
+
+
+def make_entries(a, rng: random.Random):
+    lines, _ = make_lines(argparse.Namespace(lines=a.lines, events=a.events), rng)
+    smods = [f"s{i}" for i in range(max(1, a.shards // len(MODS)))]
+    shards = [(m, s) for m in MODS for s in smods]
+    return [(ln.encode(), *rng.choice(shards), "W", 7, "2024-01-01 00:00:00", ln) for ln in lines]
+
+
+def legacy_add(conn: sqlite3.Connection, threshold: int, e) -> None:
+    with write_transaction(conn) as c:
+        r = c.execute("SELECT buffer_id, current_size FROM BUFFER_GROUP WHERE status='收集中' "
+                      "ORDER BY buffer_id DESC LIMIT 1").fetchone()
+        if r is None:
+            r = (c.execute("INSERT INTO BUFFER_GROUP(scope, size_threshold, current_size, created_at, status) "
+                           "VALUES('全局', ?, 0, CURRENT_TIMESTAMP, '收集中')", (threshold,)).lastrowid, 0)
+        c.execute("INSERT INTO BUFFER_ITEM(buffer_id, run_id, timestamp, mod, smod, level, thread_id, key_text, raw_log) "
+                  "VALUES(?,?,?,?,?,?,?,?,?)", (r[0], 1, e[5], e[1], e[2], e[3], e[4], e[6], e[0].decode()))
+        c.execute("UPDATE BUFFER_GROUP SET current_size=? WHERE buffer_id=?", (r[1] + 1, r[0]))
+
+
+def fresh_db(d: str, name: str) -> Database:
+    db = Database(os.path.join(d, name))
+    init_db(db)
+    return db
+
+
+def check_shards(conn: sqlite3.Connection, threshold: int, total: int) -> int:
+    assert conn.execute("SELECT COUNT(*) FROM BUFFER_ITEM").fetchone()[0] == total
+    bad = conn.execute(
+        "SELECT COUNT(*) FROM BUFFER_GROUP g WHERE current_size != "
+        "(SELECT COUNT(*) FROM BUFFER_ITEM i WHERE i.buffer_id=g.buffer_id)").fetchone()[0]
+    assert bad == 0, bad
+    mixed = conn.execute("SELECT COUNT(*) FROM (SELECT buffer_id FROM BUFFER_ITEM GROUP BY buffer_id "
+                         "HAVING COUNT(DISTINCT mod || '/' || smod) > 1)").fetchone()[0]
+    assert mixed == 0, mixed
+    assert conn.execute("SELECT MAX(current_size) FROM BUFFER_GROUP").fetchone()[0] <= threshold
+    return conn.execute("SELECT COUNT(*) FROM BUFFER_GROUP WHERE scope=? AND current_size>=size_threshold",
+                        (SCOPE,)).fetchone()[0]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lines", type=int, default=200000)
+    ap.add_argument("--legacy", type=int, default=20000, help="逐条入缓冲只跑前若干条")
+    ap.add_argument("--events", type=int, default=60)
+    ap.add_argument("--shards", type=int, default=16)
+    ap.add_argument("--threshold", type=int, default=2000)
+    a = ap.parse_args()
+    entries = make_entries(a, random.Random(19))
+    cfg = {"app": {"buffer_flush_rows": 5000, "buffer_flush_s": 2.0}, "llm": {"enabled": False}, "miner": {}}
+
+    with tempfile.TemporaryDirectory() as d:
+        db = fresh_db(d, "legacy.db")
+        part = entries[:a.legacy]
+        t0 = time.perf_counter()
+        for e in part:
+            legacy_add(db.conn, a.threshold, e)
+        t_legacy = time.perf_counter() - t0
+        db.conn.close()
+
+        db = fresh_db(d, "shard.db")
+        bm = BufferManager(cfg, db, threshold=a.threshold)
+        t0 = time.perf_counter()
+        bm.add_records(1, entries)
+        bm.close()
+        t_shard = time.perf_counter() - t0
+        full = check_shards(db.conn, a.threshold, len(entries))
+        assert sorted(bm.full_buffers()) == sorted(r[0] for r in db.conn.execute(
+            "SELECT buffer_id FROM BUFFER_GROUP WHERE current_size>=size_threshold")), "满缓冲交出不一致"
+        db.conn.close()
+
+        # 不 close 模拟崩溃：另一连接能看到的行数
+        db = fresh_db(d, "crash.db")
+        bm = BufferManager(cfg, db, threshold=a.threshold)
+        bm.add_records(1, entries)
+        seen = sqlite3.connect(os.path.join(d, "crash.db")).execute("SELECT COUNT(*) FROM BUFFER_ITEM").fetchone()[0]
+        assert seen >= len(entries) - bm.flush_rows, (seen, len(entries))
+        lost = len(entries) - seen
+        db.conn.close()
+
+        db = fresh_db(d, "sched.db")
+        sched = BufferScheduler(cfg, os.path.join(d, "sched.db"))
+        bm = BufferManager(cfg, db, threshold=a.threshold, on_full=sched.submit)
+        lat = []
+        t0 = time.perf_counter()
+        for i in range(0, len(entries), 1000):
+            s = time.perf_counter()
+            bm.add_records(1, entries[i:i + 1000])
+            lat.append(time.perf_counter() - s)
+        bm.close()
+        t_sched = time.perf_counter() - t0
+        time.sleep(0.5)
+        st = sched.close()
+        done = db.conn.execute("SELECT COUNT(*) FROM BUFFER_GROUP WHERE status='已处理'").fetchone()[0]
+        left = db.conn.execute("SELECT COUNT(*) FROM BUFFER_GROUP WHERE status='收集中' "
+                               "AND current_size>=size_threshold").fetchone()[0]
+        assert done == st["buffers"] and done + left == full, (done, left, full)
+        assert st["templates"] > 0 and st["failed"] == 0, st
+        db.conn.close()
+
+    lat.sort()
+    print(f"未命中 {len(entries)} 条 分片 {a.shards} 个 阈值 {a.threshold} 满缓冲 {full} 个")
+    print(f"{'path':<28}{'lines':>10}{'sec':>8}{'lines/s':>12}")
+    print(f"{'per-line (3 round trips)':<28}{len(part):>10}{t_legacy:>8.2f}{len(part) / t_legacy:>12,.0f}")
+    print(f"{'BufferManager batched':<28}{len(entries):>10}{t_shard:>8.2f}{len(entries) / t_shard:>12,.0f}")
+    print(f"{'+ BufferScheduler (miner)':<28}{len(entries):>10}{t_sched:>8.2f}{len(entries) / t_sched:>12,.0f}")
+    print(f"每千条 add 延迟 p50 {lat[len(lat) // 2] * 1000:.1f}ms p99 {lat[int(len(lat) * 0.99)] * 1000:.1f}ms "
+          f"后台处理缓冲 {st['buffers']} 个 模板 {st['templates']} 个 关闭时剩余 {left} 个")
+    print(f"未 close 时另一连接可见 {seen} 条 丢失 {lost} 条（上限 {bm.flush_rows}）")
+    print("分片归属 current_size 满缓冲交出 崩溃可见 后台处理 核对通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+pass2 聚合写入基准：逐行 INSERT ... ON CONFLICT 与 暂存表 + INSERT ... SELECT 对比
+每轮写入同一批键两次（第二次全部走 DO UPDATE） 报告 rows/s
+用法：python -m benchmarks.bench_bulk_write [--keys 200000] [--rounds 2]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from logsys.db import bulk_upsert, open_db_and_tune, write_transaction
+from logsys.ddl_sql import ALL_TABLE_DDL
+from logsys.pass2 import SUMMARY_COLS, SUMMARY_UPDATE
+
+ROW_SQL = f"""
+INSERT INTO LOG_MATCH_SUMMARY({', '.join(SUMMARY_COLS)}) VALUES({', '.join('?' * len(SUMMARY_COLS))})
+ON CONFLICT({', '.join(SUMMARY_COLS[:7])}) DO UPDATE SET {SUMMARY_UPDATE}
+"""
+
+
+def make_rows(n: int, rng: random.Random):
+    rows = []
+    for i in range(n):
+        th = str(rng.randint(1, 5000))
+        rows.append((1, i % 500 + 1, f"M{i % 37}", f"S{i % 211}", "c", rng.choice("EWID"), f"{th}-{i}",
+                     "2024-01-05T00:00:00", "2024-01-05T01:00:00", rng.randint(1, 100)))
+    return rows
+
+
+def fresh(path: str) -> sqlite3.Connection:
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    open_db_and_tune(conn)
+    for ddl in ALL_TABLE_DDL:
+        conn.executescript(ddl)
+    return conn
+
+
+def per_row(conn: sqlite3.Connection, rows) -> None:
+    for r in rows:
+        conn.execute(ROW_SQL, r)
+    conn.commit()
+
+
+def bulk(conn: sqlite3.Connection, rows) -> None:
+    with write_transaction(conn):
+        bulk_upsert(conn, "LOG_MATCH_SUMMARY", SUMMARY_COLS, rows, SUMMARY_COLS[:7], SUMMARY_UPDATE)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--keys", type=int, default=200_000)
+    ap.add_argument("--rounds", type=int, default=2)
+    a = ap.parse_args()
+    rows = make_rows(a.keys, random.Random(3))
+    with tempfile.TemporaryDirectory() as d:
+        results = {}
+        for name, fn in (("per-row upsert", per_row), ("staging bulk", bulk)):
+            conn = fresh(os.path.join(d, f"{name.split()[0]}.db"))
+            for rnd in range(a.rounds):
+                t = time.perf_counter()
+                fn(conn, rows)
+                dt = time.perf_counter() - t
+                print(f"{name:<16} round {rnd}  {dt:7.2f}s  {len(rows) / dt:>10.0f} rows/s")
+            results[name] = conn.execute(
+                "SELECT COUNT(*), SUM(line_count) FROM LOG_MATCH_SUMMARY").fetchone()
+            conn.close()
+        assert len(set(results.values())) == 1, results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+pass2 聚合基准：元组键字典（原实现） 与 列式 NumPy 聚合 对比
+报告 每事件耗时 与 每个不同键的内存（tracemalloc 峰值 / 键数） 并核对两者输出一致
+用法：python -m benchmarks.bench_colagg [--events 1000000] [--threads 2000]
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from logsys.colagg import ColumnarAgg
+from logsys.utils import epoch_iso, floor_bucket, inc, parse_ts
+
+
+def make_events(n: int, threads: int, rng: random.Random):
+    """模板挂在子模块下（每个子模块约 10 个） 线程号在 1..threads 间"""
+    mods = [(f"M{i}", f"S{i}_{j}") for i in range(30) for j in range(8)]
+    out = []
+    sec = 0
+    for _ in range(n):
+        sec += rng.randint(0, 1)
+        k = rng.randrange(len(mods))
+        mod, smod = mods[k]
+        tid = k * 10 + rng.randint(1, 10)
+        ts = f"20240105_{(sec // 3600) % 24:02d}{(sec // 60) % 60:02d}{sec % 60:02d}"
+        out.append((tid, f"c{tid % 7}", mod, smod, rng.choice("EWID"), str(rng.randint(1, threads)), ts))
+    return out
+
+
+def dict_agg(events, gran):
+    summary, buckets = {}, {}
+    for tid, cls, mod, smod, lvl, th, ts in events:
+        sk = (mod, smod, tid, cls, lvl, th)
+        v = summary.get(sk)
+        if v is None:
+            summary[sk] = {"first_ts": ts, "last_ts": ts, "count": 1}
+        else:
+            if ts < v["first_ts"]:
+                v["first_ts"] = ts
+            if ts > v["last_ts"]:
+                v["last_ts"] = ts
+            v["count"] += 1
+        inc(buckets, (mod, smod, tid, cls, lvl, th, gran, floor_bucket(ts, gran)), 1)
+    return summary, buckets
+
+
+def col_agg(events, gran):
+    agg = ColumnarAgg([gran])
+    for tid, cls, mod, smod, lvl, th, ts in events:
+        agg.add(tid, cls, mod, smod, lvl, th, parse_ts(ts))
+    agg.compact()
+    return agg
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    t = time.perf_counter()
+    out = fn(*args)
+    dt = time.perf_counter() - t
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, dt, peak
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--events", type=int, default=1_000_000)
+    ap.add_argument("--threads", type=int, default=50)
+    ap.add_argument("--gran", default="5min")
+    a = ap.parse_args()
+    events = make_events(a.events, a.threads, random.Random(5))
+
+    # 计时与内存分开测 tracemalloc 会显著拖慢逐对象分配
+    t = time.perf_counter(); (summary, buckets) = dict_agg(events, a.gran); t_dict = time.perf_counter() - t
+    t = time.perf_counter(); agg = col_agg(events, a.gran); t_col = time.perf_counter() - t
+    _, _, m_dict = measure(dict_agg, events, a.gran)
+    _, _, m_col = measure(col_agg, events, a.gran)
+
+    got_s = sorted(agg.summary_rows())
+    def to_iso(ts):
+        return epoch_iso(parse_ts(ts))
+    exp_s = sorted(k + (to_iso(v["first_ts"]), to_iso(v["last_ts"]), v["count"]) for k, v in summary.items())
+    got_b = sorted(agg.bucket_rows())
+    exp_b = sorted(k + (c,) for k, c in buckets.items())
+    assert got_s == exp_s and got_b == exp_b, "聚合结果不一致"
+
+    keys = len(summary) + len(buckets)
+    print(f"事件 {a.events} 汇总键 {len(summary)} 分桶键 {len(buckets)}")
+    print(f"{'engine':<10}{'us/event':>10}{'bytes/key':>12}")
+    print(f"{'dict':<10}{t_dict / a.events * 1e6:>10.2f}{m_dict / keys:>12.0f}")
+    print(f"{'columnar':<10}{t_col / a.events * 1e6:>10.2f}{m_col / keys:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+端到端基准：synth 生成生产格式的 .gz（或 --file 复用已生成的文件与其 .meta.json）模板按形状写入 REGEX_TEMPLATE
+- 分段计时：与单进程 pass2 相同的处理逐块拆开 每段单独计时
+  decompress（read_gz_chunks） parse（按记录切块 + scan_block） normalize（normalize_key_text）
+  match（TemplateMatcher.match_text 含结果缓存） aggregate（分类 时间戳 ColumnarAgg） write（Pass2Writer 批量写库）
+- 整体计时：run_pass1 run_pass2（同库 force） 以及新库上的 run_process
+核对：分段管线 pass2 process 三者的 LOG_MATCH_SUMMARY KEY_TIME_BUCKET 未命中键 溢出记录完全一致；
+记录数 命中数 未命中数 各模板命中行数 各粒度桶计数之和 与生成器给出的真实值一致；pass1 记录数一致
+结果追加到 --history（JSON Lines） 与同一主机 同一参数的上一条对比 耗时增加超过 --tolerance 记为回归（--strict 时失败）
+用法：python -m benchmarks.bench_e2e [--mb 16 | --records 1000000 | --file x.gz] [--templates 500] [--zipf 1.1]
+      [--multiline 0.05] [--miss 0.1] [--history e2e_history.jsonl] [--tolerance 0.15] [--strict]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.bench_follow import run_rows
+from benchmarks.synth import check_shapes, load_meta, seed_templates, write_log
+from logsys import scanner
+from logsys.db import Database, register_file, start_run
+from logsys.ingest import read_gz_chunks
+from logsys.key_extract import normalize_key_text
+from logsys.main import init_db
+from logsys.matcher import TemplateMatcher
+from logsys.pass1 import run_pass1
+from logsys.pass2 import Pass2Writer, _classification, run_pass2
+from logsys.process import run_process
+from logsys.utils import now_epoch, parse_ts
+
+STAGES = ["decompress", "parse", "normalize", "match", "aggregate", "write"]
+FULL = ["pass1", "pass2", "process"]
+
+
+def cfg_for(d: str, name: str) -> dict:
+    """与 config.yaml 的缺省值一致"""
+    return {"app": {"db_path": os.path.join(d, f"{name}.db"), "time_bucket": ["5min", "hour", "day"],
+                    "pass2_batch_rows": 10000, "match_cache_size": 100000, "gz_index_span_mb": 16,
+                    "unmatched_dir": os.path.join(d, f"unmatched_{name}")}}
+
+
+def open_db(cfg: dict, shapes) -> tuple:
+    db = Database(cfg["app"]["db_path"])
+    init_db(db)
+    return db, seed_templates(db, shapes)
+
+
+def timed_chunks(chunks, cost: dict):
+    it = iter(chunks)
+    while True:
+        t = time.perf_counter()
+        c = next(it, None)
+        cost["decompress"] += time.perf_counter() - t
+        if c is None:
+            return
+        yield c
+
+
+def staged(cfg: dict, db: Database, gz: str) -> tuple:
+    """单进程 pass2 的逐段拆分（同 run_pass2 + aggregate_record） 返回 (run_id, 各段耗时)"""
+    cost = dict.fromkeys(STAGES, 0.0)
+    conn = db.conn
+    run_id = start_run(conn, register_file(conn, gz), "PASS2", cfg)
+    conn.commit()
+    matcher = TemplateMatcher(db, cache_size=int(cfg["app"]["match_cache_size"]))
+    matcher.load_templates()
+    w = Pass2Writer(cfg, db, run_id)
+    acc = w.acc
+    agg, um, cls_cache = acc["agg"], acc["unmatched"], {}
+    blocks = scanner.iter_blocks(timed_chunks(read_gz_chunks(gz), cost))
+    while True:
+        t, d0 = time.perf_counter(), cost["decompress"]
+        block = next(blocks, None)
+        cost["parse"] += time.perf_counter() - t - (cost["decompress"] - d0)
+        if block is None:
+            break
+        t = time.perf_counter()
+        recs = list(scanner.scan_block(block))
+        t1 = time.perf_counter()
+        norms = [normalize_key_text(r[4]) for r in recs]
+        t2 = time.perf_counter()
+        matcher.maybe_refresh()
+        hits = [matcher.match_text(r[4], n) for r, n in zip(recs, norms)]
+        t3 = time.perf_counter()
+        for (ts_s, lvl, mod, smod, key, raw), norm, hit in zip(recs, norms, hits):
+            acc["total"] += 1
+            acc["pre"] += 1
+            if not hit:
+                acc["unmatched_lines"] += 1
+                um.append((raw, mod, smod, lvl, None, ts_s, key, norm))
+                continue
+            acc["matched"] += 1
+            acc["pending"] += 1
+            tid = hit["template_id"]
+            cls = _classification(hit["semantic_info"], cls_cache, tid)
+            ts = parse_ts(ts_s)
+            if ts is None:
+                ts = now_epoch()
+            agg.add(tid, cls, mod or "", smod or "", lvl or "", "", ts)
+        t4 = time.perf_counter()
+        cost["parse"] += t1 - t
+        cost["normalize"] += t2 - t1
+        cost["match"] += t3 - t2
+        cost["aggregate"] += t4 - t3
+        if w.due():
+            w.flush()
+            cost["write"] += time.perf_counter() - t4
+    t = time.perf_counter()
+    w.finish(matcher.cache_hit_ratio)
+    cost["write"] += time.perf_counter() - t
+    return run_id, cost
+
+
+def timed_call(fn, *args, **kw):
+    t = time.perf_counter()
+    r = fn(*args, **kw)
+    return r, time.perf_counter() - t
+
+
+def check_run(conn, run_id: int, meta: dict, ids: list) -> None:
+    total, matched, unmatched = conn.execute("SELECT total_lines, matched_lines, unmatched_lines FROM RUN_SESSION "
+                                             "WHERE run_id=?", (run_id,)).fetchone()
+    assert (total, matched, unmatched) == (meta["records"], sum(meta["hits"]), meta["unmatched"]), \
+        (run_id, total, matched, unmatched)
+    want = {tid: n for tid, n in zip(ids, meta["hits"]) if n}
+    got = dict(conn.execute("SELECT template_id, SUM(line_count) FROM LOG_MATCH_SUMMARY WHERE run_id=? "
+                            "GROUP BY template_id", (run_id,)).fetchall())
+    assert got == want, "各模板命中行数与生成器不一致"
+    per_gran = conn.execute("SELECT bucket_granularity, SUM(count_in_bucket) FROM KEY_TIME_BUCKET WHERE run_id=? "
+                            "GROUP BY 1", (run_id,)).fetchall()
+    assert len(per_gran) == 3 and all(n == matched for _, n in per_gran), per_gran
+    n_key = conn.execute("SELECT COALESCE(SUM(line_count), 0) FROM UNMATCHED_KEY WHERE run_id=?",
+                         (run_id,)).fetchone()[0]
+    assert n_key == unmatched, (n_key, unmatched)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def previous(path: str, host: str, params: dict):
+    """同一主机 同一参数的最近一条历史"""
+    if not path or not os.path.exists(path):
+        return None
+    last = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            e = json.loads(line)
+            if e.get("host") == host and e.get("params") == params:
+                last = e
+    return last
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--file", help="复用 synth 生成的 .gz（需同目录的 .meta.json）")
+    ap.add_argument("--mb", type=float, default=None, help="解压后大小 MiB 缺省 16")
+    ap.add_argument("--records", type=int, default=None)
+    ap.add_argument("--templates", type=int, default=500)
+    ap.add_argument("--zipf", type=float, default=1.1)
+    ap.add_argument("--multiline", type=float, default=0.05)
+    ap.add_argument("--miss", type=float, default=0.1)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--history", default="e2e_history.jsonl", help="JSON Lines 历史文件 空串不记录")
+    ap.add_argument("--tolerance", type=float, default=0.15, help="耗时增加超过该比例记为回归")
+    ap.add_argument("--strict", action="store_true", help="有回归时失败")
+    a = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        gz = a.file
+        t = time.perf_counter()
+        if gz is None:
+            gz = os.path.join(d, "synth.gz")
+            meta = write_log(gz, a.mb, a.records, a.templates, a.zipf, a.multiline, a.miss, a.seed)
+        else:
+            meta = load_meta(gz)
+        t_gen = time.perf_counter() - t
+        check_shapes(meta["shapes"], random.Random(a.seed))
+        n, size = meta["records"], meta["bytes"]
+
+        cfg = cfg_for(d, "main")
+        db, ids = open_db(cfg, meta["shapes"])
+        ra, cost = staged(cfg, db, gz)
+        db.commit()
+        check_run(db.conn, ra, meta, ids)
+        _, cost["pass1"] = timed_call(run_pass1, cfg, db, gz)
+        db.commit()
+        p1 = db.conn.execute("SELECT total_lines FROM RUN_SESSION WHERE pass_type='PASS1' ORDER BY run_id DESC "
+                             "LIMIT 1").fetchone()[0]
+        assert p1 == n, ("pass1", p1, n)
+        rb, cost["pass2"] = timed_call(run_pass2, cfg, db, gz, force=True)
+        db.commit()
+        check_run(db.conn, rb, meta, ids)
+        assert run_rows(db.conn, ra) == run_rows(db.conn, rb), "分段管线与 pass2 统计不一致"
+
+        cfg_p = cfg_for(d, "proc")
+        dbp, ids_p = open_db(cfg_p, meta["shapes"])
+        st, cost["process"] = timed_call(run_process, cfg_p, dbp, gz)
+        dbp.commit()
+        assert ids_p == ids and st["records"] == n, st
+        rp = dbp.conn.execute("SELECT MAX(run_id) FROM RUN_SESSION WHERE pass_type='PASS2'").fetchone()[0]
+        check_run(dbp.conn, rp, meta, ids)
+        assert run_rows(dbp.conn, rp) == run_rows(db.conn, rb), "process 与 pass2 统计不一致"
+        hit_ratio = db.conn.execute("SELECT match_cache_hit_ratio FROM RUN_SESSION WHERE run_id=?",
+                                    (rb,)).fetchone()[0]
+        db.close()
+        dbp.close()
+        gz_bytes = os.path.getsize(gz)
+
+    host = platform.node()
+    params = dict(meta["params"], records=n, bytes=size)
+    prev = previous(a.history, host, params)
+    entry = {"at": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(), "host": host,
+             "python": platform.python_version(), "params": params,
+             "stages": {k: round(v, 4) for k, v in cost.items()}}
+    if a.history:
+        with open(a.history, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    print(f"{n} 条 解压后 {size / 2 ** 20:.1f} MiB（压缩 {gz_bytes / 2 ** 20:.1f} MiB） 模板 {len(ids)} "
+          f"命中 {sum(meta['hits'])} 未命中 {meta['unmatched']} 多行 {meta['multiline_records']} "
+          f"{'复用' if a.file else f'生成 {t_gen:.1f}s'} 匹配缓存命中率 {hit_ratio or 0:.1%}")
+    base = f"（对比 {prev['at']} {prev['commit'] or ''}）" if prev else "（无同参数历史）"
+    print(f"{'stage':<12}{'sec':>9}{'krec/s':>10}{'MiB/s':>9}{'prev sec':>10}{'Δ':>8}   {base}")
+    regress = []
+    for k in STAGES + ["sum"] + FULL:
+        sec = sum(cost[s] for s in STAGES) if k == "sum" else cost[k]
+        old = (sum(prev["stages"][s] for s in STAGES) if k == "sum" else prev["stages"].get(k)) if prev else None
+        tail = ""
+        if old:
+            delta = sec / old - 1
+            tail = f"{old:>10.2f}{delta:>+8.0%}"
+            if delta > a.tolerance and k != "sum":
+                regress.append(k)
+                tail += "   回归"
+        print(f"{k:<12}{sec:>9.2f}{n / sec / 1000:>10.1f}{size / 2 ** 20 / sec:>9.1f}{tail}")
+    if regress:
+        print(f"耗时增加超过 {a.tolerance:.0%}：{' '.join(regress)}")
+        assert not a.strict, "性能回归"
+    print("分段管线 pass2 process 结果一致 计数与生成器真实值一致 核对通过")
+
+
+if __name__ == "__main__":
+    main()
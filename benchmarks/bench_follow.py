@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+follow 模式延迟与一致性检查：
+- 后台线程跟随一个临时纯文本日志 主线程分轮追加记录（命中 未命中 带续行的多行记录 每轮最后一条带续行）
+  每轮写完后轮询 KEY_TIME_BUCKET 断言 --latency 秒内计数与已写入的命中条数一致 报告各轮可见延迟
+- 随后一次性快速追加大量记录 报告吞吐与进程峰值常驻内存的增量
+- 结束后把同样的内容压成 .gz 走 pass2 核对 LOG_MATCH_SUMMARY 与 KEY_TIME_BUCKET 与 follow 完全一致
+用法：python -m benchmarks.bench_follow [--rounds 8] [--per-round 2000] [--latency 2] [--bulk 200000]
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import resource
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from logsys.db import Database
+from logsys.follow import run_follow
+from logsys.main import init_db
+from logsys.pass2 import run_pass2
+from logsys.unmatched_store import iter_records
+
+TEMPLATES = [("get lane err size \\d+ id \\w+", "车道"), ("sensor timeout after \\d+ ms", "超时")]
+HIT = ["get lane err size {n} id v{n}", "sensor timeout after {n} ms"]
+MISS = ["unexpected frame gap {n}", "规划 重试 {n} 次"]
+
+
+class Gen:
+    """按秒递增的记录生成器 同时给出其中会命中模板的条数（多行记录一律用未命中的消息）"""
+
+    def __init__(self, seed: int) -> None:
+        self.rng = random.Random(seed)
+        self.sec = 0
+
+    def records(self, n: int):
+        rng, out, hits = self.rng, [], 0
+        for i in range(n):
+            self.sec += rng.randint(0, 2)
+            s = self.sec
+            ts = f"202401{1 + s // 86400:02d}_{s // 3600 % 24:02d}{s // 60 % 60:02d}{s % 60:02d}"
+            head = f"[{ts}][{rng.randint(100, 104)}][{rng.choice('EWID')}][MOD:PNC][SMOD:planner]"
+            if i == n - 1 or rng.random() < 0.05:
+                out.append(f"{head} {rng.choice(MISS).format(n=i)}\n  detail {rng.randint(0, 9)}\n")
+            elif rng.random() < 0.8:
+                out.append(f"{head} {rng.choice(HIT).format(n=rng.randint(0, 999))}\n")
+                hits += 1
+            else:
+                out.append(f"{head} {rng.choice(MISS).format(n=i)}\n")
+        return "".join(out).encode(), hits
+
+
+def visible(db_path: str) -> int:
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT COALESCE(SUM(count_in_bucket), 0) FROM KEY_TIME_BUCKET "
+                            "WHERE bucket_granularity='hour'").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def wait_visible(db_path: str, want: int, limit: float) -> float:
+    t0 = time.perf_counter()
+    while True:
+        dt = time.perf_counter() - t0
+        if visible(db_path) >= want or dt > limit:
+            return dt
+        time.sleep(0.01)
+
+
+def run_rows(conn: sqlite3.Connection, run_id: int):
+    s = conn.execute("SELECT template_id, mod, smod, classification, level, thread_id, first_ts, last_ts, line_count "
+                     "FROM LOG_MATCH_SUMMARY WHERE run_id=? ORDER BY 1, 2, 3, 4, 5, 6", (run_id,)).fetchall()
+    b = conn.execute("SELECT template_id, mod, smod, classification, level, thread_id, bucket_granularity, "
+                     "bucket_start, count_in_bucket FROM KEY_TIME_BUCKET WHERE run_id=? "
+                     "ORDER BY 1, 2, 3, 4, 5, 6, 7, 8", (run_id,)).fetchall()
+    k = conn.execute("SELECT key_text, mod, smod, line_count, first_ts, last_ts, first_seq, last_seq "
+                     "FROM UNMATCHED_KEY WHERE run_id=? ORDER BY 1, 2, 3", (run_id,)).fetchall()
+    e = conn.execute("SELECT seq, raw_log FROM UNMATCHED_EXEMPLAR WHERE run_id=? ORDER BY seq", (run_id,)).fetchall()
+    u = [r[1:] for r in iter_records(conn, run_id)]
+    return s, b, k, e, u
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=8)
+    ap.add_argument("--per-round", type=int, default=2000)
+    ap.add_argument("--latency", type=float, default=2.0)
+    ap.add_argument("--bulk", type=int, default=200_000)
+    a = ap.parse_args()
+    with tempfile.TemporaryDirectory() as d:
+        db_path = os.path.join(d, "follow.db")
+        cfg = {"app": {"db_path": db_path, "time_bucket": ["5min", "hour"], "pass2_batch_rows": 10000,
+                       "match_cache_size": 10000, "unmatched_dir": os.path.join(d, "unmatched"),
+                       "gz_index_span_mb": 0}}
+        db = Database(db_path)
+        init_db(db)
+        for p, cls in TEMPLATES:
+            db.execute("INSERT INTO REGEX_TEMPLATE(pattern, is_active, semantic_info) VALUES(?, 1, ?)",
+                       (p, json.dumps({"分类": cls}, ensure_ascii=False)))
+        db.commit()
+
+        log = os.path.join(d, "live.log")
+        open(log, "wb").close()
+        stop = threading.Event()
+        res = {}
+        t = threading.Thread(target=lambda: res.update(
+            run_follow(cfg, Database(db_path), log, latency=a.latency, stop=stop)))
+        t.start()
+
+        gen = Gen(5)
+        want = 0
+        lat = []
+        with open(log, "ab") as f:
+            for _ in range(a.rounds):
+                data, hits = gen.records(a.per_round)
+                f.write(data)
+                f.flush()
+                want += hits
+                dt = wait_visible(db_path, want, 2 * a.latency)
+                got = visible(db_path)
+                assert got == want and dt <= a.latency, f"{dt:.2f}s 内可见 {got}/{want}"
+                lat.append(dt)
+                time.sleep(a.latency / 4)
+
+            rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            t0 = time.perf_counter()
+            left = a.bulk
+            while left > 0:
+                data, hits = gen.records(min(left, 5000))
+                f.write(data)
+                want += hits
+                left -= 5000
+            f.flush()
+            wait_visible(db_path, want, 600)
+            bulk_dt = time.perf_counter() - t0
+            rss1 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        time.sleep(a.latency)
+        stop.set()
+        t.join()
+        assert visible(db_path) == want
+
+        gz = os.path.join(d, "live.gz")
+        with open(log, "rb") as src, gzip.open(gz, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        ref = run_pass2(cfg, db, gz)
+        db.commit()
+        assert run_rows(db.conn, res["run_id"]) == run_rows(db.conn, ref), "follow 与 pass2 统计不一致"
+
+        print(f"可见延迟（上限 {a.latency:.1f}s） 每轮 {a.per_round} 条："
+              f" 最大 {max(lat):.2f}s 平均 {sum(lat) / len(lat):.2f}s")
+        print(f"快速追加 {a.bulk} 条：{bulk_dt:.2f}s {a.bulk / bulk_dt:.0f} rec/s"
+              f" 峰值常驻内存增量 {(rss1 - rss0) / 1024:.1f} MiB")
+        print(f"共 {res['records']} 条 命中 {res['matched']} 与 pass2 逐行一致")
+
+
+if __name__ == "__main__":
+    main()
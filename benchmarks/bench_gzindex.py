@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+gzip 解压基准：整文件顺序解压 / 顺序解压同时建索引 / 按访问点多进程并行解压 三者对比
+并行结果逐区段核对行数与总字节数 与顺序解压一致
+用法：python -m benchmarks.bench_gzindex [--size-mb 2048] [--span-mb 16] [--workers 8] [--file x.gz]
+未指定 --file 时在临时目录生成指定解压大小的合成日志
+"""
+import argparse
+import gzip
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Tuple
+
+from logsys import gzindex
+
+MODS = [("PNC", "planner"), ("PER", "lidar"), ("MAP", "fusion"), ("LOC", "gnss")]
+MSGS = ["get lane err size {n} id v{n}", "sensor timeout after {n} ms",
+        "invalid by too close to real merge {n} cross", "planner replan count {n}"]
+
+
+def make_gz(path: str, size_mb: int, rng: random.Random) -> None:
+    target = size_mb << 20
+    written = 0
+    sec = 0
+    with gzip.open(path, "wb", compresslevel=6) as f:
+        while written < target:
+            lines = []
+            for _ in range(5000):
+                sec += rng.randint(0, 2)
+                mod, smod = rng.choice(MODS)
+                msg = rng.choice(MSGS).format(n=rng.randint(0, 10 ** 6))
+                lines.append(f"[20240105_{(sec // 3600) % 24:02d}{(sec // 60) % 60:02d}{sec % 60:02d}]"
+                             f"[{rng.randint(100, 120)}][{rng.choice('EWID')}][MOD:{mod}][SMOD:{smod}] {msg}\n")
+            buf = "".join(lines).encode()
+            f.write(buf)
+            written += len(buf)
+
+
+def sequential(path: str) -> Tuple[int, int]:
+    n = size = 0
+    with gzip.open(path, "rb") as f:
+        while True:
+            buf = f.read(1 << 20)
+            if not buf:
+                break
+            n += buf.count(b"\n")
+            size += len(buf)
+    return n, size
+
+
+def build(path: str, span: int):
+    r = gzindex.IndexingReader(path, span)
+    n = size = 0
+    for buf in r:
+        n += buf.count(b"\n")
+        size += len(buf)
+    return r.index, n, size
+
+
+def _segment(args) -> Tuple[int, int]:
+    path, point, limit = args
+    n = size = 0
+    for buf in gzindex.iter_from(path, point, limit):
+        n += buf.count(b"\n")
+        size += len(buf)
+    return n, size
+
+
+def parallel(path: str, index, workers: int) -> Tuple[int, int]:
+    jobs = [(path, p, e - s) for p, (s, e) in zip(index.points, index.segments())]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        parts = list(ex.map(_segment, jobs))
+    return sum(p[0] for p in parts), sum(p[1] for p in parts)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--size-mb", type=int, default=512, help="合成日志解压后大小")
+    ap.add_argument("--span-mb", type=float, default=16)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--file", default=None)
+    ap.add_argument("--seed", type=int, default=7)
+    a = ap.parse_args()
+    if not gzindex.available():
+        raise SystemExit("系统 libz 不可用 无法建立 gzip 索引")
+
+    tmp = None
+    path = a.file
+    if path is None:
+        tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(tmp.name, "bench.gz")
+        t = time.perf_counter()
+        make_gz(path, a.size_mb, random.Random(a.seed))
+        print(f"生成 {a.size_mb} MiB 日志 压缩后 {os.path.getsize(path) >> 20} MiB 用时 {time.perf_counter() - t:.1f}s")
+
+    t = time.perf_counter()
+    n0, s0 = sequential(path)
+    t_seq = time.perf_counter() - t
+    t = time.perf_counter()
+    index, n1, s1 = build(path, int(a.span_mb * (1 << 20)))
+    t_build = time.perf_counter() - t
+    t = time.perf_counter()
+    n2, s2 = parallel(path, index, a.workers)
+    t_par = time.perf_counter() - t
+    assert (n0, s0) == (n1, s1) == (n2, s2), "解压结果不一致"
+
+    mb = s0 / (1 << 20)
+    print(f"{'mode':<22}{'sec':>9}{'MiB/s':>10}")
+    print(f"{'gzip sequential':<22}{t_seq:>9.2f}{mb / t_seq:>10.1f}")
+    print(f"{'sequential + index':<22}{t_build:>9.2f}{mb / t_build:>10.1f}")
+    print(f"{f'indexed x{a.workers}':<22}{t_par:>9.2f}{mb / t_par:>10.1f}")
+    print(f"访问点 {len(index.points)} 个 行数 {n0} 解压 {mb:.0f} MiB")
+
+    # 续读：从中部访问点开始解压的首字节延迟
+    mid = index.points[len(index.points) // 2]
+    t = time.perf_counter()
+    next(iter(gzindex.iter_from(path, mid)))
+    print(f"从 {mid.out_offset >> 20} MiB 处续读首块延迟 {(time.perf_counter() - t) * 1000:.1f} ms")
+    if tmp is not None:
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 缓冲批量聚类基准：本地 OpenAI 兼容桩服务（benchmarks.llm_stub）模拟延迟与周期性 503
+同一批缓冲分别以 旧版逐条 call_llm（无连接复用 无重试） 与 drain_buffers 并发数 1 / N 处理 对比耗时
+黄金核对：并发与串行入库的模板集合 BUFFER_RESULT 出现次数 与直接对各任务样本聚类的期望完全一致；
+LLM_TASK 每行都有 状态 尝试次数 HTTP 状态 耗时 token；连接数不超过并发数（连接复用）
+另核对：超时按配置重试后记为失败 失败的缓冲下次 drain 重新提交
+缓存：同一库再来一批只有数字不同的同形样本（另一辆车 另一天） 全部命中 LLM_CACHE 不发请求 入库模板不变；
+提示词模板改动后不再命中 prune 清除旧条目 超过 cache_max_mb 时按最近使用淘汰
+用法：python -m benchmarks.bench_llm [--buffers 4] [--keys 300] [--per-task 20] [--latency 0.1] [--concurrency 8]
+"""
+import argparse
+import os
+import random
+import re
+import tempfile
+import time
+from collections import Counter
+
+from benchmarks.llm_stub import StubServer, cluster
+from logsys.db import Database
+from logsys import llm_cache
+from logsys.llm_adapter import LLMClient, call_llm
+from logsys.llm_tasks import drain_buffers, pending_buffers
+from logsys.main import init_db
+
+WORDS = ["lane", "sensor", "timeout", "planner", "fusion", "merge", "cross", "map", "frame", "gap", "retry"]
+
+
+def make_keys(n: int, rng: random.Random):
+    forms = [" ".join(rng.sample(WORDS, 4)) + " {} id {}" for _ in range(max(1, n // 6))]
+    keys = set()
+    while len(keys) < n:
+        keys.add(rng.choice(forms).format(rng.randint(0, 999), rng.randint(0, 99)))
+    return sorted(keys)
+
+
+def setup(path: str, a, rng: random.Random):
+    db = Database(path)
+    init_db(db)
+    chunks = []
+    for b in range(a.buffers):
+        keys = make_keys(a.keys, rng)
+        bid = db.execute("INSERT INTO BUFFER_GROUP(scope, size_threshold, current_size, created_at, status) "
+                         "VALUES('全局', ?, ?, CURRENT_TIMESTAMP, '收集中')", (a.keys, len(keys)))
+        db.conn.executemany("INSERT INTO BUFFER_ITEM(buffer_id, key_text, raw_log) VALUES(?,?,?)",
+                            [(bid, k, k) for k in keys])
+        chunks += [keys[i:i + a.per_task] for i in range(0, len(keys), a.per_task)]
+    db.commit()
+    return db, chunks
+
+
+def add_day(db: Database, n_buffers: int, rng: random.Random) -> int:
+    """按原顺序复制首批每个缓冲的关键文本 数字换成新值：归一化后的样本集合不变"""
+    n = 0
+    for bid, in db.conn.execute("SELECT buffer_id FROM BUFFER_GROUP WHERE buffer_id<=? ORDER BY buffer_id",
+                                (n_buffers,)).fetchall():
+        keys = [r[0] for r in db.conn.execute("SELECT key_text FROM BUFFER_ITEM WHERE buffer_id=? ORDER BY item_id", (bid,))]
+        keys = list(dict.fromkeys(re.sub(r"\d+", lambda m: str(rng.randint(1000, 9999)), k) for k in keys))
+        nb = db.execute("INSERT INTO BUFFER_GROUP(scope, size_threshold, current_size, created_at, status) "
+                        "VALUES('全局', ?, ?, CURRENT_TIMESTAMP, '收集中')", (len(keys), len(keys)))
+        db.conn.executemany("INSERT INTO BUFFER_ITEM(buffer_id, key_text, raw_log) VALUES(?,?,?)", [(nb, k, k) for k in keys])
+        n += 1
+    db.commit()
+    return n
+
+
+def snapshot(db: Database):
+    c = db.conn
+    tpls = sorted(r[0] for r in c.execute("SELECT pattern FROM REGEX_TEMPLATE"))
+    occ = Counter()
+    for p, n in c.execute("SELECT t.pattern, r.occurrences FROM BUFFER_RESULT r JOIN REGEX_TEMPLATE t USING(template_id)"):
+        occ[p] += n
+    return tpls, occ
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--buffers", type=int, default=4)
+    ap.add_argument("--keys", type=int, default=300)
+    ap.add_argument("--per-task", type=int, default=20)
+    ap.add_argument("--latency", type=float, default=0.1)
+    ap.add_argument("--fail-every", type=int, default=7)
+    ap.add_argument("--concurrency", type=int, default=8)
+    a = ap.parse_args()
+    os.environ["LLM_STUB_KEY"] = "stub"
+    rows = []
+    with tempfile.TemporaryDirectory() as d:
+        prompt = os.path.join(d, "prompt.txt")
+        with open(prompt, "w", encoding="utf-8") as f:
+            f.write("对下列样本聚类 输出 JSON 数组：\n<samples>\n{SAMPLES}\n")
+
+        def cfg_for(srv, conc, **kw):
+            llm = {"enabled": True, "api_base": srv.api_base, "api_key_env": "LLM_STUB_KEY", "model": "stub",
+                   "prompt_path": prompt, "n_samples_per_task": a.keys, "max_prompt_samples": a.per_task,
+                   "concurrency": conc, "retries": 3, "backoff_s": 0.02, "timeout_sec": 10,
+                   "reduce": False}  # 按旧方式切任务 与逐条 call_llm 同口径（归并见 bench_reduce）
+            llm.update(kw)
+            return {"app": {"db_path": ""}, "llm": llm}
+
+        # 期望：每个任务的样本各自聚类
+        _, chunks = setup(os.path.join(d, "expect.db"), a, random.Random(3))
+        want_occ = Counter()
+        for ch in chunks:
+            for it in cluster(ch):
+                want_occ[it["匹配规则"]] += it["出现次数"]
+        want = (sorted(want_occ), want_occ)
+
+        # 旧版：逐条阻塞请求 无连接复用 失败即丢弃
+        srv = StubServer(0, a.latency, a.fail_every).start()
+        t0 = time.perf_counter()
+        got = sum(1 for ch in chunks if call_llm(cfg_for(srv, 1, retries=0), ch))
+        rows.append(("call_llm loop", time.perf_counter() - t0, len(chunks), got, srv.stats["connections"], 1))
+        srv.shutdown()
+
+        for conc in (1, a.concurrency):
+            db, _ = setup(os.path.join(d, f"c{conc}.db"), a, random.Random(3))
+            srv = StubServer(0, a.latency, a.fail_every).start()
+            t0 = time.perf_counter()
+            st = drain_buffers(cfg_for(srv, conc), db)
+            dt = time.perf_counter() - t0
+            assert st["failed"] == 0 and st["ok"] == st["tasks"] == len(chunks), st
+            assert snapshot(db) == want, f"并发 {conc}：入库模板与期望不一致"
+            bad = db.conn.execute("SELECT COUNT(*) FROM LLM_TASK WHERE status!='成功' OR attempts IS NULL OR "
+                                  "http_status!=200 OR latency_ms IS NULL OR prompt_tokens IS NULL").fetchone()[0]
+            retried = db.conn.execute("SELECT SUM(attempts - 1) FROM LLM_TASK").fetchone()[0]
+            assert bad == 0 and retried == srv.stats["failed"] > 0, (bad, retried, srv.stats)
+            assert srv.stats["connections"] <= conc and srv.stats["max_active"] <= conc, srv.stats
+            assert not pending_buffers(db), "缓冲应全部处理完"
+            rows.append((f"drain x{conc}", dt, st["tasks"], st["ok"], srv.stats["connections"], srv.stats["max_active"]))
+            srv.shutdown()
+
+        # 缓存：第二天同形样本全部命中 不发请求
+        add_day(db, a.buffers, random.Random(5))
+        srv = StubServer(0, a.latency, a.fail_every).start()
+        tpl0 = snapshot(db)[0]
+        t0 = time.perf_counter()
+        st = drain_buffers(cfg_for(srv, a.concurrency), db)
+        dt = time.perf_counter() - t0
+        assert st["cache_hits"] == st["ok"] == st["tasks"] == len(chunks) and srv.stats["requests"] == 0, (st, srv.stats)
+        assert snapshot(db)[0] == tpl0, "缓存命中后入库模板应不变"
+        hits = db.conn.execute("SELECT COUNT(*) FROM LLM_TASK WHERE cache_hit=1 AND attempts=0").fetchone()[0]
+        assert hits == len(chunks)
+        rows.append(("drain cached", dt, st["tasks"], st["ok"], srv.stats["connections"], srv.stats["max_active"]))
+        # 提示词模板改动：不再命中 prune 清掉旧摘要的条目；大小上限按最近使用淘汰
+        with open(prompt, "w", encoding="utf-8") as f:
+            f.write("对下列样本聚类 只输出 JSON 数组：\n<samples>\n{SAMPLES}\n")
+        add_day(db, a.buffers, random.Random(6))
+        n0 = llm_cache.cache_stats(db.conn)["entries"]
+        st = drain_buffers(cfg_for(srv, a.concurrency), db)
+        assert st["cache_hits"] == 0 and srv.stats["requests"] >= len(chunks), (st, srv.stats)
+        assert llm_cache.cache_stats(db.conn)["entries"] == n0, "旧模板摘要的条目应被清除 由新结果替代"
+        size = llm_cache.cache_stats(db.conn)["bytes"]
+        llm_cache.prune(db.conn, max_mb=size / 2 / (1 << 20))
+        assert 0 < llm_cache.cache_stats(db.conn)["bytes"] <= size / 2
+        srv.shutdown()
+
+        # 超时：重试耗尽后记失败 缓冲下次重新提交
+        db, _ = setup(os.path.join(d, "timeout.db"), argparse.Namespace(buffers=1, keys=5, per_task=5), random.Random(4))
+        srv = StubServer(0, 0.3, 0).start()
+        st = drain_buffers(cfg_for(srv, 2, timeout_sec=0.05, retries=1), db)
+        r = db.conn.execute("SELECT status, attempts, error FROM LLM_TASK").fetchone()
+        assert st["failed"] == 1 and r[0] == "失败" and r[1] == 2 and "Timeout" in r[2], (st, tuple(r))
+        assert pending_buffers(db) == [1]
+        st = drain_buffers(cfg_for(srv, 2), db)
+        assert st["ok"] == 1 and not pending_buffers(db)
+        srv.shutdown()
+        client = LLMClient(cfg_for(srv, 1))
+        assert client.retries == 3 and client.concurrency == 1
+
+    print(f"缓冲 {a.buffers} × {a.keys} 个关键文本 每任务 {a.per_task} 条 桩延迟 {a.latency}s 每 {a.fail_every} 个请求一次 503")
+    print(f"{'path':<16}{'sec':>8}{'tasks':>7}{'ok':>5}{'conns':>7}{'max_active':>12}{'tasks/s':>9}")
+    for name, dt, n, ok, conns, act in rows:
+        print(f"{name:<16}{dt:>8.2f}{n:>7}{ok:>5}{conns:>7}{act:>12}{n / dt:>9.1f}")
+    print("入库模板与 BUFFER_RESULT 与期望一致 超时重试与失败重提 缓存命中 模板改动失效 大小淘汰 核对通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+提交前样本归并基准：合成的未命中缓冲（长尾形态 数字 / 十六进制 / 长 ID 各异 同一形态还有只差一个词的近重复变体）
+分别以 旧方式（不同关键文本每 max_prompt_samples 条一个任务）与 reducer（归一化 + MinHash 近重复归并 按 token 预算装箱）
+经本地桩服务（延迟随 token 数增长）drain 对比 任务数 提示词 token 耗时
+核对：每个缓冲各任务的 [×N] 计数之和等于缓冲条数（每条未命中都有代表）；提示词不超过 token 预算；
+同一输入两次规划结果相同（缓存键稳定）；生成模板覆盖的关键文本比例不低于 90%
+（桩只会把 {a|b|…} 写成 .+? 词数不同而并入同组的成员不被覆盖 真实 LLM 按典型日志归纳时覆盖更高）
+用法：python -m benchmarks.bench_reduce [--buffers 4] [--items 2000] [--budget 4000] [--latency 0.3] [--per-ktok 0.2]
+"""
+import argparse
+import os
+import random
+import re
+import tempfile
+import time
+
+from benchmarks.llm_stub import StubServer
+from logsys.db import Database
+from logsys.llm_adapter import load_prompt_template
+from logsys.llm_tasks import drain_buffers
+from logsys.main import init_db
+from logsys.reducer import estimate_tokens, plan_samples, reduce_samples
+
+FORMS = [
+    "open file /data/{w}/seg_{n}.bin failed errno {n}",
+    "topic /perception/{w} timeout {n} ms, last stamp {n}",
+    "lane {n} cost {n} too high in mode {w}",
+    "invalid by too close to real merge cross {n} [Process, {n}, /home/.../{w}_map.cpp]",
+    "get GetNextOrPreLeftMost err ! {id}, size {n}[GetNextOrPreLeftOrRightMost, {n}, /home/.../sdmap_helper.h]",
+    "frame {id} dropped: queue {w} full ({n}/{n})",
+    "checksum mismatch 0x{hex} expected 0x{hex} on {w}",
+    "planner replan reason {w} at s={n}.{n} l={n}.{n}",
+]
+WORDS = ["lidar", "camera", "radar", "fusion", "planner", "control", "map", "gnss", "imu", "ultrasonic"]
+NOUNS = ["sensor", "node", "channel", "pipe", "worker", "stage", "module", "driver", "bridge", "proxy",
+         "buffer", "cache", "queue", "timer", "loader", "parser", "writer", "reader", "agent", "client"]
+
+
+def make_items(n: int, rng: random.Random):
+    """长尾形态：基础句式 × 组件名 × 少量附加词 出现次数按 Zipf 分布"""
+    shapes = []
+    for f in FORMS:
+        for noun in NOUNS:
+            extra = rng.choice(["", " retry", " again", " (degraded)"])
+            shapes.append(f"{noun} " + f + extra)
+    weights = [1 / (i + 1) ** 0.8 for i in range(len(shapes))]
+    out = []
+    for shape in rng.choices(shapes, weights, k=n):
+        out.append(shape.format_map(_Fill(rng)))
+    return out
+
+
+class _Fill(dict):
+    def __init__(self, rng: random.Random) -> None:
+        super().__init__()
+        self.rng = rng
+
+    def __missing__(self, k: str) -> str:
+        r = self.rng
+        if k == "n":
+            return str(r.randint(0, 9999))
+        if k == "hex":
+            return "".join(r.choice("0123456789abcdef") for _ in range(8))
+        if k == "id":
+            return str(r.randint(10 ** 13, 10 ** 14))
+        return r.choice(WORDS)
+
+
+def setup(path: str, a, rng: random.Random):
+    db = Database(path)
+    init_db(db)
+    bufs = []
+    for _ in range(a.buffers):
+        items = make_items(a.items, rng)
+        bid = db.execute("INSERT INTO BUFFER_GROUP(scope, size_threshold, current_size, created_at, status) "
+                         "VALUES('全局', ?, ?, CURRENT_TIMESTAMP, '收集中')", (a.items, len(items)))
+        db.conn.executemany("INSERT INTO BUFFER_ITEM(buffer_id, key_text, raw_log) VALUES(?,?,?)",
+                            [(bid, k, k) for k in items])
+        bufs.append(items)
+    db.commit()
+    return db, bufs
+
+
+def _counted(items):
+    counts = {}
+    for k in items:
+        counts[k] = counts.get(k, 0) + 1
+    return counts.items()
+
+
+def coverage(db: Database) -> float:
+    pats = [re.compile(p) for p, in db.conn.execute("SELECT pattern FROM REGEX_TEMPLATE")]
+    keys = [k for k, in db.conn.execute("SELECT key_text FROM BUFFER_ITEM")]
+    return sum(1 for k in keys if any(p.search(k) for p in pats)) / len(keys)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--buffers", type=int, default=4)
+    ap.add_argument("--items", type=int, default=2000)
+    ap.add_argument("--per-task", type=int, default=100)
+    ap.add_argument("--budget", type=int, default=4000)
+    ap.add_argument("--threshold", type=float, default=0.8)
+    ap.add_argument("--latency", type=float, default=0.3)
+    ap.add_argument("--per-ktok", type=float, default=0.2)
+    ap.add_argument("--concurrency", type=int, default=4)
+    a = ap.parse_args()
+    os.environ["LLM_STUB_KEY"] = "stub"
+    rows = []
+    with tempfile.TemporaryDirectory() as d:
+        prompt = os.path.join(d, "prompt.txt")
+        with open(prompt, "w", encoding="utf-8") as f:
+            f.write("对下列样本聚类 输出 JSON 数组 行首 [×N] 表示代表 N 条 {a|b|…} 为可变位置：\n<samples>\n{SAMPLES}\n")
+
+        def cfg_for(srv, reduce):
+            return {"app": {"db_path": ""}, "llm": {
+                "enabled": True, "api_base": srv.api_base, "api_key_env": "LLM_STUB_KEY", "model": "stub",
+                "prompt_path": prompt, "max_prompt_samples": a.per_task, "concurrency": a.concurrency,
+                "retries": 2, "backoff_s": 0.02, "timeout_sec": 60, "cache": False,
+                "reduce": reduce, "reduce_threshold": a.threshold, "prompt_token_budget": a.budget}}
+
+        for reduce in (False, True):
+            db, bufs = setup(os.path.join(d, f"r{int(reduce)}.db"), a, random.Random(7))
+            srv = StubServer(0, a.latency, 0, a.per_ktok).start()
+            cfg = cfg_for(srv, reduce)
+            tmpl = load_prompt_template(cfg)
+            t0 = time.perf_counter()
+            plans = [plan_samples(cfg, list(_counted(items)), tmpl) for items in bufs]
+            t_plan = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            st = drain_buffers(cfg, db)
+            dt = time.perf_counter() - t0
+            srv.shutdown()
+            assert st["failed"] == 0 and st["ok"] == st["tasks"] == sum(map(len, plans)), st
+            if reduce:
+                over = estimate_tokens(tmpl.replace("{SAMPLES}", ""))
+                for items, plan in zip(bufs, plans):
+                    lines = [ln for pack in plan for ln in pack]
+                    n = sum(int(m.group(1)) if m else 1 for m in map(re.compile(r"^\[×(\d+)\] ").match, lines))
+                    assert n == len(items), "每条未命中都应计入某个代表"
+                    assert all(over + sum(estimate_tokens(ln) + 2 for ln in pack) <= a.budget for pack in plan)
+                    assert plan_samples(cfg, list(_counted(items)), tmpl) == plan, "同一输入的规划应稳定"
+                got = db.conn.execute("SELECT SUM(occurrences) FROM BUFFER_RESULT").fetchone()[0]
+                assert got == a.buffers * a.items, (got, a.buffers * a.items)
+            groups = sum(len(reduce_samples(_counted(items), a.threshold if reduce else 1.0)) for items in bufs)
+            distinct = sum(len(set(items)) for items in bufs)
+            cov = coverage(db)
+            assert cov >= (0.9 if reduce else 1.0), f"模板覆盖率 {cov:.1%}"
+            rows.append(("reducer" if reduce else "exact dedup", distinct, groups if reduce else distinct,
+                         st["tasks"], st["prompt_tokens"], st["completion_tokens"], dt, t_plan, cov))
+
+    print(f"缓冲 {a.buffers} × {a.items} 条 每任务至多 {a.per_task} 行 预算 {a.budget} tokens "
+          f"桩延迟 {a.latency}s + {a.per_ktok}s/千 token 并发 {a.concurrency}")
+    print(f"{'path':<13}{'distinct':>9}{'samples':>9}{'tasks':>7}{'prompt_tok':>12}{'compl_tok':>11}"
+          f"{'sec':>8}{'plan_s':>8}{'coverage':>10}")
+    for name, dis, smp, n, pt, ct, dt, tp, cov in rows:
+        print(f"{name:<13}{dis:>9}{smp:>9}{n:>7}{pt:>12}{ct:>11}{dt:>8.2f}{tp:>8.3f}{cov:>10.1%}")
+    print("代表计数覆盖全部未命中 token 预算 规划稳定 模板覆盖率 核对通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+模板注册表增量刷新基准：N 个模板加载后 先经 TemplateManager 只新增若干模板 再分散地合并 停用 改写模式
+两个阶段分别对比 全量 load_templates 与 增量 refresh 的耗时
+黄金核对：刷新后的匹配结果（含缓存路径）与新建匹配器全量加载的结果逐行一致；
+刷新期间另一线程持续匹配 每条结果必须等于旧模板集合或新模板集合之一的结果（不会看到半建好的索引）
+用法：python -m benchmarks.bench_registry [--templates 10000] [--changes 50] [--lines 5000]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from benchmarks.bench_matcher import make_lines, make_templates
+from logsys.db import Database
+from logsys.key_extract import normalize_key_text
+from logsys.main import init_db
+from logsys.matcher import TemplateMatcher
+from logsys.template_mgr import TemplateManager, bump_registry
+
+
+def results(m: TemplateMatcher, lines, cached: bool = False):
+    out = []
+    for s in lines:
+        h = m.match_text(s, normalize_key_text(s) if cached else None)
+        out.append(None if h is None else (h["template_id"], h["semantic_info"]))
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--templates", type=int, default=10_000)
+    ap.add_argument("--changes", type=int, default=50)
+    ap.add_argument("--lines", type=int, default=5000)
+    a = ap.parse_args()
+    rng = random.Random(11)
+    with tempfile.TemporaryDirectory() as d:
+        db = Database(os.path.join(d, "reg.db"))
+        init_db(db)
+        tpls = make_templates(a.templates + a.changes, rng)
+        base, extra = tpls[:a.templates], tpls[a.templates:]
+        db.conn.executemany("INSERT INTO REGEX_TEMPLATE(template_id, pattern, is_active, semantic_info) VALUES(?,?,1,?)",
+                            [(tid, p, json.dumps({"分类": "基线"}, ensure_ascii=False)) for tid, p in base])
+        db.commit()
+        lines = make_lines(tpls, a.lines, 0.7, rng)
+
+        m = TemplateMatcher(db, cache_size=10000)
+        t0 = time.perf_counter()
+        m.load_templates()
+        t_first = time.perf_counter() - t0
+        # 另一个匹配器只在最后一次刷新 期间由读线程并发匹配
+        live = TemplateMatcher(db, cache_size=10000)
+        live.load_templates()
+        before = results(live, lines)
+        mgr = TemplateManager(db)
+        rows = [("initial full load", t_first, None)]
+
+        def phase(name: str) -> None:
+            db.commit()
+            fresh = TemplateMatcher(db)
+            t0 = time.perf_counter()
+            fresh.load_templates()
+            t_full = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            changed = m.refresh()
+            t_delta = time.perf_counter() - t0
+            want = results(fresh, lines)
+            assert changed and m.version == fresh.version, "增量刷新后的版本戳与全量加载不一致"
+            assert results(m, lines) == want and results(m, lines, cached=True) == want, f"{name}: 增量刷新后匹配结果与全量加载不一致"
+            rows.append((name, t_full, t_delta))
+
+        # 阶段一：只新增（LLM 产出的常态 id 排在末尾）
+        mgr.upsert_from_llm(0, 0, [{"匹配规则": p, "典型日志": "", "分类": "新增"} for _, p in extra])
+        phase("append only")
+        # 阶段二：分散在各 id 区间的 合并（改语义） 停用 改写模式
+        mgr.upsert_from_llm(0, 0, [{"匹配规则": p, "典型日志": "", "分类": "合并"} for _, p in rng.sample(base, a.changes)])
+        mgr.set_active([tid for tid, _ in rng.sample(base, a.changes)], False)
+        edit = rng.sample(base, max(1, a.changes // 5))
+        db.conn.executemany("UPDATE REGEX_TEMPLATE SET pattern=?, version=version+1 WHERE template_id=?",
+                            [(p.replace(" size ", " sz "), tid) for tid, p in edit])
+        bump_registry(db.conn, [tid for tid, _ in edit])
+        phase("scattered changes")
+        assert not m.refresh(), "注册表版本未变时不应重建"
+
+        after = results(m, lines)
+        bad = []
+        stop = threading.Event()
+
+        def reader() -> None:
+            while not stop.is_set():
+                for i, s in enumerate(lines[:500]):
+                    h = live.match_text(s, normalize_key_text(s))
+                    r = None if h is None else (h["template_id"], h["semantic_info"])
+                    if r != before[i] and r != after[i]:
+                        bad.append((i, r))
+
+        t = threading.Thread(target=reader)
+        t.start()
+        time.sleep(0.1)
+        live.refresh()
+        time.sleep(0.2)
+        stop.set()
+        t.join()
+        assert not bad, bad[:5]
+        assert results(live, lines) == after
+
+        n_diff = sum(x != y for x, y in zip(before, after))
+        print(f"模板 {a.templates} 新增 {a.changes} 后 合并/停用 各 {a.changes} 改写 {len(edit)}；"
+              f"{a.lines} 行中 {n_diff} 行结果变化 增量刷新与全量加载逐行一致 并发匹配未见中间状态")
+        print(f"{'step':<22}{'full_s':>8}{'delta_s':>9}{'speedup':>9}")
+        for name, full, delta in rows:
+            if delta is None:
+                print(f"{name:<22}{full:>8.3f}")
+            else:
+                print(f"{name:<22}{full:>8.3f}{delta:>9.3f}{full / delta:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
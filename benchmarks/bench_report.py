@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+报表汇总表基准：
+- 管线：若干 run 的随机命中事件经 ColumnarAgg + write_aggregates 分批写库（汇总表同一事务内增量累加）
+  核对 增量汇总表 与 rebuild_rollups 从明细重建的结果一致；top_templates trend run_diff 与直接查 KEY_TIME_BUCKET
+  LOG_MATCH_SUMMARY 的结果一致；报告汇总表维护占写库耗时的比例 以及 明细查询 与 汇总表查询 的耗时
+- 规模：按 --days --mods --active --contexts 写 KEY_TIME_BUCKET 明细（一天一个 run 5min hour day 三种粒度）
+  行数 = 天数 × mod × active × contexts × (288 + 24 + 1) 缺省约 1.1 亿行 汇总表由 rebuild_rollups 从明细导出
+  报告 明细查询 与 汇总表查询 的耗时并核对结果一致；断言 前 k 个模板 小时趋势 run 差异 各汇总表查询在 1 秒内
+用法：python -m benchmarks.bench_report [--runs 4] [--events 300000] [--days 180] [--mods 20] [--active 50]
+"""
+import argparse
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from logsys import pass2
+from logsys.colagg import ColumnarAgg
+from logsys.db import Database, write_transaction
+from logsys.main import init_db
+from logsys.reporting import rebuild_rollups, run_diff, top_templates, trend
+from logsys.utils import epoch_iso
+
+GRANS = ["5min", "hour", "day"]
+T0 = 1704067200  # 2024-01-01
+
+
+@contextmanager
+def timed(acc: dict, key: str):
+    t = time.perf_counter()
+    yield
+    acc[key] = acc.get(key, 0.0) + time.perf_counter() - t
+
+
+def fill_runs(db: Database, a, rng: np.random.Generator, cost: dict):
+    """每个 run 一个 RUN_SESSION 事件按批写入 返回 run_id 列表"""
+    mods = [f"M{i}" for i in range(8)]
+    ctxs = [(m, f"S{j}", lvl, f"{th}") for m in mods for j in range(3) for lvl in "EWI" for th in range(4)]
+    w = rng.zipf(1.3, 10 * a.templates)
+    w = w[w <= a.templates]
+    real = pass2.write_rollups
+
+    def timed_rollups(*args):
+        with timed(cost, "rollups"):
+            return real(*args)
+
+    pass2.write_rollups = timed_rollups
+    runs = []
+    try:
+        for r in range(a.runs):
+            rid = db.execute("INSERT INTO RUN_SESSION(pass_type, status) VALUES('PASS2', '成功')")
+            db.commit()
+            tids = rng.choice(w, a.events)
+            cids = rng.integers(0, len(ctxs), a.events)
+            ts = T0 + r * 86400 + rng.integers(0, 10 * 86400, a.events)
+            for lo in range(0, a.events, 50000):
+                agg = ColumnarAgg(GRANS)
+                for t, c, e in zip(tids[lo:lo + 50000].tolist(), cids[lo:lo + 50000].tolist(), ts[lo:lo + 50000].tolist()):
+                    agg.add(t, "cls", *ctxs[c], e)
+                with timed(cost, "write"), write_transaction(db.conn) as conn:
+                    pass2.write_aggregates(conn, rid, agg)
+            runs.append(rid)
+    finally:
+        pass2.write_rollups = real
+    return runs
+
+
+def snapshot(conn):
+    return [conn.execute(f"SELECT * FROM {t} ORDER BY 1, 2, 3").fetchall() for t in ("ROLLUP_RUN", "ROLLUP_HOUR", "ROLLUP_DAY")]
+
+
+def pipeline(a, d: str):
+    db = Database(os.path.join(d, "pipe.db"))
+    init_db(db)
+    cost: dict = {}
+    runs = fill_runs(db, a, np.random.default_rng(22), cost)
+    c = db.conn
+    inc = snapshot(c)
+    st = rebuild_rollups(db)
+    assert snapshot(c) == inc, "增量汇总表与重建结果不一致"
+    n_bucket = c.execute("SELECT COUNT(*) FROM KEY_TIME_BUCKET").fetchone()[0]
+
+    q = {}
+    start, end, mod = epoch_iso(T0 + 86400)[:10], epoch_iso(T0 + 9 * 86400)[:10], "M3"
+    with timed(q, "raw top"):
+        raw = c.execute("SELECT template_id, SUM(count_in_bucket) n FROM KEY_TIME_BUCKET WHERE bucket_granularity='day' "
+                        "AND bucket_start >= ? AND bucket_start < ? AND mod = ? GROUP BY template_id "
+                        "ORDER BY n DESC, template_id LIMIT 20", (start, end, mod)).fetchall()
+    with timed(q, "rollup top"):
+        got = top_templates(db, start, end, mod, 20)
+    assert got == [tuple(r) for r in raw], (got[:3], raw[:3])
+    tid = got[0][0]
+    with timed(q, "raw trend"):
+        raw = c.execute("SELECT bucket_start, SUM(count_in_bucket) FROM KEY_TIME_BUCKET WHERE bucket_granularity='hour' "
+                        "AND bucket_start >= ? AND bucket_start < ? AND mod = ? AND template_id = ? "
+                        "GROUP BY bucket_start ORDER BY bucket_start", (start, end, mod, tid)).fetchall()
+    with timed(q, "rollup trend"):
+        got = trend(db, start, end, tid, mod)
+    assert got == [tuple(r) for r in raw]
+    with timed(q, "raw diff"):
+        raw = c.execute("SELECT template_id, SUM(CASE WHEN run_id=? THEN line_count ELSE 0 END) a, "
+                        "SUM(CASE WHEN run_id=? THEN line_count ELSE 0 END) b FROM LOG_MATCH_SUMMARY WHERE run_id IN (?, ?) "
+                        "GROUP BY template_id ORDER BY abs(b - a) DESC, template_id LIMIT 20", (runs[0], runs[1]) * 2).fetchall()
+    with timed(q, "rollup diff"):
+        got = run_diff(db, runs[0], runs[1])
+    assert got == [(t, x, y, y - x) for t, x, y in raw]
+    c.close()
+    return n_bucket, st, cost, q
+
+
+def fill_scale(c, a, rng: np.random.Generator) -> int:
+    """
+    一天一个 run：每个 mod 当天有 --active 个模板 每个 (模板, mod) 有 --contexts 个 (smod level thread) 组合
+    5min 桶计数随机 hour day 桶为其和；按唯一索引的列序写 KEY_TIME_BUCKET（插入只追加在 B 树右端）
+    LOG_MATCH_SUMMARY 每个 (run, 模板, mod, 组合) 一行；返回桶行数
+    """
+    sql = ("INSERT INTO KEY_TIME_BUCKET(run_id, template_id, mod, smod, classification, level, thread_id, "
+           "bucket_granularity, bucket_start, count_in_bucket) VALUES(?,?,?,?,?,?,?,?,?,?)")
+    ctxs = [(f"S{k}", "EWI"[k % 3], str(k)) for k in range(a.contexts)]
+    grans = ["5min"] * 288 + ["day"] + ["hour"] * 24     # 唯一索引中粒度在桶起点之前 按字典序
+    n = 0
+    for day in range(a.days):
+        t0 = T0 + day * 86400
+        starts = [epoch_iso(t0 + i * 300) for i in range(288)] + [epoch_iso(t0)] + [epoch_iso(t0 + h * 3600) for h in range(24)]
+        rid = c.execute("INSERT INTO RUN_SESSION(pass_type, status) VALUES('PASS2', '成功')").lastrowid
+        pairs = sorted((int(t) + 1, f"M{m}") for m in range(a.mods)
+                       for t in rng.choice(a.templates, a.active, replace=False))
+        g = len(pairs) * len(ctxs)
+        c5 = rng.integers(1, 50, (g, 288))
+        cnt = np.concatenate([c5, c5.sum(1, keepdims=True), c5.reshape(g, 24, 12).sum(2)], axis=1)
+        rows = ((rid, tid, mod, smod, f"C{tid % 6}", lvl, th, gr, st, k)
+                for (tid, mod), (smod, lvl, th), ks in zip(((p for p in pairs for _ in ctxs)), ctxs * len(pairs),
+                                                           cnt.tolist())
+                for gr, st, k in zip(grans, starts, ks))
+        with write_transaction(c):
+            c.executemany(sql, rows)
+            c.executemany("INSERT INTO LOG_MATCH_SUMMARY(run_id, template_id, mod, smod, classification, level, "
+                          "thread_id, line_count) VALUES(?,?,?,?,?,?,?,?)",
+                          ((rid, tid, mod, smod, f"C{tid % 6}", lvl, th, k) for (tid, mod), (smod, lvl, th), k
+                           in zip((p for p in pairs for _ in ctxs), ctxs * len(pairs), cnt[:, 288].tolist())))
+        n += cnt.size
+        if (day + 1) % 30 == 0:
+            print(f"  已写 {day + 1} 天 KEY_TIME_BUCKET {n / 1e6:.0f}M 行", flush=True)
+    return n
+
+
+def scale(a, d: str):
+    db = Database(os.path.join(d, "scale.db"))
+    init_db(db)
+    c = db.conn
+    c.execute("PRAGMA journal_mode=OFF")  # 临时库 一次性装载
+    c.execute("PRAGMA synchronous=OFF")
+    c.execute("PRAGMA cache_size=-1000000")
+    t = time.perf_counter()
+    n_bucket = fill_scale(c, a, np.random.default_rng(23))
+    gen = time.perf_counter() - t
+    t = time.perf_counter()
+    sizes = rebuild_rollups(db)
+    rebuild = time.perf_counter() - t
+    for table in ("ROLLUP_HOUR", "ROLLUP_DAY", "ROLLUP_RUN"):
+        c.execute(f"ANALYZE {table}")
+
+    q = {}
+    mod = f"M{min(7, a.mods - 1)}"
+    end = epoch_iso(T0 + a.days * 86400)[:10]
+    start = epoch_iso(T0 + (a.days - min(30, a.days)) * 86400)[:10]
+    with timed(q, "raw top k mod 30d"):
+        raw = c.execute("SELECT template_id, SUM(count_in_bucket) n FROM KEY_TIME_BUCKET WHERE bucket_granularity='day' "
+                        "AND bucket_start >= ? AND bucket_start < ? AND mod = ? GROUP BY template_id "
+                        "ORDER BY n DESC, template_id LIMIT 20", (start, end, mod)).fetchall()
+    with timed(q, "top k mod 30d"):
+        top = top_templates(db, start, end, mod, 20)
+    assert top == [tuple(r) for r in raw], (top[:3], raw[:3])
+    with timed(q, "top k all 30d"):
+        top_templates(db, start, end, None, 20)
+    with timed(q, "trend mod 30d hourly"):
+        tr = trend(db, start, end, mod=mod)
+    with timed(q, "trend tpl 30d hourly"):
+        trend(db, start, end, template_id=top[0][0])
+    with timed(q, "raw trend tpl+mod 30d"):
+        raw = c.execute("SELECT bucket_start, SUM(count_in_bucket) FROM KEY_TIME_BUCKET WHERE bucket_granularity='hour' "
+                        "AND bucket_start >= ? AND bucket_start < ? AND mod = ? AND template_id = ? "
+                        "GROUP BY bucket_start ORDER BY bucket_start", (start, end, mod, top[0][0])).fetchall()
+    with timed(q, "trend tpl+mod 30d"):
+        got = trend(db, start, end, template_id=top[0][0], mod=mod)
+    assert got == [tuple(r) for r in raw]
+    with timed(q, "raw run diff"):
+        raw = c.execute("SELECT template_id, SUM(CASE WHEN run_id=1 THEN line_count ELSE 0 END) a, "
+                        "SUM(CASE WHEN run_id=2 THEN line_count ELSE 0 END) b FROM LOG_MATCH_SUMMARY WHERE run_id IN (1, 2) "
+                        "GROUP BY template_id ORDER BY abs(b - a) DESC, template_id LIMIT 20").fetchall()
+    with timed(q, "run diff"):
+        got = run_diff(db, 1, 2)
+    assert got == [(t, x, y, y - x) for t, x, y in raw]
+    assert len(tr) == min(30, a.days) * 24, len(tr)
+    slow = {k: v for k, v in q.items() if v >= 1.0 and not k.startswith("raw")}
+    assert not slow, slow
+    c.close()
+    return n_bucket, sizes, gen, rebuild, q
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=4)
+    ap.add_argument("--events", type=int, default=300000, help="管线部分每个 run 的命中事件数")
+    ap.add_argument("--templates", type=int, default=2000)
+    ap.add_argument("--days", type=int, default=180)
+    ap.add_argument("--mods", type=int, default=20)
+    ap.add_argument("--active", type=int, default=50, help="规模部分每个 (mod, 天) 有命中的模板数")
+    ap.add_argument("--contexts", type=int, default=2, help="规模部分每个 (mod, 天, 模板) 的 (smod level thread) 组合数")
+    a = ap.parse_args()
+    with tempfile.TemporaryDirectory() as d:
+        n_bucket, st, cost, q1 = pipeline(a, d)
+        n_scale, sizes, gen, rebuild, q2 = scale(a, d)
+
+    print(f"管线：{a.runs} 个 run 每个 {a.events} 条命中 KEY_TIME_BUCKET {n_bucket} 行 汇总表 "
+          + " ".join(f"{k} {v}" for k, v in st.items()))
+    print(f"写库 {cost['write']:.2f}s 其中汇总表维护 {cost['rollups']:.2f}s（{cost['rollups'] / cost['write']:.0%}）")
+    print(f"{'query':<16}{'raw ms':>10}{'rollup ms':>12}")
+    for k in ("top", "trend", "diff"):
+        print(f"{k:<16}{q1['raw ' + k] * 1000:>10.1f}{q1['rollup ' + k] * 1000:>12.1f}")
+    print(f"规模：{a.days} 天 {a.mods} 个 mod KEY_TIME_BUCKET {n_scale / 1e6:.0f}M 行 写入 {gen:.0f}s "
+          f"rebuild_rollups {rebuild:.0f}s 汇总表 " + " ".join(f"{k} {v}" for k, v in sizes.items()))
+    for k, v in q2.items():
+        print(f"{k:<24}{v * 1000:>12.1f} ms")
+    print("增量汇总与重建一致 查询结果与明细一致 规模查询均在 1 秒内 核对通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+pass2 记录扫描基准：原链路（gzip 文本解码 + normalize_lines + parse_line + extract_key_text）
+与 融合字节扫描（scanner） 对比 行/秒
+同时做黄金核对：两条链路逐条记录的 时间戳 级别 MOD SMOD 关键文本 原始行 必须完全一致；
+数据含 续行 空白续行 CRLF 中文 缺级别 正文中的 [MOD:..] 空中括号 首条记录前的杂行 等情形
+另按小间隔建 gzip 索引 核对各区段记录拼接后与整文件一致
+用法：python -m benchmarks.bench_scanner [--lines 500000] [--span-kb 256]
+"""
+import argparse
+import gzip
+import os
+import random
+import tempfile
+import time
+
+from logsys import gzindex, scanner
+from logsys.ingest import read_gz_chunks, read_gz_lines
+from logsys.key_extract import extract_key_text
+from logsys.parser import parse_line
+from logsys.preprocess import normalize_lines
+
+
+def make_file(path: str, n: int, rng: random.Random) -> None:
+    mods = [("PNC", "planner"), ("PER", "lidar"), ("MAP", "fusion"), ("定位", "融合")]
+    msgs = ["get lane err size {n} id v{n}", "invalid by too close to real merge {n} cross",
+            "sensor timeout after {n} ms", "规划 重试 {n} 次"]
+    # 少量边角情形 比例不高以免主导计时
+    rare = ["obj [MOD:BODY] moved {n}", "  padded message {n}  ", "list [] and [x] {n}"]
+    with gzip.open(path, "wb") as f:
+        f.write(b"header line before first record\n\n")
+        sec = 0
+        for i in range(n):
+            sec += rng.randint(0, 3)
+            ts = f"20240105_{(sec // 3600) % 24:02d}{(sec // 60) % 60:02d}{sec % 60:02d}"
+            mod, smod = rng.choice(mods)
+            msg = rng.choice(rare if rng.random() < 0.03 else msgs).format(n=rng.randint(0, 5000))
+            r = rng.random()
+            if r < 0.95:
+                head = f"[{ts}][{rng.randint(100, 105)}][{rng.choice('EWID')}][MOD:{mod}][SMOD:{smod}]"
+            elif r < 0.98:
+                head = f"[{ts}][MOD:{mod}][SMOD:{smod}][]"
+            else:
+                head = f"[{ts}][{rng.randint(100, 105)}][X][SMOD:{smod}][MOD:{mod} SMOD:{smod}x]"
+            eol = "\r\n" if rng.random() < 0.02 else "\n"
+            f.write(f"{head} {msg}{eol}".encode())
+            r = rng.random()
+            if r < 0.05:
+                f.write(f"   continuation detail {rng.randint(0, 9)}  \n".encode())
+            elif r < 0.06:
+                f.write("\t \n　续行 全角空白　\n".encode())
+
+
+def old_chain(path: str):
+    for line in normalize_lines(read_gz_lines(path)):
+        p = parse_line(line)
+        yield p["timestamp"], p["level"], p["mod"], p["smod"], extract_key_text(p["raw"]), line
+
+
+def new_chain(path: str):
+    # pass2 只在未命中时解码原始行 计时不含该解码；核对时统一解码后比较
+    return scanner.iter_records(read_gz_chunks(path))
+
+
+def decoded(recs):
+    for ts, lvl, mod, smod, key, raw in recs:
+        yield ts, lvl, mod, smod, key, raw.decode("utf-8", "ignore")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lines", type=int, default=500_000)
+    ap.add_argument("--span-kb", type=int, default=256)
+    a = ap.parse_args()
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "scan.gz")
+        make_file(path, a.lines, random.Random(7))
+
+        old = list(old_chain(path))
+        new = list(decoded(new_chain(path)))
+        assert len(old) == len(new), (len(old), len(new))
+        for i, (o, n) in enumerate(zip(old, new)):
+            assert o == n, (i, o, n)
+
+        if gzindex.available():
+            reader = gzindex.IndexingReader(path, a.span_kb << 10)
+            for _ in reader:
+                pass
+            idx = reader.index
+            seg = [r for s, e in idx.segments()
+                   for b in scanner.iter_blocks_range(path, idx, s, e)
+                   for r in decoded(scanner.scan_block(b))]
+            assert seg == new, "分段扫描与整文件不一致"
+            print(f"分段核对：{len(idx.segments())} 个区段 一致")
+
+        rows = []
+        for name, fn in (("old chain", old_chain), ("fused scanner", new_chain)):
+            t = time.perf_counter()
+            n = sum(1 for _ in fn(path))
+            rows.append((name, time.perf_counter() - t, n))
+        print(f"记录 {len(old)} 字段逐条一致")
+        print(f"{'path':<16}{'sec':>8}{'rec/s':>12}")
+        for name, dt, n in rows:
+            print(f"{name:<16}{dt:>8.2f}{n / dt:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+pass1 唯一关键文本跟踪基准：若干高频事件（Zipf） 混入大量只出现一次的长尾关键文本
+- 摘要层：原实现（字典满 pass1_unique_cap 时弹出最早插入的键）与 SpaceSaving（至多 2 × cap 个键）
+  对比 结束时真实前 K 名的保留率 保留键的计数误差 吞吐 以及不同行数下的峰值内存（tracemalloc）
+- 端到端：写 .gz 跑 run_pass1 前一半事件有模板 核对 REGEX_TEMPLATE.match_count 为真实行数的下界且误差不超过 1%；
+  未命中入缓冲按次数降序 最先入缓冲的是最高频的未命中事件
+用法：python -m benchmarks.bench_sketch [--lines 1000000] [--cap 5000] [--events 200] [--tail 0.5]
+"""
+import argparse
+import gzip
+import os
+import random
+import string
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+from logsys.db import Database
+from logsys.main import init_db
+from logsys.pass1 import run_pass1
+from logsys.sketch import SpaceSaving
+
+WORDS = ["lidar", "camera", "radar", "planner", "control", "gnss", "imu", "chassis", "can", "map"]
+STATES = ["timeout", "dropped", "rejected", "retrying", "degraded", "stale"]
+
+
+def make_events(n: int, rng: random.Random):
+    out = set()
+    while len(out) < n:
+        out.add(f"{rng.choice(WORDS)} {rng.choice(STATES)} {rng.choice(WORDS)} {''.join(rng.choices(string.ascii_lowercase, k=4))}")
+    return sorted(out)
+
+
+def make_stream(a, rng: random.Random):
+    """(关键文本 事件序号 或 -1 表示长尾) 长尾关键文本各不相同"""
+    events = make_events(a.events, rng)
+    weights = [1 / (i + 1) for i in range(len(events))]
+    picks = rng.choices(range(len(events)), weights, k=a.lines)
+    out = []
+    for i, e in enumerate(picks):
+        if rng.random() < a.tail:
+            out.append((f"trace {''.join(rng.choices(string.ascii_lowercase, k=10))} done", -1))
+        else:
+            out.append((events[e], e))
+    return events, out
+
+
+def fifo(keys, cap: int):
+    uniq = {}
+    for k in keys:
+        if k not in uniq:
+            if len(uniq) >= cap:
+                uniq.pop(next(iter(uniq)))
+            uniq[k] = 1
+        else:
+            uniq[k] += 1
+    return uniq
+
+
+def sketch(keys, cap: int) -> SpaceSaving:
+    sk = SpaceSaving(cap)
+    for k in keys:
+        if sk.add(k):
+            sk.items[k] = k
+    return sk
+
+
+def peak(fn, keys, cap: int) -> int:
+    tracemalloc.start()
+    fn(keys, cap)
+    p = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return p
+
+
+def end_to_end(a, events, stream):
+    truth = Counter(e for _, e in stream if e >= 0)
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "p1.gz")
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            for i, (k, _) in enumerate(stream):
+                f.write(f"[20240105_{(i // 3600) % 24:02d}{(i // 60) % 60:02d}{i % 60:02d}][101][W][MOD:PNC][SMOD:planner] {k}\n")
+        db = Database(os.path.join(d, "p1.db"))
+        init_db(db)
+        # 偶数序号的事件有模板 奇数序号的留作未命中
+        tids = {}
+        for e in range(0, len(events), 2):
+            tids[e] = db.execute("INSERT INTO REGEX_TEMPLATE(pattern, match_count, is_active) VALUES(?, 0, 1)",
+                                 ("^" + events[e] + "$",))
+        db.commit()
+        cfg = {"app": {"db_path": os.path.join(d, "p1.db"), "gz_index_span_mb": 0},
+               "pass1_unique_cap": a.cap, "buffer_threshold": 100}
+        t0 = time.perf_counter()
+        run_pass1(cfg, db, path)
+        sec = time.perf_counter() - t0
+        c = db.conn
+        worst = 0.0
+        for e, tid in tids.items():
+            got = c.execute("SELECT match_count FROM REGEX_TEMPLATE WHERE template_id=?", (tid,)).fetchone()[0]
+            assert got <= truth[e], (events[e], got, truth[e])
+            if truth[e] >= 100:
+                worst = max(worst, 1 - got / truth[e])
+        assert worst <= 0.01, worst
+        first = [r[0] for r in c.execute("SELECT key_text FROM BUFFER_ITEM ORDER BY item_id LIMIT 5")]
+        want = [events[e] for e, _ in sorted(((e, n) for e, n in truth.items() if e % 2), key=lambda x: -x[1])[:5]]
+        assert first == want, (first, want)
+        db.conn.close()
+    return sec, worst
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lines", type=int, default=1_000_000)
+    ap.add_argument("--cap", type=int, default=5000)
+    ap.add_argument("--events", type=int, default=200)
+    ap.add_argument("--tail", type=float, default=0.5, help="只出现一次的关键文本占比")
+    ap.add_argument("--top", type=int, default=50)
+    a = ap.parse_args()
+    events, stream = make_stream(a, random.Random(20))
+    keys = [k for k, _ in stream]
+    truth = Counter(keys)
+    top = [k for k, _ in truth.most_common(a.top)]
+
+    t0 = time.perf_counter()
+    old = fifo(keys, a.cap)
+    t_old = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    sk = sketch(keys, a.cap)
+    t_new = time.perf_counter() - t0
+
+    old_kept = sum(k in old for k in top)
+    new_kept = sum(k in sk for k in top)
+    assert new_kept == len(top), new_kept
+    for k in top:
+        assert sk.guaranteed(k) <= truth[k] <= sk.count(k), k
+    assert sk.floor <= a.lines / a.cap
+    new_err = max((sk.count(k) - truth[k]) / truth[k] for k in top)
+    # 原实现对保留键只计入最后一次进入字典后的次数
+    old_err = max(((truth[k] - old[k]) / truth[k] for k in top if k in old), default=1.0)
+
+    quarter = keys[:len(keys) // 4]
+    p_old = (peak(fifo, quarter, a.cap), peak(fifo, keys, a.cap))
+    p_new = (peak(sketch, quarter, a.cap), peak(sketch, keys, a.cap))
+    assert p_new[1] < p_new[0] * 1.25, p_new
+
+    sec, worst = end_to_end(a, events, stream)
+
+    print(f"{a.lines} 行 事件 {a.events} 类 长尾占比 {a.tail:.0%} 不同关键文本 {len(truth)} cap {a.cap}")
+    print(f"{'path':<22}{'sec':>8}{'lines/s':>12}{'top-' + str(a.top) + ' kept':>14}{'max err':>10}"
+          f"{'peak 1/4':>12}{'peak full':>12}")
+    print(f"{'FIFO evict (old)':<22}{t_old:>8.2f}{a.lines / t_old:>12,.0f}{old_kept:>14}{old_err:>10.1%}"
+          f"{p_old[0] / 2 ** 20:>10.1f}MB{p_old[1] / 2 ** 20:>10.1f}MB")
+    print(f"{'SpaceSaving':<22}{t_new:>8.2f}{a.lines / t_new:>12,.0f}{new_kept:>14}{new_err:>10.1%}"
+          f"{p_new[0] / 2 ** 20:>10.1f}MB{p_new[1] / 2 ** 20:>10.1f}MB")
+    print(f"SpaceSaving 淘汰 {sk.evicted} 个键 floor {sk.floor}")
+    print(f"run_pass1 {sec:.2f}s 模板计数最大低估 {worst:.2%}（>=100 行的事件） 缓冲前 5 条为最高频未命中")
+    print("前 K 名保留 计数上下界 峰值内存 模板计数 缓冲顺序 核对通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+merge-summary 基准：若干模板 与 大量适用上下文的历史 之后每轮只有少量模板计数与上下文变化
+- 原实现：逐行读出全部 REGEX_TEMPLATE 逐条 upsert 再对整张 TEMPLATE_APPLICABILITY 分组 逐条 upsert
+- 增量：触发器记下变化的 template_id 每轮两条 INSERT ... SELECT ... ON CONFLICT
+核对：每轮之后两种方式得到的 SUMMARY_REGEX_TEMPLATE 与 SUMMARY_TEMPLATE_APPLICABILITY（不含时间戳列）完全一致
+用法：python -m benchmarks.bench_summary [--templates 20000] [--contexts 400000] [--rounds 5] [--changed 200]
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+from logsys.db import Database, bump_template_stats_bulk
+from logsys.main import init_db
+from logsys.summary_agg import merge_to_summary
+from logsys.template_mgr import TemplateManager
+
+TPL_COLS = ("template_id, pattern, sample_log, normalized_sample, version, is_active, semantic_info, "
+            "total_match_count, first_seen_global, last_seen_global")
+APP_COLS = "template_id, mod, smod, total_count, first_seen_in_ctx, last_seen_in_ctx, source"
+
+
+def legacy_merge(db: Database) -> None:
+    now = datetime.utcnow().isoformat()
+    for r in db.query("SELECT * FROM REGEX_TEMPLATE"):
+        db.conn.execute(
+            "INSERT INTO SUMMARY_REGEX_TEMPLATE(template_id, pattern, sample_log, normalized_sample, version, is_active, "
+            "semantic_info, aggregated_at, total_match_count, first_seen_global, last_seen_global) VALUES(?,?,?,?,?,?,?,?,?,?,?) "
+            "ON CONFLICT(template_id) DO UPDATE SET pattern=excluded.pattern, sample_log=excluded.sample_log, "
+            "normalized_sample=excluded.normalized_sample, version=excluded.version, is_active=excluded.is_active, "
+            "semantic_info=excluded.semantic_info, aggregated_at=excluded.aggregated_at, "
+            "total_match_count=excluded.total_match_count, first_seen_global=excluded.first_seen_global, "
+            "last_seen_global=excluded.last_seen_global",
+            (r["template_id"], r["pattern"], r["sample_log"], r["normalized_sample"], r["version"], r["is_active"],
+             r["semantic_info"], now, r["match_count"], r["first_seen"], r["last_seen"]))
+    for it in db.query("SELECT template_id, mod, smod, SUM(observed_count) c, MIN(first_seen_in_ctx) fmin, "
+                       "MAX(last_seen_in_ctx) fmax FROM TEMPLATE_APPLICABILITY GROUP BY template_id, mod, smod"):
+        db.conn.execute(
+            "INSERT INTO SUMMARY_TEMPLATE_APPLICABILITY(template_id, mod, smod, total_count, first_seen_in_ctx, "
+            "last_seen_in_ctx, source, last_updated) VALUES(?,?,?,?,?,?,?,?) "
+            "ON CONFLICT(template_id, mod, smod, source) DO UPDATE SET total_count=excluded.total_count, "
+            "last_seen_in_ctx=excluded.last_seen_in_ctx, last_updated=excluded.last_updated",
+            (it["template_id"], it["mod"], it["smod"], it["c"] or 0, it["fmin"], it["fmax"], "mixed", now))
+    db.commit()
+
+
+def ctx_rows(rng: random.Random, tids, n: int, day: int):
+    mods = [(f"M{i}", f"S{j}") for i in range(20) for j in range(10)]
+    ts = f"2024-01-{day:02d}T00:00:00"
+    return [(rng.choice(tids), *rng.choice(mods), rng.randint(1, 50), ts, ts) for _ in range(n)]
+
+
+def snapshot(db: Database):
+    return (db.conn.execute(f"SELECT {TPL_COLS} FROM SUMMARY_REGEX_TEMPLATE ORDER BY template_id").fetchall(),
+            db.conn.execute(f"SELECT {APP_COLS} FROM SUMMARY_TEMPLATE_APPLICABILITY ORDER BY template_id, mod, smod").fetchall())
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--templates", type=int, default=20000)
+    ap.add_argument("--contexts", type=int, default=400000)
+    ap.add_argument("--rounds", type=int, default=5)
+    ap.add_argument("--changed", type=int, default=200, help="每轮计数变化的模板数")
+    a = ap.parse_args()
+    rng = random.Random(21)
+
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "base.db")
+        db = Database(path)
+        init_db(db)
+        db.conn.executemany(
+            "INSERT INTO REGEX_TEMPLATE(template_id, pattern, sample_log, match_count, first_seen, last_seen, version, is_active) "
+            "VALUES(?,?,?,?,?,?,1,1)",
+            [(t, f"^evt{t} \\d+$", f"evt{t} 1", rng.randint(0, 10 ** 6), "2024-01-01", "2024-01-01")
+             for t in range(1, a.templates + 1)])
+        db.commit()
+        tids = list(range(1, a.templates + 1))
+        TemplateManager(db).observe_bulk(ctx_rows(rng, tids, a.contexts, 1))
+        t0 = time.perf_counter()
+        st = merge_to_summary(db)
+        t_first = time.perf_counter() - t0
+        assert st["templates"] == a.templates, st
+        db.conn.close()
+        shutil.copy(path, os.path.join(d, "old.db"))
+        old, new = Database(os.path.join(d, "old.db")), Database(path)
+
+        t_old = t_new = 0.0
+        for r in range(a.rounds):
+            changed = rng.sample(tids, a.changed)
+            counts = {t: rng.randint(1, 100) for t in changed}
+            rows = ctx_rows(rng, changed, a.changed * 5, r + 2)
+            for db in (old, new):
+                bump_template_stats_bulk(db.conn, counts)
+                db.commit()
+                TemplateManager(db).observe_bulk(rows)
+            t0 = time.perf_counter()
+            legacy_merge(old)
+            t_old += time.perf_counter() - t0
+            t0 = time.perf_counter()
+            st = merge_to_summary(new)
+            t_new += time.perf_counter() - t0
+            assert st["templates"] == a.changed, st
+            assert snapshot(old) == snapshot(new), f"第 {r + 1} 轮 SUMMARY 不一致"
+        assert new.conn.execute("SELECT COUNT(*) FROM SUMMARY_DIRTY").fetchone()[0] == 0
+        full = merge_to_summary(new, full=True)
+        assert full["templates"] == a.templates and snapshot(old) == snapshot(new)
+        n_ctx = new.conn.execute("SELECT COUNT(*) FROM SUMMARY_TEMPLATE_APPLICABILITY").fetchone()[0]
+        old.conn.close()
+        new.conn.close()
+
+    print(f"模板 {a.templates} 适用上下文 {n_ctx} 行 每轮变化模板 {a.changed} 共 {a.rounds} 轮")
+    print(f"{'path':<28}{'sec/round':>12}")
+    print(f"{'first merge (all dirty)':<28}{t_first:>12.3f}")
+    print(f"{'legacy full merge':<28}{t_old / a.rounds:>12.3f}")
+    print(f"{'incremental merge':<28}{t_new / a.rounds:>12.3f}   x{t_old / max(t_new, 1e-9):.0f}")
+    print("每轮 SUMMARY 与全量合并一致 SUMMARY_DIRTY 清空 --full 一致 核对通过")
+
+
+if __name__ == "__main__":
+    main()
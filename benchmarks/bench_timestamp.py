@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+时间戳阶段微基准：
+- 原路径：iso() + floor_bucket()（datetime.fromisoformat）每行每粒度一次
+- 新路径：parse_ts() 定宽解析为 epoch 秒 一次解析后多个粒度用整数取整（逐行 与 NumPy 向量化）
+并核对两条路径的分桶结果一致
+用法：python -m benchmarks.bench_timestamp [--lines 1000000] [--grans 1min,5min,hour,day]
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from logsys.utils import epoch_iso, floor_bucket, gran_seconds, iso, parse_ts
+
+
+def make_ts(n: int, rng: random.Random):
+    out = []
+    sec = 0
+    for _ in range(n):
+        sec += rng.randint(0, 2)
+        day = 5 + sec // 86400
+        out.append(f"202401{day:02d}_{(sec // 3600) % 24:02d}{(sec // 60) % 60:02d}{sec % 60:02d}")
+    return out
+
+
+def old_path(ts_list, grans):
+    out = []
+    for ts in ts_list:
+        t = iso(ts)
+        out.append(tuple(floor_bucket(t, g) for g in grans))
+    return out
+
+
+def new_scalar(ts_list, steps):
+    out = []
+    for ts in ts_list:
+        e = parse_ts(ts)
+        out.append(tuple(e - e % s for s in steps))
+    return out
+
+
+def new_vector(ts_list, steps):
+    ep = np.fromiter((parse_ts(ts) for ts in ts_list), dtype=np.int64, count=len(ts_list))
+    return [ep - ep % s for s in steps]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lines", type=int, default=1_000_000)
+    ap.add_argument("--grans", default="1min,5min,hour,day")
+    a = ap.parse_args()
+    grans = a.grans.split(",")
+    steps = [gran_seconds(g) for g in grans]
+    ts_list = make_ts(a.lines, random.Random(11))
+
+    # floor_bucket 只认识 hour/5min 其余按分钟取整 只对这些粒度核对
+    comparable = [i for i, g in enumerate(grans) if g in ("1min", "5min", "hour")]
+    sample = ts_list[:: max(1, len(ts_list) // 5000)]
+    old = old_path(sample, grans)
+    new = new_scalar(sample, steps)
+    for o, n in zip(old, new):
+        for i in comparable:
+            assert o[i] == epoch_iso(n[i]), (o[i], epoch_iso(n[i]))
+
+    rows = []
+    for name, fn, arg in (("iso+floor_bucket", old_path, grans),
+                          ("parse_ts scalar", new_scalar, steps),
+                          ("parse_ts + numpy", new_vector, steps)):
+        t = time.perf_counter()
+        fn(ts_list, arg)
+        rows.append((name, time.perf_counter() - t))
+    print(f"{a.lines} 行 粒度 {grans}")
+    print(f"{'path':<20}{'sec':>8}{'ns/line':>10}")
+    for name, dt in rows:
+        print(f"{name:<20}{dt:>8.2f}{dt / a.lines * 1e9:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
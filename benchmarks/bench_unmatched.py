@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+未命中存储基准：模拟模板缺失的一天 大量只差数字 / ID 的未命中记录
+- 原实现：每条未命中一行 UNMATCHED_LOG（含完整原始行） 同时明文追加到 unmatched_dir
+- 去重存储：按 (归一化关键文本, mod, smod) 聚合进 UNMATCHED_KEY 原始行压缩分块追加到溢出文件
+  对比 写库行数 写入耗时 库大小 磁盘占用 进程写出字节（/proc/self/io 的 wchar 含 WAL）
+  核对 溢出文件按序读回与输入逐行一致 随机行序号取回一致 各键行数之和与样例正确 key_records 行数与聚合一致
+- 中断续写：聚合未写出时中断 新写者从溢出文件重放后结果与一次写完一致
+- resolve：同一 .gz 先在缺一条模板的库上 pass2 补上模板后 resolve 结果与在完整模板库上直接 pass2 一致 再次 resolve 不重复补入
+用法：python -m benchmarks.bench_unmatched [--lines 1000000] [--shapes 20] [--batch 10000]
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.bench_follow import TEMPLATES, Gen, run_rows
+from logsys.db import Database, bulk_upsert, write_transaction
+from logsys.key_extract import normalize_key_text
+from logsys.main import init_db
+from logsys.pass2 import run_pass2
+from logsys.process import resolve_run
+from logsys.unmatched_store import UnmatchedStore, iter_records, key_records, read_record
+
+LEGACY_COLS = ("run_id", "mod", "smod", "level", "thread_id", "timestamp", "key_text", "raw_log", "buffered", "reason")
+WORDS = ["decode", "frame", "lane", "sensor", "planner", "retry", "timeout", "checksum", "queue", "drop"]
+MISSING = ("unexpected frame gap \\d+", "帧")
+
+
+def wchar() -> int:
+    try:
+        with open("/proc/self/io") as f:
+            return next(int(l.split()[1]) for l in f if l.startswith("wchar"))
+    except (OSError, StopIteration):
+        return 0
+
+
+def gen_items(a, rng: random.Random):
+    """
+    同 part['unmatched'] 的 (原始行字节, mod, smod, level, thread_id, 时间戳, 关键文本, 归一化键) 只差数字与 ID 的若干种消息
+    归一化键在 pass2 匹配时已算好（匹配缓存的键） 这里预先算出 不计入写入耗时
+    """
+    shapes = [" ".join(rng.sample(WORDS, 4)) + " id {id} seq {n} took {ms} ms" for _ in range(a.shapes)]
+    ids = [f"0x{rng.getrandbits(48):012x}" for _ in range(1000)]
+    items = []
+    for i in range(a.lines):
+        s = i * 86400 // a.lines
+        ts = f"20240105_{s // 3600:02d}{s // 60 % 60:02d}{s % 60:02d}"
+        mod, smod = f"M{rng.randrange(10)}", f"S{rng.randrange(3)}"
+        key = rng.choice(shapes).format(id=rng.choice(ids), n=i, ms=rng.randint(1, 500))
+        raw = f"[{ts}][{rng.randint(100, 199)}][E][MOD:{mod}][SMOD:{smod}] {key}"
+        items.append((raw.encode(), mod, smod, "E", None, ts, key, normalize_key_text(key)))
+    return items
+
+
+def db_bytes(db: Database, path: str) -> int:
+    db.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return os.path.getsize(path)
+
+
+def legacy_write(db: Database, items, batch: int, um_path: str) -> int:
+    conn = db.conn
+    with open(um_path, "w", encoding="utf-8") as f:
+        for lo in range(0, len(items), batch):
+            part = items[lo:lo + batch]
+            with write_transaction(conn):
+                lines = [raw.decode("utf-8", "ignore") for raw, *_ in part]
+                bulk_upsert(conn, "UNMATCHED_LOG", LEGACY_COLS,
+                            ((1, mod, smod, lvl, th, ts, key, line, 0, "no_match_pass2")
+                             for line, (_, mod, smod, lvl, th, ts, key, _) in zip(lines, part)))
+            f.writelines(line + "\n" for line in lines)
+    return len(items)
+
+
+def store_write(cfg: dict, db: Database, items, batch: int) -> int:
+    conn = db.conn
+    st = UnmatchedStore(cfg, conn, 1)
+    n = 0
+    for lo in range(0, len(items), batch):
+        st.add(items[lo:lo + batch])
+        with write_transaction(conn):
+            n += st.write(conn, final=lo + batch >= len(items))
+    st.close()
+    return n
+
+
+def keys_of(conn):
+    return [tuple(r) for r in conn.execute("SELECT * FROM UNMATCHED_KEY ORDER BY 1, 2, 3, 4")]
+
+
+def check_replay(d: str, items, batch: int) -> None:
+    """写到一半中断（聚合尚未写出）后新建写者续写 UNMATCHED_KEY 与一次写完的结果一致"""
+    out = []
+    for name, cut in (("once", None), ("crash", len(items) // 2)):
+        db = Database(os.path.join(d, f"replay_{name}.db"))
+        init_db(db)
+        db.execute("INSERT INTO RUN_SESSION(run_id, pass_type, status) VALUES(1, 'PASS2', '成功')")
+        db.commit()
+        cfg = {"app": {"unmatched_dir": os.path.join(d, f"um_replay_{name}"), "unmatched_key_flush_rows": len(items)}}
+        if cut is None:
+            store_write(cfg, db, items, batch)
+        else:
+            st = UnmatchedStore(cfg, db.conn, 1)
+            for lo in range(0, cut, batch):
+                st.add(items[lo:min(lo + batch, cut)])
+                with write_transaction(db.conn):
+                    st.write(db.conn)
+            st.close()
+            assert not keys_of(db.conn)
+            store_write(cfg, db, items[cut:], batch)
+        out.append(keys_of(db.conn))
+        db.close()
+    assert out[0] == out[1], "中断续写后 UNMATCHED_KEY 不一致"
+
+
+def measure(fn, *args):
+    w0, t0 = wchar(), time.perf_counter()
+    rows = fn(*args)
+    return rows, time.perf_counter() - t0, wchar() - w0
+
+
+def check_store(db: Database, items, rng: random.Random) -> int:
+    conn = db.conn
+    got = iter_records(conn, 1)
+    for i, (it, r) in enumerate(zip(items, got)):
+        raw, mod, smod, lvl, _, ts, key, _ = it
+        assert r.seq == i and r.raw_log == raw.decode() and (r.mod, r.smod, r.timestamp, r.key_text) == (mod, smod, ts, key), i
+    assert next(got, None) is None
+    for q in rng.sample(range(len(items)), 200):
+        assert read_record(conn, 1, q).raw_log == items[q][0].decode()
+    total, n_keys = conn.execute("SELECT SUM(line_count), COUNT(*) FROM UNMATCHED_KEY WHERE run_id=1").fetchone()
+    assert total == len(items), total
+    key, mod, smod, cnt = conn.execute("SELECT key_text, mod, smod, line_count FROM UNMATCHED_KEY "
+                                       "ORDER BY line_count DESC LIMIT 1").fetchone()
+    rows = key_records(conn, 1, key, mod, smod)
+    assert len(rows) == cnt and all(normalize_key_text(r.key_text) == key for r in rows)
+    ex = conn.execute("SELECT seq, raw_log FROM UNMATCHED_EXEMPLAR WHERE run_id=1 AND key_text=? AND mod=? AND smod=? "
+                      "ORDER BY seq", (key, mod, smod)).fetchall()
+    assert [tuple(r) for r in ex] == [(r.seq, r.raw_log) for r in rows[:3]]
+    assert conn.execute("SELECT COUNT(*) FROM UNMATCHED_EXEMPLAR").fetchone()[0] <= 3 * n_keys
+    return n_keys
+
+
+def check_resolve(d: str) -> tuple:
+    """缺 MISSING 模板的库 pass2 + 补模板 + resolve 与 完整模板库 pass2 的统计一致"""
+    data, _ = Gen(7).records(20000)
+    gz = os.path.join(d, "day.gz")
+    with gzip.open(gz, "wb") as f:
+        f.write(data)
+    out = []
+    for name, late in (("late", True), ("full", False)):
+        path = os.path.join(d, f"{name}.db")
+        cfg = {"app": {"db_path": path, "time_bucket": ["5min", "hour"], "pass2_batch_rows": 2000,
+                       "match_cache_size": 10000, "unmatched_dir": os.path.join(d, f"um_{name}"), "gz_index_span_mb": 0}}
+        db = Database(path)
+        init_db(db)
+        tpls = TEMPLATES + ([] if late else [MISSING])
+        for p, cls in tpls:
+            db.execute("INSERT INTO REGEX_TEMPLATE(pattern, is_active, semantic_info) VALUES(?, 1, ?)",
+                       (p, json.dumps({"分类": cls}, ensure_ascii=False)))
+        db.commit()
+        rid = run_pass2(cfg, db, gz)
+        db.commit()
+        n = 0
+        if late:
+            p, cls = MISSING
+            db.execute("INSERT INTO REGEX_TEMPLATE(pattern, is_active, semantic_info) VALUES(?, 1, ?)",
+                       (p, json.dumps({"分类": cls}, ensure_ascii=False)))
+            db.commit()
+            n, left = resolve_run(cfg, db, rid)
+            assert n > 0 and resolve_run(cfg, db, rid) == (0, left), "重复补入"
+        counts = db.conn.execute("SELECT matched_lines, unmatched_lines FROM RUN_SESSION WHERE run_id=?", (rid,)).fetchone()
+        left = db.conn.execute("SELECT COALESCE(SUM(line_count), 0) FROM UNMATCHED_KEY WHERE run_id=?", (rid,)).fetchone()[0]
+        assert left == counts[1], (left, counts)
+        out.append((run_rows(db.conn, rid)[:2], tuple(counts), n))
+        db.close()
+    assert out[0][:2] == out[1][:2], "resolve 后统计与完整模板 pass2 不一致"
+    return out[0][2], out[0][1]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lines", type=int, default=1000000)
+    ap.add_argument("--shapes", type=int, default=20, help="不同消息形态数（归一化后的关键文本种数）")
+    ap.add_argument("--batch", type=int, default=10000, help="每次写库的未命中行数 同 app.pass2_batch_rows")
+    a = ap.parse_args()
+    rng = random.Random(24)
+    items = gen_items(a, rng)
+    raw_bytes = sum(len(it[0]) + 1 for it in items)
+
+    res = {}
+    with tempfile.TemporaryDirectory() as d:
+        for name in ("legacy", "store"):
+            path = os.path.join(d, f"{name}.db")
+            db = Database(path)
+            init_db(db)
+            db.execute("INSERT INTO RUN_SESSION(run_id, pass_type, status) VALUES(1, 'PASS2', '成功')")
+            db.commit()
+            um = os.path.join(d, f"um_{name}")
+            os.makedirs(um)
+            base = db_bytes(db, path)
+            if name == "legacy":
+                rows, dt, io = measure(legacy_write, db, items, a.batch, os.path.join(um, "unmatched_1.log"))
+            else:
+                cfg = {"app": {"unmatched_dir": um}}
+                rows, dt, io = measure(store_write, cfg, db, items, a.batch)
+                n_keys = check_store(db, items, rng)
+            side = sum(os.path.getsize(os.path.join(um, f)) for f in os.listdir(um))
+            res[name] = (rows, dt, db_bytes(db, path) - base, side, io)
+            db.close()
+        n_resolved, counts = check_resolve(d)
+        check_replay(d, items[:100000], a.batch)
+
+    mib = 2 ** 20
+    print(f"{a.lines} 条未命中 原始 {raw_bytes / mib:.1f} MiB 归一化后 (关键文本, mod, smod) {n_keys} 组")
+    print(f"{'path':<10}{'rows':>10}{'sec':>8}{'db MiB':>10}{'file MiB':>10}{'written MiB':>13}")
+    for name, (rows, dt, dbb, side, io) in res.items():
+        print(f"{name:<10}{rows:>10}{dt:>8.2f}{dbb / mib:>10.2f}{side / mib:>10.2f}{io / mib:>13.1f}")
+    (r0, t0, b0, s0, i0), (r1, t1, b1, s1, i1) = res["legacy"], res["store"]
+    print(f"写库行数 x{r0 / r1:.0f} 库增量 x{b0 / max(b1, 1):.0f} 磁盘占用 x{(b0 + s0) / (b1 + s1):.0f} "
+          f"写出字节 x{i0 / max(i1, 1):.0f} 耗时 x{t0 / t1:.1f}")
+    print(f"resolve：补入 {n_resolved} 行 命中 / 未命中 {counts[0]} / {counts[1]} 与完整模板 pass2 一致")
+    assert r0 / r1 >= 100 and (b0 + s0) / (b1 + s1) >= 10
+    print("溢出文件逐行可取回 聚合与样例正确 中断续写一致 resolve 一致且不重复补入 核对通过")
+
+
+if __name__ == "__main__":
+    main()
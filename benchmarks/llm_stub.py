@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+本地 OpenAI 兼容桩服务：POST /v1/chat/completions 按提示词最后一个 <samples> 之后以 "- " 开头的样本行聚类
+（数字串替换为 \\d+ {a|b|…} 可变位置替换为 .+? 后相同的样本归为一类 行首 [×N] 计数标记按 N 条累计） 返回模板 JSON 数组与 usage；GET /stats 返回请求统计
+可模拟 延迟（--latency 固定部分 + --per-ktok 每千 token 的部分 token 按 提示词 + 输出 字符数 / 4 估） 周期性限流 / 服务端错误（--fail-every N：每第 N 个请求返回 503 并带 Retry-After）
+统计含 请求数 最大并发 不同客户端连接数（核对连接复用）
+faults 按请求序号（从 1 起）指定单个请求的故障：整数为返回该 HTTP 状态码 "timeout" 为先停顿 stall_s 秒再应答（供测试用）
+用法：python -m benchmarks.llm_stub [--port 8765] [--latency 0.2] [--per-ktok 0] [--fail-every 0]
+     在 llm.api_base 填 http://127.0.0.1:8765/v1 即可让 llm-drain 打到本服务
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Union
+
+
+_COUNT = re.compile(r"^\[×(\d+)\] ")
+_SLOT = re.compile(r"\{([^{}|]*)(?:\|[^{}|]*)+\}")
+
+
+def cluster(samples: List[str]) -> List[Dict]:
+    groups: Dict[str, List] = {}
+    for s in samples:
+        m = _COUNT.match(s)
+        n = int(m.group(1)) if m else 1
+        s = s[m.end():] if m else s
+        pat = ".+?".join(r"\d+".join(re.escape(p) for p in re.split(r"\d+", part)) for part in _SLOT.split(s)[::2])
+        groups.setdefault(pat, [_SLOT.sub(r"\1", s), 0])[1] += n
+    return [{"分类": "桩", "推荐方案": "", "匹配规则": p, "典型日志": v[0], "mod": "", "smod": "", "出现次数": v[1]}
+            for p, v in groups.items()]
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0, fail_every: int = 0, per_ktok: float = 0.0,
+                 faults: Optional[Dict[int, Union[int, str]]] = None, stall_s: float = 1.0) -> None:
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency = latency
+        self.per_ktok = per_ktok
+        self.fail_every = fail_every
+        self.faults = faults or {}
+        self.stall_s = stall_s
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "failed": 0, "active": 0, "max_active": 0, "connections": 0}
+
+    @property
+    def api_base(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self) -> "StubServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 保持连接 客户端可复用
+    disable_nagle_algorithm = True  # 头与正文分两次写出 否则长连接上每个请求多等一个延迟确认
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.lock:
+            self.server.stats["connections"] += 1
+
+    def log_message(self, fmt, *args) -> None:
+        pass
+
+    def _send(self, code: int, body: Dict, headers: Dict = None) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # 客户端已超时断开
+
+    def do_GET(self) -> None:
+        with self.server.lock:
+            self._send(200, dict(self.server.stats))
+
+    def do_POST(self) -> None:
+        srv, st = self.server, self.server.stats
+        req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with srv.lock:
+            st["requests"] += 1
+            n = st["requests"]
+            st["active"] += 1
+            st["max_active"] = max(st["max_active"], st["active"])
+        try:
+            fault = srv.faults.get(n)
+            if fault == "timeout":
+                time.sleep(srv.stall_s)
+            elif fault is not None:
+                with srv.lock:
+                    st["failed"] += 1
+                self._send(int(fault), {"error": {"message": f"stub fault {fault}"}})
+                return
+            if srv.fail_every and n % srv.fail_every == 0:
+                time.sleep(srv.latency)
+                with srv.lock:
+                    st["failed"] += 1
+                self._send(503, {"error": {"message": "stub overloaded"}}, {"Retry-After": "0"})
+                return
+            prompt = req["messages"][-1]["content"]
+            # 提示词模板在最后一个 <samples> 之后放样本 之前的示例样本不计
+            samples = [ln[2:] for ln in prompt.rsplit("<samples>", 1)[-1].splitlines() if ln.startswith("- ")]
+            content = json.dumps(cluster(samples), ensure_ascii=False)
+            time.sleep(srv.latency + srv.per_ktok * (len(prompt) + len(content)) / 4000)
+            self._send(200, {
+                "id": f"stub-{n}", "object": "chat.completion", "model": req.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                          "total_tokens": len(prompt) // 4 + len(content) // 4},
+            })
+        finally:
+            with srv.lock:
+                st["active"] -= 1
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.2)
+    ap.add_argument("--per-ktok", type=float, default=0.0)
+    ap.add_argument("--fail-every", type=int, default=0)
+    a = ap.parse_args()
+    srv = StubServer(a.port, a.latency, a.fail_every, a.per_ktok)
+    print(f"LLM 桩服务：{srv.api_base}")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+合成日志生成器：按生产格式写 .gz 供端到端基准使用
+- 记录首行 [YYYYMMDD_HHMMSS][pid][E|W|I|D][T线程][MOD:x][SMOD:y] 关键文本 可带若干续行（--multiline 为带续行记录的比例）
+- --templates 个消息形状 各对应一条 ^ 锚定的正则（词序列互不相同 两两不会同时命中）
+  数字 十六进制 长 ID 等可变段覆盖 normalize_key_text 的各类占位 续行拼入关键文本后仍能命中
+- 形状按 Zipf(--zipf) 分布抽取；--miss 比例的记录取自另一套词表的未命中形状 任何模板都不会命中
+- 同时写出 <out>.meta.json：参数 形状 各模板的真实命中行数 未命中行数 供基准核对
+seed_templates 把形状对应的正则写入 REGEX_TEMPLATE 返回 template_id（与形状同序）
+用法：python -m benchmarks.synth --out /tmp/synth.gz [--mb 16 | --records 1000000] [--templates 500] [--zipf 1.1]
+      [--multiline 0.05] [--miss 0.1] [--seed 1] [--db /tmp/synth.db]
+"""
+import argparse
+import gzip
+import itertools
+import json
+import random
+import re
+from typing import Dict, List, Optional
+
+VOCAB = ["get", "lane", "err", "size", "sensor", "timeout", "after", "invalid", "merge", "cross", "route", "plan",
+         "obstacle", "track", "lost", "frame", "drop", "queue", "full", "retry", "send", "recv", "topic", "latency",
+         "exceed", "map", "tile", "load", "fail", "pose", "jump", "imu", "gnss", "fix", "radar", "camera", "init",
+         "done", "reset", "state", "switch", "mode", "brake", "steer", "cmd", "reject", "limit", "speed", "curve",
+         "signal", "stale", "cache", "evict", "buffer", "overflow", "config", "reload", "heartbeat", "missing", "ok"]
+# 未命中形状的词表与 VOCAB 不相交 且不以 ASCII 单词开头
+MISS_VOCAB = ["规划", "重试", "感知", "异常", "融合", "跳变", "定位", "丢失", "控制", "超限", "地图", "加载",
+              "通信", "中断", "预测", "偏差", "标定", "失效", "诊断", "告警"]
+# (正则片段, 生成格式)：{n} 普通数字 {h} 十六进制 {i} 长 ID；十六进制段与 miner 导出的写法一致
+SLOTS = [("\\d+", "{n}"), ("0x[0-9a-fA-F]+", "0x{h}"), ("v\\d+", "v{n}"), ("\\d+ ms", "{n} ms"), ("\\d+", "{i}"),
+         ("\\w+", "{w}")]
+CLASSES = ["车道", "超时", "通信", "定位", "规划", "感知"]
+MODS = [("PNC", ["planner", "decider", "router"]), ("PER", ["lidar", "camera", "radar"]), ("LOC", ["fusion", "imu"]),
+        ("MAP", ["tile", "hdmap"]), ("CTL", ["lon", "lat"]), ("定位", ["融合"])]
+CONT = ["  at frame {n}", "    stack 0x{h}", "\tdetail {w} {n}", "  原因 {n}"]
+WORDS = ["alpha", "beta", "gamma", "delta", "up", "down", "left", "right"]
+
+
+def make_shapes(n: int, rng: random.Random) -> List[Dict]:
+    """n 个命中形状：{pattern, fmt, cls}"""
+    combos = list(itertools.permutations(range(len(VOCAB)), 3))
+    assert n <= len(combos), f"形状数上限 {len(combos)}"
+    out = []
+    for i, (a, b, c) in enumerate(rng.sample(combos, n)):
+        s1, s2 = rng.choice(SLOTS), rng.choice(SLOTS)
+        w1, w2, w3 = VOCAB[a], VOCAB[b], VOCAB[c]
+        out.append({"pattern": f"^{w1} {w2} {s1[0]} {w3} {s2[0]}", "fmt": f"{w1} {w2} {s1[1]} {w3} {s2[1]}",
+                    "cls": CLASSES[i % len(CLASSES)]})
+    return out
+
+
+def make_miss_shapes(n: int, rng: random.Random) -> List[str]:
+    combos = list(itertools.permutations(MISS_VOCAB, 2))
+    return [f"{a} {b} {{n}} 次 {{w}}" for a, b in rng.sample(combos, min(n, len(combos)))]
+
+
+def zipf_cum(n: int, s: float) -> List[float]:
+    return list(itertools.accumulate(1.0 / (r + 1) ** s for r in range(n)))
+
+
+def _fill(fmt: str, rng: random.Random) -> str:
+    return fmt.format(n=rng.randint(0, 99999), h=f"{rng.getrandbits(32):x}", i=rng.randint(10 ** 10, 10 ** 13),
+                      w=rng.choice(WORDS))
+
+
+def write_log(path: str, mb: Optional[float] = None, records: Optional[int] = None, templates: int = 500,
+              zipf: float = 1.1, multiline: float = 0.05, miss: float = 0.1, seed: int = 1) -> Dict:
+    """写 .gz 与 <path>.meta.json 返回 meta；mb 为解压后大小的目标 与 records 二选一"""
+    if records is None and mb is None:
+        mb = 16
+    rng = random.Random(seed)
+    shapes = make_shapes(templates, rng)
+    miss_shapes = make_miss_shapes(max(templates // 4, 1), rng)
+    hit_cw, miss_cw = zipf_cum(len(shapes), zipf), zipf_cum(len(miss_shapes), zipf)
+    ctxs = [(m, s) for m, ss in MODS for s in ss]
+    hits = [0] * len(shapes)
+    target = int(mb * (1 << 20)) if records is None else None
+    n = n_miss = n_multi = size = sec = 0
+    with gzip.open(path, "wb", compresslevel=6) as f:
+        while (size < target) if target is not None else (n < records):
+            k = 10000 if target is not None else min(10000, records - n)
+            tpl = rng.choices(range(len(shapes)), cum_weights=hit_cw, k=k)
+            lines = []
+            for t in tpl:
+                sec += rng.randint(0, 1)
+                ts = f"202401{1 + sec // 86400:02d}_{sec // 3600 % 24:02d}{sec // 60 % 60:02d}{sec % 60:02d}"
+                mod, smod = rng.choice(ctxs)
+                head = f"[{ts}][{rng.randint(1000, 1015)}][{rng.choice('EWIIIDD')}][T{rng.randint(1, 8)}]" \
+                       f"[MOD:{mod}][SMOD:{smod}]"
+                if rng.random() < miss:
+                    msg = _fill(miss_shapes[rng.choices(range(len(miss_shapes)), cum_weights=miss_cw)[0]], rng)
+                    n_miss += 1
+                else:
+                    msg = _fill(shapes[t]["fmt"], rng)
+                    hits[t] += 1
+                lines.append(f"{head} {msg}\n")
+                if rng.random() < multiline:
+                    n_multi += 1
+                    for _ in range(rng.randint(1, 3)):
+                        lines.append(_fill(rng.choice(CONT), rng) + "\n")
+            data = "".join(lines).encode()
+            f.write(data)
+            size += len(data)
+            n += k
+    meta = {"params": {"mb": mb, "records": records, "templates": templates, "zipf": zipf, "multiline": multiline,
+                       "miss": miss, "seed": seed},
+            "records": n, "bytes": size, "multiline_records": n_multi, "unmatched": n_miss, "hits": hits,
+            "shapes": shapes}
+    with open(path + ".meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    return meta
+
+
+def load_meta(path: str) -> Dict:
+    with open(path + ".meta.json", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def seed_templates(db, shapes: List[Dict]) -> List[int]:
+    """形状对应的正则入 REGEX_TEMPLATE（分类写入 semantic_info） 返回 template_id"""
+    ids = []
+    for s in shapes:
+        ids.append(db.execute("INSERT INTO REGEX_TEMPLATE(pattern, is_active, semantic_info) VALUES(?, 1, ?)",
+                              (s["pattern"], json.dumps({"分类": s["cls"]}, ensure_ascii=False))))
+    db.commit()
+    return ids
+
+
+def check_shapes(shapes: List[Dict], rng: random.Random, per: int = 3) -> None:
+    """每个形状的样例（带续行）只被自己的正则命中"""
+    regs = [re.compile(s["pattern"]) for s in shapes]
+    for i, s in enumerate(shapes):
+        for _ in range(per):
+            text = _fill(s["fmt"], rng) + " " + _fill(rng.choice(CONT), rng).strip()
+            assert [j for j, r in enumerate(regs) if r.search(text)] == [i], (s, text)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--mb", type=float, default=None, help="解压后大小 MiB 缺省 16")
+    ap.add_argument("--records", type=int, default=None)
+    ap.add_argument("--templates", type=int, default=500)
+    ap.add_argument("--zipf", type=float, default=1.1)
+    ap.add_argument("--multiline", type=float, default=0.05)
+    ap.add_argument("--miss", type=float, default=0.1)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--db", help="同时初始化该库并写入模板")
+    a = ap.parse_args()
+    meta = write_log(a.out, a.mb, a.records, a.templates, a.zipf, a.multiline, a.miss, a.seed)
+    if a.db:
+        from logsys.db import Database
+        from logsys.main import init_db
+        db = Database(a.db)
+        init_db(db)
+        seed_templates(db, meta["shapes"])
+        db.close()
+    print(f"{a.out}：{meta['records']} 条 解压后 {meta['bytes'] / 2 ** 20:.1f} MiB 命中 {sum(meta['hits'])} "
+          f"未命中 {meta['unmatched']} 多行 {meta['multiline_records']}")
+
+
+if __name__ == "__main__":
+    main()
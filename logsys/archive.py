@@ -0,0 +1,304 @@
+# logsys/archive.py
+"""
+已结束 run 的 KEY_TIME_BUCKET 与 LOG_MATCH_SUMMARY 归档为按天分区的列式文件 可内存映射直接查询：
+- 维度字典编码：(mod, smod, level, thread_id) 组合为一个上下文编码（同 ColumnarAgg） 分类 粒度各自编码
+  字典全局共享 只追加 存于 <root>/dims.json
+- <root>/buckets/<YYYY-MM-DD>/run-<run_id>/ 一个 run 在一天内的桶：行按 (粒度, 桶起点, template_id, 上下文) 排序
+  每列一个 .npy（template_id 上下文 分类 计数 取能容纳最大值的最窄无符号整数）
+  (粒度, 桶起点) 相同的行连续 只记一次：grp_gran grp_ts 与行偏移 grp_off 时间范围过滤只需在分组上二分取连续行段
+- <root>/summary/<first_ts 所在日>/run-<run_id>/ 同样的列 加 first last（epoch 秒）
+- <root>/manifest.json 记录已归档的 run 及其分区 先写分区 再写字典 最后写清单 中途失败重跑会覆盖同名分区
+- purge 时归档完成后从 SQLite 删除这些 run 的明细（汇总表 ROLLUP_* 保留）；文件体积需另行 VACUUM 才回收
+ArchiveReader 以 np.load(mmap_mode='r') 打开分区 top_templates trend run_diff 与 reporting 同名接口 结果一致
+"""
+
+from __future__ import annotations
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .db import Database, write_transaction
+
+__all__ = [
+    "archive_runs",
+    "closed_runs",
+    "ArchiveReader",
+]
+
+logger = logging.getLogger(__name__)
+
+BUCKET_SQL = ("SELECT template_id, mod, smod, level, thread_id, classification, bucket_granularity, bucket_start, "
+              "count_in_bucket FROM KEY_TIME_BUCKET WHERE run_id=? AND template_id IS NOT NULL")
+SUMMARY_SQL = ("SELECT template_id, mod, smod, level, thread_id, classification, first_ts, last_ts, line_count "
+               "FROM LOG_MATCH_SUMMARY WHERE run_id=? AND template_id IS NOT NULL")
+
+
+def _epoch(values) -> np.ndarray:
+    """ISO 字符串或日期 → epoch 秒 缺失为 0"""
+    return np.array([v or "1970-01-01" for v in values], dtype="datetime64[s]").astype(np.int64)
+
+
+def _day(ep: int) -> str:
+    return str(np.datetime64(int(ep), "s").astype("datetime64[D]"))
+
+
+def _narrow(a: np.ndarray) -> np.ndarray:
+    return a.astype(np.min_scalar_type(int(a.max()) if len(a) else 0))
+
+
+def _dump_json(path: str, obj) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _write_part(path: str, cols: Dict[str, np.ndarray]) -> int:
+    """整个分区目录先写到临时目录再换名 返回字节数"""
+    tmp = path + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    size = 0
+    for name, arr in cols.items():
+        np.save(os.path.join(tmp, name + ".npy"), arr)
+        size += os.path.getsize(os.path.join(tmp, name + ".npy"))
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return size
+
+
+class _Dims:
+    """全局维度字典 只追加 编码即列表下标"""
+
+    KINDS = ("ctx", "cls", "gran")
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        raw = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                raw = json.load(f)
+        self.values: Dict[str, List] = {k: [tuple(v) if k == "ctx" else v for v in raw.get(k, [])] for k in self.KINDS}
+        self.codes: Dict[str, Dict] = {k: {v: i for i, v in enumerate(vs)} for k, vs in self.values.items()}
+
+    def encode(self, kind: str, vals: Iterable) -> np.ndarray:
+        codes, values = self.codes[kind], self.values[kind]
+        out = []
+        for v in vals:
+            c = codes.get(v)
+            if c is None:
+                c = codes[v] = len(values)
+                values.append(v)
+            out.append(c)
+        return np.array(out, dtype=np.int64)
+
+    def save(self) -> None:
+        _dump_json(self.path, self.values)
+
+
+def closed_runs(db: Database) -> List[int]:
+    """已成功结束的 PASS2 run（pass2 process follow 均登记为 PASS2）"""
+    return [r[0] for r in db.conn.execute(
+        "SELECT run_id FROM RUN_SESSION WHERE pass_type='PASS2' AND status='成功' ORDER BY run_id")]
+
+
+def _split(cols: Dict[str, np.ndarray], days: np.ndarray) -> Iterator[Tuple[str, Dict[str, np.ndarray]]]:
+    for d in np.unique(days).tolist():
+        sel = days == d
+        yield _day(d * 86400), {k: v[sel] for k, v in cols.items()}
+
+
+def _bucket_part(c: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    order = np.lexsort((c["ctx"], c["tid"], c["ts"], c["gran"]))
+    c = {k: v[order] for k, v in c.items()}
+    key = c["gran"] * (1 << 40) + c["ts"]
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    return {
+        "tid": _narrow(c["tid"]), "ctx": _narrow(c["ctx"]), "cls": _narrow(c["cls"]), "cnt": _narrow(c["cnt"]),
+        "grp_gran": _narrow(c["gran"][starts]), "grp_ts": c["ts"][starts],
+        "grp_off": np.r_[starts, len(key)].astype(np.int64),
+    }
+
+
+def _summary_part(c: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    order = np.lexsort((c["ctx"], c["tid"]))
+    c = {k: v[order] for k, v in c.items()}
+    return {"tid": _narrow(c["tid"]), "ctx": _narrow(c["ctx"]), "cls": _narrow(c["cls"]), "cnt": _narrow(c["cnt"]),
+            "first": c["first"], "last": c["last"]}
+
+
+def archive_runs(cfg: dict, db: Database, run_ids: Optional[Iterable[int]] = None,
+                 purge: bool = False) -> Dict[str, int]:
+    """
+    归档 run（缺省为尚未归档的全部已结束 run） 已在清单中的 run 跳过
+    返回 {"runs", "buckets", "summary", "bytes"}
+    """
+    root = cfg["app"].get("archive_dir", "./archive")
+    os.makedirs(root, exist_ok=True)
+    man_path = os.path.join(root, "manifest.json")
+    manifest = {"runs": {}}
+    if os.path.exists(man_path):
+        with open(man_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    dims = _Dims(os.path.join(root, "dims.json"))
+    conn = db.conn
+    todo = [r for r in (closed_runs(db) if run_ids is None else run_ids) if str(r) not in manifest["runs"]]
+    st = {"runs": 0, "buckets": 0, "summary": 0, "bytes": 0}
+    for rid in todo:
+        entry = {"days": [], "summary_days": [], "buckets": 0, "summary": 0, "bytes": 0}
+        rows = conn.execute(BUCKET_SQL, (rid,)).fetchall()
+        if rows:
+            tid, mod, smod, lvl, th, cls, gran, ts, cnt = zip(*rows)
+            ep = _epoch(ts)
+            cols = {"tid": np.array(tid, dtype=np.int64), "ctx": dims.encode("ctx", zip(mod, smod, lvl, th)),
+                    "cls": dims.encode("cls", cls), "gran": dims.encode("gran", gran), "ts": ep,
+                    "cnt": np.array(cnt, dtype=np.int64)}
+            for day, part in _split(cols, ep // 86400):
+                entry["bytes"] += _write_part(os.path.join(root, "buckets", day, f"run-{rid}"), _bucket_part(part))
+                entry["days"].append(day)
+            entry["buckets"] = len(rows)
+        rows = conn.execute(SUMMARY_SQL, (rid,)).fetchall()
+        if rows:
+            tid, mod, smod, lvl, th, cls, first, last, cnt = zip(*rows)
+            ep = _epoch(first)
+            cols = {"tid": np.array(tid, dtype=np.int64), "ctx": dims.encode("ctx", zip(mod, smod, lvl, th)),
+                    "cls": dims.encode("cls", cls), "first": ep, "last": _epoch(last),
+                    "cnt": np.array(cnt, dtype=np.int64)}
+            for day, part in _split(cols, ep // 86400):
+                entry["bytes"] += _write_part(os.path.join(root, "summary", day, f"run-{rid}"), _summary_part(part))
+                entry["summary_days"].append(day)
+            entry["summary"] = len(rows)
+        entry["archived_at"] = datetime.utcnow().isoformat()
+        dims.save()
+        manifest["runs"][str(rid)] = entry
+        _dump_json(man_path, manifest)
+        if purge:
+            with write_transaction(conn) as c:
+                c.execute("DELETE FROM KEY_TIME_BUCKET WHERE run_id=?", (rid,))
+                c.execute("DELETE FROM LOG_MATCH_SUMMARY WHERE run_id=?", (rid,))
+        st["runs"] += 1
+        for k in ("buckets", "summary", "bytes"):
+            st[k] += entry[k]
+        logger.info("归档 run=%s 桶 %d 行 汇总 %d 行 %d 天 %.1f KiB", rid, entry["buckets"], entry["summary"],
+                    len(entry["days"]), entry["bytes"] / 1024)
+    return st
+
+
+class ArchiveReader:
+    """只读访问归档：分区按需内存映射 维度字典与清单在打开时读入"""
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        dims = _Dims(os.path.join(root, "dims.json"))
+        self.ctx = dims.values["ctx"]
+        self.gran = dims.codes["gran"]
+        self.runs: Dict[str, Dict] = {}
+        man_path = os.path.join(root, "manifest.json")
+        if os.path.exists(man_path):
+            with open(man_path, encoding="utf-8") as f:
+                self.runs = json.load(f)["runs"]
+        self._mod_cache: Dict[str, np.ndarray] = {}
+
+    def _load(self, path: str) -> Dict[str, np.ndarray]:
+        return {fn[:-4]: np.load(os.path.join(path, fn), mmap_mode="r") for fn in os.listdir(path) if fn.endswith(".npy")}
+
+    def _parts(self, kind: str, days: Iterable[str], runs: Optional[Iterable[int]] = None) -> Iterator[Tuple[int, Dict]]:
+        want = None if runs is None else {f"run-{r}" for r in runs}
+        for day in days:
+            d = os.path.join(self.root, kind, day)
+            if not os.path.isdir(d):
+                continue
+            for name in sorted(os.listdir(d)):
+                if name.startswith("run-") and not name.endswith(".tmp") and (want is None or name in want):
+                    yield int(name[4:]), self._load(os.path.join(d, name))
+
+    def _days(self, start: str, end: str) -> List[str]:
+        s, e = np.datetime64(start, "s"), np.datetime64(end, "s")
+        d0, d1 = s.astype("datetime64[D]"), (e - np.timedelta64(1, "s")).astype("datetime64[D]")
+        return [str(d) for d in np.arange(d0, d1 + 1)] if d1 >= d0 else []
+
+    def _mod_mask(self, mod: str) -> np.ndarray:
+        """上下文编码 → 是否属于该 mod"""
+        m = self._mod_cache.get(mod)
+        if m is None:
+            m = self._mod_cache[mod] = np.array([(c[0] or "") == mod for c in self.ctx] or [False], dtype=bool)
+        return m
+
+    def _rows(self, start: str, end: str, gran: str, mod: Optional[str]):
+        """[start, end) 内某粒度的桶：逐分区给出 (分组桶起点, 分组行偏移, template_id, 计数, 行掩码或 None)"""
+        g = self.gran.get(gran)
+        if g is None:
+            return
+        s = int(np.datetime64(start, "s").astype(np.int64))
+        e = int(np.datetime64(end, "s").astype(np.int64))
+        for _, p in self._parts("buckets", self._days(start, end)):
+            gg, gts, off = p["grp_gran"], p["grp_ts"], p["grp_off"]
+            # 分组按 (粒度, 桶起点) 有序：先取该粒度的分组段 再在段内二分时间
+            lo, hi = np.searchsorted(gg, g, "left"), np.searchsorted(gg, g, "right")
+            a = lo + np.searchsorted(gts[lo:hi], s, "left")
+            b = lo + np.searchsorted(gts[lo:hi], e, "left")
+            if a >= b:
+                continue
+            r0, r1 = int(off[a]), int(off[b])
+            mask = self._mod_mask(mod)[p["ctx"][r0:r1]] if mod is not None else None
+            yield gts[a:b], off[a:b + 1] - r0, p["tid"][r0:r1], p["cnt"][r0:r1], mask
+
+    def top_templates(self, start: str, end: str, mod: Optional[str] = None, k: int = 20,
+                      gran: str = "day") -> List[Tuple[int, int]]:
+        """同 reporting.top_templates 直接按 KEY_TIME_BUCKET 的该粒度桶求和"""
+        total = np.zeros(0, dtype=np.int64)
+        for _, _, tid, cnt, mask in self._rows(start, end, gran, mod):
+            if mask is not None:
+                tid, cnt = tid[mask], cnt[mask]
+            if not len(tid):
+                continue
+            add = np.bincount(tid, weights=cnt).astype(np.int64)
+            if len(add) > len(total):
+                total = np.pad(total, (0, len(add) - len(total)))
+            total[:len(add)] += add
+        nz = np.flatnonzero(total)
+        order = nz[np.lexsort((nz, -total[nz]))][:k]
+        return [(int(t), int(total[t])) for t in order]
+
+    def trend(self, start: str, end: str, template_id: Optional[int] = None, mod: Optional[str] = None,
+              gran: str = "hour") -> List[Tuple[str, int]]:
+        """同 reporting.trend 只列出有数据的桶"""
+        acc: Dict[int, int] = {}
+        for gts, off, tid, cnt, mask in self._rows(start, end, gran, mod):
+            w = cnt.astype(np.int64)
+            if mask is not None:
+                w = w * mask
+            if template_id is not None:
+                w = w * (tid == template_id)
+            sums = np.add.reduceat(w, off[:-1]) if len(w) else w
+            for ts, n in zip(gts.tolist(), sums.tolist()):
+                if n:
+                    acc[ts] = acc.get(ts, 0) + n
+        return [(str(np.datetime64(ts, "s")), n) for ts, n in sorted(acc.items())]
+
+    def run_diff(self, run_a: int, run_b: int, mod: Optional[str] = None,
+                 k: int = 20) -> List[Tuple[int, int, int, int]]:
+        """同 reporting.run_diff 取两个 run 归档的 LOG_MATCH_SUMMARY"""
+        per = []
+        for rid in (run_a, run_b):
+            total = np.zeros(0, dtype=np.int64)
+            days = self.runs.get(str(rid), {}).get("summary_days", [])
+            for _, p in self._parts("summary", days, [rid]):
+                tid, cnt = p["tid"], p["cnt"]
+                if mod is not None:
+                    m = self._mod_mask(mod)[p["ctx"]]
+                    tid, cnt = tid[m], cnt[m]
+                add = np.bincount(tid, weights=cnt, minlength=len(total)).astype(np.int64)
+                total = np.pad(total, (0, len(add) - len(total))) + add
+            per.append(total)
+        n = max(len(per[0]), len(per[1]))
+        a, b = (np.pad(x, (0, n - len(x))) for x in per)
+        nz = np.flatnonzero((a != 0) | (b != 0))
+        d = b[nz] - a[nz]
+        order = nz[np.lexsort((nz, -np.abs(d)))][:k]
+        return [(int(t), int(a[t]), int(b[t]), int(b[t] - a[t])) for t in order]
@@ -0,0 +1,237 @@
+# logsys/batch.py
+"""
+多文件批处理：
+- expand_inputs 把 单文件 / 目录 / glob / 清单文件（@list.txt）展开为去重有序的 .gz 路径
+- 文件级进程池：worker 只读加载一次模板 负责解压 解析 匹配 聚合 不写库
+- 主进程是唯一写者：每个文件登记 FILE_REGISTRY 与各自的 RUN_SESSION 写库不争用 WAL 写锁
+"""
+
+from __future__ import annotations
+import glob
+import logging
+import multiprocessing as mp
+import os
+import queue
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from . import gzindex
+from .db import Database, finish_run, register_file, start_run
+from . import scanner
+from .ingest import read_gz_chunks
+from .pass1 import index_span, load_rules, scan_file, write_pass1_result
+from .pass2 import Pass2Writer, _init_worker, _work_block, open_run, shard_bytes, template_poll_s
+from .utils import time_buckets
+
+__all__ = [
+    "expand_inputs",
+    "run_pass1_batch",
+    "run_pass2_batch",
+]
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_SUFFIXES = (".txt", ".lst", ".manifest")
+
+
+def _read_manifest(path: str) -> List[str]:
+    """清单每行一个 文件 / 目录 / glob 空行与 # 注释忽略 相对路径相对清单所在目录"""
+    base = os.path.dirname(os.path.abspath(path))
+    out: List[str] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            s = line.strip()
+            if s and not s.startswith("#"):
+                out.append(s if os.path.isabs(s) else os.path.join(base, s))
+    return out
+
+
+def expand_inputs(specs: Iterable[str], suffix: str = ".gz") -> List[str]:
+    """
+    展开输入：
+    - @path 或 .txt/.lst/.manifest 文件视为清单
+    - 目录递归收集 *{suffix}
+    - 含通配符时按 glob（支持 **）
+    - 其他按单文件 不存在时报错
+    同一文件只保留首次出现 目录与 glob 内部按路径排序
+    """
+    out: List[str] = []
+    seen: Set[str] = set()
+
+    def add(p: str) -> None:
+        ap = os.path.abspath(p)
+        if ap not in seen:
+            seen.add(ap)
+            out.append(p)
+
+    for spec in specs:
+        if spec.startswith("@") or (os.path.isfile(spec) and spec.endswith(MANIFEST_SUFFIXES)):
+            for p in expand_inputs(_read_manifest(spec.lstrip("@")), suffix):
+                add(p)
+        elif os.path.isdir(spec):
+            for p in sorted(glob.glob(os.path.join(spec, "**", f"*{suffix}"), recursive=True)):
+                add(p)
+        elif glob.has_magic(spec):
+            for p in sorted(glob.glob(spec, recursive=True)):
+                if os.path.isfile(p):
+                    add(p)
+        elif os.path.isfile(spec):
+            add(spec)
+        else:
+            raise FileNotFoundError(f"输入不存在: {spec}")
+    return out
+
+
+def _register(db: Database, files: List[str], pass_type: str, cfg: dict) -> List[Tuple[int, int]]:
+    """逐文件登记 返回 [(file_id, run_id)]"""
+    runs = []
+    for path in files:
+        fid = register_file(db.conn, path)
+        runs.append((fid, start_run(db.conn, fid, pass_type, cfg)))
+    db.commit()
+    return runs
+
+
+# === Pass1 ===
+
+_W: Dict = {}
+
+
+def _init_pass1_worker(db_path: str) -> None:
+    db = Database(db_path)
+    _W["rules"] = load_rules(db.conn)
+    db.close()
+
+
+def _pass1_file(path: str, uniq_cap: int, span: int):
+    return scan_file(path, _W["rules"], uniq_cap, span)
+
+
+def run_pass1_batch(cfg: dict, db: Database, files: List[str], workers: int = 1) -> Dict[str, int]:
+    """多文件 pass1：worker 并行扫描 主进程按完成顺序落库 未命中样本跨文件去重后入缓冲"""
+    uniq_cap = int(cfg.get("pass1_unique_cap", 200_000))
+    buffer_threshold = int(cfg.get("buffer_threshold", 100))
+    spans = [index_span(cfg) if gzindex.find_indexed_file(db.conn, p) is None else 0 for p in files]
+    runs = _register(db, files, "PASS1", cfg)
+    buffered: Set[str] = set()
+    stats = {"files": len(files), "ok": 0, "failed": 0}
+
+    def done(i: int, res=None, err: Optional[BaseException] = None) -> None:
+        fid, rid = runs[i]
+        if err is not None:
+            logger.error("pass1 失败 %s: %r", files[i], err)
+            finish_run(db.conn, rid, "失败")
+            db.commit()
+            stats["failed"] += 1
+            return
+        write_pass1_result(db.conn, res, fid, rid, buffer_threshold, buffered)
+        stats["ok"] += 1
+
+    if workers <= 1:
+        rules = load_rules(db.conn)
+        for i, path in enumerate(files):
+            try:
+                res = scan_file(path, rules, uniq_cap, spans[i])
+            except Exception as e:  # noqa: BLE001
+                done(i, err=e)
+                continue
+            done(i, res)
+        return stats
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_pass1_worker,
+                             initargs=(cfg["app"]["db_path"],)) as ex:
+        futs = {ex.submit(_pass1_file, p, uniq_cap, spans[i]): i for i, p in enumerate(files)}
+        for f in as_completed(futs):
+            err = f.exception()
+            done(futs[f], None if err else f.result(), err)
+    return stats
+
+
+# === Pass2 ===
+
+def _init_pass2_worker(db_path: str, cache_size: int, grans: List[str], q, poll_s: float = 0) -> None:
+    _init_worker(db_path, cache_size, grans, poll_s=poll_s)
+    _W["put"] = q.put
+
+
+def _pass2_file(i: int, path: str, block_size: int, put: Optional[Callable] = None, start: int = 0) -> None:
+    """
+    按记录对齐块把 (断点偏移, 部分聚合) 发给写者 最后发送 done；异常转成 error 消息 不让写者空等
+    start>0 为续跑：顺序解压并跳过其前内容
+    """
+    put = put or _W["put"]
+    try:
+        for pos, block in scanner.iter_blocks_at(read_gz_chunks(path, start=start), block_size, offset=start):
+            put(("part", i, (_work_block(block), pos)))
+        put(("done", i, None))
+    except Exception as e:  # noqa: BLE001
+        put(("error", i, f"{type(e).__name__}: {e}"))
+
+
+def run_pass2_batch(cfg: dict, db: Database, files: List[str], workers: int = 1,
+                    resume: bool = False, force: bool = False) -> Dict[str, int]:
+    """
+    多文件 pass2：每个 worker 一次处理一个文件 分片结果经有界队列送回主进程
+    主进程为每个 run 维护一个 Pass2Writer 同一文件的分片按产出顺序写入未命中溢出文件 顺序不变
+    内容已入库的文件跳过（force 时照常处理）；resume 时有断点的文件从断点续跑
+    """
+    cache_size = int(cfg["app"].get("match_cache_size", 0))
+    grans = time_buckets(cfg)
+    block_size = shard_bytes(cfg)
+    runs: Dict[int, Tuple] = {}
+    seen: Set[int] = set()
+    for i, path in enumerate(files):
+        fid = register_file(db.conn, path)
+        if fid in seen:
+            logger.info("pass2 跳过 %s：与本批中前面的文件内容相同", path)
+            continue
+        seen.add(fid)
+        opened = open_run(cfg, db, path, resume, force)
+        if opened is not None:
+            runs[i] = opened
+    writers: Dict[int, Pass2Writer] = {}
+    closed: Set[int] = set()
+    stats = {"files": len(files), "ok": 0, "failed": 0, "skipped": len(files) - len(runs)}
+
+    def handle(msg) -> None:
+        kind, i, payload = msg
+        if i in closed:
+            return
+        w = writers.get(i)
+        if w is None:
+            fid, rid, _, counts = runs[i]
+            w = writers[i] = Pass2Writer(cfg, db, rid, counts, fid)
+        if kind == "part":
+            w.add(*payload)
+            return
+        acc = w.acc
+        if kind == "done":
+            w.finish(acc["cache_hits"] / acc["cache_lookups"] if acc["cache_lookups"] else None)
+            stats["ok"] += 1
+        else:
+            logger.error("pass2 失败 %s: %s", files[i], payload)
+            w.finish(None, status="失败")
+            stats["failed"] += 1
+        db.commit()
+        closed.add(i)
+        del writers[i]
+
+    if workers <= 1:
+        _init_worker(cfg["app"]["db_path"], cache_size, grans, poll_s=template_poll_s(cfg))
+        for i in runs:
+            _pass2_file(i, files[i], block_size, handle, runs[i][2])
+        return stats
+
+    q = mp.Queue(maxsize=4 * workers)  # 有界：写者跟不上时 worker 阻塞 内存不随积压增长
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_pass2_worker,
+                             initargs=(cfg["app"]["db_path"], cache_size, grans, q, template_poll_s(cfg))) as ex:
+        futs = {i: ex.submit(_pass2_file, i, files[i], block_size, None, runs[i][2]) for i in runs}
+        while len(closed) < len(runs):
+            try:
+                handle(q.get(timeout=1.0))
+            except queue.Empty:
+                # worker 进程异常退出时不会发送消息 据 future 状态收尾
+                for i, f in futs.items():
+                    if i not in closed and f.done() and f.exception() is not None:
+                        handle(("error", i, repr(f.exception())))
+    return stats
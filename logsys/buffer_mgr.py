@@ -1,58 +1,234 @@
-# -*- coding: utf-8 -*-
-from typing import List, Dict
-from datetime import datetime
-from .db import Database
+# logsys/buffer_mgr.py
+"""
+未命中缓冲：按 (mod, smod) 分片 在内存中累积 批量写出（write-behind）
+- add_unmatched / add_samples / add_records 只追加到内存；每个分片对应一个 收集中 的 BUFFER_GROUP（scope='分片'）
+  分片首次出现时才查找上次未满的缓冲或新建一行
+- flush 在一个事务内 executemany 写入全部待写 BUFFER_ITEM 并累加各缓冲 current_size；
+  待写行数达到 app.buffer_flush_rows 或距上次写出超过 app.buffer_flush_s 秒时在 add 内自动写出
+  调用方空闲时可调 maybe_flush；进程崩溃最多丢失最近一个写出周期内的未命中（只影响模板学习 不影响统计）
+- 分片累计满 threshold 行即满：立即写出 再交给 on_full（如 BufferScheduler.submit） 之后的行进入该分片的新缓冲
+  满的缓冲仍为 收集中 且 current_size >= size_threshold 未交出时 llm-drain / mine 按阈值照常处理
+- should_trigger / full_buffers 只看内存状态 不查库
+BufferScheduler：后台线程用自己的连接把满的缓冲交给 LLM（llm.enabled）或本地挖掘 入库线程只入队不等待
+"""
+
+from __future__ import annotations
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .db import Database, write_transaction
+from .llm_tasks import drain_buffers
+from .miner import mine_buffers
+
+__all__ = [
+    "SCOPE",
+    "BufferManager",
+    "BufferScheduler",
+    "handle_buffers",
+]
+
+logger = logging.getLogger(__name__)
+
+SCOPE = "分片"
+ITEM_COLS = "buffer_id, run_id, timestamp, mod, smod, level, thread_id, key_text, raw_log"
+
+
+class _Shard:
+    __slots__ = ("buffer_id", "size")
+
+    def __init__(self, buffer_id: int, size: int) -> None:
+        self.buffer_id = buffer_id
+        self.size = size
+
 
 class BufferManager:
     """
-    简单全局缓冲 默认 scope=global
-    可拓展为按 mod smod 维度分桶
+    分片缓冲 只在创建它的线程使用；threshold 缺省取 llm.n_samples_per_task
+    db 可为 Database 或 sqlite3.Connection
     """
 
-    def __init__(self, cfg: dict, db: Database):
+    def __init__(self, cfg: dict, db, threshold: Optional[int] = None,
+                 on_full: Optional[Callable[[int], None]] = None) -> None:
         self.cfg = cfg
-        self.db = db
-        self.threshold = int(cfg["llm"]["n_samples_per_task"])
+        self.conn = getattr(db, "conn", db)
+        app = cfg.get("app", {})
+        self.threshold = max(1, int(threshold if threshold is not None else cfg.get("llm", {}).get("n_samples_per_task", 100)))
+        self.flush_rows = max(1, int(app.get("buffer_flush_rows", 5000)))
+        self.flush_s = float(app.get("buffer_flush_s", 2.0))
+        self.on_full = on_full
+        self.shards: Dict[Tuple[str, str], _Shard] = {}
+        self.rows: List[Tuple] = []
+        self.full: List[int] = []           # 已满且已写出 on_full 为空时由调用方 full_buffers 取走
+        self._handoff: List[int] = []       # 已满 待本次写出后交出
+        self._flushed_at = time.monotonic()
 
-    def ensure_global_buffer(self) -> int:
-        rows = self.db.query("SELECT buffer_id, current_size, size_threshold, status FROM BUFFER_GROUP WHERE scope=? AND status=?", ("global", "收集中"))
-        if rows:
-            return rows[0]["buffer_id"]
-        # 新建
-        now = datetime.utcnow().isoformat()
-        sql = "INSERT INTO BUFFER_GROUP(scope, mod, smod, size_threshold, current_size, created_at, status) VALUES(?,?,?,?,?,?,?)"
-        bid = self.db.execute(sql, ("global", None, None, self.threshold, 0, now, "收集中"))
+    def _shard(self, key: Tuple[str, str]) -> _Shard:
+        sh = self.shards.get(key)
+        if sh is None:
+            r = self.conn.execute(
+                "SELECT buffer_id, current_size FROM BUFFER_GROUP WHERE scope=? AND mod=? AND smod=? AND status='收集中' "
+                "AND current_size < size_threshold ORDER BY buffer_id DESC LIMIT 1", (SCOPE,) + key).fetchone()
+            if r is None:
+                with write_transaction(self.conn) as c:
+                    r = (c.execute(
+                        "INSERT INTO BUFFER_GROUP(scope, mod, smod, size_threshold, current_size, created_at, status) "
+                        "VALUES(?,?,?,?,0,CURRENT_TIMESTAMP,'收集中')", (SCOPE,) + key + (self.threshold,)).lastrowid, 0)
+            sh = self.shards[key] = _Shard(r[0], r[1])
+        return sh
+
+    def _add(self, run_id, ts, mod, smod, level, thread_id, key_text: str, raw) -> int:
+        key = (mod or "", smod or "")
+        sh = self.shards.get(key) or self._shard(key)
+        bid = sh.buffer_id
+        self.rows.append((bid, run_id, ts, mod, smod, level, thread_id, key_text, raw))
+        sh.size += 1
+        if sh.size >= self.threshold:
+            del self.shards[key]
+            self._handoff.append(bid)
+            self.flush()
+        elif len(self.rows) >= self.flush_rows or time.monotonic() - self._flushed_at >= self.flush_s:
+            self.flush()
         return bid
 
     def add_unmatched(self, run_id: int, parsed: Dict, key_text: str, raw: str) -> int:
-        buffer_id = self.ensure_global_buffer()
-        now = datetime.utcnow().isoformat()
-        self.db.execute(
-            "INSERT INTO BUFFER_ITEM(buffer_id, run_id, timestamp, mod, smod, level, thread_id, key_text, raw_log) VALUES(?,?,?,?,?,?,?,?,?)",
-            (buffer_id, run_id, parsed.get("timestamp"), parsed.get("mod"), parsed.get("smod"), parsed.get("level"), parsed.get("thread_id"), key_text, raw)
-        )
-        # 更新计数
-        self.db.execute("UPDATE BUFFER_GROUP SET current_size=current_size+1 WHERE buffer_id=?", (buffer_id,))
-        return buffer_id
+        """登记一条未命中 返回所在缓冲 id"""
+        return self._add(run_id, parsed.get("timestamp"), parsed.get("mod"), parsed.get("smod"), parsed.get("level"),
+                         parsed.get("thread_id"), key_text, raw)
+
+    def add_samples(self, samples: Iterable) -> int:
+        """pass1 的唯一样本（含 key_text mod smod 属性） 原始行即关键文本；返回条数"""
+        n = 0
+        for s in samples:
+            self._add(None, None, s.mod, s.smod, None, None, s.key_text, s.key_text)
+            n += 1
+        return n
+
+    def add_records(self, run_id: int, entries: Iterable[Tuple]) -> int:
+        """pass2 / follow 的未命中暂存条目 (raw 字节, mod, smod, level, thread_id, ts, key_text, 归一化键)；返回条数"""
+        n = 0
+        for raw, mod, smod, lvl, tid, ts, key, *_ in entries:
+            self._add(run_id, ts, mod, smod, lvl, tid, key,
+                      raw.decode("utf-8", "replace") if isinstance(raw, (bytes, bytearray)) else raw)
+            n += 1
+        return n
+
+    def flush(self) -> int:
+        """写出待写的未命中 并交出本次写出的满缓冲；返回写出行数"""
+        rows, self.rows = self.rows, []
+        handoff, self._handoff = self._handoff, []
+        self._flushed_at = time.monotonic()
+        if rows:
+            sizes: Dict[int, int] = {}
+            for r in rows:
+                sizes[r[0]] = sizes.get(r[0], 0) + 1
+            with write_transaction(self.conn) as c:
+                c.executemany(f"INSERT INTO BUFFER_ITEM({ITEM_COLS}) VALUES(?,?,?,?,?,?,?,?,?)", rows)
+                c.executemany("UPDATE BUFFER_GROUP SET current_size=current_size+? WHERE buffer_id=?",
+                              [(n, b) for b, n in sizes.items()])
+        for bid in handoff:
+            if self.on_full is not None:
+                self.on_full(bid)
+            else:
+                self.full.append(bid)
+        return len(rows)
+
+    def maybe_flush(self) -> int:
+        """距上次写出超过 flush_s 时写出 供调用方在空闲循环中调用"""
+        if self.rows and time.monotonic() - self._flushed_at >= self.flush_s:
+            return self.flush()
+        return 0
 
     def should_trigger(self) -> bool:
-        rows = self.db.query("SELECT current_size, size_threshold FROM BUFFER_GROUP WHERE scope=? AND status=?", ("global", "收集中"))
-        if not rows:
-            return False
-        cur, th = rows[0]["current_size"], rows[0]["size_threshold"]
-        return cur >= th
-
-    def drain_samples(self) -> List[Dict]:
-        """取出 threshold 条 并将 group 标记为 已提交"""
-        rows = self.db.query("SELECT buffer_id, current_size, size_threshold FROM BUFFER_GROUP WHERE scope=? AND status=?", ("global", "收集中"))
-        if not rows:
-            return []
-        gid = rows[0]["buffer_id"]
-        samples = self.db.query("SELECT * FROM BUFFER_ITEM WHERE buffer_id=? ORDER BY item_id ASC LIMIT ?", (gid, self.threshold))
-        # 标记提交
-        self.db.execute("UPDATE BUFFER_GROUP SET status=? WHERE buffer_id=?", ("已提交", gid))
-        return samples
-
-    def clear_buffer(self, buffer_id: int):
-        self.db.execute("DELETE FROM BUFFER_ITEM WHERE buffer_id=?", (buffer_id,))
-        self.db.execute("UPDATE BUFFER_GROUP SET current_size=0, status=? WHERE buffer_id=?", ("已清理", buffer_id))
+        return bool(self.full)
+
+    def full_buffers(self) -> List[int]:
+        out, self.full = self.full, []
+        return out
+
+    def close(self) -> None:
+        self.flush()
+
+    def clear_buffer(self, buffer_id: int) -> None:
+        with write_transaction(self.conn) as c:
+            c.execute("DELETE FROM BUFFER_ITEM WHERE buffer_id=?", (buffer_id,))
+            c.execute("UPDATE BUFFER_GROUP SET current_size=0, status=? WHERE buffer_id=?", ("已清理", buffer_id))
+        self.shards = {k: v for k, v in self.shards.items() if v.buffer_id != buffer_id}
+
+
+def handle_buffers(cfg: dict, db: Database, buffer_ids: List[int]) -> Dict[str, int]:
+    """
+    处理一批满的缓冲：llm.enabled 时并发提交 LLM 失败的缓冲按 miner.fallback 先本地挖掘兜底（状态仍为失败）；
+    LLM 关闭（或缺少密钥）且 miner.fallback 开启时直接本地挖掘；返回 {"buffers", "templates", "failed"}
+    """
+    fallback = cfg.get("miner", {}).get("fallback", True)
+    if cfg.get("llm", {}).get("enabled", False):
+        try:
+            st = drain_buffers(cfg, db, buffer_ids)
+        except RuntimeError as e:
+            logger.warning("LLM 不可用（%s） 改为本地挖掘", e)
+        else:
+            failed = [r[0] for r in db.conn.execute(
+                "SELECT buffer_id FROM BUFFER_GROUP WHERE status='失败'") if r[0] in buffer_ids]
+            templates = st["templates"]
+            if failed and fallback:
+                templates += mine_buffers(cfg, db, failed, mark_done=False)["templates"]
+            return {"buffers": len(buffer_ids), "templates": templates, "failed": len(failed)}
+    if not fallback:
+        return {"buffers": 0, "templates": 0, "failed": 0}
+    st = mine_buffers(cfg, db, buffer_ids)
+    return {"buffers": len(buffer_ids), "templates": st["templates"], "failed": 0}
+
+
+class BufferScheduler:
+    """
+    后台处理满的缓冲：submit 只入队 后台线程用独立连接批量取出调用 handle_buffers
+    close 时处理完手头的一批即退出 队列中剩下的缓冲保持 收集中（已满） 由下次 llm-drain / mine 处理
+    """
+
+    def __init__(self, cfg: dict, db_path: str) -> None:
+        self.cfg = cfg
+        self.db_path = db_path
+        self.q: "queue.Queue[Optional[int]]" = queue.Queue()
+        self.stats = {"buffers": 0, "templates": 0, "failed": 0}
+        self._stop = threading.Event()
+        self._t = threading.Thread(target=self._run, name="buffer-scheduler", daemon=True)
+        self._t.start()
+
+    def submit(self, buffer_id: int) -> None:
+        self.q.put(buffer_id)
+
+    def _run(self) -> None:
+        db = Database(self.db_path)
+        try:
+            while not self._stop.is_set():
+                bid = self.q.get()
+                if bid is None:
+                    break
+                bids = [bid]
+                while True:
+                    try:
+                        b = self.q.get_nowait()
+                    except queue.Empty:
+                        break
+                    if b is None:
+                        self._stop.set()
+                        break
+                    bids.append(b)
+                try:
+                    st = handle_buffers(self.cfg, db, bids)
+                except Exception:
+                    logger.exception("处理缓冲 %s 失败", bids)
+                    continue
+                for k in self.stats:
+                    self.stats[k] += st[k]
+        finally:
+            db.conn.close()
+
+    def close(self) -> Dict[str, int]:
+        self._stop.set()
+        self.q.put(None)
+        self._t.join()
+        return self.stats
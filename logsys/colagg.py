@@ -0,0 +1,266 @@
+# logsys/colagg.py
+"""
+pass2 列式聚合：
+- (mod, smod, level, thread_id, 分类) 上下文组合驻留为整数编码；分类随上下文记录 运行中模板改了分类 新旧两类各自成组
+- 命中事件以 (template_id, 上下文编码, epoch 秒) 三个整数攒成小批 整批写入预分配的 NumPy 列
+  列满或输出时做一次向量化 group-by 压实为分组行
+- 分组行与事件行同构（计数 首末时间） 压实 分片合并走同一套 group-by
+- 多个分桶粒度由同一批事件以整数取整得到 不重复扫描；时间只在输出时格式化为 ISO 字符串
+- rollup_rows 把桶分组跨上下文再汇总到 (mod, 小时 / 天, template_id) 供报表汇总表增量累加
+"""
+
+from __future__ import annotations
+from typing import Dict, Hashable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .utils import epoch_iso, gran_seconds
+
+__all__ = [
+    "Interner",
+    "ColumnarAgg",
+]
+
+_INT = np.int64
+# 事件列：template_id 上下文编码 epoch 秒
+_NCOL = 3
+
+
+class Interner:
+    """可哈希值 → 连续整数编码 只增不删"""
+
+    __slots__ = ("codes", "values")
+
+    def __init__(self) -> None:
+        self.codes: Dict[Hashable, int] = {}
+        self.values: List = []
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def code(self, v: Hashable) -> int:
+        c = self.codes.get(v)
+        if c is None:
+            c = self.codes[v] = len(self.values)
+            self.values.append(v)
+        return c
+
+    def remap(self, other: "Interner") -> np.ndarray:
+        """other 的编码 → 本表编码 的映射数组 缺失的值追加进本表"""
+        return np.fromiter((self.code(v) for v in other.values), dtype=_INT, count=len(other.values))
+
+
+def _unique_rows(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """按行去重 返回 (唯一行, 每行所属组号)；基数乘积可容纳时压成单列 int64 再去重"""
+    if len(keys) == 0:
+        return keys, np.empty(0, dtype=_INT)
+    lo = keys.min(axis=0)
+    radix = keys.max(axis=0) - lo + 1
+    if float(np.prod(radix.astype(np.float64))) < 2.0 ** 62:
+        comb = keys[:, 0] - lo[0]
+        for j in range(1, keys.shape[1]):
+            comb *= radix[j]
+            comb += keys[:, j] - lo[j]
+        _, idx, inv = np.unique(comb, return_index=True, return_inverse=True)
+    else:
+        _, idx, inv = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    return keys[idx], inv.reshape(-1)
+
+
+class ColumnarAgg:
+    """
+    聚合单元：summary 分组键 (template_id, 上下文) 记 计数 首末时间；
+    bucket 分组键为 (template_id, 上下文, 粒度序号, 桶起点) 记计数
+    """
+
+    def __init__(self, granularities: Sequence[str], capacity: int = 1 << 16, batch: int = 2048) -> None:
+        self.granularities = list(granularities)
+        self._steps = np.array([gran_seconds(g) for g in self.granularities], dtype=_INT)
+        self.ctx = Interner()     # (mod, smod, level, thread_id, 分类)
+        self._capacity = capacity
+        self._batch_size = batch
+        self._buf = np.empty((capacity, _NCOL), dtype=_INT)
+        self._n = 0
+        self._batch: List[Tuple[int, int, int]] = []
+        self._clear_groups()
+
+    def _clear_groups(self) -> None:
+        self._sk = np.empty((0, 2), dtype=_INT)
+        self._sc = np.empty(0, dtype=_INT)
+        self._sf = np.empty(0, dtype=_INT)
+        self._sl = np.empty(0, dtype=_INT)
+        self._bk = np.empty((0, 4), dtype=_INT)
+        self._bc = np.empty(0, dtype=_INT)
+
+    # === 写入 ===
+
+    def add(self, tpl_id: int, cls: str, mod: str, smod: str, lvl: str, th: str, ts: int) -> None:
+        key = (mod, smod, lvl, th, cls)
+        c = self.ctx.codes.get(key)
+        if c is None:
+            c = self.ctx.code(key)
+        self._batch.append((tpl_id, c, ts))
+        if len(self._batch) >= self._batch_size:
+            self._drain()
+
+    def _drain(self) -> None:
+        """小批整体写入预分配列 列满则压实"""
+        b = self._batch
+        if not b:
+            return
+        i = 0
+        while i < len(b):
+            take = min(len(b) - i, self._capacity - self._n)
+            self._buf[self._n:self._n + take] = b[i:i + take]
+            self._n += take
+            i += take
+            if self._n == self._capacity:
+                self._compact()
+                if len(self._bc) > self._capacity // 2:
+                    # 分组数逼近列容量时翻倍 避免每次压实都重排全部已有分组
+                    self._capacity *= 2
+                    self._buf = np.empty((self._capacity, _NCOL), dtype=_INT)
+        b.clear()
+
+    @property
+    def empty(self) -> bool:
+        return not self._batch and self._n == 0 and len(self._sc) == 0
+
+    # === group-by ===
+
+    def _bucket_keys(self, ev: np.ndarray) -> np.ndarray:
+        """事件 → 每个粒度一行 (template_id, 上下文, 粒度序号, 桶起点)"""
+        parts = []
+        for gi, step in enumerate(self._steps):
+            ts = ev[:, 2]
+            parts.append(np.column_stack([ev[:, :2], np.full(len(ev), gi, dtype=_INT), ts - ts % step]))
+        return np.concatenate(parts) if parts else np.empty((0, 4), dtype=_INT)
+
+    def _compact(self, extra: Optional[Tuple[np.ndarray, ...]] = None) -> None:
+        ev = self._buf[:self._n]
+        sk = [self._sk, ev[:, :2]]
+        sc = [self._sc, np.ones(len(ev), dtype=_INT)]
+        sf = [self._sf, ev[:, 2]]
+        sl = [self._sl, ev[:, 2]]
+        bk = [self._bk, self._bucket_keys(ev)]
+        bc = [self._bc, np.ones(len(ev) * len(self._steps), dtype=_INT)]
+        if extra is not None:
+            for lst, arr in zip((sk, sc, sf, sl, bk, bc), extra):
+                lst.append(arr)
+        self._n = 0
+        if not sum(len(c) for c in sc):
+            self._clear_groups()
+            return
+
+        keys, inv = _unique_rows(np.concatenate(sk))
+        m = len(keys)
+        counts = np.zeros(m, dtype=_INT)
+        np.add.at(counts, inv, np.concatenate(sc))
+        first = np.full(m, np.iinfo(_INT).max, dtype=_INT)
+        np.minimum.at(first, inv, np.concatenate(sf))
+        last = np.full(m, np.iinfo(_INT).min, dtype=_INT)
+        np.maximum.at(last, inv, np.concatenate(sl))
+        self._sk, self._sc, self._sf, self._sl = keys, counts, first, last
+
+        bkeys, binv = _unique_rows(np.concatenate(bk))
+        bcounts = np.zeros(len(bkeys), dtype=_INT)
+        np.add.at(bcounts, binv, np.concatenate(bc))
+        self._bk, self._bc = bkeys, bcounts
+
+    def compact(self) -> None:
+        self._drain()
+        if self._n:
+            self._compact()
+
+    def merge(self, other: "ColumnarAgg") -> None:
+        """合并另一聚合单元（如 worker 分片结果）：上下文编码重映射后与本方分组一起 group-by"""
+        if other.granularities != self.granularities:
+            raise ValueError("分桶粒度不一致 无法合并")
+        other.compact()
+        if not len(other._sc):
+            return
+        self._drain()
+        ctx_map = self.ctx.remap(other.ctx)
+        sk = np.column_stack([other._sk[:, 0], ctx_map[other._sk[:, 1]]])
+        bk = other._bk.copy()
+        bk[:, 1] = ctx_map[bk[:, 1]]
+        self._compact((sk, other._sc, other._sf, other._sl, bk, other._bc))
+
+    # === 输出 ===
+
+    def summary_rows(self) -> Iterator[Tuple[str, str, int, str, str, str, str, str, int]]:
+        """(mod, smod, template_id, 分类, level, thread_id, first_ts, last_ts, 计数) 时间为 ISO 字符串"""
+        self.compact()
+        ctx = self.ctx.values
+        for (tid, c), f, la, n in zip(self._sk.tolist(), self._sf.tolist(), self._sl.tolist(), self._sc.tolist()):
+            mod, smod, lvl, th, cls = ctx[c]
+            yield mod, smod, tid, cls, lvl, th, epoch_iso(f), epoch_iso(la), n
+
+    def bucket_rows(self) -> Iterator[Tuple[str, str, int, str, str, str, str, str, int]]:
+        """(mod, smod, template_id, 分类, level, thread_id, 粒度, 桶起点, 计数)"""
+        self.compact()
+        ctx, grans = self.ctx.values, self.granularities
+        iso_cache: Dict[int, str] = {}
+        for (tid, c, gi, b), n in zip(self._bk.tolist(), self._bc.tolist()):
+            mod, smod, lvl, th, cls = ctx[c]
+            s = iso_cache.get(b)
+            if s is None:
+                s = iso_cache[b] = epoch_iso(b)
+            yield mod, smod, tid, cls, lvl, th, grans[gi], s, n
+
+    def mod_totals(self) -> Iterator[Tuple[str, int, int]]:
+        """跨上下文汇总到 (mod, template_id) 的 (mod, template_id, 计数) mod 为空记 ''"""
+        self.compact()
+        if not len(self._sc):
+            return
+        mods = Interner()
+        mod_of = np.fromiter((mods.code(v[0] or "") for v in self.ctx.values), dtype=_INT, count=len(self.ctx))
+        keys, inv = _unique_rows(np.column_stack([mod_of[self._sk[:, 1]], self._sk[:, 0]]))
+        counts = np.zeros(len(keys), dtype=_INT)
+        np.add.at(counts, inv, self._sc)
+        for (m, tid), n in zip(keys.tolist(), counts.tolist()):
+            yield mods.values[m], tid, n
+
+    def rollup_rows(self, step: int) -> Iterator[Tuple[str, str, int, int]]:
+        """
+        跨上下文汇总到 (mod, step 秒的桶, template_id) 的 (mod, 桶起点, template_id, 计数) mod 为空记 ''
+        取能整除 step 的最粗分桶粒度重新取整；没有这样的粒度时为空
+        """
+        steps = self._steps.tolist()
+        gis = [gi for gi, s in enumerate(steps) if step % s == 0]
+        if not gis:
+            return
+        gi = max(gis, key=lambda i: steps[i])
+        self.compact()
+        sel = self._bk[:, 2] == gi
+        bk = self._bk[sel]
+        if not len(bk):
+            return
+        mods = Interner()
+        mod_of = np.fromiter((mods.code(v[0] or "") for v in self.ctx.values), dtype=_INT, count=len(self.ctx))
+        keys, inv = _unique_rows(np.column_stack([mod_of[bk[:, 1]], bk[:, 3] - bk[:, 3] % step, bk[:, 0]]))
+        counts = np.zeros(len(keys), dtype=_INT)
+        np.add.at(counts, inv, self._bc[sel])
+        iso_cache: Dict[int, str] = {}
+        for (m, b, tid), n in zip(keys.tolist(), counts.tolist()):
+            s = iso_cache.get(b)
+            if s is None:
+                s = iso_cache[b] = epoch_iso(b)
+            yield mods.values[m], s, tid, n
+
+    def clear(self) -> None:
+        """清空分组与待压实事件 编码表保留 后续批次继续复用"""
+        self._batch.clear()
+        self._n = 0
+        self._clear_groups()
+
+    def __getstate__(self) -> dict:
+        # 跨进程传递前先压实 只传分组 不传预分配缓冲
+        self.compact()
+        st = self.__dict__.copy()
+        st["_buf"] = None
+        return st
+
+    def __setstate__(self, st: dict) -> None:
+        self.__dict__.update(st)
+        self._buf = np.empty((self._capacity, _NCOL), dtype=_INT)
@@ -7,13 +7,31 @@ Database 兼容层：
 """
 
 from __future__ import annotations
+import hashlib
+import json
 import os
 import sqlite3
-from typing import Iterable, List, Set, Tuple, Optional
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterable, Iterator, List, Mapping, Optional, Sequence, Set, Tuple, Union
 
 __all__ = [
     "Database",
     "open_db_and_tune",
+    "ensure_column",
+    "file_meta",
+    "file_sha256",
+    "register_file",
+    "register_stream",
+    "start_run",
+    "finish_run",
+    "find_done_run",
+    "find_resumable_run",
+    "reopen_run",
+    "save_checkpoint",
+    "write_transaction",
+    "bulk_upsert",
     "upsert_module_bulk",
     "upsert_smod_bulk",
     "bump_template_stats_bulk",
@@ -71,6 +89,17 @@ class Database:
         cur.executescript(sql)
         self.conn.commit()
 
+    def query(self, sql: str, params: Iterable = ()) -> List[sqlite3.Row]:
+        """执行查询并返回全部行。"""
+        return self.conn.execute(sql, tuple(params)).fetchall()
+
+    def execute(self, sql: str, params: Iterable = ()) -> int:
+        """执行单条写语句 返回 lastrowid；事务由调用方 commit 收口。"""
+        return self.conn.execute(sql, tuple(params)).lastrowid
+
+    def commit(self) -> None:
+        self.conn.commit()
+
     # 兼容用法
     def cursor(self):
         return self.conn.cursor()
@@ -91,6 +120,201 @@ def open_db_and_tune(db: sqlite3.Connection) -> None:
     db.commit()
 
 
+def ensure_column(db: sqlite3.Connection, table: str, column: str, col_type: str) -> bool:
+    """已有表缺列时补齐 返回是否执行了 ALTER TABLE"""
+    cols = {r[1] for r in db.execute(f"PRAGMA table_info({table})").fetchall()}
+    if not cols or column in cols:
+        return False
+    db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {col_type}")
+    return True
+
+
+def file_meta(path: str) -> Tuple[int, str]:
+    """文件大小与修改时间（UTC ISO） 用于识别同一输入文件"""
+    st = os.stat(path)
+    return st.st_size, datetime.utcfromtimestamp(st.st_mtime).isoformat()
+
+
+def file_sha256(path: str, chunk: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for buf in iter(lambda: f.read(chunk), b""):
+            h.update(buf)
+    return h.hexdigest()
+
+
+def register_file(db: sqlite3.Connection, path: str, sha256: Optional[str] = None, status: str = "新") -> int:
+    """
+    登记输入文件 返回 file_id；路径取绝对路径 size_bytes gz_mtime 取自文件系统
+    同一内容（sha256）只登记一次：已登记过时复用其 file_id 并更新为本次的路径与修改时间
+    sha256 未给出时 路径 大小 修改时间都未变则沿用已登记的值 否则读文件计算
+    """
+    size, mtime = file_meta(path)
+    ap = os.path.abspath(path)
+    if sha256 is None:
+        row = db.execute(
+            "SELECT sha256 FROM FILE_REGISTRY WHERE path=? AND size_bytes=? AND gz_mtime=? AND sha256 IS NOT NULL "
+            "ORDER BY file_id DESC LIMIT 1",
+            (ap, size, mtime),
+        ).fetchone()
+        sha256 = row[0] if row else file_sha256(path)
+    row = db.execute(
+        "SELECT file_id FROM FILE_REGISTRY WHERE sha256=? ORDER BY file_id DESC LIMIT 1", (sha256,)
+    ).fetchone()
+    if row:
+        db.execute("UPDATE FILE_REGISTRY SET path=?, size_bytes=?, gz_mtime=? WHERE file_id=?", (ap, size, mtime, row[0]))
+        return row[0]
+    cur = db.execute(
+        "INSERT INTO FILE_REGISTRY(path, sha256, size_bytes, gz_mtime, ingested_at, status) VALUES(?,?,?,?,?,?)",
+        (ap, sha256, size, mtime, datetime.utcnow().isoformat(), status),
+    )
+    return cur.lastrowid
+
+
+def register_stream(db: sqlite3.Connection, name: str) -> int:
+    """登记跟随读取的输入（增长中的文件 或 - 表示标准输入） 内容不定 不计 sha256 每次跟随登记一行"""
+    path = name if name == "-" else os.path.abspath(name)
+    cur = db.execute(
+        "INSERT INTO FILE_REGISTRY(path, ingested_at, status) VALUES(?,?,?)",
+        (path, datetime.utcnow().isoformat(), "跟随"),
+    )
+    return cur.lastrowid
+
+
+def start_run(db: sqlite3.Connection, file_id: int, pass_type: str, cfg: dict) -> int:
+    """为一个文件的一遍处理开启 RUN_SESSION 返回 run_id"""
+    cur = db.execute(
+        "INSERT INTO RUN_SESSION(file_id, pass_type, config_json, started_at, status) VALUES(?,?,?,?,?)",
+        (file_id, pass_type, json.dumps(cfg, ensure_ascii=False), datetime.utcnow().isoformat(), "运行中"),
+    )
+    return cur.lastrowid
+
+
+def finish_run(
+    db: sqlite3.Connection,
+    run_id: int,
+    status: str,
+    total: Optional[int] = None,
+    pre: Optional[int] = None,
+    matched: Optional[int] = None,
+    unmatched: Optional[int] = None,
+    hit_ratio: Optional[float] = None,
+) -> None:
+    db.execute(
+        "UPDATE RUN_SESSION SET ended_at=?, total_lines=?, preprocessed_lines=?, matched_lines=?, unmatched_lines=?, "
+        "status=?, match_cache_hit_ratio=? WHERE run_id=?",
+        (datetime.utcnow().isoformat(), total, pre, matched, unmatched, status, hit_ratio, run_id),
+    )
+
+
+def find_done_run(db: sqlite3.Connection, file_id: int, pass_type: str) -> Optional[int]:
+    """该文件（按内容）已成功完成的 pass_type 的 run_id 没有则为 None"""
+    row = db.execute(
+        "SELECT run_id FROM RUN_SESSION WHERE file_id=? AND pass_type=? AND status='成功' ORDER BY run_id DESC LIMIT 1",
+        (file_id, pass_type),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def find_resumable_run(db: sqlite3.Connection, file_id: int, pass_type: str) -> Optional[Tuple[int, int]]:
+    """
+    该文件最近一次未成功且有断点的 run 返回 (run_id, 断点解压偏移)
+    状态为 运行中 的也算（进程被强杀时来不及标记失败）；之后已有成功 run 的不算
+    """
+    row = db.execute(
+        "SELECT run_id, ckpt_out_offset FROM RUN_SESSION WHERE file_id=? AND pass_type=? "
+        "AND status IN ('失败', '运行中') AND ckpt_out_offset IS NOT NULL "
+        "AND run_id > COALESCE((SELECT MAX(run_id) FROM RUN_SESSION WHERE file_id=? AND pass_type=? AND status='成功'), 0) "
+        "ORDER BY run_id DESC LIMIT 1",
+        (file_id, pass_type, file_id, pass_type),
+    ).fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def reopen_run(db: sqlite3.Connection, run_id: int) -> Tuple[int, int, int, int]:
+    """把待续跑的 run 置回 运行中 返回断点时已提交的 (total, pre, matched, unmatched)"""
+    db.execute("UPDATE RUN_SESSION SET status='运行中', ended_at=NULL WHERE run_id=?", (run_id,))
+    row = db.execute(
+        "SELECT total_lines, preprocessed_lines, matched_lines, unmatched_lines FROM RUN_SESSION WHERE run_id=?",
+        (run_id,),
+    ).fetchone()
+    return tuple(int(v or 0) for v in row)
+
+
+def save_checkpoint(
+    db: sqlite3.Connection,
+    run_id: int,
+    out_offset: int,
+    in_offset: Optional[int],
+    total: int,
+    pre: int,
+    matched: int,
+    unmatched: int,
+) -> None:
+    """
+    记录断点：解压偏移 out_offset 之前的记录已全部计入本 run 的统计
+    in_offset 为可从此续读的最近 gzip 访问点的压缩偏移（无访问点时为 None）
+    须与对应批次的统计写入在同一事务内
+    """
+    db.execute(
+        "UPDATE RUN_SESSION SET ckpt_out_offset=?, ckpt_in_offset=?, ckpt_at=?, total_lines=?, preprocessed_lines=?, "
+        "matched_lines=?, unmatched_lines=? WHERE run_id=?",
+        (out_offset, in_offset, datetime.utcnow().isoformat(), total, pre, matched, unmatched, run_id),
+    )
+
+
+@contextmanager
+def write_transaction(db: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """
+    显式写事务：先提交调用方未提交的隐式事务 再 BEGIN IMMEDIATE 一次拿到写锁
+    正常退出 COMMIT 异常 ROLLBACK
+    """
+    if db.in_transaction:
+        db.commit()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield db
+    except BaseException:
+        db.rollback()
+        raise
+    db.commit()
+
+
+def bulk_upsert(
+    db: sqlite3.Connection,
+    table: str,
+    columns: Sequence[str],
+    rows: Iterable[Sequence],
+    conflict: Sequence[str] = (),
+    update: Optional[str] = None,
+) -> int:
+    """
+    集合式批量写：rows 经 executemany 进入 TEMP 暂存表 再用一条 INSERT ... SELECT 合并到目标表
+    - conflict 为冲突键列 update 为 DO UPDATE SET 子句 可引用 excluded.*；conflict 为空时纯追加
+    - 暂存表按 rowid 顺序导入 追加写保持 rows 的顺序
+    - 不开启事务 由调用方用 write_transaction 包住同一批次的多张表
+    返回写入行数
+    """
+    cols = ", ".join(columns)
+    stage = f"temp.stage_{table.lower()}"
+    db.execute(f"CREATE TEMP TABLE IF NOT EXISTS stage_{table.lower()} AS SELECT {cols} FROM main.{table} WHERE 0")
+    db.execute(f"DELETE FROM {stage}")
+    cur = db.executemany(
+        f"INSERT INTO {stage}({cols}) VALUES({', '.join('?' * len(columns))})", rows
+    )
+    n = cur.rowcount
+    if n <= 0:
+        return 0
+    # 有冲突键时按键排序 唯一索引顺序插入 页面局部性好；追加写按 rowid 保序
+    order = ", ".join(conflict) if conflict else "rowid"
+    sql = f"INSERT INTO main.{table}({cols}) SELECT {cols} FROM {stage} WHERE true ORDER BY {order}"
+    if conflict:
+        sql += f" ON CONFLICT({', '.join(conflict)}) DO " + (f"UPDATE SET {update}" if update else "NOTHING")
+    db.execute(sql)
+    db.execute(f"DELETE FROM {stage}")
+    return n
+
+
 def upsert_module_bulk(db: sqlite3.Connection, mods: Set[str]) -> None:
     if not mods:
         return
@@ -119,16 +343,18 @@ def upsert_smod_bulk(db: sqlite3.Connection, mod_smods: Set[Tuple[str, str]]) ->
     )
 
 
-def bump_template_stats_bulk(db: sqlite3.Connection, tids: List[int]) -> None:
-    if not tids:
+def bump_template_stats_bulk(db: sqlite3.Connection, tids: Union[Iterable[int], Mapping[int, int]]) -> None:
+    """tids 为模板 id 序列（每次出现计 1）或 {模板 id: 次数}；每个模板只发一条 UPDATE"""
+    counts = tids if isinstance(tids, Mapping) else Counter(tids)
+    if not counts:
         return
     cur = db.cursor()
     cur.executemany(
         """
         UPDATE REGEX_TEMPLATE
-           SET match_count = COALESCE(match_count, 0) + 1,
+           SET match_count = COALESCE(match_count, 0) + ?,
                last_seen   = CURRENT_TIMESTAMP
          WHERE template_id = ?
         """,
-        [(tid,) for tid in tids],
+        [(n, tid) for tid, n in counts.items()],
     )
@@ -1,2 +1,4 @@
 # -*- coding: utf-8 -*-
-ALL_TABLE_DDL=["-- 核心建表 SQL 含中文注释\nCREATE TABLE IF NOT EXISTS FILE_REGISTRY(file_id INTEGER PRIMARY KEY, path TEXT NOT NULL, sha256 TEXT, size_bytes INTEGER, gz_mtime TEXT, ingested_at TEXT, status TEXT);\nCREATE INDEX IF NOT EXISTS idx_file_path ON FILE_REGISTRY(path);\nCREATE TABLE IF NOT EXISTS RUN_SESSION(run_id INTEGER PRIMARY KEY, file_id INTEGER, pass_type TEXT, config_json TEXT, started_at TEXT, ended_at TEXT, total_lines INTEGER, preprocessed_lines INTEGER, matched_lines INTEGER, unmatched_lines INTEGER, status TEXT, FOREIGN KEY(file_id) REFERENCES FILE_REGISTRY(file_id));\nCREATE INDEX IF NOT EXISTS idx_run_file ON RUN_SESSION(file_id);\nCREATE TABLE IF NOT EXISTS MODULE(mod TEXT PRIMARY KEY, description TEXT, created_at TEXT, updated_at TEXT);\nCREATE TABLE IF NOT EXISTS SUBMODULE(smod TEXT PRIMARY KEY, mod TEXT, description TEXT, created_at TEXT, updated_at TEXT, FOREIGN KEY(mod) REFERENCES MODULE(mod));\nCREATE INDEX IF NOT EXISTS idx_smod_mod ON SUBMODULE(mod);\nCREATE TABLE IF NOT EXISTS REGEX_TEMPLATE(template_id INTEGER PRIMARY KEY, pattern TEXT NOT NULL, sample_log TEXT, normalized_sample TEXT, match_count INTEGER DEFAULT 0, first_seen TEXT, last_seen TEXT, version INTEGER DEFAULT 1, is_active INTEGER DEFAULT 1, semantic_info TEXT);\nCREATE UNIQUE INDEX IF NOT EXISTS idx_tpl_pattern ON REGEX_TEMPLATE(pattern);\nCREATE TABLE IF NOT EXISTS TEMPLATE_HISTORY(history_id INTEGER PRIMARY KEY, template_id INTEGER, pattern TEXT, sample_log TEXT, version INTEGER, created_at TEXT, source TEXT, note TEXT, FOREIGN KEY(template_id) REFERENCES REGEX_TEMPLATE(template_id));\nCREATE INDEX IF NOT EXISTS idx_hist_tpl ON TEMPLATE_HISTORY(template_id);\nCREATE TABLE IF NOT EXISTS TEMPLATE_APPLICABILITY(app_id INTEGER PRIMARY KEY, template_id INTEGER, mod TEXT, smod TEXT, observed_count INTEGER DEFAULT 0, first_seen_in_ctx TEXT, last_seen_in_ctx TEXT, source TEXT, last_updated TEXT, UNIQUE(template_id, mod, smod, source), FOREIGN KEY(template_id) REFERENCES REGEX_TEMPLATE(template_id));\nCREATE INDEX IF NOT EXISTS idx_app_tpl_ctx ON TEMPLATE_APPLICABILITY(template_id, mod, smod);\nCREATE TABLE IF NOT EXISTS UNMATCHED_LOG(um_id INTEGER PRIMARY KEY, run_id INTEGER, mod TEXT, smod TEXT, level TEXT, thread_id TEXT, timestamp TEXT, key_text TEXT, raw_log TEXT, buffered INTEGER DEFAULT 0, buffer_id INTEGER, reason TEXT, FOREIGN KEY(run_id) REFERENCES RUN_SESSION(run_id));\nCREATE INDEX IF NOT EXISTS idx_unmatch_run ON UNMATCHED_LOG(run_id);\nCREATE TABLE IF NOT EXISTS LOG_MATCH_SUMMARY(summary_id INTEGER PRIMARY KEY, run_id INTEGER, template_id INTEGER, mod TEXT, smod TEXT, classification TEXT, level TEXT, thread_id TEXT, first_ts TEXT, last_ts TEXT, line_count INTEGER, UNIQUE(run_id, template_id, mod, smod, classification, level, thread_id), FOREIGN KEY(run_id) REFERENCES RUN_SESSION(run_id), FOREIGN KEY(template_id) REFERENCES REGEX_TEMPLATE(template_id));\nCREATE INDEX IF NOT EXISTS idx_sum_keys ON LOG_MATCH_SUMMARY(run_id, template_id, mod, smod);\nCREATE TABLE IF NOT EXISTS KEY_TIME_BUCKET(bucket_id INTEGER PRIMARY KEY, run_id INTEGER, template_id INTEGER, mod TEXT, smod TEXT, classification TEXT, level TEXT, thread_id TEXT, bucket_granularity TEXT, bucket_start TEXT, count_in_bucket INTEGER, UNIQUE(run_id, template_id, mod, smod, classification, level, thread_id, bucket_granularity, bucket_start));\nCREATE INDEX IF NOT EXISTS idx_bucket_keys ON KEY_TIME_BUCKET(run_id, template_id, mod, smod, bucket_start);\nCREATE TABLE IF NOT EXISTS BUFFER_GROUP(buffer_id INTEGER PRIMARY KEY, scope TEXT, mod TEXT, smod TEXT, size_threshold INTEGER, current_size INTEGER, created_at TEXT, status TEXT);\nCREATE TABLE IF NOT EXISTS BUFFER_ITEM(item_id INTEGER PRIMARY KEY, buffer_id INTEGER, run_id INTEGER, timestamp TEXT, mod TEXT, smod TEXT, level TEXT, thread_id TEXT, key_text TEXT, raw_log TEXT, FOREIGN KEY(buffer_id) REFERENCES BUFFER_GROUP(buffer_id));\nCREATE INDEX IF NOT EXISTS idx_buf_items ON BUFFER_ITEM(buffer_id);\nCREATE TABLE IF NOT EXISTS LLM_TASK(llm_task_id INTEGER PRIMARY KEY, buffer_id INTEGER, model TEXT, prompt_version TEXT, started_at TEXT, finished_at TEXT, status TEXT, input_count INTEGER, output_json TEXT, error TEXT, FOREIGN KEY(buffer_id) REFERENCES BUFFER_GROUP(buffer_id));\nCREATE TABLE IF NOT EXISTS BUFFER_RESULT(result_id INTEGER PRIMARY KEY, buffer_id INTEGER, llm_task_id INTEGER, template_id INTEGER, occurrences INTEGER, suggested_context TEXT, FOREIGN KEY(buffer_id) REFERENCES BUFFER_GROUP(buffer_id), FOREIGN KEY(llm_task_id) REFERENCES LLM_TASK(llm_task_id), FOREIGN KEY(template_id) REFERENCES REGEX_TEMPLATE(template_id));\nCREATE TABLE IF NOT EXISTS SUMMARY_MODULE(mod TEXT PRIMARY KEY, description TEXT, created_at TEXT, updated_at TEXT);\nCREATE TABLE IF NOT EXISTS SUMMARY_SUBMODULE(smod TEXT PRIMARY KEY, mod TEXT, description TEXT, created_at TEXT, updated_at TEXT, FOREIGN KEY(mod) REFERENCES SUMMARY_MODULE(mod));\nCREATE TABLE IF NOT EXISTS SUMMARY_REGEX_TEMPLATE(template_id INTEGER PRIMARY KEY, pattern TEXT, sample_log TEXT, normalized_sample TEXT, version INTEGER, is_active INTEGER, semantic_info TEXT, aggregated_at TEXT, total_match_count INTEGER, first_seen_global TEXT, last_seen_global TEXT);\nCREATE TABLE IF NOT EXISTS SUMMARY_TEMPLATE_HISTORY(history_id INTEGER PRIMARY KEY, template_id INTEGER, pattern TEXT, sample_log TEXT, version INTEGER, created_at TEXT, FOREIGN KEY(template_id) REFERENCES SUMMARY_REGEX_TEMPLATE(template_id));\nCREATE TABLE IF NOT EXISTS SUMMARY_TEMPLATE_APPLICABILITY(app_id INTEGER PRIMARY KEY, template_id INTEGER, mod TEXT, smod TEXT, total_count INTEGER, first_seen_in_ctx TEXT, last_seen_in_ctx TEXT, source TEXT, last_updated TEXT, UNIQUE(template_id, mod, smod, source), FOREIGN KEY(template_id) REFERENCES SUMMARY_REGEX_TEMPLATE(template_id));\n"]
+ALL_TABLE_DDL=["-- 核心建表 SQL 含中文注释\nCREATE TABLE IF NOT EXISTS FILE_REGISTRY(file_id INTEGER PRIMARY KEY, path TEXT NOT NULL, sha256 TEXT, size_bytes INTEGER, gz_mtime TEXT, ingested_at TEXT, status TEXT, gz_index_span INTEGER, gz_out_size INTEGER);\nCREATE INDEX IF NOT EXISTS idx_file_path ON FILE_REGISTRY(path);\nCREATE INDEX IF NOT EXISTS idx_file_sha ON FILE_REGISTRY(sha256);\nCREATE TABLE IF NOT EXISTS GZ_INDEX_POINT(file_id INTEGER NOT NULL, seq INTEGER NOT NULL, out_offset INTEGER NOT NULL, in_offset INTEGER NOT NULL, bits INTEGER NOT NULL, window BLOB, PRIMARY KEY(file_id, seq), FOREIGN KEY(file_id) REFERENCES FILE_REGISTRY(file_id));\nCREATE TABLE IF NOT EXISTS RUN_SESSION(run_id INTEGER PRIMARY KEY, file_id INTEGER, pass_type TEXT, config_json TEXT, started_at TEXT, ended_at TEXT, total_lines INTEGER, preprocessed_lines INTEGER, matched_lines INTEGER, unmatched_lines INTEGER, status TEXT, match_cache_hit_ratio REAL, ckpt_out_offset INTEGER, ckpt_in_offset INTEGER, ckpt_at TEXT, unmatched_key_seq INTEGER, rollup_retracted INTEGER DEFAULT 0, FOREIGN KEY(file_id) REFERENCES FILE_REGISTRY(file_id));\nCREATE INDEX IF NOT EXISTS idx_run_file ON RUN_SESSION(file_id);\nCREATE TABLE IF NOT EXISTS MODULE(mod TEXT PRIMARY KEY, description TEXT, created_at TEXT, updated_at TEXT);\nCREATE TABLE IF NOT EXISTS SUBMODULE(smod TEXT PRIMARY KEY, mod TEXT, description TEXT, created_at TEXT, updated_at TEXT, FOREIGN KEY(mod) REFERENCES MODULE(mod));\nCREATE INDEX IF NOT EXISTS idx_smod_mod ON SUBMODULE(mod);\nCREATE TABLE IF NOT EXISTS REGEX_TEMPLATE(template_id INTEGER PRIMARY KEY, pattern TEXT NOT NULL, sample_log TEXT, normalized_sample TEXT, match_count INTEGER DEFAULT 0, first_seen TEXT, last_seen TEXT, version INTEGER DEFAULT 1, is_active INTEGER DEFAULT 1, semantic_info TEXT, registry_version INTEGER DEFAULT 0, source TEXT DEFAULT 'llm');\nCREATE UNIQUE INDEX IF NOT EXISTS idx_tpl_pattern ON REGEX_TEMPLATE(pattern);\nCREATE TABLE IF NOT EXISTS TEMPLATE_REGISTRY(id INTEGER PRIMARY KEY CHECK(id = 1), version INTEGER NOT NULL DEFAULT 0, updated_at TEXT);\nINSERT OR IGNORE INTO TEMPLATE_REGISTRY(id, version) VALUES(1, 0);\nCREATE TABLE IF NOT EXISTS TEMPLATE_HISTORY(history_id INTEGER PRIMARY KEY, template_id INTEGER, pattern TEXT, sample_log TEXT, version INTEGER, created_at TEXT, source TEXT, note TEXT, FOREIGN KEY(template_id) REFERENCES REGEX_TEMPLATE(template_id));\nCREATE INDEX IF NOT EXISTS idx_hist_tpl ON TEMPLATE_HISTORY(template_id);\nCREATE TABLE IF NOT EXISTS TEMPLATE_APPLICABILITY(app_id INTEGER PRIMARY KEY, template_id INTEGER, mod TEXT, smod TEXT, observed_count INTEGER DEFAULT 0, first_seen_in_ctx TEXT, last_seen_in_ctx TEXT, source TEXT, last_updated TEXT, UNIQUE(template_id, mod, smod, source), FOREIGN KEY(template_id) REFERENCES REGEX_TEMPLATE(template_id));\nCREATE INDEX IF NOT EXISTS idx_app_tpl_ctx ON TEMPLATE_APPLICABILITY(template_id, mod, smod);\nCREATE TABLE IF NOT EXISTS UNMATCHED_LOG(um_id INTEGER PRIMARY KEY, run_id INTEGER, mod TEXT, smod TEXT, level TEXT, thread_id TEXT, timestamp TEXT, key_text TEXT, raw_log TEXT, buffered INTEGER DEFAULT 0, buffer_id INTEGER, reason TEXT, FOREIGN KEY(run_id) REFERENCES RUN_SESSION(run_id));\nCREATE INDEX IF NOT EXISTS idx_unmatch_run ON UNMATCHED_LOG(run_id);\n-- 未命中按 (run, 归一化关键文本, mod, smod) 聚合；全部原始行按到达顺序写入压缩分块的溢出文件 first_seq last_seq 为首末行序号\nCREATE TABLE IF NOT EXISTS UNMATCHED_KEY(run_id INTEGER NOT NULL, key_text TEXT NOT NULL, mod TEXT NOT NULL, smod TEXT NOT NULL, line_count INTEGER NOT NULL, first_ts TEXT, last_ts TEXT, first_seq INTEGER, last_seq INTEGER, PRIMARY KEY(run_id, key_text, mod, smod)) WITHOUT ROWID;\n-- 每个聚合键最先到达的几条原始行 只追加\nCREATE TABLE IF NOT EXISTS UNMATCHED_EXEMPLAR(ex_id INTEGER PRIMARY KEY, run_id INTEGER NOT NULL, key_text TEXT NOT NULL, mod TEXT NOT NULL, smod TEXT NOT NULL, seq INTEGER NOT NULL, raw_log TEXT);\nCREATE INDEX IF NOT EXISTS idx_unmatched_ex ON UNMATCHED_EXEMPLAR(run_id, key_text, mod, smod, seq);\n-- 溢出文件的块索引：文件 偏移 压缩长度 首行序号 行数\nCREATE TABLE IF NOT EXISTS UNMATCHED_SPILL(run_id INTEGER NOT NULL, first_seq INTEGER NOT NULL, path TEXT NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL, lines INTEGER NOT NULL, PRIMARY KEY(run_id, first_seq)) WITHOUT ROWID;\n-- resolve 已补入统计的原始关键文本 再次 resolve 时跳过溢出文件中的这些行\nCREATE TABLE IF NOT EXISTS UNMATCHED_RESOLVED(run_id INTEGER NOT NULL, key_text TEXT NOT NULL, template_id INTEGER, PRIMARY KEY(run_id, key_text)) WITHOUT ROWID;\nCREATE TABLE IF NOT EXISTS LOG_MATCH_SUMMARY(summary_id INTEGER PRIMARY KEY, run_id INTEGER, template_id INTEGER, mod TEXT, smod TEXT, classification TEXT, level TEXT, thread_id TEXT, first_ts TEXT, last_ts TEXT, line_count INTEGER, UNIQUE(run_id, template_id, mod, smod, classification, level, thread_id), FOREIGN KEY(run_id) REFERENCES RUN_SESSION(run_id), FOREIGN KEY(template_id) REFERENCES REGEX_TEMPLATE(template_id));\nCREATE INDEX IF NOT EXISTS idx_sum_keys ON LOG_MATCH_SUMMARY(run_id, template_id, mod, smod);\nCREATE TABLE IF NOT EXISTS KEY_TIME_BUCKET(bucket_id INTEGER PRIMARY KEY, run_id INTEGER, template_id INTEGER, mod TEXT, smod TEXT, classification TEXT, level TEXT, thread_id TEXT, bucket_granularity TEXT, bucket_start TEXT, count_in_bucket INTEGER, UNIQUE(run_id, template_id, mod, smod, classification, level, thread_id, bucket_granularity, bucket_start));\nCREATE INDEX IF NOT EXISTS idx_bucket_keys ON KEY_TIME_BUCKET(run_id, template_id, mod, smod, bucket_start);\nCREATE TABLE IF NOT EXISTS BUFFER_GROUP(buffer_id INTEGER PRIMARY KEY, scope TEXT, mod TEXT, smod TEXT, size_threshold INTEGER, current_size INTEGER, created_at TEXT, status TEXT);\nCREATE TABLE IF NOT EXISTS BUFFER_ITEM(item_id INTEGER PRIMARY KEY, buffer_id INTEGER, run_id INTEGER, timestamp TEXT, mod TEXT, smod TEXT, level TEXT, thread_id TEXT, key_text TEXT, raw_log TEXT, FOREIGN KEY(buffer_id) REFERENCES BUFFER_GROUP(buffer_id));\nCREATE INDEX IF NOT EXISTS idx_buf_items ON BUFFER_ITEM(buffer_id);\nCREATE TABLE IF NOT EXISTS LLM_TASK(llm_task_id INTEGER PRIMARY KEY, buffer_id INTEGER, model TEXT, prompt_version TEXT, started_at TEXT, finished_at TEXT, status TEXT, input_count INTEGER, output_json TEXT, error TEXT, attempts INTEGER, http_status INTEGER, latency_ms INTEGER, prompt_tokens INTEGER, completion_tokens INTEGER, cache_hit INTEGER DEFAULT 0, FOREIGN KEY(buffer_id) REFERENCES BUFFER_GROUP(buffer_id));\nCREATE TABLE IF NOT EXISTS LLM_CACHE(cache_key TEXT PRIMARY KEY, model TEXT, prompt_version TEXT, template_sha TEXT, output_json TEXT NOT NULL, sample_count INTEGER, size_bytes INTEGER, created_at TEXT, last_used_at TEXT, hit_count INTEGER DEFAULT 0);\nCREATE INDEX IF NOT EXISTS idx_llm_cache_used ON LLM_CACHE(last_used_at);\nCREATE TABLE IF NOT EXISTS BUFFER_RESULT(result_id INTEGER PRIMARY KEY, buffer_id INTEGER, llm_task_id INTEGER, template_id INTEGER, occurrences INTEGER, suggested_context TEXT, FOREIGN KEY(buffer_id) REFERENCES BUFFER_GROUP(buffer_id), FOREIGN KEY(llm_task_id) REFERENCES LLM_TASK(llm_task_id), FOREIGN KEY(template_id) REFERENCES REGEX_TEMPLATE(template_id));\nCREATE TABLE IF NOT EXISTS SUMMARY_MODULE(mod TEXT PRIMARY KEY, description TEXT, created_at TEXT, updated_at TEXT);\nCREATE TABLE IF NOT EXISTS SUMMARY_SUBMODULE(smod TEXT PRIMARY KEY, mod TEXT, description TEXT, created_at TEXT, updated_at TEXT, FOREIGN KEY(mod) REFERENCES SUMMARY_MODULE(mod));\nCREATE TABLE IF NOT EXISTS SUMMARY_REGEX_TEMPLATE(template_id INTEGER PRIMARY KEY, pattern TEXT, sample_log TEXT, normalized_sample TEXT, version INTEGER, is_active INTEGER, semantic_info TEXT, aggregated_at TEXT, total_match_count INTEGER, first_seen_global TEXT, last_seen_global TEXT);\nCREATE TABLE IF NOT EXISTS SUMMARY_TEMPLATE_HISTORY(history_id INTEGER PRIMARY KEY, template_id INTEGER, pattern TEXT, sample_log TEXT, version INTEGER, created_at TEXT, FOREIGN KEY(template_id) REFERENCES SUMMARY_REGEX_TEMPLATE(template_id));\nCREATE TABLE IF NOT EXISTS SUMMARY_TEMPLATE_APPLICABILITY(app_id INTEGER PRIMARY KEY, template_id INTEGER, mod TEXT, smod TEXT, total_count INTEGER, first_seen_in_ctx TEXT, last_seen_in_ctx TEXT, source TEXT, last_updated TEXT, UNIQUE(template_id, mod, smod, source), FOREIGN KEY(template_id) REFERENCES SUMMARY_REGEX_TEMPLATE(template_id));\n-- 自上次 merge-summary 以来有变化的模板（触发器维护） merge-summary 只合并这些模板；触发器内不用 OR IGNORE（外层 upsert 的冲突处理会覆盖它）\nCREATE TABLE IF NOT EXISTS SUMMARY_DIRTY(template_id INTEGER PRIMARY KEY);\nCREATE TRIGGER IF NOT EXISTS trg_tpl_ins_dirty AFTER INSERT ON REGEX_TEMPLATE BEGIN INSERT INTO SUMMARY_DIRTY(template_id) SELECT NEW.template_id WHERE NOT EXISTS (SELECT 1 FROM SUMMARY_DIRTY WHERE template_id=NEW.template_id); END;\nCREATE TRIGGER IF NOT EXISTS trg_tpl_upd_dirty AFTER UPDATE ON REGEX_TEMPLATE BEGIN INSERT INTO SUMMARY_DIRTY(template_id) SELECT NEW.template_id WHERE NOT EXISTS (SELECT 1 FROM SUMMARY_DIRTY WHERE template_id=NEW.template_id); END;\nCREATE TRIGGER IF NOT EXISTS trg_app_ins_dirty AFTER INSERT ON TEMPLATE_APPLICABILITY BEGIN INSERT INTO SUMMARY_DIRTY(template_id) SELECT NEW.template_id WHERE NOT EXISTS (SELECT 1 FROM SUMMARY_DIRTY WHERE template_id=NEW.template_id); END;\nCREATE TRIGGER IF NOT EXISTS trg_app_upd_dirty AFTER UPDATE ON TEMPLATE_APPLICABILITY BEGIN INSERT INTO SUMMARY_DIRTY(template_id) SELECT NEW.template_id WHERE NOT EXISTS (SELECT 1 FROM SUMMARY_DIRTY WHERE template_id=NEW.template_id); END;\nCREATE TRIGGER IF NOT EXISTS trg_app_del_dirty AFTER DELETE ON TEMPLATE_APPLICABILITY BEGIN INSERT INTO SUMMARY_DIRTY(template_id) SELECT OLD.template_id WHERE NOT EXISTS (SELECT 1 FROM SUMMARY_DIRTY WHERE template_id=OLD.template_id); END;\n-- 旧库首次建触发器时 尚未合并过的模板记为有变化\nINSERT OR IGNORE INTO SUMMARY_DIRTY(template_id) SELECT template_id FROM REGEX_TEMPLATE WHERE template_id NOT IN (SELECT template_id FROM SUMMARY_REGEX_TEMPLATE);\n-- 报表汇总（跨 run 按 mod 时间 模板累加 pass2 每批写入时增量维护） 主键与索引均为覆盖索引\nCREATE TABLE IF NOT EXISTS ROLLUP_HOUR(mod TEXT NOT NULL, hour_start TEXT NOT NULL, template_id INTEGER NOT NULL, line_count INTEGER NOT NULL, PRIMARY KEY(mod, hour_start, template_id)) WITHOUT ROWID;\nCREATE INDEX IF NOT EXISTS idx_rollup_hour_tpl ON ROLLUP_HOUR(template_id, hour_start, mod, line_count);\nCREATE TABLE IF NOT EXISTS ROLLUP_DAY(mod TEXT NOT NULL, day TEXT NOT NULL, template_id INTEGER NOT NULL, line_count INTEGER NOT NULL, PRIMARY KEY(mod, day, template_id)) WITHOUT ROWID;\nCREATE INDEX IF NOT EXISTS idx_rollup_day_all ON ROLLUP_DAY(day, template_id, line_count);\nCREATE INDEX IF NOT EXISTS idx_rollup_day_tpl ON ROLLUP_DAY(template_id, day, mod, line_count);\nCREATE TABLE IF NOT EXISTS ROLLUP_RUN(run_id INTEGER NOT NULL, template_id INTEGER NOT NULL, mod TEXT NOT NULL, line_count INTEGER NOT NULL, PRIMARY KEY(run_id, template_id, mod)) WITHOUT ROWID;\n"]
+# 已有库升级补列：(表, 列, 类型)；init-db 时按需 ALTER TABLE
+ALTER_COLUMNS=[("RUN_SESSION", "match_cache_hit_ratio", "REAL"), ("FILE_REGISTRY", "gz_index_span", "INTEGER"), ("FILE_REGISTRY", "gz_out_size", "INTEGER"), ("RUN_SESSION", "ckpt_out_offset", "INTEGER"), ("RUN_SESSION", "ckpt_in_offset", "INTEGER"), ("RUN_SESSION", "ckpt_at", "TEXT"), ("REGEX_TEMPLATE", "registry_version", "INTEGER DEFAULT 0"), ("LLM_TASK", "attempts", "INTEGER"), ("LLM_TASK", "http_status", "INTEGER"), ("LLM_TASK", "latency_ms", "INTEGER"), ("LLM_TASK", "prompt_tokens", "INTEGER"), ("LLM_TASK", "completion_tokens", "INTEGER"), ("LLM_TASK", "cache_hit", "INTEGER DEFAULT 0"), ("REGEX_TEMPLATE", "source", "TEXT DEFAULT 'llm'"), ("RUN_SESSION", "unmatched_key_seq", "INTEGER"), ("RUN_SESSION", "rollup_retracted", "INTEGER DEFAULT 0")]
@@ -0,0 +1,196 @@
+# logsys/follow.py
+"""
+follow 模式：跟随增长中的纯文本日志文件或标准输入 增量更新 LOG_MATCH_SUMMARY 与 KEY_TIME_BUCKET
+- 读到的字节按完整行累积；最后一条记录首行之前的记录已完整（之后的行不会再并入） 立即切分 解析 匹配
+- 最后一条记录可能还有续行：输入静默 idle 秒后按已完整处理；此后才到达的续行已无记录可并 按首条记录前的杂行丢弃
+- 有待写统计时 最早一条待写记录入账后 latency/2 内写库 达到批量阈值时提前写；记录写出后约 latency 秒内可查到
+- 内存有界：待写统计与未命中每次写库后清空 读缓冲超过 max_buffer 仍无新记录首行时强制切分
+- 文件被截断或轮转（inode 变化）时读完旧文件后从新文件开头继续；旧文件末尾没有换行的半行按完整记录处理 不与新文件拼接
+与 pass2 共用 scanner 的切分解析 TemplateMatcher 匹配 Pass2Writer 写库；登记为 PASS2 run 下游查询不变
+run 的断点偏移记为已处理的字节数 每次写库同步 RUN_SESSION 的行数 便于观察进度
+运行中按 app.template_poll_s 轮询模板注册表 新增 改动 停用的模板增量生效 无需重启
+未命中同时按 (mod, smod) 分片写入 BUFFER_ITEM（app.follow_buffer 缺省开启 见 BufferManager）；
+app.buffer_auto_drain 开启时 满的缓冲交给后台 BufferScheduler（LLM 或本地挖掘） 新模板经注册表轮询生效
+"""
+
+from __future__ import annotations
+import logging
+import os
+import select
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+from . import scanner
+from .buffer_mgr import BufferManager, BufferScheduler
+from .db import Database, register_stream, start_run
+from .matcher import TemplateMatcher
+from .pass2 import Pass2Writer, aggregate_record, template_poll_s
+
+__all__ = [
+    "run_follow",
+]
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 1 << 20
+
+
+class _FileSource:
+    """增量读取普通文件：read() 返回新字节 暂无新数据时等待 timeout 秒后返回 b""
+    截断或轮转后重新打开时 该次 read() 置 reopened 返回的是新文件开头的字节"""
+
+    reopened = False
+
+    def __init__(self, path: str, from_end: bool = False) -> None:
+        self.path = path
+        self.f = open(path, "rb")
+        if from_end:
+            self.f.seek(0, os.SEEK_END)
+        self.ino = os.fstat(self.f.fileno()).st_ino
+
+    def read(self, timeout: float) -> Optional[bytes]:
+        self.reopened = False
+        data = self.f.read(READ_SIZE)
+        if data:
+            return data
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None  # 轮转间隙 新文件尚未出现
+        if st is not None and (st.st_ino != self.ino or st.st_size < self.f.tell()):
+            logger.info("follow %s: 文件%s 从头读取", self.path, "被截断" if st.st_ino == self.ino else "已轮转")
+            self.f.close()
+            self.f = open(self.path, "rb")
+            self.ino = os.fstat(self.f.fileno()).st_ino
+            self.reopened = True
+            return self.f.read(READ_SIZE)
+        time.sleep(timeout)
+        return b""
+
+    def close(self) -> None:
+        self.f.close()
+
+
+class _StdinSource:
+    """增量读取标准输入 输入结束返回 None"""
+
+    reopened = False
+
+    def __init__(self) -> None:
+        self.fd = sys.stdin.buffer.fileno()
+
+    def read(self, timeout: float) -> Optional[bytes]:
+        r, _, _ = select.select([self.fd], [], [], timeout)
+        if not r:
+            return b""
+        return os.read(self.fd, READ_SIZE) or None
+
+    def close(self) -> None:
+        pass
+
+
+def run_follow(
+    cfg: dict,
+    db: Database,
+    path: str,
+    latency: Optional[float] = None,
+    from_end: bool = False,
+    idle_exit: Optional[float] = None,
+    stop: Optional[threading.Event] = None,
+) -> Dict[str, int]:
+    """
+    跟随 path（- 为标准输入）直到 输入结束 / Ctrl-C / stop 被置位 / 连续 idle_exit 秒无新数据
+    latency 缺省取 app.follow_latency_s；from_end 时跳过文件已有内容 只处理新追加的部分
+    返回 {"run_id", "records", "matched", "bytes"}
+    """
+    app = cfg["app"]
+    latency = float(latency if latency is not None else app.get("follow_latency_s", 2.0))
+    idle = min(float(app.get("follow_idle_s", 0.5)), latency / 4)
+    poll = min(0.05, latency / 10)
+    max_buffer = int(float(app.get("follow_max_buffer_mb", 8)) * (1 << 20))
+    cache_size = int(app.get("match_cache_size", 0))
+
+    conn = db.conn
+    file_id = register_stream(conn, path)
+    run_id = start_run(conn, file_id, "PASS2", cfg)
+    conn.commit()
+    w = Pass2Writer(cfg, db, run_id, file_id=file_id)
+    acc = w.acc
+    w.pos = 0
+    matcher = TemplateMatcher(db, cache_size=cache_size, poll_s=template_poll_s(cfg))
+    matcher.load_templates()
+    cls_cache: Dict[int, str] = {}
+    sched = BufferScheduler(cfg, app["db_path"]) if app.get("follow_buffer", True) and app.get("buffer_auto_drain") else None
+    bm = BufferManager(cfg, db, on_full=sched.submit if sched else None) if app.get("follow_buffer", True) else None
+    src = _StdinSource() if path == "-" else _FileSource(path, from_end)
+
+    buf = bytearray()
+    consumed = 0                 # 已切分处理的字节数
+    pending_since: Optional[float] = None
+
+    def scan(n: int) -> None:
+        nonlocal consumed, pending_since
+        if matcher.maybe_refresh():
+            cls_cache.clear()    # 刷新可能改动已有模板的 semantic_info
+        k = len(acc["unmatched"])
+        for rec in scanner.scan_block(bytes(buf[:n])):
+            aggregate_record(acc, rec, matcher, cls_cache)
+        if bm is not None and len(acc["unmatched"]) > k:
+            bm.add_records(run_id, acc["unmatched"][k:])
+        del buf[:n]
+        consumed += n
+        w.pos = consumed
+        if pending_since is None and (acc["pending"] or acc["unmatched"]):
+            pending_since = time.monotonic()
+
+    last_data = time.monotonic()
+    try:
+        try:
+            while stop is None or not stop.is_set():
+                data = src.read(poll)
+                now = time.monotonic()
+                if data is None:
+                    break
+                if src.reopened and buf:
+                    # 旧文件已读完 剩下的半行是它的最后一条记录
+                    scan(len(buf))
+                if data:
+                    buf += data
+                    last_data = now
+                    end = buf.rfind(b"\n") + 1
+                    cut = scanner.record_cut(bytes(buf[:end])) if end else 0
+                    if not cut and len(buf) > max_buffer:
+                        cut = end or len(buf)
+                    if cut:
+                        scan(cut)
+                elif buf and now - last_data >= idle:
+                    # 输入静默：最后一条记录视为完整（只取完整行 半行等待写完）
+                    end = buf.rfind(b"\n") + 1
+                    if end:
+                        scan(end)
+                if pending_since is not None and (w.due() or now - pending_since >= latency / 2):
+                    w.flush()
+                    pending_since = None
+                if bm is not None:
+                    bm.maybe_flush()
+                if idle_exit is not None and now - last_data >= idle_exit:
+                    break
+        except KeyboardInterrupt:
+            logger.info("follow %s: 收到中断 收尾退出", path)
+        if buf:
+            scan(len(buf))
+        if bm is not None:
+            bm.close()
+        w.finish(matcher.cache_hit_ratio)
+        conn.commit()
+    except BaseException:
+        w.fail()
+        raise
+    finally:
+        src.close()
+        if sched is not None:
+            sched.close()
+    logger.info("follow %s run=%s: 记录 %d 命中 %d 字节 %d", path, run_id, acc["total"], acc["matched"], consumed)
+    return {"run_id": run_id, "records": acc["total"], "matched": acc["matched"], "bytes": consumed}
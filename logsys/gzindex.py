@@ -0,0 +1,439 @@
+# logsys/gzindex.py
+"""
+gzip 随机访问索引（zran 思路）：
+- 第一次顺序解压时按 span 字节（解压后）记录访问点：压缩偏移 位偏移 与前 32KiB 窗口
+- 索引存入 GZ_INDEX_POINT 以 FILE_REGISTRY.file_id 关联 同时回填 sha256 size_bytes gz_mtime
+- 之后的遍历可从任一访问点开始解压 多个进程各自解压不同区段 实现并行与断点续读
+- 需要系统 libz 的 inflatePrime/inflateSetDictionary 经 ctypes 调用 不可用时 available() 为 False
+  调用方应回退到 gzip 顺序读取
+"""
+
+from __future__ import annotations
+import ctypes
+import ctypes.util
+import hashlib
+import os
+import sqlite3
+import zlib
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from .db import file_meta
+
+__all__ = [
+    "AccessPoint",
+    "GzIndex",
+    "available",
+    "IndexingReader",
+    "iter_from",
+    "iter_bytes_from",
+    "iter_lines",
+    "iter_lines_range",
+    "iter_records_range",
+    "save_index",
+    "save_points",
+    "load_index",
+    "find_indexed_file",
+]
+
+WINSIZE = 32768          # deflate 最大回溯窗口
+CHUNK = 1 << 18          # 每次读取的压缩字节数
+DEFAULT_SPAN = 16 << 20  # 默认每 16 MiB 解压输出记录一个访问点
+
+Z_OK, Z_STREAM_END, Z_NEED_DICT, Z_BUF_ERROR = 0, 1, 2, -5
+Z_NO_FLUSH, Z_BLOCK = 0, 5
+
+
+class _ZStream(ctypes.Structure):
+    _fields_ = [
+        ("next_in", ctypes.c_void_p),
+        ("avail_in", ctypes.c_uint),
+        ("total_in", ctypes.c_ulong),
+        ("next_out", ctypes.c_void_p),
+        ("avail_out", ctypes.c_uint),
+        ("total_out", ctypes.c_ulong),
+        ("msg", ctypes.c_char_p),
+        ("state", ctypes.c_void_p),
+        ("zalloc", ctypes.c_void_p),
+        ("zfree", ctypes.c_void_p),
+        ("opaque", ctypes.c_void_p),
+        ("data_type", ctypes.c_int),
+        ("adler", ctypes.c_ulong),
+        ("reserved", ctypes.c_ulong),
+    ]
+
+
+def _load_libz():
+    name = ctypes.util.find_library("z")
+    if not name:
+        return None
+    try:
+        lib = ctypes.CDLL(name)
+        for fn in ("inflateInit2_", "inflate", "inflateEnd", "inflateReset2",
+                   "inflatePrime", "inflateSetDictionary", "zlibVersion"):
+            getattr(lib, fn)
+    except (OSError, AttributeError):
+        return None
+    lib.zlibVersion.restype = ctypes.c_char_p
+    p = ctypes.POINTER(_ZStream)
+    lib.inflateInit2_.argtypes = [p, ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+    lib.inflate.argtypes = [p, ctypes.c_int]
+    lib.inflateEnd.argtypes = [p]
+    lib.inflateReset2.argtypes = [p, ctypes.c_int]
+    lib.inflatePrime.argtypes = [p, ctypes.c_int, ctypes.c_int]
+    lib.inflateSetDictionary.argtypes = [p, ctypes.c_char_p, ctypes.c_uint]
+    return lib
+
+
+_LIBZ = _load_libz()
+
+
+def available() -> bool:
+    return _LIBZ is not None
+
+
+class AccessPoint:
+    __slots__ = ("out_offset", "in_offset", "bits", "window")
+
+    def __init__(self, out_offset: int, in_offset: int, bits: int, window: bytes) -> None:
+        self.out_offset = out_offset  # 解压后偏移
+        self.in_offset = in_offset    # 压缩文件内偏移（首个完整字节）
+        self.bits = bits              # 前一字节中尚未消费的位数
+        self.window = window          # 访问点之前最多 32KiB 的解压输出
+
+
+class GzIndex:
+    __slots__ = ("points", "span", "size_bytes", "sha256", "out_size")
+
+    def __init__(self, points: List[AccessPoint], span: int, size_bytes: int, sha256: str, out_size: int) -> None:
+        self.points = points
+        self.span = span
+        self.size_bytes = size_bytes
+        self.sha256 = sha256
+        self.out_size = out_size
+
+    def segments(self) -> List[Tuple[int, int]]:
+        """相邻访问点之间的解压区段 [start, end) 最后一段 end=out_size"""
+        starts = [p.out_offset for p in self.points]
+        return list(zip(starts, starts[1:] + [self.out_size]))
+
+
+class _Inflater:
+    """ctypes 包装的 z_stream 输出写入 32KiB 环形窗口"""
+
+    def __init__(self, window_bits: int) -> None:
+        self.strm = _ZStream()
+        self.window = ctypes.create_string_buffer(WINSIZE)
+        self._in = None
+        ver = _LIBZ.zlibVersion()
+        ret = _LIBZ.inflateInit2_(ctypes.byref(self.strm), window_bits, ver, ctypes.sizeof(_ZStream))
+        if ret != Z_OK:
+            raise zlib.error(f"inflateInit2 失败: {ret}")
+        self.strm.avail_out = 0
+
+    def feed(self, data: bytes) -> None:
+        self._in = ctypes.create_string_buffer(data, len(data))
+        self.strm.next_in = ctypes.cast(self._in, ctypes.c_void_p)
+        self.strm.avail_in = len(data)
+
+    def step(self, flush: int) -> Tuple[int, bytes]:
+        """调用一次 inflate 返回 (ret, 本次产出的字节)"""
+        s = self.strm
+        if s.avail_out == 0:
+            s.next_out = ctypes.addressof(self.window)
+            s.avail_out = WINSIZE
+        off = WINSIZE - s.avail_out
+        before = s.avail_out
+        ret = _LIBZ.inflate(ctypes.byref(s), flush)
+        if ret not in (Z_OK, Z_STREAM_END, Z_BUF_ERROR):
+            raise zlib.error(f"inflate 失败: {ret} {s.msg!r}")
+        produced = before - s.avail_out
+        data = ctypes.string_at(ctypes.addressof(self.window) + off, produced) if produced else b""
+        return ret, data
+
+    def last_window(self, total_out: int) -> bytes:
+        """访问点处的回溯窗口：环形缓冲按时间顺序展开"""
+        left = self.strm.avail_out
+        raw = self.window.raw
+        w = raw[WINSIZE - left:] + raw[:WINSIZE - left] if left else raw
+        return w[-min(total_out, WINSIZE):] if total_out else b""
+
+    def close(self) -> None:
+        _LIBZ.inflateEnd(ctypes.byref(self.strm))
+
+
+class IndexingReader:
+    """
+    顺序解压同时建索引：迭代产出解压字节块 迭代结束后 .index 可用
+    span 为相邻访问点最小解压间隔；迭代过程中 .points 为已经过的访问点 可先行落库作为断点
+    """
+
+    def __init__(self, path: str, span: int = DEFAULT_SPAN) -> None:
+        if not available():
+            raise RuntimeError("系统 libz 不可用 无法建立 gzip 索引")
+        self.path = path
+        self.span = max(int(span), WINSIZE)
+        self.index: Optional[GzIndex] = None
+        self.points: List[AccessPoint] = []
+
+    def __iter__(self) -> Iterator[bytes]:
+        h = hashlib.sha256()
+        points = self.points = []
+        inf = _Inflater(47)  # 自动识别 gzip/zlib 头
+        totin = totout = 0
+        last = -1
+        ended = True  # 空文件视为完整
+        try:
+            with open(self.path, "rb") as f:
+                while True:
+                    buf = f.read(CHUNK)
+                    if not buf:
+                        break
+                    h.update(buf)
+                    inf.feed(buf)
+                    ended = False
+                    s = inf.strm
+                    while s.avail_in:
+                        ain = s.avail_in
+                        ret, data = inf.step(Z_BLOCK)
+                        totin += ain - s.avail_in
+                        totout += len(data)
+                        if data:
+                            yield data
+                        if ret == Z_STREAM_END:
+                            # 多成员 gzip：复位后继续解析下一个成员头
+                            _LIBZ.inflateReset2(ctypes.byref(s), 47)
+                            ended = True
+                            continue
+                        ended = False
+                        if ret == Z_BUF_ERROR and s.avail_in:
+                            raise zlib.error("gzip 数据损坏")
+                        dt = s.data_type
+                        if (dt & 128) and not (dt & 64) and (last < 0 or totout - last >= self.span):
+                            points.append(AccessPoint(totout, totin, dt & 7, inf.last_window(totout)))
+                            last = totout
+            if not ended:
+                raise EOFError("gzip 文件不完整：压缩流未正常结束")
+        finally:
+            inf.close()
+        self.index = GzIndex(points, self.span, os.path.getsize(self.path), h.hexdigest(), totout)
+
+
+def iter_from(path: str, point: AccessPoint, limit: Optional[int] = None) -> Iterator[bytes]:
+    """从访问点开始解压 产出字节块；limit 为最多产出的字节数"""
+    inf = _Inflater(-15)
+    remaining = limit
+    try:
+        with open(path, "rb") as f:
+            f.seek(point.in_offset - (1 if point.bits else 0))
+            if point.bits:
+                ch = f.read(1)[0]
+                _LIBZ.inflatePrime(ctypes.byref(inf.strm), point.bits, ch >> (8 - point.bits))
+            if point.window:
+                _LIBZ.inflateSetDictionary(ctypes.byref(inf.strm), point.window, len(point.window))
+            raw_mode = True
+            pending = b""
+            while True:
+                buf = pending or f.read(CHUNK)
+                pending = b""
+                if not buf:
+                    return
+                inf.feed(buf)
+                s = inf.strm
+                while s.avail_in:
+                    ret, data = inf.step(Z_NO_FLUSH)
+                    if data:
+                        if remaining is not None:
+                            if len(data) >= remaining:
+                                yield data[:remaining]
+                                return
+                            remaining -= len(data)
+                        yield data
+                    if ret == Z_STREAM_END:
+                        # 当前成员结束 跳过原始 deflate 模式下未消费的 8 字节尾部 后续按 gzip 头解析
+                        rest = ctypes.string_at(s.next_in, s.avail_in) if s.avail_in else b""
+                        if raw_mode:
+                            tail_need = 8 - len(rest)
+                            rest = rest[8:] if tail_need <= 0 else b""
+                            if tail_need > 0:
+                                f.read(tail_need)
+                        raw_mode = False
+                        _LIBZ.inflateReset2(ctypes.byref(s), 47)
+                        s.avail_in = 0
+                        pending = rest
+                        break
+                    if ret == Z_BUF_ERROR and s.avail_in:
+                        raise zlib.error("gzip 数据损坏")
+    finally:
+        inf.close()
+
+
+def _point_for(index: GzIndex, offset: int) -> AccessPoint:
+    best = index.points[0]
+    for p in index.points:
+        if p.out_offset > offset:
+            break
+        best = p
+    return best
+
+
+def iter_bytes_from(path: str, index: GzIndex, offset: int) -> Iterator[bytes]:
+    """从解压偏移 offset 起产出字节块 自 offset 之前最近的访问点开始解压"""
+    p = _point_for(index, offset)
+    skip = offset - p.out_offset
+    for data in iter_from(path, p):
+        if skip:
+            if len(data) <= skip:
+                skip -= len(data)
+                continue
+            data = data[skip:]
+            skip = 0
+        yield data
+
+
+def _iter_raw_lines(path: str, index: GzIndex, start: int) -> Iterator[Tuple[int, bytes]]:
+    """从解压偏移 start 起产出 (行首偏移, 行字节)；start>0 时丢弃首个不完整行"""
+    p = _point_for(index, max(start - 1, 0))
+    pos = p.out_offset
+    skip_to = max(start - 1, 0)
+    tail = b""
+    tail_off = pos
+    first = start > 0
+    for data in iter_from(path, p):
+        if pos + len(data) <= skip_to:
+            pos += len(data)
+            continue
+        if pos < skip_to:
+            data = data[skip_to - pos:]
+            pos = skip_to
+        if tail:
+            data = tail + data
+            pos = tail_off
+        else:
+            tail_off = pos
+        i = 0
+        n = len(data)
+        while True:
+            j = data.find(b"\n", i)
+            if j < 0:
+                break
+            if first:
+                first = False
+            else:
+                yield pos + i, data[i:j]
+            i = j + 1
+        tail = data[i:]
+        tail_off = pos + i
+        pos += n
+    if tail and not first:
+        yield tail_off, tail
+
+
+def _decode(raw: bytes, encoding: str, errors: str) -> List[str]:
+    """与 gzip.open(..., "rt") 的通用换行一致：\r\n 与单独的 \r 也视为行尾"""
+    line = raw.decode(encoding, errors)
+    if "\r" not in line:
+        return [line]
+    parts = line.split("\r")
+    if parts[-1] == "":
+        parts.pop()
+    return parts
+
+
+def iter_lines(chunks: Iterable[bytes], encoding: str = "utf-8", errors: str = "replace") -> Iterator[str]:
+    """把解压字节块切成文本行（不含换行符） 如 IndexingReader 的输出"""
+    tail = b""
+    for data in chunks:
+        if tail:
+            data = tail + data
+        lines = data.split(b"\n")
+        tail = lines.pop()
+        for raw in lines:
+            yield from _decode(raw, encoding, errors)
+    if tail:
+        yield from _decode(tail, encoding, errors)
+
+
+def iter_lines_range(path: str, index: GzIndex, start: int, end: int,
+                     encoding: str = "utf-8", errors: str = "replace") -> Iterator[str]:
+    """产出行首偏移落在 [start, end) 内的行（不含换行符）"""
+    for off, raw in _iter_raw_lines(path, index, start):
+        if off >= end:
+            return
+        yield from _decode(raw, encoding, errors)
+
+
+def iter_records_range(path: str, index: GzIndex, start: int, end: int, is_record_start,
+                       encoding: str = "utf-8", errors: str = "replace") -> Iterator[str]:
+    """
+    按多行记录切分区段：跳过区段开头属于上一条记录的续行
+    区段末尾越过 end 继续读取 直到下一条记录开始 保证续行不被截断
+    is_record_start(line) 判断一行是否为记录首行
+    """
+    started = start == 0
+    for off, raw in _iter_raw_lines(path, index, start):
+        for line in _decode(raw, encoding, errors):
+            rec = is_record_start(line)
+            if not started:
+                if not rec:
+                    continue
+                started = True
+            if off >= end and rec:
+                return
+            yield line
+
+
+# === 持久化：FILE_REGISTRY + GZ_INDEX_POINT ===
+
+def save_index(conn: sqlite3.Connection, file_id: int, index: GzIndex) -> None:
+    conn.execute("DELETE FROM GZ_INDEX_POINT WHERE file_id=?", (file_id,))
+    conn.executemany(
+        "INSERT INTO GZ_INDEX_POINT(file_id, seq, out_offset, in_offset, bits, window) VALUES(?,?,?,?,?,?)",
+        [(file_id, i, p.out_offset, p.in_offset, p.bits, zlib.compress(p.window))
+         for i, p in enumerate(index.points)],
+    )
+    conn.execute(
+        "UPDATE FILE_REGISTRY SET sha256=?, size_bytes=?, gz_index_span=?, gz_out_size=? WHERE file_id=?",
+        (index.sha256, index.size_bytes, index.span, index.out_size, file_id),
+    )
+
+
+def save_points(conn: sqlite3.Connection, file_id: int, points: List[AccessPoint], start: int = 0) -> int:
+    """顺序建索引途中 把 points[start:] 先行落库（不标记索引完成） 返回已落库的访问点数"""
+    conn.executemany(
+        "INSERT OR REPLACE INTO GZ_INDEX_POINT(file_id, seq, out_offset, in_offset, bits, window) VALUES(?,?,?,?,?,?)",
+        [(file_id, i, p.out_offset, p.in_offset, p.bits, zlib.compress(p.window))
+         for i, p in enumerate(points[start:], start)],
+    )
+    return len(points)
+
+
+def load_index(conn: sqlite3.Connection, file_id: int, partial: bool = False) -> Optional[GzIndex]:
+    """
+    读取已完成的索引；partial=True 时也返回未完成的索引（只含先行落库的访问点 out_size 为 None）
+    未完成的索引只用于从某个偏移续读 不可用于 segments()
+    """
+    meta = conn.execute(
+        "SELECT sha256, size_bytes, gz_index_span, gz_out_size FROM FILE_REGISTRY WHERE file_id=?", (file_id,)
+    ).fetchone()
+    if not meta or (meta[3] is None and not partial):
+        return None
+    rows = conn.execute(
+        "SELECT out_offset, in_offset, bits, window FROM GZ_INDEX_POINT WHERE file_id=? ORDER BY seq", (file_id,)
+    ).fetchall()
+    if not rows:
+        return None
+    points = [AccessPoint(o, i, b, zlib.decompress(w)) for o, i, b, w in rows]
+    return GzIndex(points, meta[2], meta[1], meta[0], meta[3])
+
+
+def find_indexed_file(conn: sqlite3.Connection, path: str) -> Optional[int]:
+    """按路径 大小 修改时间 找到已建索引的文件记录 文件变化后旧索引失效"""
+    if not os.path.isfile(path):
+        return None
+    size, mtime = file_meta(path)
+    row = conn.execute(
+        "SELECT file_id FROM FILE_REGISTRY WHERE path=? AND size_bytes=? AND gz_mtime=? AND gz_out_size IS NOT NULL "
+        "ORDER BY file_id DESC LIMIT 1",
+        (os.path.abspath(path), size, mtime),
+    ).fetchone()
+    return row[0] if row else None
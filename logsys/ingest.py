@@ -5,3 +5,13 @@ def read_gz_lines(path: str) -> Iterator[str]:
     with gzip.open(path, 'rt', encoding='utf-8', errors='ignore') as f:
         for line in f:
             yield line.rstrip('\n')
+def read_gz_chunks(path: str, size: int = 1 << 20, start: int = 0) -> Iterator[bytes]:
+    """按块读取解压后的原始字节 交给 scanner 切分记录；start>0 时从该解压偏移起读（其前内容解压后丢弃）"""
+    with gzip.open(path, 'rb') as f:
+        if start:
+            f.seek(start)
+        while True:
+            data = f.read(size)
+            if not data:
+                return
+            yield data
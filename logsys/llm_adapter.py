@@ -1,7 +1,9 @@
 
 # -*- coding: utf-8 -*-
-import os, json, re
-from typing import List, Dict, Optional
+import os, json, re, random, sqlite3, threading, time
+from typing import List, Dict, Optional, Tuple
+from . import llm_cache
+from .reducer import plan_samples
 
 def _read_text(path: str) -> str:
     try:
@@ -45,35 +47,20 @@ def _extract_json_array(text: str) -> Optional[List[Dict]]:
         start = text.find("[", start + 1)
     return None
 
-def call_llm(cfg: dict, samples: List[str]) -> List[Dict]:
-    """
-    根据配置调用 LLM 并返回聚类后的条目列表。
-    配置：
-      llm.enabled: bool
-      llm.api_base: OpenAI 兼容 API
-      llm.model: 模型名
-      llm.api_key_env: 环境变量名
-      llm.timeout_sec: 超时
-      llm.prompt_path: 提示词模板路径（包含 {SAMPLES} 占位符）
-    """
-    if not cfg.get("llm", {}).get("enabled", False):
-        return []
-
-    # 惰性导入第三方，未安装也不影响主流程
-    try:
-        import requests
-    except Exception:
-        return []
-
-    api_key = os.getenv(cfg["llm"].get("api_key_env", "OPENAI_API_KEY"), "")
-    if not api_key:
-        return []
-
-    tmpl_path = cfg["llm"].get("prompt_path") or ""
-    tmpl = _read_text(tmpl_path).strip()
+def load_prompt_template(cfg: dict) -> str:
+    """llm.prompt_path 指向的提示词模板 缺失时用内置兜底模板"""
+    tmpl = _read_text(cfg["llm"].get("prompt_path") or "").strip()
     if not tmpl:
         # 内置兜底模板
-        tmpl = "你是日志模板生成器。仅输出 JSON 数组。每个对象包含 分类 推荐方案 匹配规则 典型日志 mod smod 出现次数。输入：{SAMPLES}"
+        tmpl = ("你是日志模板生成器。仅输出 JSON 数组。每个对象包含 分类 推荐方案 匹配规则 典型日志 mod smod 出现次数。"
+                "样本行首的 [×N] 表示该行代表 N 条相近日志 出现次数按 N 累计 匹配规则不含该标记；"
+                "{a|b|…} 表示该位置取值不同 匹配规则应写成可变部分。输入：\n{SAMPLES}")
+    return tmpl
+
+def build_prompt(cfg: dict, samples: List[str], tmpl: Optional[str] = None) -> Tuple[str, List[str]]:
+    """按提示词模板渲染 样本去重后最多取 max_prompt_samples 条；返回 (提示词, 实际使用的样本)"""
+    if tmpl is None:
+        tmpl = load_prompt_template(cfg)
 
     # 采样与去重
     uniq = []
@@ -85,29 +72,223 @@ def call_llm(cfg: dict, samples: List[str]) -> List[Dict]:
         seen.add(s); uniq.append(s)
         if len(uniq) >= int(cfg["llm"].get("max_prompt_samples", 50)):
             break
+    return _render_prompt(tmpl, uniq), uniq
 
-    prompt = _render_prompt(tmpl, uniq)
+class LLMResult:
+    """单次请求（含重试）的结果 status 为 成功 / 失败"""
+    __slots__ = ("status", "items", "text", "http_status", "error", "attempts", "latency_ms", "prompt_tokens", "completion_tokens", "cache_hit")
 
-    api_base = cfg["llm"].get("api_base", "https://api.openai.com/v1")
-    model = cfg["llm"].get("model", "gpt-4o-mini")
-    timeout = int(cfg["llm"].get("timeout_sec", 60))
+    def __init__(self) -> None:
+        self.status = "失败"
+        self.items: List[Dict] = []
+        self.text = ""
+        self.http_status: Optional[int] = None
+        self.error: Optional[str] = None
+        self.attempts = 0
+        self.latency_ms = 0
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self.cache_hit = False
 
-    url = f"{api_base}/chat/completions"
-    headers = {"Authorization": f"Bearer {api_key}"}
-    data = {
-        "model": model,
-        "messages": [
+    @classmethod
+    def cached(cls, items: List[Dict]) -> "LLMResult":
+        """由 LLM_CACHE 命中构造 不发请求"""
+        res = cls()
+        res.status, res.items, res.text, res.attempts, res.cache_hit = "成功", items, json.dumps(items, ensure_ascii=False), 0, True
+        return res
+
+class _RateLimiter:
+    """令牌桶 各线程共享 rate<=0 不限速"""
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.tokens = float(self.burst)
+        self.t = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.t) * self.rate)
+                self.t = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# 可重试的 HTTP 状态：限流与服务端错误
+RETRY_STATUS = (408, 409, 429, 500, 502, 503, 504)
+
+class LLMClient:
+    """
+    OpenAI 兼容接口的并发客户端：每个线程一个 requests.Session 复用连接 可由线程池并发调用 complete
+    配置（均在 llm 下）：
+      concurrency: 并发请求数（连接池大小） 默认 4
+      rate_per_s: 每秒最多发起的请求数 0 不限
+      timeout_sec / timeout: 单次请求超时（秒）
+      retries / extra.retries: 失败后的重试次数
+      backoff_s / backoff_max_s: 重试退避的基数与上限 实际等待为 [0, min(上限, 基数*2^n)] 内的随机值（全抖动）
+    连接错误 超时 RETRY_STATUS 中的状态码会重试 429/503 带 Retry-After 时至少等待该秒数 其余 4xx 不重试
+    """
+
+    def __init__(self, cfg: dict) -> None:
+        # 惰性导入第三方，未安装也不影响主流程
+        import requests
+        from requests.adapters import HTTPAdapter
+        self._requests = requests
+        self._adapter_cls = HTTPAdapter
+        llm = cfg["llm"]
+        extra = llm.get("extra") or {}
+        self.model = llm.get("model", "gpt-4o-mini")
+        self.url = f"{llm.get('api_base', 'https://api.openai.com/v1').rstrip('/')}/chat/completions"
+        self.api_key = os.getenv(llm.get("api_key_env", "OPENAI_API_KEY"), "")
+        self.concurrency = max(1, int(llm.get("concurrency", 4)))
+        self.timeout = float(llm.get("timeout_sec", llm.get("timeout", 60)))
+        self.retries = max(0, int(llm.get("retries", extra.get("retries", 2))))
+        self.backoff = float(llm.get("backoff_s", 1.0))
+        self.backoff_max = float(llm.get("backoff_max_s", 30.0))
+        self.params = {"temperature": float(llm.get("temperature", 0.2))}
+        for k in ("max_tokens", "top_p"):
+            if llm.get(k) is not None:
+                self.params[k] = llm[k]
+        self.limiter = _RateLimiter(float(llm.get("rate_per_s", 0)), self.concurrency)
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def _session(self):
+        s = getattr(self._local, "session", None)
+        if s is None:
+            s = self._requests.Session()
+            ad = self._adapter_cls(pool_connections=1, pool_maxsize=self.concurrency)
+            s.mount("http://", ad); s.mount("https://", ad)
+            s.headers["Authorization"] = f"Bearer {self.api_key}"
+            self._local.session = s
+            with self._lock:
+                self._sessions.append(s)
+        return s
+
+    def _delay(self, attempt: int, retry_after: Optional[str]) -> float:
+        d = random.uniform(0, min(self.backoff_max, self.backoff * (2 ** attempt)))
+        try:
+            d = max(d, float(retry_after)) if retry_after else d
+        except ValueError:
+            pass
+        return d
+
+    def complete(self, prompt: str) -> LLMResult:
+        """发送一次聊天补全 按配置重试 不抛异常；latency_ms 含重试与退避的总耗时"""
+        res = LLMResult()
+        data = dict(self.params, model=self.model, messages=[
             {"role": "system", "content": "你是资深日志规则抽取专家。"},
             {"role": "user", "content": prompt}
-        ],
-        "temperature": 0.2
-    }
+        ])
+        t0 = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            res.attempts = attempt + 1
+            self.limiter.acquire()
+            retry_after = None
+            try:
+                resp = self._session().post(self.url, json=data, timeout=self.timeout)
+                res.http_status = resp.status_code
+                if resp.status_code >= 400:
+                    res.error = f"HTTP {resp.status_code}: {resp.text[:200]}"
+                    if resp.status_code not in RETRY_STATUS:
+                        break
+                    retry_after = resp.headers.get("Retry-After")
+                else:
+                    body = resp.json()
+                    usage = body.get("usage") or {}
+                    res.prompt_tokens = usage.get("prompt_tokens")
+                    res.completion_tokens = usage.get("completion_tokens")
+                    res.text = body["choices"][0]["message"]["content"] or ""
+                    arr = _extract_json_array(res.text)
+                    if arr is None:
+                        # 输出不是 JSON 数组 重试也多半相同 不再重试
+                        res.error = "输出中没有 JSON 数组"
+                        break
+                    res.items = [x for x in arr if isinstance(x, dict)]
+                    res.status, res.error = "成功", None
+                    break
+            except (self._requests.RequestException, ValueError, KeyError, IndexError, TypeError) as e:
+                res.error = f"{type(e).__name__}: {e}"
+            if attempt < self.retries:
+                time.sleep(self._delay(attempt, retry_after))
+        res.latency_ms = int((time.perf_counter() - t0) * 1000)
+        return res
 
-    try:
-        resp = requests.post(url, headers=headers, json=data, timeout=timeout)
-        resp.raise_for_status()
-        txt = resp.json()["choices"][0]["message"]["content"]
-        arr = _extract_json_array(txt)
-        return arr or []
-    except Exception:
+    def close(self) -> None:
+        with self._lock:
+            for s in self._sessions:
+                s.close()
+            self._sessions.clear()
+
+def call_llm(cfg: dict, samples: List[str], conn: Optional[sqlite3.Connection] = None) -> List[Dict]:
+    """
+    根据配置调用 LLM 并返回聚类后的条目列表 失败返回空列表（重试策略见 LLMClient）
+    样本先经 reducer 近重复归并 按 llm.prompt_token_budget 拆成若干提示词依次请求 结果合并返回
+    每个提示词发请求前先查 LLM_CACHE（llm.cache 缺省开启） 成功的结果写回缓存；conn 缺省打开 app.db_path
+    配置：
+      llm.enabled: bool
+      llm.api_base: OpenAI 兼容 API
+      llm.model: 模型名
+      llm.api_key_env: 环境变量名
+      llm.timeout_sec: 超时
+      llm.prompt_path: 提示词模板路径（包含 {SAMPLES} 占位符）
+    批量处理缓冲见 llm_tasks.drain_buffers
+    """
+    if not cfg.get("llm", {}).get("enabled", False):
         return []
+
+    tmpl = load_prompt_template(cfg)
+    counts: Dict[str, int] = {}
+    for s in samples:
+        s = (s or "").strip()
+        if s:
+            counts[s] = counts.get(s, 0) + 1
+    packs = plan_samples(cfg, counts.items(), tmpl)
+    if not cfg["llm"].get("reduce", True):
+        packs = packs[:1]  # 旧行为：只取前 max_prompt_samples 条
+    own = None
+    if conn is None and llm_cache.cache_enabled(cfg) and cfg.get("app", {}).get("db_path"):
+        own = conn = sqlite3.connect(cfg["app"]["db_path"])
+    client = None
+    try:
+        out: List[Dict] = []
+        for lines in packs:
+            prompt, used = build_prompt(cfg, lines, tmpl)
+            key = None
+            if conn is not None and llm_cache.cache_enabled(cfg):
+                tsha = llm_cache.template_sha(tmpl)
+                key = llm_cache.cache_key(cfg, tsha, used, prompt)
+                try:
+                    items = llm_cache.lookup(conn, key)
+                except sqlite3.OperationalError:
+                    items = key = None  # 旧库尚无 LLM_CACHE（需 init-db）
+                if items is not None:
+                    conn.commit()
+                    out += items
+                    continue
+            if client is None:
+                try:
+                    client = LLMClient(cfg)
+                except ImportError:
+                    return out
+                if not client.api_key:
+                    return out
+            res = client.complete(prompt)
+            if key is not None and res.status == "成功":
+                llm_cache.store(conn, key, cfg, tsha, res.items, len(used))
+                conn.commit()
+            out += res.items
+        return out
+    finally:
+        if client is not None:
+            client.close()
+        if own is not None:
+            own.close()
@@ -0,0 +1,116 @@
+# logsys/llm_cache.py
+"""
+LLM 聚类结果的持久缓存（LLM_CACHE 表 按内容寻址）：
+- 键为 sha256(模型, prompt_version, 提示词模板摘要, 样本集合)
+  样本集合缺省取 normalize_key_text 归一化后去重排序的结果：不同车辆 不同日期的同形未命中命中同一条
+  llm.cache_key: prompt 时改为整段渲染后的提示词（只有完全相同的样本才命中）
+- 值为 _extract_json_array 解析出的数组（JSON 文本） 记录命中次数与最近使用时间
+- 模板文件改动后摘要变化 旧条目自然不再命中 prune 时按当前摘要清除；也可按 prompt_version 显式失效
+- 淘汰：超过 llm.cache_max_age_days 未使用的删除 总大小超过 llm.cache_max_mb 时按最近使用时间从旧到新删除
+读写都在调用方连接上进行 由调用方提交
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from .key_extract import normalize_key_text
+
+__all__ = [
+    "cache_enabled",
+    "template_sha",
+    "cache_key",
+    "lookup",
+    "store",
+    "prune",
+    "invalidate",
+    "cache_stats",
+]
+
+
+def cache_enabled(cfg: dict) -> bool:
+    return bool(cfg.get("llm", {}).get("cache", True))
+
+
+def template_sha(tmpl: str) -> str:
+    return hashlib.sha256(tmpl.encode("utf-8")).hexdigest()
+
+
+def cache_key(cfg: dict, tmpl_sha: str, samples: List[str], prompt: str) -> str:
+    llm = cfg["llm"]
+    h = hashlib.sha256()
+    h.update(f"{llm.get('model', '')}\x1f{llm.get('prompt_version', '')}\x1f{tmpl_sha}\n".encode("utf-8"))
+    if llm.get("cache_key", "samples") == "prompt":
+        h.update(prompt.encode("utf-8"))
+    else:
+        h.update("\n".join(sorted({normalize_key_text(s) for s in samples})).encode("utf-8"))
+    return h.hexdigest()
+
+
+def lookup(conn: sqlite3.Connection, key: str) -> Optional[List[Dict]]:
+    """命中返回缓存的数组 并记一次命中"""
+    row = conn.execute("SELECT output_json FROM LLM_CACHE WHERE cache_key=?", (key,)).fetchone()
+    if row is None:
+        return None
+    conn.execute("UPDATE LLM_CACHE SET hit_count=hit_count+1, last_used_at=? WHERE cache_key=?",
+                 (datetime.utcnow().isoformat(), key))
+    return json.loads(row[0])
+
+
+def store(conn: sqlite3.Connection, key: str, cfg: dict, tmpl_sha: str, items: List[Dict], sample_count: int) -> None:
+    llm = cfg["llm"]
+    now = datetime.utcnow().isoformat()
+    out = json.dumps(items, ensure_ascii=False)
+    conn.execute(
+        "INSERT INTO LLM_CACHE(cache_key, model, prompt_version, template_sha, output_json, sample_count, "
+        "size_bytes, created_at, last_used_at, hit_count) VALUES(?,?,?,?,?,?,?,?,?,0) "
+        "ON CONFLICT(cache_key) DO UPDATE SET output_json=excluded.output_json, size_bytes=excluded.size_bytes, "
+        "last_used_at=excluded.last_used_at",
+        (key, llm.get("model"), llm.get("prompt_version"), tmpl_sha, out, sample_count, len(out.encode("utf-8")), now, now))
+
+
+def prune(
+    conn: sqlite3.Connection,
+    max_age_days: Optional[float] = None,
+    max_mb: Optional[float] = None,
+    keep_template_sha: Optional[str] = None,
+) -> int:
+    """
+    淘汰：keep_template_sha 给出时删除其他模板摘要的条目；超龄未使用的删除；
+    总大小超过 max_mb 时删除最久未使用的条目直到不超过；返回删除条数
+    """
+    n = 0
+    if keep_template_sha is not None:
+        n += conn.execute("DELETE FROM LLM_CACHE WHERE template_sha != ?", (keep_template_sha,)).rowcount
+    if max_age_days:
+        cut = (datetime.utcnow() - timedelta(days=float(max_age_days))).isoformat()
+        n += conn.execute("DELETE FROM LLM_CACHE WHERE last_used_at < ?", (cut,)).rowcount
+    if max_mb:
+        cap = int(float(max_mb) * (1 << 20))
+        total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM LLM_CACHE").fetchone()[0]
+        if total > cap:
+            drop, over = [], total - cap
+            for key, size in conn.execute("SELECT cache_key, size_bytes FROM LLM_CACHE ORDER BY last_used_at, created_at"):
+                if over <= 0:
+                    break
+                drop.append((key,))
+                over -= size or 0
+            conn.executemany("DELETE FROM LLM_CACHE WHERE cache_key=?", drop)
+            n += len(drop)
+    return n
+
+
+def invalidate(conn: sqlite3.Connection, prompt_version: Optional[str] = None) -> int:
+    """显式失效：给出 prompt_version 时只删该版本 否则清空；返回删除条数"""
+    if prompt_version is None:
+        return conn.execute("DELETE FROM LLM_CACHE").rowcount
+    return conn.execute("DELETE FROM LLM_CACHE WHERE prompt_version IS ?", (prompt_version,)).rowcount
+
+
+def cache_stats(conn: sqlite3.Connection) -> Dict[str, int]:
+    n, size, hits = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0), COALESCE(SUM(hit_count), 0) FROM LLM_CACHE").fetchone()
+    return {"entries": n, "bytes": size, "hits": hits}
@@ -0,0 +1,183 @@
+# logsys/llm_tasks.py
+"""
+缓冲批量聚类：把 BUFFER_GROUP 中积压的未命中样本并发提交 LLM 生成模板
+- 每个缓冲按首次出现顺序取不同的关键文本及出现次数 经 reducer 近重复归并为带次数的代表样本
+  再按 llm.prompt_token_budget 装箱切成若干 LLM_TASK 大缓冲也能并发（llm.reduce: false 时每 max_prompt_samples 条一个）
+- 提交前先查 LLM_CACHE：命中的任务不发请求 直接按缓存结果入库（LLM_TASK.cache_hit=1） 成功的请求结果写回缓存
+  结束时按 llm.cache_max_age_days / cache_max_mb 淘汰 并清除提示词模板已改动的旧条目
+- 请求由 LLMClient 在线程池中发出（连接复用 限速 超时 抖动退避重试）
+- 只有主线程写库：任务登记 结果回写 模板入库（TemplateManager 递增注册表版本）与 BUFFER_RESULT 各自一个事务
+- LLM_TASK 记录每个任务的 状态 尝试次数 HTTP 状态 耗时 token 用量 与是否命中缓存
+缓冲状态：收集中 → 已提交 → 已处理（全部任务成功）/ 失败（下次 drain 重新提交）
+"""
+
+from __future__ import annotations
+import json
+import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from . import llm_cache
+from .db import Database, write_transaction
+from .llm_adapter import LLMClient, LLMResult, build_prompt, load_prompt_template
+from .reducer import plan_samples
+from .template_mgr import TemplateManager
+
+__all__ = [
+    "pending_buffers",
+    "drain_buffers",
+]
+
+logger = logging.getLogger(__name__)
+
+
+def pending_buffers(db: Database, include_open: bool = False) -> List[int]:
+    """待提交的缓冲：达到阈值的 收集中 缓冲 与上次失败的缓冲；include_open 时不看阈值"""
+    rows = db.conn.execute(
+        "SELECT buffer_id FROM BUFFER_GROUP WHERE (status='收集中' AND (? OR current_size >= size_threshold)) "
+        "OR status='失败' ORDER BY buffer_id", (1 if include_open else 0,)).fetchall()
+    return [r[0] for r in rows]
+
+
+def _chunks(cfg: dict, db: Database, buffer_id: int, tmpl: str) -> List[List[str]]:
+    rows = db.conn.execute(
+        "SELECT key_text, COUNT(*) FROM BUFFER_ITEM WHERE buffer_id=? AND key_text IS NOT NULL AND key_text != '' "
+        "GROUP BY key_text ORDER BY MIN(item_id)", (buffer_id,)).fetchall()
+    return plan_samples(cfg, rows, tmpl)
+
+
+def _write_result(db: Database, mgr: TemplateManager, task_id: int, buffer_id: int, res: LLMResult,
+                  cache: Optional[Tuple] = None) -> int:
+    """回写一个任务 成功时模板入库并登记 BUFFER_RESULT；cache 为 (键, cfg, 模板摘要, 样本数) 时写回缓存；返回涉及的模板数"""
+    conn = db.conn
+    with write_transaction(conn):
+        conn.execute(
+            "UPDATE LLM_TASK SET finished_at=?, status=?, output_json=?, error=?, attempts=?, http_status=?, "
+            "latency_ms=?, prompt_tokens=?, completion_tokens=?, cache_hit=? WHERE llm_task_id=?",
+            (datetime.utcnow().isoformat(), res.status, res.text or None, res.error, res.attempts, res.http_status,
+             res.latency_ms, res.prompt_tokens, res.completion_tokens, 1 if res.cache_hit else 0, task_id))
+        if res.status != "成功":
+            return 0
+        if cache is not None and not res.cache_hit:
+            llm_cache.store(conn, cache[0], cache[1], cache[2], res.items, cache[3])
+        items = [it for it in res.items if (it.get("匹配规则", "") or "").strip()]
+        ids = mgr.upsert_from_llm(buffer_id, task_id, items)
+        conn.executemany(
+            "INSERT INTO BUFFER_RESULT(buffer_id, llm_task_id, template_id, occurrences, suggested_context) "
+            "VALUES(?,?,?,?,?)",
+            [(buffer_id, task_id, tid, _int(it.get("出现次数")),
+              json.dumps({"mod": it.get("mod", ""), "smod": it.get("smod", "")}, ensure_ascii=False))
+             for tid, it in zip(ids, items)])
+        return len(ids)
+
+
+def _int(v) -> Optional[int]:
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def drain_buffers(
+    cfg: dict,
+    db: Database,
+    buffer_ids: Optional[Iterable[int]] = None,
+    include_open: bool = False,
+    client: Optional[LLMClient] = None,
+) -> Dict[str, int]:
+    """
+    并发处理缓冲 buffer_ids 缺省为 pending_buffers(include_open)
+    并发数 限速 超时 重试见 LLMClient；在途任务数不超过 2*concurrency 提示词按需渲染
+    返回 {"buffers", "tasks", "ok", "failed", "cache_hits", "templates", "prompt_tokens", "completion_tokens"}
+    """
+    conn = db.conn
+    llm = cfg["llm"]
+    own = client is None
+    client = client or LLMClient(cfg)
+    if not client.api_key:
+        raise RuntimeError(f"环境变量 {llm.get('api_key_env', 'OPENAI_API_KEY')} 未设置")
+    tmpl = load_prompt_template(cfg)
+    bids = list(buffer_ids) if buffer_ids is not None else pending_buffers(db, include_open)
+    stats = {"buffers": len(bids), "tasks": 0, "ok": 0, "failed": 0, "cache_hits": 0, "templates": 0,
+             "prompt_tokens": 0, "completion_tokens": 0}
+
+    # 登记全部任务 缓冲标记为已提交（pass1 之后的未命中会进入新的缓冲）
+    tasks: List[Tuple[int, int, List[str]]] = []
+    left: Dict[int, int] = {}
+    failed: Dict[int, bool] = {}
+    now = datetime.utcnow().isoformat()
+    with write_transaction(conn):
+        for bid in bids:
+            chunks = _chunks(cfg, db, bid, tmpl)
+            conn.execute("UPDATE BUFFER_GROUP SET status=? WHERE buffer_id=?", ("已提交" if chunks else "已处理", bid))
+            for keys in chunks:
+                cur = conn.execute(
+                    "INSERT INTO LLM_TASK(buffer_id, model, prompt_version, started_at, status, input_count) "
+                    "VALUES(?,?,?,?,?,?)", (bid, client.model, llm.get("prompt_version"), now, "运行中", len(keys)))
+                tasks.append((cur.lastrowid, bid, keys))
+            left[bid] = len(chunks)
+            failed[bid] = False
+    stats["tasks"] = len(tasks)
+
+    mgr = TemplateManager(db)
+    tsha = llm_cache.template_sha(tmpl)
+    use_cache = llm_cache.cache_enabled(cfg)
+
+    def done(task_id: int, bid: int, res: LLMResult, cache: Optional[Tuple] = None) -> None:
+        stats["templates"] += _write_result(db, mgr, task_id, bid, res, cache)
+        stats["ok" if res.status == "成功" else "failed"] += 1
+        stats["cache_hits"] += res.cache_hit
+        stats["prompt_tokens"] += res.prompt_tokens or 0
+        stats["completion_tokens"] += res.completion_tokens or 0
+        if res.status != "成功":
+            failed[bid] = True
+            logger.warning("LLM 任务 %s（缓冲 %s）失败：%s", task_id, bid, res.error)
+        left[bid] -= 1
+        if not left[bid]:
+            with write_transaction(conn):
+                conn.execute("UPDATE BUFFER_GROUP SET status=? WHERE buffer_id=?",
+                             ("失败" if failed[bid] else "已处理", bid))
+
+    try:
+        with ThreadPoolExecutor(max_workers=client.concurrency) as ex:
+            inflight: Dict[Future, Tuple] = {}
+            it = iter(tasks)
+            while True:
+                for task_id, bid, keys in it:
+                    prompt, used = build_prompt(cfg, keys, tmpl)
+                    cache = None
+                    if use_cache:
+                        key = llm_cache.cache_key(cfg, tsha, used, prompt)
+                        items = llm_cache.lookup(conn, key)
+                        if items is not None:
+                            done(task_id, bid, LLMResult.cached(items))
+                            continue
+                        cache = (key, cfg, tsha, len(used))
+                    inflight[ex.submit(client.complete, prompt)] = (task_id, bid, cache)
+                    if len(inflight) >= 2 * client.concurrency:
+                        break
+                if not inflight:
+                    break
+                finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for f in finished:
+                    task_id, bid, cache = inflight.pop(f)
+                    done(task_id, bid, f.result(), cache)
+    except BaseException:
+        # 中断时未回写的任务与缓冲标记失败 下次 drain 重新提交
+        with write_transaction(conn):
+            conn.executemany("UPDATE LLM_TASK SET status='失败', error='中断' WHERE llm_task_id=? AND status='运行中'",
+                             [(t[0],) for t in tasks])
+            conn.executemany("UPDATE BUFFER_GROUP SET status='失败' WHERE buffer_id=? AND status='已提交'",
+                             [(b,) for b in bids])
+        raise
+    finally:
+        if own:
+            client.close()
+    if use_cache:
+        with write_transaction(conn):
+            llm_cache.prune(conn, llm.get("cache_max_age_days"), llm.get("cache_max_mb"), keep_template_sha=tsha)
+    logger.info("LLM 缓冲 %d 个 任务 %d 成功 %d 失败 %d 缓存命中 %d 模板 %d tokens %d/%d", stats["buffers"], stats["tasks"],
+                stats["ok"], stats["failed"], stats["cache_hits"], stats["templates"], stats["prompt_tokens"],
+                stats["completion_tokens"])
+    return stats
@@ -1,27 +1,124 @@
 # -*- coding: utf-8 -*-
-import argparse, os
+import argparse, logging, os
 from .config import load_config
-from .db import Database
-from .ddl_sql import ALL_TABLE_DDL
+from .db import Database, ensure_column
+from .ddl_sql import ALL_TABLE_DDL, ALTER_COLUMNS
 from .pass1 import run_pass1
 from .pass2 import run_pass2
 from .summary_agg import merge_to_summary
+from . import reporting
+from .archive import ArchiveReader, archive_runs
+from .unmatched_store import key_records, read_record
+from .batch import expand_inputs, run_pass1_batch, run_pass2_batch
+from .process import run_process, resolve_run
+from .follow import run_follow
+from .llm_tasks import drain_buffers
+from .miner import mine_buffers
+from . import llm_cache
+from .llm_adapter import load_prompt_template
 def init_db(db: Database):
     for ddl in ALL_TABLE_DDL:
         db.execute_script(ddl)
+    for table, col, typ in ALTER_COLUMNS:
+        ensure_column(db.conn, table, col, typ)
+    db.commit()
+def merge_after(cfg: dict, db: Database):
+    """app.merge_summary 开启时 每个文件（批量时每批）处理完即增量合并 SUMMARY"""
+    if cfg['app'].get('merge_summary', False): merge_to_summary(db)
 def main():
     p=argparse.ArgumentParser(description='日志规则演进 与 统计管线')
     p.add_argument('--config', required=True)
+    p.add_argument('--log-level', default='INFO', help='日志级别 如 DEBUG INFO WARNING')
     sub=p.add_subparsers(dest='cmd', required=True)
     sub.add_parser('init-db')
-    s1=sub.add_parser('pass1'); s1.add_argument('--file', required=True)
-    s2=sub.add_parser('pass2'); s2.add_argument('--file', required=True)
-    sub.add_parser('merge-summary')
+    s1=sub.add_parser('pass1'); s1.add_argument('--file', required=True, nargs='+', help='文件 目录 glob 或 @清单'); s1.add_argument('--workers', type=int, default=1, help='文件级并行进程数')
+    s2=sub.add_parser('pass2'); s2.add_argument('--file', required=True, nargs='+', help='文件 目录 glob 或 @清单'); s2.add_argument('--workers', type=int, default=1, help='并行进程数 单文件时按分片 多文件时按文件'); s2.add_argument('--resume', action='store_true', help='从失败 run 的断点续跑'); s2.add_argument('--force', action='store_true', help='内容已入库也重新处理')
+    s3=sub.add_parser('process', help='单次解压 同时完成 pass1 与 pass2'); s3.add_argument('--file', required=True, nargs='+', help='文件 目录 glob 或 @清单'); s3.add_argument('--force', action='store_true', help='内容已入库也重新处理')
+    s4=sub.add_parser('resolve', help='新模板落库后 重新匹配 run 的未命中记录'); s4.add_argument('--run', required=True, nargs='+', type=int, help='RUN_SESSION.run_id')
+    s5=sub.add_parser('follow', help='跟随增长中的纯文本日志或标准输入 增量更新统计'); s5.add_argument('--file', required=True, help='纯文本日志路径 - 为标准输入'); s5.add_argument('--latency', type=float, default=None, help='统计可见延迟上限（秒） 缺省取 app.follow_latency_s'); s5.add_argument('--from-end', action='store_true', help='跳过已有内容 只处理新追加的行'); s5.add_argument('--idle-exit', type=float, default=None, help='连续若干秒无新数据后退出')
+    s6=sub.add_parser('llm-drain', help='把积压的缓冲并发提交 LLM 生成模板'); s6.add_argument('--buffer', nargs='+', type=int, default=None, help='BUFFER_GROUP.buffer_id 缺省为达到阈值或上次失败的缓冲'); s6.add_argument('--all', action='store_true', help='未达阈值的收集中缓冲也提交'); s6.add_argument('--concurrency', type=int, default=None, help='并发请求数 缺省取 llm.concurrency')
+    s7=sub.add_parser('llm-cache', help='LLM 结果缓存 统计 淘汰 失效'); s7.add_argument('--prune', action='store_true', help='按 llm.cache_max_age_days cache_max_mb 淘汰 并清除提示词模板已改动的条目'); s7.add_argument('--clear', action='store_true', help='清空缓存 配合 --prompt-version 只清该版本'); s7.add_argument('--prompt-version', default=None)
+    s8=sub.add_parser('mine', help='本地 Drain 式挖掘缓冲中的未命中 生成模板（不依赖 LLM）'); s8.add_argument('--buffer', nargs='+', type=int, default=None, help='BUFFER_GROUP.buffer_id 缺省为达到阈值或上次失败的缓冲'); s8.add_argument('--all', action='store_true', help='未达阈值的收集中缓冲也处理')
+    s9=sub.add_parser('merge-summary', help='把上次合并以来有变化的模板并入 SUMMARY 表'); s9.add_argument('--full', action='store_true', help='全部模板重新合并')
+    s10=sub.add_parser('report', help='按跨 run 汇总表查询：时间范围内前 k 个模板 趋势 两个 run 的差异'); s10.add_argument('--start', help='起始时间（含） ISO 或日期'); s10.add_argument('--end', help='结束时间（不含）'); s10.add_argument('--mod', default=None); s10.add_argument('--template', type=int, default=None, help='--trend 时只看该模板'); s10.add_argument('--top', type=int, default=20); s10.add_argument('--trend', action='store_true', help='输出趋势而非前 k 个模板'); s10.add_argument('--gran', default=None, help='前 k 缺省按天 趋势缺省按小时'); s10.add_argument('--diff', nargs=2, type=int, default=None, metavar=('RUN_A','RUN_B'), help='两个 run 按模板的命中行数差异'); s10.add_argument('--rebuild', action='store_true', help='从 KEY_TIME_BUCKET LOG_MATCH_SUMMARY 重建汇总表'); s10.add_argument('--archive', action='store_true', help='从 app.archive_dir 的列式归档查询（按明细桶 --gran 可为任一分桶粒度）')
+    s11=sub.add_parser('archive', help='把已结束 run 的 KEY_TIME_BUCKET LOG_MATCH_SUMMARY 按天归档为列式文件'); s11.add_argument('--run', nargs='+', type=int, default=None, help='RUN_SESSION.run_id 缺省为尚未归档的全部已结束 run'); s11.add_argument('--purge', action='store_true', help='归档后从库中删除这些 run 的明细')
+    s12=sub.add_parser('unmatched', help='查看 run 的未命中：按行数列出关键文本 或取回原始行'); s12.add_argument('--run', required=True, type=int); s12.add_argument('--top', type=int, default=20); s12.add_argument('--key', default=None, help='归一化关键文本 输出其原始行'); s12.add_argument('--mod', default=None); s12.add_argument('--smod', default=None); s12.add_argument('--limit', type=int, default=100, help='--key 时最多输出的行数'); s12.add_argument('--seq', nargs='+', type=int, default=None, help='按溢出文件行序号取回原始行')
     a=p.parse_args(); cfg=load_config(a.config)
+    logging.basicConfig(level=getattr(logging, a.log_level.upper(), logging.INFO), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
     os.makedirs(cfg['app']['unmatched_dir'], exist_ok=True)
     db=Database(cfg['app']['db_path'])
     if a.cmd=='init-db': init_db(db); print('数据库初始化完成。'); return
-    if a.cmd=='pass1': run_pass1(cfg, db, a.file); print('Pass1 完成。'); return
-    if a.cmd=='pass2': run_pass2(cfg, db, a.file); print('Pass2 完成。'); return
-    if a.cmd=='merge-summary': merge_to_summary(db); print('SUMMARY 合并完成。'); return
+    files=expand_inputs(a.file) if a.cmd in ('pass1','pass2','process') else []
+    single=bool(files) and len(a.file)==1 and files==a.file
+    if a.cmd=='pass1':
+        if single: run_pass1(cfg, db, files[0]); merge_after(cfg, db); print('Pass1 完成。'); return
+        st=run_pass1_batch(cfg, db, files, workers=a.workers); merge_after(cfg, db); print(f"Pass1 完成：{st['ok']}/{st['files']} 个文件 失败 {st['failed']}。"); return
+    if a.cmd=='pass2':
+        if single:
+            rid=run_pass2(cfg, db, files[0], workers=a.workers, resume=a.resume, force=a.force); db.commit(); merge_after(cfg, db)
+            print('Pass2 完成。' if rid is not None else 'Pass2 跳过：该文件内容已入库。'); return
+        st=run_pass2_batch(cfg, db, files, workers=a.workers, resume=a.resume, force=a.force); db.commit(); merge_after(cfg, db); print(f"Pass2 完成：{st['ok']}/{st['files']} 个文件 失败 {st['failed']} 跳过 {st['skipped']}。"); return
+    if a.cmd=='process':
+        done=0
+        for f in files:
+            done+=run_process(cfg, db, f, force=a.force) is not None; merge_after(cfg, db)
+        print(f'Process 完成：{done}/{len(files)} 个文件 跳过 {len(files)-done}。'); return
+    if a.cmd=='resolve':
+        for rid in a.run:
+            n,left=resolve_run(cfg, db, rid); print(f'run {rid}: 补入 {n} 行 剩余未命中 {left} 行。')
+        return
+    if a.cmd=='follow':
+        st=run_follow(cfg, db, a.file, latency=a.latency, from_end=a.from_end, idle_exit=a.idle_exit)
+        print(f"Follow 结束：run {st['run_id']} 记录 {st['records']} 命中 {st['matched']}。"); return
+    fallback=cfg.get('miner', {}).get('fallback', True)
+    if a.cmd=='mine' or (a.cmd=='llm-drain' and not cfg['llm'].get('enabled', False) and fallback):
+        st=mine_buffers(cfg, db, a.buffer, include_open=a.all)
+        print(f"本地挖掘完成：缓冲 {st['buffers']} 行 {st['lines']} 模板 {st['templates']} 耗时 {st['sec']:.2f}s。"); return
+    if a.cmd=='llm-drain':
+        if not cfg['llm'].get('enabled', False): print('llm.enabled 未开启。'); return
+        if a.concurrency: cfg['llm']['concurrency']=a.concurrency
+        st=drain_buffers(cfg, db, a.buffer, include_open=a.all)
+        print(f"LLM 完成：缓冲 {st['buffers']} 任务 {st['ok']}/{st['tasks']} 失败 {st['failed']} 缓存命中 {st['cache_hits']} 模板 {st['templates']}。")
+        if st['failed'] and fallback:
+            # 接口不可用：失败的缓冲先本地挖掘兜底 状态仍为失败 下次 llm-drain 再提交
+            bids=[r[0] for r in db.conn.execute("SELECT buffer_id FROM BUFFER_GROUP WHERE status='失败'") if a.buffer is None or r[0] in a.buffer]
+            st=mine_buffers(cfg, db, bids, mark_done=False)
+            print(f"本地挖掘兜底：缓冲 {st['buffers']} 行 {st['lines']} 模板 {st['templates']}。")
+        return
+    if a.cmd=='llm-cache':
+        n=0
+        if a.clear: n+=llm_cache.invalidate(db.conn, a.prompt_version)
+        if a.prune: n+=llm_cache.prune(db.conn, cfg['llm'].get('cache_max_age_days'), cfg['llm'].get('cache_max_mb'), keep_template_sha=llm_cache.template_sha(load_prompt_template(cfg)))
+        db.commit(); st=llm_cache.cache_stats(db.conn)
+        print(f"LLM 缓存：删除 {n} 条 剩余 {st['entries']} 条 {st['bytes']/(1<<20):.1f} MiB 累计命中 {st['hits']}。"); return
+    if a.cmd=='unmatched':
+        if a.seq:
+            for q in a.seq:
+                r=read_record(db.conn, a.run, q); print(f'{q}\t{r.raw_log}' if r else f'{q}\t（无此行）')
+            return
+        if a.key is not None:
+            for r in key_records(db.conn, a.run, a.key, a.mod, a.smod, a.limit): print(f'{r.seq}\t{r.raw_log}')
+            return
+        for key,mod,smod,n,f,l in db.conn.execute("SELECT key_text, mod, smod, line_count, first_ts, last_ts FROM UNMATCHED_KEY WHERE run_id=? ORDER BY line_count DESC LIMIT ?", (a.run, a.top)):
+            print(f'{n}\t{mod}\t{smod}\t{f}\t{l}\t{key}')
+        return
+    if a.cmd=='archive':
+        st=archive_runs(cfg, db, a.run, a.purge)
+        print(f"归档完成：run {st['runs']} 桶 {st['buckets']} 行 汇总 {st['summary']} 行 {st['bytes']/(1<<20):.1f} MiB。"); return
+    if a.cmd=='report':
+        q=ArchiveReader(cfg['app'].get('archive_dir', './archive')) if a.archive else None
+        if q is None and a.gran not in (None, 'hour', 'day'): p.error('汇总表只支持 --gran hour / day')
+        if a.rebuild:
+            st=reporting.rebuild_rollups(db); print('汇总表重建完成：'+' '.join(f'{k} {v}' for k,v in st.items())+'。'); return
+        if a.diff:
+            for tid,x,y,d in (q.run_diff(a.diff[0], a.diff[1], a.mod, a.top) if q else reporting.run_diff(db, a.diff[0], a.diff[1], a.mod, a.top)): print(f'{tid}\t{x}\t{y}\t{d:+d}')
+            return
+        if not (a.start and a.end): p.error('report 需要 --start 与 --end（或 --diff / --rebuild）')
+        if a.trend:
+            for b,n in (q.trend(a.start, a.end, a.template, a.mod, a.gran or 'hour') if q else reporting.trend(db, a.start, a.end, a.template, a.mod, a.gran or 'hour')): print(f'{b}\t{n}')
+            return
+        for tid,n in (q.top_templates(a.start, a.end, a.mod, a.top, a.gran or 'day') if q else reporting.top_templates(db, a.start, a.end, a.mod, a.top, a.gran or 'day')): print(f'{tid}\t{n}')
+        return
+    if a.cmd=='merge-summary':
+        st=merge_to_summary(db, full=a.full); print(f"SUMMARY 合并完成：模板 {st['templates']} 适用上下文 {st['contexts']}。"); return
 if __name__=='__main__': main()
@@ -0,0 +1,270 @@
+# logsys/match_cache.py
+"""
+归一化关键文本 → 匹配结果 的 LRU 缓存：
+- 键为 key_extract.normalize_key_text 的结果 命中与未命中均缓存
+- 模板集合版本戳变化时整体失效
+- 归一化只替换整词形态的数字 十六进制 长 ID 占位；模板若能“看见”这些词的内容
+  （如字面量数字 计数型重复 \\B 反向引用等）则判定为不安全 缓存命中时仍对其逐条复核
+"""
+
+from __future__ import annotations
+import unicodedata
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+    from re import _constants as sre_constants
+except ImportError:  # pragma: no cover
+    import sre_parse  # type: ignore
+    import sre_constants  # type: ignore
+
+__all__ = [
+    "PLACEHOLDERS",
+    "placeholder_safe",
+    "MatchCache",
+]
+
+# normalize_key_text 产生的占位符；原文自带占位符时键有歧义 不走缓存
+PLACEHOLDERS = ("<NUM>", "<HEX>", "<ID>")
+
+# 被归一化掉的整词可能包含的字符代表：数字（含全角与阿拉伯数字）与十六进制字符
+_V_NUM = tuple("0123456789") + ("٣", "５")
+_V_HEX = _V_NUM + tuple("abcdefABCDEFx")
+
+_C = sre_constants
+_SINGLE = (_C.LITERAL, _C.NOT_LITERAL, _C.IN, _C.ANY)
+_REPEATS = tuple(
+    op for op in (_C.MAX_REPEAT, _C.MIN_REPEAT, getattr(_C, "POSSESSIVE_REPEAT", None))
+    if op is not None
+)
+_ATOMIC = getattr(_C, "ATOMIC_GROUP", None)
+_SCOPED_OK = _C.SRE_FLAG_MULTILINE | _C.SRE_FLAG_DOTALL | _C.SRE_FLAG_VERBOSE
+
+
+class _Unsafe(Exception):
+    pass
+
+
+def _is_word(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+def _category(cat, ch: str, ascii_only: bool) -> bool:
+    if ascii_only and not ch.isascii():
+        digit = word = False
+    else:
+        digit = unicodedata.category(ch) == "Nd"
+        word = _is_word(ch)
+    space = ch.isspace()
+    table = {
+        _C.CATEGORY_DIGIT: digit,
+        _C.CATEGORY_NOT_DIGIT: not digit,
+        _C.CATEGORY_SPACE: space,
+        _C.CATEGORY_NOT_SPACE: not space,
+        _C.CATEGORY_WORD: word,
+        _C.CATEGORY_NOT_WORD: not word,
+        _C.CATEGORY_LINEBREAK: ch == "\n",
+        _C.CATEGORY_NOT_LINEBREAK: ch != "\n",
+    }
+    if cat not in table:
+        raise _Unsafe()
+    return table[cat]
+
+
+def _accepts(op, av, ch: str, ascii_only: bool) -> bool:
+    """单字符元素是否接受字符 ch"""
+    code = ord(ch)
+    if op is _C.LITERAL:
+        return av == code
+    if op is _C.NOT_LITERAL:
+        return av != code
+    if op is _C.ANY:
+        return ch != "\n"
+    if op is _C.IN:
+        negate = False
+        hit = False
+        for iop, iav in av:
+            if iop is _C.NEGATE:
+                negate = True
+            elif iop is _C.LITERAL:
+                hit = hit or iav == code
+            elif iop is _C.RANGE:
+                hit = hit or iav[0] <= code <= iav[1]
+            elif iop is _C.CATEGORY:
+                hit = hit or _category(iav, ch, ascii_only)
+            else:
+                raise _Unsafe()
+        return hit != negate
+    raise _Unsafe()
+
+
+class _Ctx:
+    __slots__ = ("v", "hex_mode", "ascii_only")
+
+    def __init__(self, hex_mode: bool, ascii_only: bool) -> None:
+        self.v = _V_HEX if hex_mode else _V_NUM
+        self.hex_mode = hex_mode
+        self.ascii_only = ascii_only
+
+    def coverage(self, op, av) -> int:
+        """0 不接受任何可变字符 1 部分接受 2 全部接受"""
+        n = sum(1 for ch in self.v if _accepts(op, av, ch, self.ascii_only))
+        return 0 if n == 0 else (2 if n == len(self.v) else 1)
+
+    def in_v(self, ch: str) -> bool:
+        return ch in self.v or unicodedata.category(ch) == "Nd"
+
+
+def _check_run(run: str, ctx: _Ctx) -> None:
+    """字面量片段不得落在可被归一化的整词内"""
+    i, n = 0, len(run)
+    while i < n:
+        if not _is_word(run[i]):
+            i += 1
+            continue
+        j = i
+        while j < n and _is_word(run[j]):
+            j += 1
+        word = run[i:j]
+        if i > 0 and j < n:
+            # 片段内部的完整单词：只有本身就是数字或十六进制整词时才会被替换
+            if word.isdecimal() or (ctx.hex_mode and word[:2] == "0x" and len(word) > 2
+                                    and all(c in "0123456789abcdefABCDEF" for c in word[2:])):
+                raise _Unsafe()
+        elif all(ctx.in_v(c) for c in word):
+            # 片段边缘的残词可能是某个可变词的一部分
+            raise _Unsafe()
+        i = j
+
+
+def _walk(seq, ctx: _Ctx, pending: bool, strict: bool) -> bool:
+    """
+    顺序检查元素 返回新的 pending。
+    pending 表示自上一个“屏障”（不可能出现在可变词内的字符或 \\b）以来
+    已出现过一个至少消耗一字符的全接受重复 再出现一个即可能按长度区分可变词。
+    strict 时不允许任何元素消耗可变字符（用于断言与多次重复的子模式）。
+    """
+    run = []
+
+    def flush(p: bool) -> bool:
+        if run:
+            _check_run("".join(run), ctx)
+            run.clear()
+            return False  # 安全字面量片段必含非可变字符 视作屏障
+        return p
+
+    for op, av in seq:
+        if op is _C.LITERAL:
+            run.append(chr(av))
+            continue
+        pending = flush(pending)
+        if op is _C.AT:
+            if av is _C.AT_NON_BOUNDARY:
+                raise _Unsafe()
+            if av is _C.AT_BOUNDARY:
+                pending = False
+        elif op in (_C.NOT_LITERAL, _C.IN, _C.ANY):
+            if ctx.coverage(op, av) != 0:
+                raise _Unsafe()
+            pending = False
+        elif op in _REPEATS:
+            lo, hi, sub = av
+            if len(sub) == 1 and sub[0][0] in _SINGLE:
+                sop, sav = sub[0]
+                cov = ctx.coverage(sop, sav)
+                if cov == 0:
+                    if lo >= 1:
+                        pending = False
+                elif cov == 1 or strict or hi != _C.MAXREPEAT or lo >= 2:
+                    raise _Unsafe()
+                elif lo == 1:
+                    if pending:
+                        raise _Unsafe()
+                    pending = True
+            elif hi == 1:
+                after = _walk(sub, ctx, pending, strict)
+                pending = after or (pending if lo == 0 else False)
+            else:
+                _walk(sub, ctx, False, True)
+        elif op is _C.SUBPATTERN:
+            _, add_flags, _, sub = av
+            if add_flags & ~_SCOPED_OK:
+                raise _Unsafe()
+            pending = _walk(sub, ctx, pending, strict)
+        elif _ATOMIC is not None and op is _ATOMIC:
+            pending = _walk(av, ctx, pending, strict)
+        elif op is _C.BRANCH:
+            outs = [_walk(b, ctx, pending, strict) for b in av[1]]
+            pending = any(outs)
+        elif op in (_C.ASSERT, _C.ASSERT_NOT):
+            _walk(av[1], ctx, False, True)
+        else:
+            # 反向引用 条件分组等 无法保证
+            raise _Unsafe()
+    return flush(pending)
+
+
+def placeholder_safe(pattern: str) -> Tuple[bool, bool]:
+    """
+    判断模板在归一化等价的两条文本上是否必然得到相同匹配结果。
+    返回 (无 <HEX> 时安全, 含 <HEX> 时也安全)
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:  # noqa: BLE001
+        return False, False
+    flags = parsed.state.flags
+    if flags & (_C.SRE_FLAG_IGNORECASE | _C.SRE_FLAG_LOCALE):
+        return False, False
+    ascii_only = bool(flags & _C.SRE_FLAG_ASCII)
+    out = []
+    for hex_mode in (False, True):
+        try:
+            _walk(parsed, _Ctx(hex_mode, ascii_only), False, False)
+            out.append(True)
+        except (_Unsafe, RecursionError):
+            out.append(False)
+    return out[0], out[0] and out[1]
+
+
+class MatchCache:
+    """有界 LRU 缓存 按版本戳整体失效 统计命中率"""
+
+    _MISSING = object()
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = max(0, int(capacity))
+        self.version: Optional[Hashable] = None
+        self.hits = 0
+        self.lookups = 0
+        self._d: "OrderedDict[str, Optional[int]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._d)
+
+    def reset(self, version: Hashable) -> None:
+        if version != self.version:
+            self._d.clear()
+            self.version = version
+
+    def get(self, key: str) -> Tuple[bool, Optional[int]]:
+        self.lookups += 1
+        v = self._d.get(key, self._MISSING)
+        if v is self._MISSING:
+            return False, None
+        self._d.move_to_end(key)
+        self.hits += 1
+        return True, v  # type: ignore[return-value]
+
+    def put(self, key: str, value: Optional[int]) -> None:
+        if not self.capacity:
+            return
+        self._d[key] = value
+        self._d.move_to_end(key)
+        if len(self._d) > self.capacity:
+            self._d.popitem(last=False)
+
+    @property
+    def hit_ratio(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
@@ -1,29 +1,189 @@
 # -*- coding: utf-8 -*-
+import hashlib
 import re
-from typing import List, Dict, Optional
+import time
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
 # from db import Database
 from .db import Database
+from .match_cache import PLACEHOLDERS, MatchCache, placeholder_safe
+from .multimatch import MultiPatternMatcher
+from .prefilter import LiteralPrefilter, best_literal
+from .template_mgr import registry_version
+
+MAX_UNSAFE = 64  # 需逐条复核的不安全模板过多时 缓存得不偿失 直接走正则
+
+class _Tpl(NamedTuple):
+    """单个模板的编译结果 模式不合法时 regex 为 None"""
+    pattern: str
+    version: int
+    sem: Optional[str]
+    regex: Optional["re.Pattern[str]"]
+    literal: Optional[str]
+    safe: Tuple[bool, bool]
+
+def _compile(pattern: str, version: int, sem: Optional[str]) -> _Tpl:
+    try:
+        cre = re.compile(pattern)
+    except re.error:
+        return _Tpl(pattern, version, sem, None, None, (False, False))
+    return _Tpl(pattern, version, sem, cre, best_literal(pattern), placeholder_safe(pattern))
+
+class _Snapshot:
+    """
+    一次加载的完整匹配状态 构建完成后只读；刷新时整体替换 匹配中的调用始终看到同一份
+    version 为模板集合内容的版本戳（缓存按它失效） registry 为对应的注册表版本
+    """
+    __slots__ = ("version", "registry", "tpls", "engine", "prefilter", "unsafe", "unsafe_sets")
+
+    def __init__(self, tpls: Dict[int, _Tpl], registry: int, reuse: Optional[MultiPatternMatcher] = None):
+        ids = sorted(tpls)
+        h = hashlib.sha1()
+        for tid in ids:
+            t = tpls[tid]
+            h.update(f"{tid}:{t.version}:{t.pattern}\n".encode("utf-8"))
+        self.version = h.hexdigest()
+        self.registry = registry
+        self.tpls = tpls
+        live = [tid for tid in ids if tpls[tid].regex is not None]
+        # 内容未变的批沿用 reuse 中已编译的交替正则
+        self.engine = MultiPatternMatcher(((tid, tpls[tid].regex) for tid in live), reuse=reuse)
+        self.prefilter = LiteralPrefilter((tid, tpls[tid].literal) for tid in live)
+        # 两种归一化形态下的不安全模板 rank：(不含 <HEX>, 含 <HEX>)
+        un, uh = [], []
+        for rank, tid in enumerate(self.engine.ids):
+            safe_num, safe_hex = tpls[tid].safe
+            if not safe_num: un.append(rank)
+            if not safe_hex: uh.append(rank)
+        self.unsafe: Tuple[List[int], List[int]] = (un, uh)
+        self.unsafe_sets: Tuple[Set[int], Set[int]] = (set(un), set(uh))
 
 class TemplateMatcher:
-    """正则模板匹配器"""
+    """
+    正则模板匹配器 必需字面量预筛出候选 再由批量匹配引擎按 template_id 顺序取第一个命中
+    cache_size>0 时按归一化关键文本缓存结果 对归一化敏感的模板在命中缓存后逐条复核
+    长时间运行时调用 refresh / maybe_refresh：注册表版本变化才增量加载变化的模板 新快照建好后一次性替换
+    poll_s 为 maybe_refresh 的最短轮询间隔 <=0 时不轮询
+    """
 
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, cache_size: int = 0, poll_s: float = 5.0):
         self.db = db
-        self._compiled = []  # list of dict pattern re template_id semantic_info
+        self.poll_s = float(poll_s)
+        self._snap: Optional[_Snapshot] = None
+        self._cache: Optional[MatchCache] = MatchCache(cache_size) if cache_size > 0 else None
+        self._polled = 0.0
 
     def load_templates(self):
-        rows = self.db.query("SELECT template_id, pattern, semantic_info FROM REGEX_TEMPLATE WHERE is_active=1")
-        self._compiled = []
+        """全量加载：先取注册表版本再读模板 其间的变更下次 refresh 会再取一次"""
+        reg = registry_version(self.db.conn)
+        rows = self.db.query("SELECT template_id, pattern, semantic_info, version FROM REGEX_TEMPLATE WHERE is_active=1 ORDER BY template_id")
+        tpls = {r["template_id"]: _compile(r["pattern"], r["version"], r["semantic_info"]) for r in rows}
+        self._install(_Snapshot(tpls, reg))
+
+    def refresh(self) -> bool:
+        """
+        注册表版本变化时 只取 registry_version 更新的模板（含已停用的）重编译 其余沿用当前快照
+        返回是否换了新快照；未曾加载时做全量加载
+        只对经 TemplateManager 的变更可见 直接改表的变更需 load_templates
+        """
+        old = self._snap
+        self._polled = time.monotonic()
+        if old is None:
+            self.load_templates()
+            return True
+        reg = registry_version(self.db.conn)
+        if reg == old.registry:
+            return False
+        rows = self.db.query("SELECT template_id, pattern, semantic_info, version, is_active FROM REGEX_TEMPLATE WHERE registry_version>?", (old.registry,))
+        tpls = dict(old.tpls)
         for r in rows:
-            try:
-                cre = re.compile(r["pattern"])
-                self._compiled.append({"id": r["template_id"], "re": cre, "sem": r["semantic_info"]})
-            except re.error:
-                # 模式不合法 跳过或告警
+            tid = r["template_id"]
+            if not r["is_active"]:
+                tpls.pop(tid, None)
                 continue
+            t = old.tpls.get(tid)
+            if t is not None and t.pattern == r["pattern"]:
+                tpls[tid] = t._replace(version=r["version"], sem=r["semantic_info"])
+            else:
+                tpls[tid] = _compile(r["pattern"], r["version"], r["semantic_info"])
+        self._install(_Snapshot(tpls, reg, reuse=old.engine))
+        return True
+
+    def maybe_refresh(self) -> bool:
+        """距上次轮询超过 poll_s 才查注册表版本 可在热循环中逐块调用"""
+        if self.poll_s <= 0 or time.monotonic() - self._polled < self.poll_s:
+            return False
+        return self.refresh()
+
+    def _install(self, snap: _Snapshot) -> None:
+        self._snap = snap
+        self._polled = time.monotonic()
+        if self._cache is not None:
+            self._cache.reset(snap.version)
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._snap.version if self._snap is not None else None
+
+    @property
+    def registry_version(self) -> Optional[int]:
+        return self._snap.registry if self._snap is not None else None
+
+    @property
+    def cache_enabled(self) -> bool:
+        st = self._snap
+        return self._cache is not None and st is not None and len(st.unsafe[0]) <= MAX_UNSAFE
+
+    @property
+    def cache_hit_ratio(self) -> Optional[float]:
+        return self._cache.hit_ratio if self._cache is not None and self._cache.lookups else None
+
+    def cache_stats(self) -> Tuple[int, int]:
+        """(命中数, 查询数) 供分片 worker 汇总"""
+        if self._cache is None:
+            return 0, 0
+        return self._cache.hits, self._cache.lookups
+
+    @staticmethod
+    def _match(st: _Snapshot, key_text: str) -> Optional[int]:
+        return st.engine.match(key_text, st.prefilter.candidates(key_text))
+
+    def _verify(self, st: _Snapshot, key_text: str, tid: Optional[int], mode: int) -> Optional[int]:
+        """缓存命中后复核：排在 tid 之前的不安全模板 以及 tid 本身不安全时重跑"""
+        eng = st.engine
+        limit = eng.rank[tid] if tid is not None else len(eng)
+        for r in st.unsafe[mode]:
+            if r >= limit:
+                break
+            if eng.regexes[r].search(key_text):
+                return eng.ids[r]
+        if tid is None or limit not in st.unsafe_sets[mode]:
+            return tid
+        if eng.regexes[limit].search(key_text):
+            return tid
+        return self._match(st, key_text)
+
+    def _lookup(self, st: _Snapshot, key_text: str, norm_key: Optional[str]) -> Optional[int]:
+        cache = self._cache
+        # 缓存版本与本次快照不一致（刷新交替之际）时不读写缓存
+        if norm_key is None or cache is None or cache.version != st.version or any(p in key_text for p in PLACEHOLDERS):
+            return self._match(st, key_text)
+        mode = 1 if "<HEX>" in norm_key else 0
+        if len(st.unsafe[mode]) > MAX_UNSAFE:
+            return self._match(st, key_text)
+        found, tid = cache.get(norm_key)
+        if found:
+            return self._verify(st, key_text, tid, mode)
+        tid = self._match(st, key_text)
+        if cache.version == st.version:
+            cache.put(norm_key, tid)
+        return tid
 
-    def match_text(self, key_text: str) -> Optional[Dict]:
-        for it in self._compiled:
-            if it["re"].search(key_text):
-                return {"template_id": it["id"], "semantic_info": it["sem"]}
-        return None
+    def match_text(self, key_text: str, norm_key: Optional[str] = None) -> Optional[Dict]:
+        """norm_key 为 normalize_key_text(key_text) 传入时启用结果缓存"""
+        st = self._snap
+        if st is None:
+            return None
+        tid = self._lookup(st, key_text, norm_key)
+        if tid is None:
+            return None
+        return {"template_id": tid, "semantic_info": st.tpls[tid].sem}
@@ -0,0 +1,190 @@
+# logsys/miner.py
+"""
+本地模板挖掘（Drain 式固定深度解析树） LLM 关闭或不可用时为缓冲中的未命中生成正则模板：
+- 关键文本先屏蔽 0x 十六进制 与 所有数字串（含词内的 如 seg_12 → seg_<NUM>） 再按空白切词
+  （比 normalize_key_text 只屏蔽独立数字更粗 同一事件的屏蔽结果更少 两次 C 层替换也更快）
+- 树：词数 → 前 depth 个词（含数字或占位符的词记为 <*>；子节点超过 max_children 时并入 <*>） → 叶子上的模板簇
+- 叶内取相同位置非 <*> 词相同比例最高的簇 不低于 sim_th 时并入（不同的位置改成 <*>） 否则新建簇
+- 屏蔽后的文本有字典缓存 同形的行不再走树（日志事件的屏蔽形态很少 绝大多数行只做屏蔽与一次查表）
+- 导出：<*> → \\S+ 占位符 → \\d+ / 0x[0-9a-fA-F]+ 其余转义 词间 \\s+ 首尾锚定；没有字面词的模板丢弃
+mine_buffers 把缓冲交给同一个挖掘器 模板经 TemplateManager.upsert_from_llm 入库（REGEX_TEMPLATE.source='drain'）
+每个缓冲登记一个 model='drain' 的 LLM_TASK 与各模板的 BUFFER_RESULT
+"""
+
+from __future__ import annotations
+import json
+import logging
+import re
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from .db import Database, write_transaction
+from .llm_tasks import pending_buffers
+from .template_mgr import TemplateManager
+
+__all__ = [
+    "DrainMiner",
+    "mask",
+    "template_regex",
+    "mine_buffers",
+]
+
+logger = logging.getLogger(__name__)
+
+WILDCARD = "<*>"
+_HEX = re.compile(r"0x[0-9a-fA-F]+")
+_DIGITS = re.compile(r"\d+")
+_PLACEHOLDER = re.compile(r"<(?:NUM|HEX)>")
+_PLACEHOLDER_RX = {"<NUM>": r"\d+", "<HEX>": r"0x[0-9a-fA-F]+"}
+
+
+def mask(text: str) -> str:
+    return _DIGITS.sub("<NUM>", _HEX.sub("<HEX>", text))
+
+
+def template_regex(tokens: List[str]) -> str:
+    parts = []
+    for tok in tokens:
+        if tok == WILDCARD:
+            parts.append(r"\S+")
+            continue
+        pieces = _PLACEHOLDER.split(tok)
+        subs = _PLACEHOLDER.findall(tok)
+        rx = re.escape(pieces[0])
+        for ph, lit in zip(subs, pieces[1:]):
+            rx += _PLACEHOLDER_RX[ph] + re.escape(lit)
+        parts.append(rx)
+    return "^" + r"\s+".join(parts) + "$"
+
+
+class _Cluster:
+    __slots__ = ("tokens", "count", "sample", "by_buffer")
+
+    def __init__(self, tokens: List[str], sample: str) -> None:
+        self.tokens = tokens
+        self.count = 0
+        self.sample = sample
+        self.by_buffer: Dict[Optional[int], int] = {}
+
+
+class DrainMiner:
+    """在线挖掘器：add 逐条（或带次数）喂入关键文本 records 导出 upsert_from_llm 兼容的条目"""
+
+    def __init__(self, depth: int = 4, sim_th: float = 0.5, max_children: int = 100) -> None:
+        self.depth = max(1, depth - 2)      # 与 Drain 一致：总深度含根与词数两层
+        self.sim_th = sim_th
+        self.max_children = max_children
+        self.root: Dict[int, Dict] = {}
+        self.clusters: List[_Cluster] = []
+        self._by_shape: Dict[str, _Cluster] = {}
+
+    def add(self, text: str, count: int = 1, buffer_id: Optional[int] = None) -> _Cluster:
+        shape = _DIGITS.sub("<NUM>", _HEX.sub("<HEX>", text))
+        c = self._by_shape.get(shape)
+        if c is None:
+            c = self._by_shape[shape] = self._place(shape.split(), text)
+        c.count += count
+        c.by_buffer[buffer_id] = c.by_buffer.get(buffer_id, 0) + count
+        return c
+
+    def _place(self, toks: List[str], text: str) -> _Cluster:
+        node = self.root.setdefault(len(toks), {})
+        for tok in toks[:self.depth]:
+            key = WILDCARD if "<" in tok and _PLACEHOLDER.search(tok) else tok
+            nxt = node.get(key)
+            if nxt is None:
+                if len(node) >= self.max_children:
+                    key = WILDCARD
+                    nxt = node.get(key)
+                if nxt is None:
+                    nxt = node[key] = {}
+            node = nxt
+        leaf: List[_Cluster] = node.setdefault(None, [])
+        best, best_sim, best_params = None, -1.0, 0
+        for c in leaf:
+            same = params = 0
+            for a, b in zip(c.tokens, toks):
+                if a == WILDCARD:
+                    params += 1
+                elif a == b:
+                    same += 1
+            sim = same / len(toks) if toks else 1.0
+            if sim > best_sim or (sim == best_sim and params > best_params):
+                best, best_sim, best_params = c, sim, params
+        if best is not None and best_sim >= self.sim_th:
+            best.tokens = [a if a == b else WILDCARD for a, b in zip(best.tokens, toks)]
+            return best
+        c = _Cluster(list(toks), text)
+        leaf.append(c)
+        self.clusters.append(c)
+        return c
+
+    def records(self, buffer_id: Optional[int] = None, min_count: int = 1) -> List[Dict]:
+        """
+        导出模板条目（字段同 LLM 输出 同一正则的簇合并）；buffer_id 给出时 出现次数只计该缓冲 不含该缓冲的模板不导出
+        min_count 按全部缓冲的总次数判断
+        """
+        out: Dict[str, Dict] = {}
+        for c in self.clusters:
+            n = c.count if buffer_id is None else c.by_buffer.get(buffer_id, 0)
+            if not n or c.count < min_count or all(t == WILDCARD for t in c.tokens):
+                continue
+            pat = template_regex(c.tokens)
+            it = out.get(pat)
+            if it is None:
+                out[pat] = {"分类": "本地挖掘", "推荐方案": "", "匹配规则": pat, "典型日志": c.sample,
+                            "mod": "", "smod": "", "出现次数": n}
+            else:
+                it["出现次数"] += n
+        return list(out.values())
+
+
+def mine_buffers(
+    cfg: dict,
+    db: Database,
+    buffer_ids: Optional[Iterable[int]] = None,
+    include_open: bool = False,
+    mark_done: bool = True,
+) -> Dict[str, int]:
+    """
+    用同一个挖掘器处理缓冲 参数见配置 miner.depth / sim_th / max_children / min_count
+    mark_done 为 False 时（LLM 失败后的兜底）缓冲状态不变 下次 llm-drain 仍会提交 LLM
+    返回 {"buffers", "lines", "templates", "sec"}
+    """
+    conn = db.conn
+    mc = cfg.get("miner", {})
+    miner = DrainMiner(int(mc.get("depth", 4)), float(mc.get("sim_th", 0.5)), int(mc.get("max_children", 100)))
+    min_count = int(mc.get("min_count", 1))
+    bids = list(buffer_ids) if buffer_ids is not None else pending_buffers(db, include_open)
+    t0 = time.perf_counter()
+    lines: Dict[int, int] = {}
+    for bid in bids:
+        lines[bid] = 0
+        for text, n in conn.execute(
+                "SELECT key_text, COUNT(*) FROM BUFFER_ITEM WHERE buffer_id=? AND key_text IS NOT NULL AND key_text != '' "
+                "GROUP BY key_text ORDER BY MIN(item_id)", (bid,)):
+            miner.add(text, n, bid)
+            lines[bid] += n
+    sec = time.perf_counter() - t0
+
+    mgr = TemplateManager(db)
+    now = datetime.utcnow().isoformat()
+    with write_transaction(conn):
+        items = miner.records(min_count=min_count)
+        ids = dict(zip((it["匹配规则"] for it in items), mgr.upsert_from_llm(None, None, items, source="drain")))
+        for bid in bids:
+            per = [it for it in miner.records(bid, min_count) if it["匹配规则"] in ids]
+            tid = conn.execute(
+                "INSERT INTO LLM_TASK(buffer_id, model, prompt_version, started_at, finished_at, status, input_count, "
+                "output_json, attempts, latency_ms, cache_hit) VALUES(?,?,?,?,?,?,?,?,?,?,0)",
+                (bid, "drain", None, now, now, "成功", lines[bid], json.dumps(per, ensure_ascii=False), 0,
+                 int(sec * 1000))).lastrowid
+            conn.executemany(
+                "INSERT INTO BUFFER_RESULT(buffer_id, llm_task_id, template_id, occurrences, suggested_context) "
+                "VALUES(?,?,?,?,?)", [(bid, tid, ids[it["匹配规则"]], it["出现次数"], None) for it in per])
+            if mark_done:
+                conn.execute("UPDATE BUFFER_GROUP SET status='已处理' WHERE buffer_id=?", (bid,))
+    total = sum(lines.values())
+    logger.info("本地挖掘 缓冲 %d 个 %d 行 模板 %d 耗时 %.2fs", len(bids), total, len(ids), sec)
+    return {"buffers": len(bids), "lines": total, "templates": len(ids), "sec": sec}
@@ -0,0 +1,225 @@
+# logsys/multimatch.py
+"""
+多模板批量匹配引擎：
+- 按模板顺序把可拼接的模式切成若干批 每批编译为一个带命名标记组的交替正则
+- 批内再二分成子批 顶层命中后沿左侧子批下钻 保证返回顺序最靠前的命中模板
+- 含反向引用 命名组 全局内联标志 的模式无法安全拼接 单独编译并按原顺序穿插
+- 与逐条 search 的语义一致：返回第一个 search 成功的模板
+- 批按 template_id 区间（每 batch_size 个 id 一段）划分 标记组按批内相对位置命名
+  模板增删改只影响所在区间的批 重建时传入旧引擎 (template_id, 模式) 完全相同的批直接复用已编译的交替正则
+"""
+
+from __future__ import annotations
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+    from re import _constants as sre_constants
+except ImportError:  # pragma: no cover
+    import sre_parse  # type: ignore
+    import sre_constants  # type: ignore
+
+__all__ = [
+    "MultiPatternMatcher",
+    "DEFAULT_BATCH_SIZE",
+    "DEFAULT_LEAF_SIZE",
+]
+
+DEFAULT_BATCH_SIZE = 64   # 顶层批大小 过大反而拖慢交替分支
+DEFAULT_LEAF_SIZE = 8     # 子批不再二分时 退化为逐条 search
+DIRECT_CANDIDATES = 16    # 候选集不超过该值时 直接逐条匹配候选
+
+PatternLike = Union[str, "re.Pattern[str]"]
+
+
+def _iter_ops(parsed) -> Iterable[Tuple[object, object]]:
+    """深度优先遍历 sre 解析树 产出 (op, av)。"""
+    for op, av in parsed:
+        yield op, av
+        for sub in _iter_subpatterns(av):
+            yield from _iter_ops(sub)
+
+
+def _iter_subpatterns(av):
+    if isinstance(av, sre_parse.SubPattern):
+        yield av
+    elif isinstance(av, (list, tuple)):
+        for x in av:
+            yield from _iter_subpatterns(x)
+
+
+def _combinable(cre: "re.Pattern[str]") -> bool:
+    """判断模式能否安全拼入交替正则：无命名组 无全局标志 无反向引用。"""
+    if cre.groupindex:
+        return False
+    if cre.flags & ~re.UNICODE:
+        return False
+    try:
+        parsed = sre_parse.parse(cre.pattern)
+    except Exception:  # noqa: BLE001
+        return False
+    for op, _ in _iter_ops(parsed):
+        if op in (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS):
+            return False
+    return True
+
+
+class _Node:
+    """批内二分节点：覆盖批内相对下标 [lo, hi) 的交替正则。"""
+    __slots__ = ("lo", "hi", "rx", "left", "right")
+
+    def __init__(self, lo: int, hi: int, rx: "re.Pattern[str]") -> None:
+        self.lo = lo
+        self.hi = hi
+        self.rx = rx
+        self.left: Optional[_Node] = None
+        self.right: Optional[_Node] = None
+
+
+class _Segment:
+    """按顺序排列的匹配段：一个批（root）或一个单独编译的模式（solo）。"""
+    __slots__ = ("lo", "hi", "root", "ids")
+
+    def __init__(self, lo: int, hi: int, root: Optional[_Node], ids: frozenset) -> None:
+        self.lo = lo
+        self.hi = hi
+        self.root = root
+        self.ids = ids
+
+
+class MultiPatternMatcher:
+    """
+    一次加载 多模板集合匹配。
+    entries 为 (template_id, pattern) 序列 顺序即优先级
+    pattern 可为字符串或已编译正则 非法模式跳过
+    reuse 为同参数构建的旧引擎 内容未变的批沿用其编译结果
+    """
+
+    def __init__(
+        self,
+        entries: Iterable[Tuple[int, PatternLike]],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        leaf_size: int = DEFAULT_LEAF_SIZE,
+        reuse: Optional["MultiPatternMatcher"] = None,
+    ) -> None:
+        self.batch_size = max(1, int(batch_size))
+        self.leaf_size = max(1, int(leaf_size))
+        self.ids: List[int] = []
+        self.regexes: List["re.Pattern[str]"] = []
+        self.combinable: List[bool] = []
+        # 可拼接判定要解析语法树 模式未变时沿用旧引擎的结论
+        known = dict(zip((r.pattern for r in reuse.regexes), reuse.combinable)) if reuse is not None else {}
+        for tid, p in entries:
+            try:
+                cre = p if isinstance(p, re.Pattern) else re.compile(p)
+            except re.error:
+                continue
+            self.ids.append(int(tid))
+            self.regexes.append(cre)
+            ok = known.get(cre.pattern)
+            self.combinable.append(_combinable(cre) if ok is None else ok)
+        combinable = self.combinable
+        self.rank = {tid: i for i, tid in enumerate(self.ids)}
+        self.segments: List[_Segment] = []
+        # 批内容 → 批根节点 供下次重建复用
+        self._roots: Dict[Tuple, Optional[_Node]] = {}
+        old = reuse._roots if reuse is not None and (reuse.batch_size, reuse.leaf_size) == (
+            self.batch_size, self.leaf_size) else {}
+        i, n = 0, len(self.ids)
+        while i < n:
+            if not combinable[i]:
+                self.segments.append(_Segment(i, i + 1, None, frozenset((self.ids[i],))))
+                i += 1
+                continue
+            j = i
+            span = self.ids[i] // self.batch_size
+            while j < n and j - i < self.batch_size and combinable[j] and self.ids[j] // self.batch_size == span:
+                j += 1
+            key = tuple((self.ids[k], self.regexes[k].pattern) for k in range(i, j))
+            root = old[key] if key in old else self._build(i, 0, j - i)
+            self._roots[key] = root
+            if root is None:
+                # 拼接失败时整批退化为逐条
+                for k in range(i, j):
+                    self.segments.append(_Segment(k, k + 1, None, frozenset((self.ids[k],))))
+            else:
+                self.segments.append(_Segment(i, j, root, frozenset(self.ids[i:j])))
+            i = j
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _build(self, base: int, lo: int, hi: int) -> Optional[_Node]:
+        """批起点为 base 的 [lo, hi)（批内相对下标） 标记组名即相对下标"""
+        src = "|".join(f"(?:{self.regexes[base + k].pattern})(?P<_{k}>)" for k in range(lo, hi))
+        try:
+            node = _Node(lo, hi, re.compile(src))
+        except (re.error, RecursionError):
+            return None
+        if hi - lo > self.leaf_size:
+            mid = (lo + hi) // 2
+            node.left = self._build(base, lo, mid)
+            node.right = self._build(base, mid, hi)
+            if node.left is None or node.right is None:
+                node.left = node.right = None
+        return node
+
+    def _first_in(self, node: _Node, text: str, w: int, base: int) -> int:
+        """node 已知命中相对下标 w；返回 [node.lo, w] 中顺序最靠前的命中（绝对下标）。"""
+        while node.left is not None:
+            left = node.left
+            if w < left.hi:
+                node = left
+                continue
+            m = left.rx.search(text)
+            if m:
+                w = int(m.lastgroup[1:])
+                node = left
+            else:
+                node = node.right  # type: ignore[assignment]
+        for k in range(base + node.lo, base + w):
+            if self.regexes[k].search(text):
+                return k
+        return base + w
+
+    def _match_rank(self, text: str, seg: _Segment) -> Optional[int]:
+        if seg.root is None:
+            return seg.lo if self.regexes[seg.lo].search(text) else None
+        m = seg.root.rx.search(text)
+        if not m:
+            return None
+        return self._first_in(seg.root, text, int(m.lastgroup[1:]), seg.lo)
+
+    def match(self, text: str, candidates: Optional[Set[int]] = None) -> Optional[int]:
+        """
+        返回第一个命中的 template_id。
+        candidates 给定时只在候选内取第一个命中 语义同逐条遍历候选
+        """
+        if candidates is None:
+            for seg in self.segments:
+                r = self._match_rank(text, seg)
+                if r is not None:
+                    return self.ids[r]
+            return None
+        if not candidates:
+            return None
+        if len(candidates) <= DIRECT_CANDIDATES:
+            rank = self.rank
+            for r in sorted(rank[t] for t in candidates if t in rank):
+                if self.regexes[r].search(text):
+                    return self.ids[r]
+            return None
+        for seg in self.segments:
+            if candidates.isdisjoint(seg.ids):
+                continue
+            r = self._match_rank(text, seg)
+            if r is None:
+                continue
+            if self.ids[r] in candidates:
+                return self.ids[r]
+            # 批内首个命中不在候选中 继续按顺序检查其后的候选
+            for k in range(r + 1, seg.hi):
+                if self.ids[k] in candidates and self.regexes[k].search(text):
+                    return self.ids[k]
+        return None
@@ -4,6 +4,7 @@
 - 与 logsys.main 中的调用一致
 - db 既可为 Database 实例 也可为 sqlite3.Connection
 - 自包含 read_gz_lines 与 normalize_lines，避免 preprocess 依赖
+- 首次读取时顺带建立 gzip 访问点索引（gzindex） 供 pass2 分段并行解压
 """
 
 from __future__ import annotations
@@ -11,14 +12,24 @@ import re
 import gzip
 import sqlite3
 from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Any
+from . import gzindex
 from .db import (
+    finish_run,
     open_db_and_tune,
+    register_file,
+    start_run,
     upsert_module_bulk,
     upsert_smod_bulk,
     bump_template_stats_bulk,
 )
+from .buffer_mgr import BufferManager
+from .multimatch import MultiPatternMatcher
+from .prefilter import LiteralPrefilter
+from .sketch import SpaceSaving
 from .patterns import (
+    CompiledPattern,
     load_compiled_patterns,
+    build_match_engine,
     build_keyword_index,
     preselect_candidates,
     try_match_patterns,
@@ -106,36 +117,12 @@ def normalize_key_text(s: str) -> str:
 
 def buffer_unmatched_for_llm(conn: sqlite3.Connection, samples: List['Sample'], threshold: int) -> None:
     """
-    最小入缓冲实现：把未命中样本批量写入 BUFFER_ITEM。
-    触发 LLM 的阈值与任务编排由下游定时任务处理。
-    """
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT buffer_id, current_size, size_threshold FROM BUFFER_GROUP WHERE status = '收集中' ORDER BY buffer_id DESC LIMIT 1"
-    )
-    row = cur.fetchone()
-    if row:
-        buffer_id, current_size, size_thr = row
-    else:
-        cur.execute(
-            "INSERT INTO BUFFER_GROUP(scope, mod, smod, size_threshold, current_size, created_at, status) "
-            "VALUES('全局', NULL, NULL, ?, 0, CURRENT_TIMESTAMP, '收集中')",
-            (threshold,),
-        )
-        buffer_id = cur.lastrowid
-        current_size = 0
-
-    to_ins = []
-    for s in samples:
-        to_ins.append((buffer_id, None, None, None, s.key_text, s.key_text))
-
-    cur.executemany(
-        "INSERT INTO BUFFER_ITEM(buffer_id, run_id, timestamp, level, key_text, raw_log) VALUES(?, ?, ?, ?, ?, ?)",
-        to_ins,
-    )
-    current_size += len(to_ins)
-    cur.execute("UPDATE BUFFER_GROUP SET current_size = ? WHERE buffer_id = ?", (current_size, buffer_id))
-    conn.commit()
+    把未命中样本按 (mod, smod) 分片批量写入 BUFFER_ITEM（见 BufferManager）
+    分片满 threshold 条即换新缓冲 满的缓冲由 llm-drain / mine 按阈值处理
+    """
+    bm = BufferManager({}, conn, threshold=threshold)
+    bm.add_samples(samples)
+    bm.close()
 
 # === Pass1 主流程 ===========================================================
 
@@ -150,70 +137,143 @@ def _ensure_conn(db_or_database: Any) -> sqlite3.Connection:
         return db_or_database.conn  # type: ignore[return-value]
     raise TypeError("db 参数必须是 sqlite3.Connection 或含 conn 属性的 Database 实例")
 
-def run_pass1(cfg: dict, db: Any, gz_path: str) -> None:
+Rules = Tuple[List[CompiledPattern], LiteralPrefilter, MultiPatternMatcher]
+
+class Pass1Result:
     """
-    与 logsys.main 的调用签名一致：run_pass1(cfg, db, file)
-    第一遍 规则演进：
-      1 批量 upsert MODULE 与 SUBMODULE
-      2 对唯一 normalized 关键文本做规则匹配 命中更新模板计数 未命中入缓冲
-    不做逐行统计 不做时间分布。
+    单文件扫描结果：只含待写库的数据 可由 worker 进程传回唯一的写者
+    matched 为 模板 id → 命中次数（频次摘要的下界） unmatched 按估计次数降序
     """
-    conn = _ensure_conn(db)
-    open_db_and_tune(conn)
+    __slots__ = ("records", "unique", "evicted", "mods", "mod_smods", "matched", "matched_unique", "unmatched", "index")
+    def __init__(self) -> None:
+        self.records = 0
+        self.unique = 0
+        self.evicted = 0
+        self.mods: Set[str] = set()
+        self.mod_smods: Set[Tuple[str, str]] = set()
+        self.matched: Dict[int, int] = {}
+        self.matched_unique = 0
+        self.unmatched: List[Tuple[str, Sample, int]] = []  # (normalized, 样本, 估计次数)
+        self.index: Optional[gzindex.GzIndex] = None
 
-    uniq_cap = int(cfg.get("pass1_unique_cap", 200_000))
-    buffer_threshold = int(cfg.get("buffer_threshold", 100))
+def load_rules(conn: sqlite3.Connection) -> Rules:
+    patterns = load_compiled_patterns(conn)
+    return patterns, build_keyword_index(patterns), build_match_engine(patterns)
+
+def index_span(cfg: dict) -> int:
+    """app.gz_index_span_mb 换算为字节 0 表示不建索引"""
+    span_mb = float(cfg.get("app", {}).get("gz_index_span_mb", 16))
+    return int(span_mb * (1 << 20)) if span_mb > 0 and gzindex.available() else 0
 
-    mods: Set[str] = set()
-    mod_smods: Set[Tuple[str, str]] = set()
-    uniq: Dict[str, Sample] = {}
+def scan_file(gz_path: str, rules: Rules, uniq_cap: int = 200_000, span: int = 0) -> Pass1Result:
+    """
+    读取一个文件 以频次摘要（至多 2 × uniq_cap 个键）统计 normalized 关键文本并做规则匹配 不写库。
+    span>0 时解压的同时记录 gzip 访问点 不额外增加一次读盘。
+    """
+    res = Pass1Result()
+    uniq = SpaceSaving(uniq_cap)
+    reader = gzindex.IndexingReader(gz_path, span) if span > 0 else None
+    lines = gzindex.iter_lines(reader) if reader is not None else read_gz_lines(gz_path)
 
-    # 轻量抽取与唯一集合构建
-    for line in normalize_lines(read_gz_lines(gz_path)):
+    # 轻量抽取与频次摘要
+    for line in normalize_lines(lines):
+        res.records += 1
         mod, smod = fast_extract_mod_smod(line)
         if mod:
-            mods.add(mod)
+            res.mods.add(mod)
             if smod:
-                mod_smods.add((mod, smod))
+                res.mod_smods.add((mod, smod))
         key = extract_key_text(line)
         norm = normalize_key_text(key)
-        if norm not in uniq:
-            if len(uniq) >= uniq_cap:
-                uniq.pop(next(iter(uniq)))
-            uniq[norm] = Sample(key_text=key, mod=mod, smod=smod)
+        if uniq.add(norm):
+            uniq.items[norm] = Sample(key_text=key, mod=mod, smod=smod)
+    if reader is not None:
+        res.index = reader.index
+    match_unique(res, uniq, rules)
+    return res
 
-    if PASS1_UNIQUE:
-        PASS1_UNIQUE.inc(len(uniq))
+def match_unique(res: Pass1Result, uniq: SpaceSaving, rules: Rules) -> None:
+    """
+    模板匹配 只针对摘要中的唯一键 结果填入 res
+    命中按模板累加次数下界（不把淘汰误差计入 match_count） 未命中按估计次数降序保留
+    """
+    res.unique = len(uniq)
+    res.evicted = uniq.evicted
+    patterns, index, engine = rules
+    matched = res.matched
+    for norm, c, err in uniq.top():
+        cands = preselect_candidates(norm, index)
+        tid = try_match_patterns(norm, cands, patterns, engine)
+        if tid is not None:
+            res.matched_unique += 1
+            if c > err:
+                matched[tid] = matched.get(tid, 0) + c - err
+        else:
+            res.unmatched.append((norm, uniq.items[norm], c))
 
+def write_pass1_result(
+    conn: sqlite3.Connection,
+    res: Pass1Result,
+    file_id: int,
+    run_id: int,
+    buffer_threshold: int,
+    buffered: Optional[Set[str]] = None,
+) -> None:
+    """
+    写库：基础表 模板计数 未命中入缓冲 gzip 索引 并收尾 RUN_SESSION。
+    buffered 为批量处理时跨文件共享的已入缓冲 normalized 集合 避免同一样本重复入缓冲。
+    """
     # 批量 upsert 基础表
-    if mods:
-        upsert_module_bulk(conn, mods)
-    if mod_smods:
-        upsert_smod_bulk(conn, mod_smods)
+    if res.mods:
+        upsert_module_bulk(conn, res.mods)
+    if res.mod_smods:
+        upsert_smod_bulk(conn, res.mod_smods)
+    if res.index is not None:
+        gzindex.save_index(conn, file_id, res.index)
+    if PASS1_UNIQUE:
+        PASS1_UNIQUE.inc(res.unique)
 
-    # 模板匹配 只针对唯一集合
-    patterns = load_compiled_patterns(conn)
-    index    = build_keyword_index(patterns)
+    if res.matched:
+        bump_template_stats_bulk(conn, res.matched)
+    if PASS1_MATCHED:
+        PASS1_MATCHED.inc(res.matched_unique)
 
-    matched_ids: List[int] = []
-    unmatched_samples: List[Sample] = []
+    # res.unmatched 已按次数降序 高频样本先入缓冲
+    samples: List[Sample] = []
+    for norm, s, _ in res.unmatched:
+        if buffered is not None:
+            if norm in buffered:
+                continue
+            buffered.add(norm)
+        samples.append(s)
+    if samples:
+        buffer_unmatched_for_llm(conn, samples, buffer_threshold)
+        if PASS1_BUFFERED:
+            PASS1_BUFFERED.inc(len(samples))
 
-    for norm, s in uniq.items():
-        cands = preselect_candidates(norm, index)
-        tid = try_match_patterns(norm, cands, patterns)
-        if tid is not None:
-            matched_ids.append(tid)
-        else:
-            unmatched_samples.append(s)
+    # pass1 的 matched/unmatched 计唯一关键文本数
+    finish_run(conn, run_id, "成功", total=res.records, pre=res.records,
+               matched=res.matched_unique, unmatched=len(res.unmatched))
+    conn.commit()
 
-    if matched_ids:
-        bump_template_stats_bulk(conn, matched_ids)
-        if PASS1_MATCHED:
-            PASS1_MATCHED.inc(len(matched_ids))
+def run_pass1(cfg: dict, db: Any, gz_path: str) -> None:
+    """
+    与 logsys.main 的调用签名一致：run_pass1(cfg, db, file)
+    第一遍 规则演进：
+      1 批量 upsert MODULE 与 SUBMODULE
+      2 对频次摘要中的 normalized 关键文本做规则匹配 命中按出现次数累加模板计数 未命中按次数降序入缓冲
+    不做逐行统计 不做时间分布。
+    """
+    conn = _ensure_conn(db)
+    open_db_and_tune(conn)
 
-    if unmatched_samples:
-        buffer_unmatched_for_llm(conn, unmatched_samples, buffer_threshold)
-        if PASS1_BUFFERED:
-            PASS1_BUFFERED.inc(len(unmatched_samples))
+    uniq_cap = int(cfg.get("pass1_unique_cap", 200_000))
+    buffer_threshold = int(cfg.get("buffer_threshold", 100))
 
+    span = index_span(cfg) if gzindex.find_indexed_file(conn, gz_path) is None else 0
+    file_id = register_file(conn, gz_path)
+    run_id = start_run(conn, file_id, "PASS1", cfg)
     conn.commit()
+
+    res = scan_file(gz_path, load_rules(conn), uniq_cap, span)
+    write_pass1_result(conn, res, file_id, run_id, buffer_threshold)
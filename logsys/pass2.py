@@ -1,81 +1,303 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
-import json, os
-from typing import Dict, Tuple
-from .ingest import read_gz_lines
-from .preprocess import normalize_lines
-from .parser import parse_line
-from .key_extract import extract_key_text
+import json, logging, time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from . import gzindex
+from . import scanner
+from .ingest import read_gz_chunks
+from .key_extract import normalize_key_text
 from .matcher import TemplateMatcher
-from .utils import iso, floor_bucket, inc
-from .db import Database
-def run_pass2(cfg:dict, db:Database, gz_path:str):
-    file_id=db.execute('INSERT INTO FILE_REGISTRY(path, status, ingested_at) VALUES(?,?,?)', (gz_path,'新', datetime.utcnow().isoformat()))
-    run_id=db.execute('INSERT INTO RUN_SESSION(file_id, pass_type, config_json, started_at, status) VALUES(?,?,?,?,?)', (file_id,'PASS2', json.dumps(cfg, ensure_ascii=False), datetime.utcnow().isoformat(),'运行中'))
-    matcher=TemplateMatcher(db); matcher.load_templates()
-    gran=cfg['app'].get('time_bucket','5min')
-    batch_threshold=int(cfg['app'].get('pass2_batch_rows',10000))
-    summary={}; buckets={}; total=pre=matched=unmatched=0
-    os.makedirs(cfg['app']['unmatched_dir'], exist_ok=True)
-    out_um=os.path.join(cfg['app']['unmatched_dir'], f'unmatched_{int(datetime.utcnow().timestamp())}.log')
-    um_f=open(out_um,'w',encoding='utf-8')
-    def flush():
-        for k,v in list(summary.items()):
-            mod,smod,tpl_id,cls,lvl,th=k
-            db.execute('''
-            INSERT INTO LOG_MATCH_SUMMARY(run_id, template_id, mod, smod, classification, level, thread_id, first_ts, last_ts, line_count)
-            VALUES(?,?,?,?,?,?,?,?,?,?)
-            ON CONFLICT(run_id, template_id, mod, smod, classification, level, thread_id) DO UPDATE SET
-              first_ts=min(first_ts, excluded.first_ts),
-              last_ts=max(last_ts, excluded.last_ts),
-              line_count=line_count + excluded.line_count
-            ''', (run_id, tpl_id, mod, smod, cls, lvl, th, v['first_ts'], v['last_ts'], v['count']))
-        summary.clear()
-        for k,cnt in list(buckets.items()):
-            mod,smod,tpl_id,cls,lvl,th,g,b=k
-            db.execute('''
-            INSERT INTO KEY_TIME_BUCKET(run_id, template_id, mod, smod, classification, level, thread_id, bucket_granularity, bucket_start, count_in_bucket)
-            VALUES(?,?,?,?,?,?,?,?,?,?)
-            ON CONFLICT(run_id, template_id, mod, smod, classification, level, thread_id, bucket_granularity, bucket_start) DO UPDATE SET
-              count_in_bucket = count_in_bucket + excluded.count_in_bucket
-            ''', (run_id, tpl_id, mod, smod, cls, lvl, th, g, b, cnt))
-        buckets.clear()
-    for line in normalize_lines(read_gz_lines(gz_path)):
-        total+=1
-        parsed=parse_line(line)
-        if not parsed: continue
-        pre+=1
-        key_text=extract_key_text(parsed['raw'])
-        hit=matcher.match_text(key_text)
-        if hit:
-            matched+=1
-            tpl_id=hit['template_id']; cls=''
-            try:
-                import json as _j
-                sem=_j.loads(hit['semantic_info']) if hit['semantic_info'] else {}
-                cls=sem.get('分类','')
-            except Exception:
-                cls=''
-            mod=parsed.get('mod') or ''
-            smod=parsed.get('smod') or ''
-            lvl=parsed.get('level') or ''
-            th=parsed.get('thread_id') or ''
-            ts=iso(parsed.get('timestamp'))
-            sk=(mod,smod,tpl_id,cls,lvl,th)
-            if sk not in summary:
-                summary[sk]={'first_ts':ts,'last_ts':ts,'count':1}
-            else:
-                if ts<summary[sk]['first_ts']: summary[sk]['first_ts']=ts
-                if ts>summary[sk]['last_ts']: summary[sk]['last_ts']=ts
-                summary[sk]['count']+=1
-            b=floor_bucket(ts,gran)
-            bk=(mod,smod,tpl_id,cls,lvl,th,gran,b)
-            inc(buckets,bk,1)
-            if sum(v['count'] for v in summary.values())>=batch_threshold:
-                flush()
+from .pass1 import index_span
+from .reporting import restore_run, retract_run, supersede_runs, write_rollups
+from .utils import parse_ts, now_epoch, time_buckets
+from .colagg import ColumnarAgg
+from .unmatched_store import UnmatchedStore
+from .db import (Database, register_file, start_run, finish_run, write_transaction, bulk_upsert,
+                 find_done_run, find_resumable_run, reopen_run, save_checkpoint)
+
+logger=logging.getLogger(__name__)
+
+# === 部分聚合：单进程与分片 worker 共用 列式聚合 合并只做 求和 取最小最大 与顺序无关 ===
+
+def new_partial(grans:List[str]) -> Dict:
+    return {'agg':ColumnarAgg(grans), 'unmatched':[], 'pending':0,
+            'total':0, 'pre':0, 'matched':0, 'unmatched_lines':0, 'cache_hits':0, 'cache_lookups':0}
+
+def _classification(sem_json, cls_cache:Dict, tpl_id:int) -> str:
+    """semantic_info 中的分类 按 template_id 缓存；注册表刷新可能改动 semantic_info 换快照后调用方清空 cls_cache"""
+    cls=cls_cache.get(tpl_id)
+    if cls is None:
+        try:
+            sem=json.loads(sem_json) if sem_json else {}
+            cls=sem.get('分类','')
+        except Exception:
+            cls=''
+        cls_cache[tpl_id]=cls
+    return cls
+
+def aggregate_record(part:Dict, rec:scanner.Record, matcher:TemplateMatcher, cls_cache:Dict) -> None:
+    """
+    匹配一条扫描出的记录 并累加到 part；未命中记录按原顺序暂存待写（原始行保持字节 写出时才解码）
+    """
+    part['total']+=1; part['pre']+=1
+    ts_s,lvl,mod,smod,key_text,raw=rec
+    norm=normalize_key_text(key_text) if matcher.cache_enabled else None
+    hit=matcher.match_text(key_text, norm)
+    if not hit:
+        part['unmatched_lines']+=1
+        part['unmatched'].append((raw, mod, smod, lvl, None, ts_s, key_text, norm))
+        return
+    part['matched']+=1; part['pending']+=1
+    tpl_id=hit['template_id']
+    cls=_classification(hit['semantic_info'], cls_cache, tpl_id)
+    # 时间戳只解析一次为 epoch 秒 缺失或非法时取处理时刻
+    ts=parse_ts(ts_s)
+    if ts is None: ts=now_epoch()
+    part['agg'].add(tpl_id, cls, mod or '', smod or '', lvl or '', '', ts)
+
+def merge_partial(dst:Dict, src:Dict) -> None:
+    dst['agg'].merge(src['agg'])
+    dst['unmatched'].extend(src['unmatched'])
+    for k in ('pending','total','pre','matched','unmatched_lines','cache_hits','cache_lookups'):
+        dst[k]+=src[k]
+
+def shard_bytes(cfg:dict) -> int:
+    """app.pass2_shard_mb：发给 worker 的记录对齐块大小"""
+    return max(int(float(cfg['app'].get('pass2_shard_mb',4))*(1<<20)), 1)
+
+def template_poll_s(cfg:dict) -> float:
+    """app.template_poll_s：运行中轮询模板注册表的间隔 新模板无需重启即生效 0 关闭"""
+    return float(cfg['app'].get('template_poll_s',5))
+
+# === 分片 worker ===
+
+_WORKER: Dict = {}
+
+def _init_worker(db_path:str, cache_size:int, grans:List[str], gz_path:str=None, file_id:int=None, poll_s:float=0):
+    db=Database(db_path)
+    m=TemplateMatcher(db, cache_size=cache_size, poll_s=poll_s); m.load_templates()
+    index=gzindex.load_index(db.conn, file_id) if file_id is not None else None
+    _WORKER.update(matcher=m, grans=grans, cls={}, gz_path=gz_path, index=index)
+
+def _work_blocks(blocks:Iterable[bytes]) -> Dict:
+    m=_WORKER['matcher']; part=new_partial(_WORKER['grans'])
+    h0,l0=m.cache_stats()
+    for block in blocks:
+        if m.maybe_refresh(): _WORKER['cls'].clear()
+        for rec in scanner.scan_block(block):
+            aggregate_record(part, rec, m, _WORKER['cls'])
+    h1,l1=m.cache_stats()
+    part['cache_hits']=h1-h0; part['cache_lookups']=l1-l0
+    return part
+
+def _work_block(block:bytes) -> Dict:
+    """主进程只解压并按记录边界切块 扫描 匹配 聚合都在 worker"""
+    return _work_blocks((block,))
+
+def _work_segment(start:int, end:int) -> Dict:
+    """worker 自行从访问点解压 [start, end) 区段 跨区段的多行记录归属记录首行所在区段"""
+    return _work_blocks(scanner.iter_blocks_range(_WORKER['gz_path'], _WORKER['index'], start, end))
+
+def _parallel_partials(cfg:dict, gz_path:str, workers:int, cache_size:int, grans:List[str], start:int=0) -> Iterator[Tuple[int,Dict]]:
+    """
+    分片并行处理 按提交顺序产出 (断点偏移, 部分聚合) 在途分片数受限以控制内存
+    start 为续跑的解压偏移（记录首行起点） 之前的记录不再处理
+    """
+    db_path=cfg['app']['db_path']
+    probe=Database(db_path)
+    file_id=gzindex.find_indexed_file(probe.conn, gz_path)
+    index=gzindex.load_index(probe.conn, file_id) if file_id is not None else None
+    probe.close()
+    if index is not None and len(index.points)>1:
+        # 已有 gzip 索引：各 worker 按区段并行解压 主进程不再读文件
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(db_path, cache_size, grans, gz_path, file_id, template_poll_s(cfg))) as ex:
+            inflight=deque()
+            for s,e in index.segments():
+                if e<=start: continue
+                inflight.append((e, ex.submit(_work_segment, max(s,start), e)))
+                if len(inflight)>=2*workers:
+                    e,f=inflight.popleft(); yield e,f.result()
+            while inflight:
+                e,f=inflight.popleft(); yield e,f.result()
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(db_path, cache_size, grans, None, None, template_poll_s(cfg))) as ex:
+        inflight=deque()
+        for pos,block in scanner.iter_blocks_at(read_gz_chunks(gz_path, start=start), shard_bytes(cfg), offset=start):
+            inflight.append((pos, ex.submit(_work_block, block)))
+            if len(inflight)>=2*workers:
+                pos,f=inflight.popleft(); yield pos,f.result()
+        while inflight:
+            pos,f=inflight.popleft(); yield pos,f.result()
+
+SUMMARY_COLS=('run_id','template_id','mod','smod','classification','level','thread_id','first_ts','last_ts','line_count')
+SUMMARY_UPDATE='first_ts=min(first_ts, excluded.first_ts), last_ts=max(last_ts, excluded.last_ts), line_count=line_count + excluded.line_count'
+BUCKET_COLS=('run_id','template_id','mod','smod','classification','level','thread_id','bucket_granularity','bucket_start','count_in_bucket')
+BUCKET_UPDATE='count_in_bucket = count_in_bucket + excluded.count_in_bucket'
+
+def write_aggregates(conn, run_id:int, agg:ColumnarAgg) -> int:
+    """在调用方的事务内 把列式聚合 upsert 到 LOG_MATCH_SUMMARY 与 KEY_TIME_BUCKET 并累加报表汇总表 返回写入行数"""
+    n=bulk_upsert(conn, 'LOG_MATCH_SUMMARY', SUMMARY_COLS,
+                  ((run_id, tpl_id, mod, smod, cls, lvl, th, first, last, cnt)
+                   for mod,smod,tpl_id,cls,lvl,th,first,last,cnt in agg.summary_rows()),
+                  SUMMARY_COLS[:7], SUMMARY_UPDATE)
+    n+=bulk_upsert(conn, 'KEY_TIME_BUCKET', BUCKET_COLS,
+                   ((run_id, tpl_id, mod, smod, cls, lvl, th, g, b, cnt)
+                    for mod,smod,tpl_id,cls,lvl,th,g,b,cnt in agg.bucket_rows()),
+                   BUCKET_COLS[:9], BUCKET_UPDATE)
+    n+=write_rollups(conn, run_id, agg)
+    return n
+
+class Pass2Writer:
+    """
+    单个 run 的写者：合并部分聚合 达到批量阈值时 upsert；所有写库只在持有连接的进程内发生
+    pos 非空时每次写入同一事务内记录断点（pos 之前的记录已全部在本批及之前的批中）
+    gz 为提供 gzip 访问点的 IndexingReader 或 GzIndex 断点同时记下可续读的压缩偏移
+    counts 为续跑时断点处已提交的 (total, pre, matched, unmatched)
+    """
+    def __init__(self, cfg:dict, db:Database, run_id:int, counts:Optional[Tuple]=None, file_id:Optional[int]=None):
+        self.db=db; self.run_id=run_id; self.file_id=file_id
+        self.batch=int(cfg['app'].get('pass2_batch_rows',10000))
+        self.um=UnmatchedStore(cfg, db.conn, run_id)
+        self.acc=new_partial(time_buckets(cfg))
+        if counts:
+            for k,v in zip(('total','pre','matched','unmatched_lines'), counts): self.acc[k]=v
+        self.rows_written=0; self.write_sec=0.0
+        self.pos=None; self.gz=None; self.points_saved=0
+    def add(self, part:Dict, pos:Optional[int]=None):
+        merge_partial(self.acc, part)
+        if pos is not None: self.pos=pos
+        if self.due(): self.flush()
+    def due(self) -> bool:
+        return self.acc['pending']>=self.batch or len(self.acc['unmatched'])>=self.batch
+    def _checkpoint(self, conn):
+        in_off=None
+        if self.gz is not None:
+            pts=self.gz.points
+            if isinstance(self.gz, gzindex.IndexingReader) and self.file_id is not None:
+                # 顺序建索引途中 访问点随断点先行落库 续跑时可从压缩偏移处解压
+                self.points_saved=gzindex.save_points(conn, self.file_id, pts, self.points_saved)
+            for p in pts:
+                if p.out_offset>self.pos: break
+                in_off=p.in_offset
+        acc=self.acc
+        save_checkpoint(conn, self.run_id, self.pos, in_off, acc['total'], acc['pre'], acc['matched'], acc['unmatched_lines'])
+    def flush(self, final:bool=False):
+        """
+        一个显式事务内 各表一次 executemany 入暂存表 + 一条 INSERT ... SELECT 以及断点
+        未命中原始行压缩追加到溢出文件 按键聚合跨批累积 final 时全部写出（见 unmatched_store）
+        """
+        acc=self.acc; run_id=self.run_id; conn=self.db.conn
+        agg=acc['agg']
+        if agg.empty and not acc['unmatched'] and not (final and self.um.pending):
+            return
+        t0=time.perf_counter()
+        self.um.add(acc['unmatched'])
+        with write_transaction(conn):
+            n=write_aggregates(conn, run_id, agg)
+            n+=self.um.write(conn, final)
+            if self.pos is not None:
+                self._checkpoint(conn)
+        dt=time.perf_counter()-t0
+        self.rows_written+=n; self.write_sec+=dt
+        logger.info('pass2 flush run=%s rows=%d %.3fs %.0f rows/s', run_id, n, dt, n/dt if dt>0 else 0.0)
+        agg.clear(); acc['unmatched'].clear()
+        acc['pending']=0
+    def finish(self, hit_ratio=None, status:str='成功'):
+        self.flush(final=True); self.um.close()
+        acc=self.acc
+        finish_run(self.db.conn, self.run_id, status, acc['total'], acc['pre'], acc['matched'], acc['unmatched_lines'], hit_ratio)
+        # 汇总表只计每个文件最终成功的一次 失败的 run 扣除 成功时扣除同一文件的其余 run
+        if status=='成功': supersede_runs(self.db.conn, self.run_id)
+        else: retract_run(self.db.conn, self.run_id)
+        if self.write_sec>0:
+            logger.info('pass2 run=%s 写入 %d 行 %.0f rows/s', self.run_id, self.rows_written, self.rows_written/self.write_sec)
+    def fail(self):
+        """异常中止：丢弃未写入的部分 run 标记失败 已提交的统计与断点保留 可 --resume 续跑（汇总表中先扣除 续跑时加回）"""
+        self.um.close()
+        conn=self.db.conn
+        conn.rollback()
+        conn.execute("UPDATE RUN_SESSION SET status='失败', ended_at=? WHERE run_id=?", (datetime.utcnow().isoformat(), self.run_id))
+        retract_run(conn, self.run_id)
+        conn.commit()
+
+def open_run(cfg:dict, db:Database, gz_path:str, resume:bool=False, force:bool=False):
+    """
+    登记文件并确定本次 PASS2 的 run 返回 (file_id, run_id, 起始解压偏移, 断点计数)
+    同一内容已有成功的 PASS2 时跳过 返回 None（force 时照常新开 run）
+    resume 时续跑该文件最近一次失败或中断且有断点的 run 没有则新开 run
+    """
+    conn=db.conn
+    file_id=register_file(conn, gz_path)
+    if not force:
+        done=find_done_run(conn, file_id, 'PASS2')
+        if done is not None:
+            conn.commit()
+            logger.info('pass2 跳过 %s：内容已由 run=%s 入库', gz_path, done)
+            return None
+    ck=find_resumable_run(conn, file_id, 'PASS2') if resume else None
+    if ck is not None:
+        run_id,start=ck
+        counts=reopen_run(conn, run_id)
+        restore_run(conn, run_id)
+        logger.info('pass2 续跑 run=%s 自解压偏移 %d 已计 %d 条', run_id, start, counts[0])
+    else:
+        run_id=start_run(conn, file_id, 'PASS2', cfg); start=0; counts=None
+    conn.commit()
+    return file_id, run_id, start, counts
+
+def _serial_chunks(cfg:dict, conn, gz_path:str, file_id:int, start:int):
+    """
+    单进程读取：从头读且尚无索引时边解压边建索引（访问点随断点落库）
+    续跑时有访问点（含未完成的索引）则从最近访问点解压 否则顺序解压跳过 start 之前的内容
+    返回 (访问点来源, 字节块迭代器)
+    """
+    if not gzindex.available():
+        return None, read_gz_chunks(gz_path, start=start)
+    index=gzindex.load_index(conn, file_id, partial=start>0)
+    if start>0 and index is not None:
+        return index, gzindex.iter_bytes_from(gz_path, index, start)
+    if start==0 and index is None and index_span(cfg)>0:
+        reader=gzindex.IndexingReader(gz_path, index_span(cfg))
+        return reader, reader
+    return index, read_gz_chunks(gz_path, start=start)
+
+def run_pass2(cfg:dict, db:Database, gz_path:str, workers:int=1, resume:bool=False, force:bool=False) -> Optional[int]:
+    """
+    单文件 pass2 返回 run_id；同内容已入库而跳过时返回 None
+    按批写入时同一事务记录断点 失败后 resume=True 从断点续跑 已写入的统计不会重复计入
+    """
+    opened=open_run(cfg, db, gz_path, resume, force)
+    if opened is None:
+        return None
+    file_id,run_id,start,counts=opened
+    cache_size=int(cfg['app'].get('match_cache_size',0))
+    grans=time_buckets(cfg)
+    w=Pass2Writer(cfg, db, run_id, counts, file_id); acc=w.acc
+    try:
+        if workers>1:
+            w.gz=gzindex.load_index(db.conn, file_id, partial=True) if gzindex.available() else None
+            for pos,part in _parallel_partials(cfg, gz_path, workers, cache_size, grans, start):
+                w.add(part, pos)
+            hit_ratio=acc['cache_hits']/acc['cache_lookups'] if acc['cache_lookups'] else None
         else:
-            unmatched+=1
-            um_f.write(line+'\n')
-            db.execute('INSERT INTO UNMATCHED_LOG(run_id,mod,smod,level,thread_id,timestamp,key_text,raw_log,buffered,reason) VALUES(?,?,?,?,?,?,?,?,?,?)', (run_id, parsed.get('mod'), parsed.get('smod'), parsed.get('level'), parsed.get('thread_id'), parsed.get('timestamp'), key_text, parsed['raw'], 0, 'no_match_pass2'))
-    flush(); um_f.close()
-    db.execute('UPDATE RUN_SESSION SET ended_at=?, total_lines=?, preprocessed_lines=?, matched_lines=?, unmatched_lines=?, status=? WHERE run_id=?', (datetime.utcnow().isoformat(), total, pre, matched, unmatched, '成功', run_id))
+            matcher=TemplateMatcher(db, cache_size=cache_size, poll_s=template_poll_s(cfg)); matcher.load_templates()
+            cls_cache={}
+            w.gz,chunks=_serial_chunks(cfg, db.conn, gz_path, file_id, start)
+            # 整块处理完才写入 断点总落在记录对齐块的边界上
+            for pos,block in scanner.iter_blocks_at(chunks, offset=start):
+                if matcher.maybe_refresh(): cls_cache.clear()
+                for rec in scanner.scan_block(block):
+                    aggregate_record(acc, rec, matcher, cls_cache)
+                w.pos=pos
+                if w.due():
+                    w.flush()
+            if isinstance(w.gz, gzindex.IndexingReader) and w.gz.index is not None:
+                gzindex.save_index(db.conn, file_id, w.gz.index)
+            hit_ratio=matcher.cache_hit_ratio
+        w.finish(hit_ratio)
+    except BaseException:
+        w.fail()
+        raise
+    return run_id
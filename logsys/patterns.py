@@ -2,24 +2,34 @@
 
 import re
 import sqlite3
-from typing import Dict, List, Optional, Set
+from typing import Dict, List, Optional, Set, Tuple
 
-WORD_RE = re.compile(r"[A-Za-z0-9_]{3,}")
+from .multimatch import MultiPatternMatcher
+from .prefilter import LiteralPrefilter, best_literal
 
 class CompiledPattern:
-    __slots__ = ("template_id", "pattern", "regex", "tokens")
+    __slots__ = ("template_id", "pattern", "regex", "literal")
     def __init__(self, template_id: int, pattern: str) -> None:
         self.template_id = template_id
         self.pattern = pattern
         self.regex = re.compile(pattern)
-        # 朴素 token 提取 可替换为更强的关键短语生成
-        self.tokens = set(WORD_RE.findall(pattern))
+        # 由语法树提取的最长必需字面量 None 表示每行都需尝试
+        self.literal = best_literal(pattern)
 
-def load_compiled_patterns(db: sqlite3.Connection) -> List[CompiledPattern]:
+def load_compiled_patterns(
+    db: sqlite3.Connection,
+    prev: Optional[List[CompiledPattern]] = None,
+) -> List[CompiledPattern]:
+    """prev 为上次加载的结果 (template_id, 模式) 未变的模板直接沿用 只编译新增或改动的"""
     cur = db.cursor()
-    cur.execute("SELECT template_id, pattern FROM REGEX_TEMPLATE WHERE is_active = 1")
+    cur.execute("SELECT template_id, pattern FROM REGEX_TEMPLATE WHERE is_active = 1 ORDER BY template_id")
+    old: Dict[Tuple[int, str], CompiledPattern] = {(cp.template_id, cp.pattern): cp for cp in prev or ()}
     out: List[CompiledPattern] = []
     for tid, ptn in cur.fetchall():
+        cp = old.get((int(tid), str(ptn)))
+        if cp is not None:
+            out.append(cp)
+            continue
         try:
             out.append(CompiledPattern(int(tid), str(ptn)))
         except re.error:
@@ -27,27 +37,33 @@ def load_compiled_patterns(db: sqlite3.Connection) -> List[CompiledPattern]:
             pass
     return out
 
-def build_keyword_index(patterns: List[CompiledPattern]) -> Dict[str, Set[int]]:
-    index: Dict[str, Set[int]] = {}
-    for cp in patterns:
-        for tk in cp.tokens:
-            index.setdefault(tk, set()).add(cp.template_id)
-    return index
-
-def preselect_candidates(text: str, index: Dict[str, Set[int]]) -> Set[int]:
-    cands: Set[int] = set()
-    for tk in set(WORD_RE.findall(text)):
-        s = index.get(tk)
-        if s:
-            cands |= s
-    return cands
-
-def try_match_patterns(text: str, candidates: Set[int], patterns: List[CompiledPattern]) -> Optional[int]:
+def build_match_engine(
+    patterns: List[CompiledPattern],
+    reuse: Optional[MultiPatternMatcher] = None,
+) -> MultiPatternMatcher:
+    """复用已编译正则构建批量匹配引擎 顺序与 patterns 一致；reuse 为旧引擎时内容未变的批不再重编译"""
+    return MultiPatternMatcher(((cp.template_id, cp.regex) for cp in patterns), reuse=reuse)
+
+def build_keyword_index(patterns: List[CompiledPattern]) -> LiteralPrefilter:
+    return LiteralPrefilter((cp.template_id, cp.literal) for cp in patterns)
+
+def preselect_candidates(text: str, index: LiteralPrefilter) -> Set[int]:
+    # 候选为可能命中模板的超集 含无字面量的 always 模板
+    return index.candidates(text)
+
+def try_match_patterns(
+    text: str,
+    candidates: Set[int],
+    patterns: List[CompiledPattern],
+    engine: Optional[MultiPatternMatcher] = None,
+) -> Optional[int]:
     if not patterns:
         return None
     if not candidates:
-        # 候选为空直接返回 None 将长尾交给 LLM 缓冲
+        # 候选为空说明没有模板可能命中 直接交给 LLM 缓冲
         return None
+    if engine is not None:
+        return engine.match(text, candidates)
     cand_map = {cp.template_id: cp for cp in patterns if cp.template_id in candidates}
     for tid, cp in cand_map.items():
         if cp.regex.search(text):
@@ -0,0 +1,201 @@
+# logsys/prefilter.py
+"""
+模板候选预筛：
+- 解析正则语法树 提取模式命中时文本中必然出现的字面量 取最长者作为该模板的锚
+- 全部锚字面量构建一个多模式自动机 每条关键文本扫描一次得到候选模板集合
+- 无可用字面量的模板进入 always 列表 每行都参与匹配 不再被静默丢弃
+- 已安装 pyahocorasick 时使用 Aho-Corasick 自动机 否则退化为字典树正则
+"""
+
+from __future__ import annotations
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+    from re import _constants as sre_constants
+except ImportError:  # pragma: no cover
+    import sre_parse  # type: ignore
+    import sre_constants  # type: ignore
+
+try:
+    import ahocorasick  # type: ignore
+except Exception:  # noqa: BLE001
+    ahocorasick = None  # type: ignore
+
+__all__ = [
+    "required_literals",
+    "best_literal",
+    "LiteralPrefilter",
+]
+
+MIN_LITERAL_LEN = 3    # 过短的字面量几乎每行都出现 预筛无意义
+MAX_LITERAL_LEN = 32   # 必需字面量的前缀同样必需 截断以控制自动机规模
+
+_LITERAL = sre_constants.LITERAL
+_AT = sre_constants.AT
+_SUBPATTERN = sre_constants.SUBPATTERN
+_ASSERT = sre_constants.ASSERT
+_REPEATS = tuple(
+    op for op in (
+        sre_constants.MAX_REPEAT,
+        sre_constants.MIN_REPEAT,
+        getattr(sre_constants, "POSSESSIVE_REPEAT", None),
+    ) if op is not None
+)
+_ATOMIC = getattr(sre_constants, "ATOMIC_GROUP", None)
+
+
+class _Runs:
+    """收集连续字面量片段"""
+    __slots__ = ("run", "out")
+
+    def __init__(self) -> None:
+        self.run: List[str] = []
+        self.out: List[str] = []
+
+    def cut(self) -> None:
+        if self.run:
+            self.out.append("".join(self.run))
+            self.run = []
+
+
+def _walk(seq, st: _Runs) -> None:
+    for op, av in seq:
+        if op is _LITERAL:
+            st.run.append(chr(av))
+        elif op is _AT:
+            # 锚点不消耗字符 两侧字面量仍然相接
+            continue
+        elif op is _SUBPATTERN:
+            _, add_flags, _, sub = av
+            if add_flags & sre_constants.SRE_FLAG_IGNORECASE:
+                st.cut()
+                continue
+            _walk(sub, st)
+        elif op in _REPEATS:
+            lo, _, sub = av
+            st.cut()
+            if lo >= 1:
+                _walk(sub, st)
+                st.cut()
+        elif _ATOMIC is not None and op is _ATOMIC:
+            _walk(av, st)
+        elif op is _ASSERT:
+            # 正向断言内的字面量同样必须出现
+            st.cut()
+            _walk(av[1], st)
+            st.cut()
+        else:
+            # 分支 字符集 任意字符 否定断言 反向引用等 无法保证字面量
+            st.cut()
+
+
+def required_literals(pattern: str) -> List[str]:
+    """返回模式任一命中都必然包含的字面量片段 大小写不敏感的模式返回空"""
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:  # noqa: BLE001
+        return []
+    if parsed.state.flags & sre_constants.SRE_FLAG_IGNORECASE:
+        return []
+    st = _Runs()
+    _walk(parsed, st)
+    st.cut()
+    return st.out
+
+
+def best_literal(pattern: str, min_len: int = MIN_LITERAL_LEN) -> Optional[str]:
+    """取最长必需字面量 不足 min_len 时返回 None"""
+    lits = required_literals(pattern)
+    if not lits:
+        return None
+    lit = max(lits, key=len)
+    if len(lit) < min_len:
+        return None
+    return lit[:MAX_LITERAL_LEN]
+
+
+class _TrieNode:
+    __slots__ = ("children", "end")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, _TrieNode] = {}
+        self.end = False
+
+
+def _trie_regex(words: Iterable[str]) -> str:
+    root = _TrieNode()
+    for w in words:
+        node = root
+        for ch in w:
+            node = node.children.setdefault(ch, _TrieNode())
+        node.end = True
+
+    def render(node: _TrieNode) -> str:
+        alts = [re.escape(ch) + render(child) for ch, child in sorted(node.children.items())]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        if node.end:
+            # 贪婪可选：同一起点优先取更长的字面量
+            return "(?:" + body + ")?"
+        return body
+
+    return render(root)
+
+
+class LiteralPrefilter:
+    """
+    必需字面量预筛索引。
+    candidates(text) 返回可能命中的 template_id 超集 包含 always 列表
+    """
+
+    def __init__(self, entries: Iterable[Tuple[int, Optional[str]]]) -> None:
+        self.always: Set[int] = set()
+        self.by_literal: Dict[str, Set[int]] = {}
+        for tid, lit in entries:
+            if lit:
+                self.by_literal.setdefault(lit, set()).add(int(tid))
+            else:
+                self.always.add(int(tid))
+        self._automaton = None
+        self._scan_rx: Optional["re.Pattern[str]"] = None
+        self._closure: Dict[str, Set[int]] = {}
+        if not self.by_literal:
+            return
+        if ahocorasick is not None:
+            a = ahocorasick.Automaton()
+            for lit in self.by_literal:
+                a.add_word(lit, lit)
+            a.make_automaton()
+            self._automaton = a
+            return
+        # 退化实现：零宽前瞻逐位置取最长字面量 其前缀字面量经闭包补齐
+        self._scan_rx = re.compile("(?=(" + _trie_regex(self.by_literal) + "))")
+        for lit in self.by_literal:
+            ids: Set[int] = set()
+            for k in range(1, len(lit) + 1):
+                s = self.by_literal.get(lit[:k])
+                if s:
+                    ids |= s
+            self._closure[lit] = ids
+
+    def __len__(self) -> int:
+        return len(self.always) + sum(len(s) for s in self.by_literal.values())
+
+    def candidates(self, text: str) -> Set[int]:
+        cands = set(self.always)
+        if self._automaton is not None:
+            by = self.by_literal
+            for _, lit in self._automaton.iter(text):
+                cands |= by[lit]
+        elif self._scan_rx is not None:
+            closure = self._closure
+            seen: Set[str] = set()
+            for m in self._scan_rx.finditer(text):
+                lit = m.group(1)
+                if lit not in seen:
+                    seen.add(lit)
+                    cands |= closure[lit]
+        return cands
@@ -0,0 +1,210 @@
+# logsys/process.py
+"""
+单次解压的 process 模式：读一遍文件 同时产出 pass1 规则演进的输入 与 pass2 统计
+- 记录由 scanner 切分与解析 pass1 侧收集 MOD/SMOD 集合与 normalized 关键文本的频次摘要（SpaceSaving） 并按需建 gzip 索引
+- pass2 侧用当前模板匹配 命中即进入列式聚合 未命中与 pass2 一样按键聚合写 UNMATCHED_KEY 原始行进压缩溢出文件
+  （见 unmatched_store） 按批写库 内存与文件大小无关
+- pass1 本身不生成模板；运行期间注册表有变化（如另一进程 llm-drain 落库新模板）时 收尾后从溢出文件重新匹配一次
+- resolve_run：之后有新模板落库时 对某个 run 留下的未命中重新匹配并补入统计 无需重读文件
+与分别执行 pass1 pass2 的差异：pass1 侧的记录切分与 MOD/SMOD 取值沿用 scanner（即 pass2 的规则）
+同一文件登记 PASS1 与 PASS2 两个 RUN_SESSION 下游查询不变
+"""
+
+from __future__ import annotations
+import logging
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+from . import gzindex, scanner
+from .colagg import ColumnarAgg
+from .db import Database, find_done_run, register_file, start_run, write_transaction
+from .ingest import read_gz_chunks
+from .key_extract import normalize_key_text
+from .matcher import TemplateMatcher
+from .pass1 import (
+    Pass1Result,
+    Sample,
+    extract_key_text as pass1_key_text,
+    index_span,
+    load_rules,
+    match_unique,
+    normalize_key_text as pass1_normalize,
+    write_pass1_result,
+)
+from .pass2 import Pass2Writer, _classification, aggregate_record, write_aggregates
+from .reporting import retract_run
+from .sketch import SpaceSaving
+from .template_mgr import registry_version
+from .unmatched_store import iter_records, resolved_keys
+from .utils import now_epoch, parse_ts, time_buckets
+
+__all__ = [
+    "run_process",
+    "resolve_run",
+]
+
+logger = logging.getLogger(__name__)
+
+
+def run_process(cfg: dict, db: Database, gz_path: str, force: bool = False) -> Optional[Dict[str, int]]:
+    """
+    一次解压完成 pass1 与 pass2：
+      1 扫描：pass1 关键文本频次摘要 模块集合 gzip 索引；pass2 命中聚合 未命中按批写入溢出文件
+      2 pass1 结果落库（模板计数 未命中入缓冲 索引） 收尾 PASS2
+      3 扫描期间注册表有新模板时 对本 run 的未命中执行 resolve_run
+    同一内容已有成功的 PASS2 时跳过 返回 None（force 时照常处理）
+    pass1 侧的频次摘要只在内存中 中途没有一致的断点 失败后整文件重跑
+    """
+    conn = db.conn
+    uniq_cap = int(cfg.get("pass1_unique_cap", 200_000))
+    buffer_threshold = int(cfg.get("buffer_threshold", 100))
+    cache_size = int(cfg["app"].get("match_cache_size", 0))
+
+    span = index_span(cfg) if gzindex.find_indexed_file(conn, gz_path) is None else 0
+    file_id = register_file(conn, gz_path)
+    done = None if force else find_done_run(conn, file_id, "PASS2")
+    if done is not None:
+        conn.commit()
+        logger.info("process 跳过 %s：内容已由 run=%s 入库", gz_path, done)
+        return None
+    run1 = start_run(conn, file_id, "PASS1", cfg)
+    run2 = start_run(conn, file_id, "PASS2", cfg)
+    conn.commit()
+
+    w: Optional[Pass2Writer] = None
+    try:
+        rules = load_rules(conn)
+        matcher = TemplateMatcher(db, cache_size=cache_size)
+        matcher.load_templates()
+        reg = matcher.registry_version
+        w = Pass2Writer(cfg, db, run2)
+        acc = w.acc
+        cls_cache: Dict[int, str] = {}
+        res = Pass1Result()
+        uniq = SpaceSaving(uniq_cap)
+
+        reader = gzindex.IndexingReader(gz_path, span) if span > 0 else None
+        for rec in scanner.iter_records(reader if reader is not None else read_gz_chunks(gz_path)):
+            _, _, mod, smod, key, _ = rec
+            if mod:
+                res.mods.add(mod)
+                if smod:
+                    res.mod_smods.add((mod, smod))
+            k1 = pass1_key_text(key)
+            norm = pass1_normalize(k1)
+            if uniq.add(norm):
+                uniq.items[norm] = Sample(key_text=k1, mod=mod, smod=smod)
+            aggregate_record(acc, rec, matcher, cls_cache)
+            if w.due():
+                w.flush()
+        res.records = acc["total"]
+        if reader is not None:
+            res.index = reader.index
+        match_unique(res, uniq, rules)
+        write_pass1_result(conn, res, file_id, run1, buffer_threshold)
+        w.finish(matcher.cache_hit_ratio)
+        conn.commit()
+    except Exception:
+        if w is not None:
+            w.um.close()
+        conn.rollback()
+        for rid in (run1, run2):
+            conn.execute("UPDATE RUN_SESSION SET status='失败' WHERE run_id=? AND status!='成功'", (rid,))
+        retract_run(conn, run2)
+        conn.commit()
+        raise
+    # run 已成功收尾；补算失败时未命中原样保留 可再执行 resolve
+    resolved = resolve_run(cfg, db, run2)[0] if registry_version(conn) != reg else 0
+    logger.info("process %s: 记录 %d 命中 %d 未命中 %d 其中后补 %d",
+                gz_path, acc["total"], acc["matched"] + resolved, acc["unmatched_lines"] - resolved, resolved)
+    return {"records": acc["total"], "matched": acc["matched"] + resolved,
+            "unmatched": acc["unmatched_lines"] - resolved, "resolved": resolved}
+
+
+def _resolve_legacy(cfg: dict, conn, matcher: TemplateMatcher, cls_cache: Dict, run_id: int) -> int:
+    """旧库逐行存于 UNMATCHED_LOG 的记录：每个不同关键文本匹配一次 命中行补入统计并移出 返回补入行数"""
+    hits = []
+    for (key,) in conn.execute("SELECT DISTINCT key_text FROM UNMATCHED_LOG WHERE run_id=?", (run_id,)).fetchall():
+        h = matcher.match_text(key or "")
+        if h is not None:
+            tid = h["template_id"]
+            hits.append((key, tid, _classification(h["semantic_info"], cls_cache, tid)))
+    n = 0
+    if hits:
+        agg = ColumnarAgg(time_buckets(cfg))
+        with write_transaction(conn):
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS resolve_key("
+                         "key_text TEXT PRIMARY KEY, template_id INTEGER, classification TEXT)")
+            conn.execute("DELETE FROM resolve_key")
+            conn.executemany("INSERT INTO resolve_key VALUES(?,?,?)", hits)
+            rows = conn.execute(
+                "SELECT u.mod, u.smod, u.level, u.thread_id, u.timestamp, k.template_id, k.classification "
+                "FROM UNMATCHED_LOG u JOIN resolve_key k ON k.key_text = u.key_text WHERE u.run_id=?", (run_id,))
+            now = now_epoch()
+            for mod, smod, lvl, th, ts_s, tid, cls in rows:
+                ts = parse_ts(ts_s)
+                agg.add(tid, cls, mod or "", smod or "", lvl or "", th or "", ts if ts is not None else now)
+                n += 1
+            write_aggregates(conn, run_id, agg)
+            conn.execute("DELETE FROM UNMATCHED_LOG WHERE run_id=? AND key_text IN (SELECT key_text FROM resolve_key)",
+                         (run_id,))
+            conn.execute("UPDATE RUN_SESSION SET matched_lines=COALESCE(matched_lines,0)+?, "
+                         "unmatched_lines=COALESCE(unmatched_lines,0)-? WHERE run_id=?", (n, n, run_id))
+    return n
+
+
+def resolve_run(cfg: dict, db: Database, run_id: int) -> Tuple[int, int]:
+    """
+    新模板落库后重新匹配某个 run 的未命中记录 无需重读文件：
+    按序读出溢出文件中 UNMATCHED_KEY 首末行序号范围内的记录 每个不同的原始关键文本匹配一次（已补入过的跳过）
+    命中行并入该 run 的 LOG_MATCH_SUMMARY 与 KEY_TIME_BUCKET；UNMATCHED_KEY 行数相应扣减 扣完的键连同样例删除
+    补入的原始关键文本记入 UNMATCHED_RESOLVED 溢出文件不改写；旧库 UNMATCHED_LOG 中的记录照旧处理
+    RUN_SESSION 的命中与未命中行数同步调整 返回 (补入行数, 剩余未命中行数)
+    """
+    conn = db.conn
+    matcher = TemplateMatcher(db)
+    matcher.load_templates()
+    cls_cache: Dict[int, str] = {}
+    n = _resolve_legacy(cfg, conn, matcher, cls_cache, run_id)
+    lo, hi = conn.execute("SELECT MIN(first_seq), MAX(last_seq) FROM UNMATCHED_KEY WHERE run_id=?", (run_id,)).fetchone()
+    if lo is not None:
+        done = resolved_keys(conn, run_id)
+        # 原始关键文本 → ((template_id, 分类), 归一化键) 未命中或已补入过为 (None, None)
+        seen: Dict[str, Tuple] = {}
+        dec: Counter = Counter()
+        agg = ColumnarAgg(time_buckets(cfg))
+        now = now_epoch()
+        for r in iter_records(conn, run_id, lo, hi + 1):
+            e = seen.get(r.key_text)
+            if e is None:
+                h = None if r.key_text in done else matcher.match_text(r.key_text)
+                if h is None:
+                    e = (None, None)
+                else:
+                    tid = h["template_id"]
+                    e = ((tid, _classification(h["semantic_info"], cls_cache, tid)), normalize_key_text(r.key_text))
+                seen[r.key_text] = e
+            hit, norm = e
+            if hit is None:
+                continue
+            ts = parse_ts(r.timestamp)
+            agg.add(hit[0], hit[1], r.mod, r.smod, r.level, r.thread_id, ts if ts is not None else now)
+            dec[(norm, r.mod, r.smod)] += 1
+        m = sum(dec.values())
+        if m:
+            with write_transaction(conn):
+                write_aggregates(conn, run_id, agg)
+                conn.executemany("UPDATE UNMATCHED_KEY SET line_count=line_count-? WHERE run_id=? AND key_text=? "
+                                 "AND mod=? AND smod=?", ((c, run_id, *k) for k, c in dec.items()))
+                conn.execute("DELETE FROM UNMATCHED_EXEMPLAR WHERE run_id=? AND (key_text, mod, smod) IN (SELECT key_text, "
+                             "mod, smod FROM UNMATCHED_KEY WHERE run_id=? AND line_count<=0)", (run_id, run_id))
+                conn.execute("DELETE FROM UNMATCHED_KEY WHERE run_id=? AND line_count<=0", (run_id,))
+                conn.executemany("INSERT OR IGNORE INTO UNMATCHED_RESOLVED(run_id, key_text, template_id) VALUES(?,?,?)",
+                                 ((run_id, k, e[0][0]) for k, e in seen.items() if e[0] is not None))
+                conn.execute("UPDATE RUN_SESSION SET matched_lines=COALESCE(matched_lines,0)+?, "
+                             "unmatched_lines=COALESCE(unmatched_lines,0)-? WHERE run_id=?", (m, m, run_id))
+            n += m
+    left = (conn.execute("SELECT COUNT(*) FROM UNMATCHED_LOG WHERE run_id=?", (run_id,)).fetchone()[0]
+            + conn.execute("SELECT COALESCE(SUM(line_count), 0) FROM UNMATCHED_KEY WHERE run_id=?", (run_id,)).fetchone()[0])
+    logger.info("resolve run=%s: 补入 %d 剩余 %d", run_id, n, left)
+    return n, left
@@ -0,0 +1,218 @@
+# logsys/reducer.py
+"""
+提交 LLM 前的样本归并与按 token 预算打包：
+- 先按 normalize_key_text 归并：只差数字 十六进制 长 ID 的关键文本成为同一形态 出现次数累加
+- 再按 MinHash（归一化文本的词集合 词内数字折叠）+ LSH 分桶找近重复形态 估计 Jaccard 不低于阈值的并为一组
+  （只差路径 组件名等个别词的形态） 组内出现次数最多的原始文本作代表
+- 代表按首次出现顺序渲染为样本行：次数大于 1 时带 [×N] 前缀；与组内同词数的成员逐词对齐
+  取值不同（且不只是数字不同）的位置写成 {a|b|…} 让 LLM 把该位置写成可变部分 提示词模板说明这两种标记
+  按估算 token 数装箱：每个提示词不超过预算 且不超过 max_prompt_samples 行 超出时拆成多个任务
+哈希只用 crc32 与固定种子 结果与进程无关 同一批样本每次分组一致（LLM_CACHE 可稳定命中）
+"""
+
+from __future__ import annotations
+import random
+import re
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .key_extract import normalize_key_text
+
+__all__ = [
+    "Representative",
+    "reduce_samples",
+    "estimate_tokens",
+    "sample_line",
+    "pack_prompts",
+    "plan_samples",
+]
+
+_PRIME = (1 << 31) - 1
+_MAX_HASH = np.uint64(_PRIME)
+_CJK = re.compile(r"[⺀-鿿가-힯＀-￯]")
+_WORD = re.compile(r"\w+|[^\w\s]")
+_TOK = re.compile(r"\w+|\W+")
+_DIGITS = re.compile(r"\d+")
+_MAX_ALTS = 4
+
+
+class Representative:
+    """
+    一组近重复样本的代表：text 为原始关键文本 count 为组内总出现次数 shapes 为归并的形态数
+    shown 为送入提示词的文本（可变位置写成 {a|b|…}） 缺省同 text
+    """
+
+    __slots__ = ("text", "count", "shapes", "shown")
+
+    def __init__(self, text: str, count: int, shapes: int = 1, shown: Optional[str] = None) -> None:
+        self.text = text
+        self.count = count
+        self.shapes = shapes
+        self.shown = shown or text
+
+    def __repr__(self) -> str:
+        return f"Representative({self.text!r}, {self.count}, {self.shapes})"
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估 token 数：中日韩字符各算一个 其余按 4 字符一个"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def sample_line(rep: Representative) -> str:
+    return f"[×{rep.count}] {rep.shown}" if rep.count > 1 else rep.shown
+
+
+def _shingles(text: str, k: int) -> List[int]:
+    toks = _WORD.findall(_DIGITS.sub("0", text))
+    if len(toks) < k:
+        grams = [" ".join(toks)]
+    else:
+        grams = [" ".join(toks[i:i + k]) for i in range(len(toks) - k + 1)]
+    return sorted({zlib.crc32(g.encode("utf-8")) % _PRIME for g in grams})
+
+
+class _MinHasher:
+    def __init__(self, num_perm: int, seed: int = 1) -> None:
+        rng = random.Random(seed)
+        self.a = np.array([rng.randrange(1, _PRIME) for _ in range(num_perm)], dtype=np.uint64)
+        self.b = np.array([rng.randrange(0, _PRIME) for _ in range(num_perm)], dtype=np.uint64)
+
+    def signature(self, shingles: List[int]) -> np.ndarray:
+        h = np.array(shingles, dtype=np.uint64)[:, None]
+        return ((h * self.a + self.b) % _MAX_HASH).min(axis=0)
+
+
+def _fold(tok: str) -> str:
+    return _DIGITS.sub("0", normalize_key_text(tok))
+
+
+def _render(text: str, others: Iterable[str]) -> str:
+    """与同词数的成员逐词对齐 只差数字以外的不同位置写成 {a|b|…}"""
+    toks = _TOK.findall(text)
+    alts: Dict[int, List[str]] = {}
+    for other in others:
+        ot = _TOK.findall(other)
+        if len(ot) != len(toks):
+            continue
+        for i, (a, b) in enumerate(zip(toks, ot)):
+            if a != b and _fold(a) != _fold(b):
+                v = alts.setdefault(i, [a])
+                if b not in v:
+                    v.append(b)
+    for i, v in alts.items():
+        toks[i] = "{" + "|".join(v[:_MAX_ALTS]) + ("|…" if len(v) > _MAX_ALTS else "") + "}"
+    return "".join(toks)
+
+
+def _find(parent: List[int], i: int) -> int:
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def reduce_samples(
+    items: Iterable[Tuple[str, int]],
+    threshold: float = 0.8,
+    num_perm: int = 64,
+    bands: int = 16,
+    shingle: int = 1,
+) -> List[Representative]:
+    """
+    items 为 (关键文本, 出现次数) 按首次出现顺序；threshold>=1 时只做归一化归并
+    返回代表列表 顺序为各组首次出现的顺序
+    """
+    shapes: Dict[str, List] = {}       # 归一化形态 → [出现次数, 原始文本 → 次数]
+    for text, n in items:
+        text = (text or "").strip()
+        if not text:
+            continue
+        norm = normalize_key_text(text)
+        g = shapes.get(norm)
+        if g is None:
+            g = shapes[norm] = [0, {}]
+        g[0] += n
+        g[1][text] = g[1].get(text, 0) + n
+    norms = list(shapes)
+    parent = list(range(len(norms)))
+    if threshold < 1 and len(norms) > 1:
+        rows = max(1, num_perm // bands)
+        mh = _MinHasher(rows * bands)
+        sigs = np.stack([mh.signature(_shingles(t, shingle)) for t in norms])
+        for b in range(bands):
+            buckets: Dict[bytes, int] = {}
+            for i, key in enumerate(map(bytes, sigs[:, b * rows:(b + 1) * rows])):
+                j = buckets.setdefault(key, i)
+                if j == i:
+                    continue
+                ri, rj = _find(parent, i), _find(parent, j)
+                if ri != rj and np.mean(sigs[i] == sigs[j]) >= threshold:
+                    parent[max(ri, rj)] = min(ri, rj)
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(norms)):
+        groups.setdefault(_find(parent, i), []).append(i)
+    out = []
+    for members in groups.values():
+        best: Optional[Tuple[int, str]] = None
+        tops = []                        # 各形态出现最多的原始文本 用于对齐可变位置
+        total = 0
+        for i in members:
+            cnt, raws = shapes[norms[i]]
+            total += cnt
+            top = max(raws.items(), key=lambda kv: kv[1])
+            tops.append(top[0])
+            if best is None or top[1] > best[0]:
+                best = (top[1], top[0])
+        shown = _render(best[1], tops) if len(members) > 1 else None
+        out.append(Representative(best[1], total, len(members), shown))
+    return out
+
+
+def pack_prompts(
+    reps: List[Representative],
+    budget_tokens: int,
+    overhead_tokens: int = 0,
+    max_samples: Optional[int] = None,
+) -> List[List[str]]:
+    """
+    按顺序装箱：每箱样本行的估算 token 数加 overhead_tokens（模板本身）不超过 budget_tokens
+    且不超过 max_samples 行；单行超出预算时截断后独占一箱
+    """
+    room = max(1, budget_tokens - overhead_tokens)
+    out: List[List[str]] = []
+    cur: List[str] = []
+    used = 0
+    for rep in reps:
+        line = sample_line(rep)
+        t = estimate_tokens(line) + 2      # 行首 "- " 与换行
+        if t > room:
+            line = line[:room * 2]
+            t = room
+        if cur and (used + t > room or (max_samples and len(cur) >= max_samples)):
+            out.append(cur)
+            cur, used = [], 0
+        cur.append(line)
+        used += t
+    if cur:
+        out.append(cur)
+    return out
+
+
+def plan_samples(cfg: dict, items: Iterable[Tuple[str, int]], tmpl: str) -> List[List[str]]:
+    """
+    按配置把 (关键文本, 出现次数) 切成每个 LLM 任务的样本行：
+      llm.reduce（缺省开启）: 近重复归并后按 llm.prompt_token_budget（缺省 8000）装箱 阈值 llm.reduce_threshold（缺省 0.8）
+      关闭时按旧方式 不同关键文本每 max_prompt_samples 条一个任务
+    """
+    llm = cfg["llm"]
+    size = max(1, int(llm.get("max_prompt_samples", 50)))
+    if not llm.get("reduce", True):
+        keys = list(dict.fromkeys(t.strip() for t, _ in items if t and t.strip()))
+        return [keys[i:i + size] for i in range(0, len(keys), size)]
+    reps = reduce_samples(items, float(llm.get("reduce_threshold", 0.8)))
+    return pack_prompts(reps, int(llm.get("prompt_token_budget", 8000)),
+                        estimate_tokens(tmpl.replace("{SAMPLES}", "")), size)
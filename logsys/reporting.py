@@ -1,6 +1,200 @@
-# -*- coding: utf-8 -*-
-from .db import Database
-def top_keys(db: Database, run_id:int, limit=20):
-    sql='''\nSELECT template_id, mod, smod, classification, level, thread_id, line_count FROM LOG_MATCH_SUMMARY WHERE run_id=? ORDER BY line_count DESC LIMIT ?\n'''
+# logsys/reporting.py
+"""
+报表查询与跨 run 汇总表：
+- ROLLUP_HOUR ROLLUP_DAY 按 (mod, 小时 / 天, template_id) 累加全部 run 的命中行数 ROLLUP_RUN 按 (run_id, template_id, mod)
+  pass2 每批写 KEY_TIME_BUCKET 的同一事务内由 write_rollups 增量累加（粒度取能整除小时 / 天的最粗 app.time_bucket）
+- 表为 WITHOUT ROWID 主键与二级索引都带 line_count 查询只走索引 扫描量与时间范围内的汇总行数有关 与 KEY_TIME_BUCKET 行数无关
+- top_templates 时间范围内的前 k 个模板 trend 小时 / 天趋势 run_diff 两个 run 的按模板差异
+- 时间参数为 ISO 字符串或日期 如 '2024-01-05' '2024-01-05T10:00:00' start 含 end 不含
+- 失败的 run 由 retract_run 从汇总表扣除（按它自己的 KEY_TIME_BUCKET 与 LOG_MATCH_SUMMARY） 续跑前 restore_run 加回；
+  同一内容的 PASS2 成功收尾时 supersede_runs 扣除该文件其余 run（--force 重算或中途被杀的） 之前成功的记为 已取代
+  RUN_SESSION.rollup_retracted=1 标记已扣除 不重复扣除
+- rebuild_rollups 从未扣除 run 的 KEY_TIME_BUCKET LOG_MATCH_SUMMARY 重建（旧库或汇总表损坏时）
+"""
+
+from __future__ import annotations
+import logging
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+from .db import Database, bulk_upsert, write_transaction
+from .utils import gran_seconds
+
+__all__ = [
+    "top_keys",
+    "write_rollups",
+    "retract_run",
+    "restore_run",
+    "supersede_runs",
+    "rebuild_rollups",
+    "top_templates",
+    "trend",
+    "run_diff",
+]
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_HOUR_COLS = ("mod", "hour_start", "template_id", "line_count")
+ROLLUP_DAY_COLS = ("mod", "day", "template_id", "line_count")
+ROLLUP_RUN_COLS = ("run_id", "template_id", "mod", "line_count")
+ROLLUP_UPDATE = "line_count = line_count + excluded.line_count"
+# 粒度 → (表, 时间列)
+_LIVE = "run_id NOT IN (SELECT run_id FROM RUN_SESSION WHERE rollup_retracted=1)"
+_TABLES = {"hour": ("ROLLUP_HOUR", "hour_start"), "day": ("ROLLUP_DAY", "day")}
+
+
+def top_keys(db: Database, run_id: int, limit=20):
+    sql = '''\nSELECT template_id, mod, smod, classification, level, thread_id, line_count FROM LOG_MATCH_SUMMARY WHERE run_id=? ORDER BY line_count DESC LIMIT ?\n'''
     return db.query(sql, (run_id, limit))
 
+
+def write_rollups(conn: sqlite3.Connection, run_id: int, agg) -> int:
+    """在调用方的事务内 把一批 ColumnarAgg 累加进三张汇总表 返回写入行数"""
+    n = bulk_upsert(conn, "ROLLUP_RUN", ROLLUP_RUN_COLS,
+                    ((run_id, tid, mod, cnt) for mod, tid, cnt in agg.mod_totals()),
+                    ROLLUP_RUN_COLS[:3], ROLLUP_UPDATE)
+    n += bulk_upsert(conn, "ROLLUP_HOUR", ROLLUP_HOUR_COLS, agg.rollup_rows(3600), ROLLUP_HOUR_COLS[:3], ROLLUP_UPDATE)
+    n += bulk_upsert(conn, "ROLLUP_DAY", ROLLUP_DAY_COLS, agg.rollup_rows(86400), ROLLUP_DAY_COLS[:3], ROLLUP_UPDATE)
+    return n
+
+
+def _source_gran(conn: sqlite3.Connection, step: int, run_id: Optional[int] = None) -> Optional[str]:
+    """能整除 step 的最粗分桶粒度 run_id 给出时只看该 run 的桶（与 ColumnarAgg.rollup_rows 取法一致）"""
+    best, best_s = None, 0
+    sql, args = "SELECT DISTINCT bucket_granularity FROM KEY_TIME_BUCKET", ()
+    if run_id is not None:
+        sql, args = sql + " WHERE run_id=?", (run_id,)
+    for (g,) in conn.execute(sql, args):
+        try:
+            s = gran_seconds(g)
+        except ValueError:
+            continue
+        if step % s == 0 and s > best_s:
+            best, best_s = g, s
+    return best
+
+
+def _apply_run(conn: sqlite3.Connection, run_id: int, sign: int) -> int:
+    """把该 run 的明细按 sign（-1 扣除 / 1 加回）计入小时 / 天汇总 ROLLUP_RUN 相应删除 / 重算 返回变动的汇总行数"""
+    row = conn.execute("SELECT COALESCE(rollup_retracted, 0) FROM RUN_SESSION WHERE run_id=?", (run_id,)).fetchone()
+    if row is None or row[0] == (1 if sign < 0 else 0):
+        return 0
+    n = conn.execute("DELETE FROM ROLLUP_RUN WHERE run_id=?", (run_id,)).rowcount
+    if sign > 0:
+        n = conn.execute("INSERT INTO ROLLUP_RUN(run_id, template_id, mod, line_count) "
+                         "SELECT run_id, template_id, COALESCE(mod, ''), SUM(line_count) FROM LOG_MATCH_SUMMARY "
+                         "WHERE run_id=? AND template_id IS NOT NULL GROUP BY 1, 2, 3", (run_id,)).rowcount
+    for gran, step, cut in (("hour", 3600, 13), ("day", 86400, 10)):
+        table, col = _TABLES[gran]
+        src = _source_gran(conn, step, run_id)
+        if src is None:
+            if n and sign < 0:
+                logger.warning("run=%s 没有能整除 %s 的 KEY_TIME_BUCKET（可能已 archive --purge） 无法从 %s 扣除",
+                               run_id, gran, table)
+            continue
+        pad = ":00:00" if gran == "hour" else "T00:00:00"
+        sel = (f"SELECT COALESCE(mod, '') AS m, substr(bucket_start, 1, {cut}) || '{pad}' AS b, template_id, "
+               f"{sign} * SUM(count_in_bucket) FROM KEY_TIME_BUCKET WHERE run_id=? AND bucket_granularity=? "
+               f"AND template_id IS NOT NULL GROUP BY 1, 2, 3")
+        n += conn.execute(f"INSERT INTO {table}(mod, {col}, template_id, line_count) {sel} "
+                          f"ON CONFLICT(mod, {col}, template_id) DO UPDATE SET {ROLLUP_UPDATE}", (run_id, src)).rowcount
+        if sign < 0:
+            conn.execute(f"DELETE FROM {table} WHERE line_count <= 0 AND (mod, {col}, template_id) IN "
+                         f"(SELECT m, b, template_id FROM ({sel}))", (run_id, src))
+    conn.execute("UPDATE RUN_SESSION SET rollup_retracted=? WHERE run_id=?", (1 if sign < 0 else 0, run_id))
+    return n
+
+
+def retract_run(conn: sqlite3.Connection, run_id: int) -> int:
+    """在调用方的事务内 从三张汇总表扣除该 run 已写入的统计（run 失败或被取代时） 已扣除过的不重复扣"""
+    return _apply_run(conn, run_id, -1)
+
+
+def restore_run(conn: sqlite3.Connection, run_id: int) -> int:
+    """续跑前把已扣除的 run 加回汇总表 续跑只再累加断点之后的部分；未扣除过的不变"""
+    return _apply_run(conn, run_id, 1)
+
+
+def supersede_runs(conn: sqlite3.Connection, run_id: int) -> List[int]:
+    """
+    该 run 成功收尾时调用：同一文件（按内容）的其余 PASS2 run 从汇总表扣除 之前成功或中途被杀的记为 已取代
+    follow 每次登记新的 file_id 不受影响；返回被扣除的 run_id
+    """
+    rows = conn.execute(
+        "SELECT r.run_id, r.status FROM RUN_SESSION r JOIN RUN_SESSION me ON me.run_id=? "
+        "WHERE r.file_id=me.file_id AND r.pass_type='PASS2' AND r.run_id!=me.run_id "
+        "AND COALESCE(r.rollup_retracted, 0)=0", (run_id,)).fetchall()
+    for rid, status in rows:
+        retract_run(conn, rid)
+        if status in ("成功", "运行中"):
+            conn.execute("UPDATE RUN_SESSION SET status='已取代' WHERE run_id=?", (rid,))
+    if rows:
+        logger.info("run=%s 取代同一文件的 run %s 其统计已从汇总表扣除", run_id, [r[0] for r in rows])
+    return [r[0] for r in rows]
+
+
+def rebuild_rollups(db: Database) -> Dict[str, int]:
+    """
+    清空汇总表后从明细重建：小时 / 天取 KEY_TIME_BUCKET 中能整除它的最粗粒度 run 汇总取 LOG_MATCH_SUMMARY
+    某个 run 没有该粒度的桶时 它不计入对应的小时 / 天汇总；已扣除（失败 已取代）的 run 不计入；返回各表行数
+    """
+    conn = db.conn
+    out: Dict[str, int] = {}
+    with write_transaction(conn) as c:
+        c.execute("DELETE FROM ROLLUP_RUN")
+        c.execute("INSERT INTO ROLLUP_RUN(run_id, template_id, mod, line_count) "
+                  "SELECT run_id, template_id, COALESCE(mod, ''), SUM(line_count) FROM LOG_MATCH_SUMMARY "
+                  f"WHERE template_id IS NOT NULL AND {_LIVE} GROUP BY 1, 2, 3")
+        for gran, step, cut in (("hour", 3600, 13), ("day", 86400, 10)):
+            table, col = _TABLES[gran]
+            c.execute(f"DELETE FROM {table}")
+            src = _source_gran(c, step)
+            if src is None:
+                logger.warning("KEY_TIME_BUCKET 中没有能整除 %s 的粒度 %s 保持为空", gran, table)
+                continue
+            pad = ":00:00" if gran == "hour" else "T00:00:00"
+            c.execute(f"INSERT INTO {table}(mod, {col}, template_id, line_count) "
+                      f"SELECT COALESCE(mod, ''), substr(bucket_start, 1, {cut}) || '{pad}', template_id, SUM(count_in_bucket) "
+                      f"FROM KEY_TIME_BUCKET WHERE bucket_granularity=? AND template_id IS NOT NULL AND {_LIVE} GROUP BY 1, 2, 3",
+                      (src,))
+        for table in ("ROLLUP_RUN", "ROLLUP_HOUR", "ROLLUP_DAY"):
+            out[table] = c.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    return out
+
+
+def top_templates(db: Database, start: str, end: str, mod: Optional[str] = None, k: int = 20,
+                  gran: str = "day") -> List[Tuple[int, int]]:
+    """[start, end) 内命中行数最多的 k 个模板 [(template_id, 行数)]；gran='hour' 时按小时边界截取"""
+    table, col = _TABLES[gran]
+    where, args = f"{col} >= ? AND {col} < ?", [start, end]
+    if mod is not None:
+        where += " AND mod = ?"
+        args.append(mod)
+    sql = (f"SELECT template_id, SUM(line_count) AS n FROM {table} WHERE {where} "
+           f"GROUP BY template_id ORDER BY n DESC, template_id LIMIT ?")
+    return [tuple(r) for r in db.conn.execute(sql, args + [k])]
+
+
+def trend(db: Database, start: str, end: str, template_id: Optional[int] = None, mod: Optional[str] = None,
+          gran: str = "hour") -> List[Tuple[str, int]]:
+    """[start, end) 内按小时 / 天的命中行数 [(桶起点, 行数)] 可按模板 mod 过滤；只列出有数据的桶"""
+    table, col = _TABLES[gran]
+    where, args = f"{col} >= ? AND {col} < ?", [start, end]
+    if template_id is not None:
+        where += " AND template_id = ?"
+        args.append(template_id)
+    if mod is not None:
+        where += " AND mod = ?"
+        args.append(mod)
+    sql = f"SELECT {col}, SUM(line_count) FROM {table} WHERE {where} GROUP BY {col} ORDER BY {col}"
+    return [tuple(r) for r in db.conn.execute(sql, args)]
+
+
+def run_diff(db: Database, run_a: int, run_b: int, mod: Optional[str] = None,
+             k: int = 20) -> List[Tuple[int, int, int, int]]:
+    """两个 run 按模板的命中行数差异 [(template_id, a 行数, b 行数, b - a)] 按差值绝对值降序取前 k 个"""
+    flt, args = ("", []) if mod is None else (" AND mod = ?", [mod])
+    sql = (f"SELECT template_id, SUM(CASE WHEN run_id = ? THEN line_count ELSE 0 END) AS a, "
+           f"SUM(CASE WHEN run_id = ? THEN line_count ELSE 0 END) AS b FROM ROLLUP_RUN "
+           f"WHERE run_id IN (?, ?){flt} GROUP BY template_id ORDER BY abs(b - a) DESC, template_id LIMIT ?")
+    return [(t, a, b, b - a) for t, a, b in db.conn.execute(sql, [run_a, run_b, run_a, run_b] + args + [k])]
@@ -0,0 +1,259 @@
+# logsys/scanner.py
+"""
+pass2 融合字节扫描：替代 read_gz_lines → normalize_lines → parse_line → extract_key_text 链路
+- 直接处理解压输出的字节 按记录首行 [YYYYMMDD_HHMMSS] 切成与记录边界对齐的块
+  块可原样发给 worker 切块只做块级正则查找 不逐行解码
+- 块内续行合并是一次 re.sub（回调只在续行上触发） 随后按换行切出记录
+- 每条记录一次 _HEAD.match 得到 时间戳 级别 以及前缀中括号段的结束位置（关键文本起点）
+  常见的 [...][MOD:x][SMOD:y] 前缀由同一次匹配取出 其余情形才逐段查找 MOD/SMOD
+- 只解码用到的字段；原始记录以字节返回 由调用方在需要时（如未命中）解码
+记录为元组 (timestamp, level, mod, smod, key_text, raw)
+对合法 UTF-8 输入与原链路逐字段一致（通用换行 续行去空白后以空格拼接 MOD/SMOD 取最后一次出现）；
+记录首行判定只认 ASCII 数字
+"""
+
+from __future__ import annotations
+import itertools
+import re
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from . import gzindex
+from .parser import PMOD, PSMOD
+
+__all__ = [
+    "Record",
+    "BLOCK_SIZE",
+    "iter_blocks",
+    "iter_blocks_at",
+    "iter_blocks_range",
+    "record_cut",
+    "scan_block",
+    "iter_records",
+]
+
+Record = Tuple[str, Optional[str], Optional[str], Optional[str], str, bytes]
+
+ENCODING = "utf-8"
+ERRORS = "ignore"        # 与 ingest.read_gz_lines 一致
+BLOCK_SIZE = 1 << 20     # 切块目标大小（字节）
+
+_REC = re.compile(rb"^\[\d{8}_\d{6}\]", re.M)
+# 含 \r 的数据：单独的 \r 也是行尾（与 gzip 文本模式的通用换行一致）
+_REC_CR = re.compile(rb"(?:^|(?<=\r))\[\d{8}_\d{6}\]", re.M)
+# 非记录首行的续行（含块末的空行）
+_CONT = re.compile(rb"\n(?!\[\d{8}_\d{6}\])([^\n]*)")
+# 时间戳 可选级别（第三个中括号段为单个 EWID） 其后连续的中括号段
+_HEAD = re.compile(rb"\[(\d{8}_\d{6})\](?:\[[^\]]+\]\[([EWID])\])?(?:\[[^\]]*\])*")
+# 常见布局：前缀以 [MOD:x][SMOD:y] 结尾 x y 不含冒号 正文不含 MOD: 时
+# 按“最后一次出现”规则 MOD/SMOD 就是这两段的值 无需逐段查找
+_FAST = re.compile(rb"\[(\d{8}_\d{6})\](?:\[[^\]]+\]\[([EWID])\])?(?:\[[^\]]*\])*?"
+                   rb"\[MOD:([^\]:]+)\]\[SMOD:([^\]:]+)\](?!\[)")
+_BR = re.compile(rb"\[([^\]]+)\]")
+_PMOD_B = re.compile(rb"\bMOD:([^\]]+)")
+_PSMOD_B = re.compile(rb"\bSMOD:([^\]]+)")
+_LEVELS = {b"E": "E", b"W": "W", b"I": "I", b"D": "D"}
+# str.strip() 在 ASCII 范围内去除的字符
+_WS = b" \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f"
+
+
+# === 切块 ===
+
+def _last_start(data: bytes, cut: int, rec_re) -> int:
+    """data[:cut] 由完整行组成 返回其中最后一条记录首行的位置 没有则为 0"""
+    j = cut - 1
+    while True:
+        i = data.rfind(b"\n", 0, j) + 1
+        if rec_re is _REC:
+            if rec_re.match(data, i):
+                return i
+        else:
+            last = None
+            for last in rec_re.finditer(data, i, j):
+                pass
+            if last is not None:
+                return last.start()
+        if i == 0:
+            return 0
+        j = i - 1
+
+
+def record_cut(data: bytes) -> int:
+    """
+    data 由完整行组成 返回其中最后一条记录首行的起点（没有则为 0）
+    其前的内容是完整的记录 之后到达的行不会再并入 可先行扫描
+    """
+    if not data:
+        return 0
+    return _last_start(data, len(data), _REC_CR if b"\r" in data else _REC)
+
+
+def iter_blocks(chunks: Iterable[bytes], block_size: int = BLOCK_SIZE,
+                end: Optional[int] = None) -> Iterator[bytes]:
+    """
+    解压字节流 → 记录对齐块：以记录首行开头 以换行结尾（流末块可无换行）
+    首条记录之前的行丢弃（同 normalize_lines）；一条记录的续行总在同一块内
+    end 为相对流起点的偏移：首行起点 >= end 的记录及其后内容不再产出
+    """
+    for _, block in iter_blocks_at(chunks, block_size, end):
+        yield block
+
+
+def iter_blocks_at(chunks: Iterable[bytes], block_size: int = BLOCK_SIZE,
+                   end: Optional[int] = None, offset: int = 0) -> Iterator[Tuple[int, bytes]]:
+    """
+    同 iter_blocks 并给出块后的流偏移 (pos, block)：pos 为下一条记录首行起点（或流末）
+    之前的记录均已在本块及之前的块中 可作为断点；offset 为 chunks 起点在流中的偏移 end 与 pos 同一坐标
+    """
+    carry = b""
+    base = offset            # carry[0] 在流中的偏移
+    started = False
+    out: List[bytes] = []
+    size = 0
+    for chunk in itertools.chain(chunks, (None,)):
+        final = chunk is None
+        data = carry if final else (carry + chunk if carry else chunk)
+        if not data:
+            if final:
+                pos = base
+                break
+            continue
+        rec_re = _REC_CR if b"\r" in data else _REC
+        cut = len(data) if final else data.rfind(b"\n") + 1
+        if not started:
+            m = rec_re.search(data, 0, cut)
+            if m is None:
+                base += cut
+                carry = data[cut:]
+                continue
+            started = True
+            s = m.start()
+            base += s
+            data = data[s:]
+            cut -= s
+        if end is not None:
+            q = end - base
+            p = 0 if q <= 0 else data.find(b"\n", q - 1) + 1
+            if q <= 0 or p > 0:
+                m = rec_re.search(data, p, cut)
+                if m is not None:
+                    if m.start():
+                        out.append(data[:m.start()])
+                    if out:
+                        yield base + m.start(), b"".join(out)
+                    return
+        if final:
+            out.append(data)
+            pos = base + len(data)
+            break
+        last = _last_start(data, cut, rec_re)
+        if last:
+            out.append(data[:last])
+            size += last
+            carry = data[last:]
+            base += last
+        else:
+            carry = data
+        if size >= block_size:
+            yield base, b"".join(out)
+            out.clear()
+            size = 0
+    if out:
+        yield pos, b"".join(out)
+
+
+def iter_blocks_range(path: str, index: gzindex.GzIndex, start: int, end: int,
+                      block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    """
+    按 gzip 访问点解压区段 [start, end)：产出首行起点落在区段内的记录
+    与 gzindex.iter_records_range 的归属规则相同 相邻区段首尾衔接 不重不漏
+    """
+    base = max(start - 1, 0)
+    it = gzindex.iter_bytes_from(path, index, base)
+    if start > 0:
+        # 丢弃 start-1 所在的行 其首行起点必在区段之前
+        for data in it:
+            j = data.find(b"\n")
+            if j >= 0:
+                base += j + 1
+                it = itertools.chain((data[j + 1:],), it)
+                break
+            base += len(data)
+        else:
+            return
+    for _, block in iter_blocks_at(it, block_size, end, base):
+        yield block
+
+
+# === 字段抽取 ===
+
+def _join_cont(m: "re.Match[bytes]") -> bytes:
+    s = m.group(1).strip(_WS)
+    if s and (s[0] >= 0x80 or s[-1] >= 0x80):
+        # 首尾为非 ASCII 时按 str.strip() 的 Unicode 空白规则处理
+        s = m.group(1).decode(ENCODING, ERRORS).strip().encode(ENCODING)
+    return b" " + s if s else b""
+
+
+def _part_mod_smod(p: bytes) -> Tuple[Optional[str], Optional[str]]:
+    """单个中括号段内的 MOD/SMOD 与 parser.PMOD/PSMOD 的 search 语义一致"""
+    if not p.isascii():
+        t = p.decode(ENCODING, ERRORS)
+        m, s = PMOD.search(t), PSMOD.search(t)
+        return (m.group("mod") if m else None), (s.group("smod") if s else None)
+    if p.startswith(b"MOD:") and len(p) > 4 and b"SMOD:" not in p:
+        return p[4:].decode("ascii"), None
+    if p.startswith(b"SMOD:") and len(p) > 5 and p.find(b"MOD:", 2) < 0:
+        return None, p[5:].decode("ascii")
+    m, s = _PMOD_B.search(p), _PSMOD_B.search(p)
+    return (m.group(1).decode("ascii") if m else None), (s.group(1).decode("ascii") if s else None)
+
+
+def _mod_smod(rec: bytes, head_end: int) -> Tuple[Optional[str], Optional[str]]:
+    """按 parse_line 的规则：遍历全部中括号段 后出现的覆盖先出现的"""
+    # 前缀段紧密相连 段内不含 ] 按 ][ 切分即得各段内容
+    parts = rec[1:head_end - 1].split(b"][")
+    if rec.find(b"MOD:", head_end) >= 0:
+        parts.extend(_BR.findall(rec, head_end))
+    mod = smod = None
+    for p in parts:
+        if b"MOD:" in p:
+            m, s = _part_mod_smod(p)
+            if m is not None:
+                mod = m
+            if s is not None:
+                smod = s
+    return mod, smod
+
+
+def scan_block(block: bytes) -> Iterator[Record]:
+    """记录对齐块 → 记录元组；块首不是记录首行时跳过到第一条记录"""
+    if b"\r" in block:
+        block = block.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+    if not _REC.match(block):
+        m = _REC.search(block)
+        if m is None:
+            return
+        block = block[m.start():]
+    block = _CONT.sub(_join_cont, block)
+    fast, head, levels = _FAST.match, _HEAD.match, _LEVELS
+    for rec in block.split(b"\n"):
+        m = fast(rec)
+        if m is not None:
+            k = m.end()
+            if rec.find(b"MOD:", k) < 0:
+                ts, lv, mod, smod = m.group(1, 2, 3, 4)
+                yield (ts.decode("ascii"), levels.get(lv), mod.decode(ENCODING, ERRORS),
+                       smod.decode(ENCODING, ERRORS), rec[k:].decode(ENCODING, ERRORS).strip(), rec)
+                continue
+        m = head(rec)
+        k = m.end()
+        mod = smod = None
+        if b"MOD:" in rec:
+            mod, smod = _mod_smod(rec, k)
+        yield (m.group(1).decode("ascii"), levels.get(m.group(2)), mod, smod,
+               rec[k:].decode(ENCODING, ERRORS).strip(), rec)
+
+
+def iter_records(chunks: Iterable[bytes], block_size: int = BLOCK_SIZE) -> Iterator[Record]:
+    for block in iter_blocks(chunks, block_size):
+        yield from scan_block(block)
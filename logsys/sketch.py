@@ -0,0 +1,83 @@
+# logsys/sketch.py
+"""
+pass1 唯一关键文本的频次摘要（Space-Saving 批量淘汰变体）：
+- 最多保留 2 × capacity 个键 满时按计数只留前 capacity 个 其余整体淘汰（摊还每个新键 O(log capacity)）
+- floor 为已淘汰键的最大计数 新键的计数从 floor 起算 并记 err = floor
+  于是 真实次数 <= count <= 真实次数 + err（err <= floor <= 总次数 / capacity） count - err 为真实次数的下界
+- 高频键一旦进入摘要就不会被淘汰 低频长尾在前 capacity 名之外互相替换；内存只与 capacity 有关 与文件大小无关
+- items 为键的附带对象（如首个样本） 随键一起淘汰
+"""
+
+from __future__ import annotations
+import heapq
+from typing import Any, Dict, Hashable, List, Tuple
+
+__all__ = [
+    "SpaceSaving",
+]
+
+
+class SpaceSaving:
+    """按键计数 键数有上限；add 返回该键是否新进入摘要 调用方据此登记 items"""
+
+    __slots__ = ("capacity", "floor", "total", "evicted", "counts", "errs", "items")
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = max(1, int(capacity))
+        self.floor = 0
+        self.total = 0
+        self.evicted = 0
+        self.counts: Dict[Hashable, int] = {}
+        self.errs: Dict[Hashable, int] = {}
+        self.items: Dict[Hashable, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.counts
+
+    def add(self, key: Hashable, n: int = 1) -> bool:
+        self.total += n
+        c = self.counts.get(key)
+        if c is not None:
+            self.counts[key] = c + n
+            return False
+        if len(self.counts) >= 2 * self.capacity:
+            self._prune()
+        self.counts[key] = self.floor + n
+        if self.floor:
+            self.errs[key] = self.floor
+        return True
+
+    def _prune(self) -> None:
+        counts = self.counts
+        keep = heapq.nlargest(self.capacity, counts.items(), key=lambda kv: kv[1])
+        kept = dict(keep)
+        floor = self.floor
+        for k, c in counts.items():
+            if k not in kept:
+                if c > floor:
+                    floor = c
+                self.errs.pop(k, None)
+                self.items.pop(k, None)
+        self.floor = floor
+        self.evicted += len(counts) - len(kept)
+        self.counts = kept
+
+    def count(self, key: Hashable) -> int:
+        """估计次数（上界） 不在摘要中的键为 floor"""
+        return self.counts.get(key, self.floor)
+
+    def guaranteed(self, key: Hashable) -> int:
+        """真实次数的下界"""
+        c = self.counts.get(key)
+        return 0 if c is None else c - self.errs.get(key, 0)
+
+    def top(self, k: int = 0) -> List[Tuple[Hashable, int, int]]:
+        """按估计次数降序的 (键, 估计次数, 误差) k 为 0 时返回全部"""
+        errs = self.errs
+        rows = sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)
+        if k:
+            rows = rows[:k]
+        return [(key, c, errs.get(key, 0)) for key, c in rows]
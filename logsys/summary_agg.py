@@ -1,32 +1,46 @@
 # -*- coding: utf-8 -*-
+"""
+merge-summary 增量合并：REGEX_TEMPLATE TEMPLATE_APPLICABILITY 上的触发器把有变化的 template_id 记入 SUMMARY_DIRTY
+每次只合并这些模板：模板行与其全部适用上下文各一条 INSERT ... SELECT ... ON CONFLICT 在一个写事务内完成 随后清空 SUMMARY_DIRTY
+耗时只与上次合并以来变化的模板数有关 可在每个文件处理完后执行（app.merge_summary）
+full 时先把全部模板记为有变化 等同原来的全量合并
+"""
 from datetime import datetime
-from .db import Database
-def merge_to_summary(db: Database):
+from typing import Dict
+from .db import Database, write_transaction
+
+TEMPLATE_SQL='''
+INSERT INTO SUMMARY_REGEX_TEMPLATE(template_id, pattern, sample_log, normalized_sample, version, is_active, semantic_info, aggregated_at, total_match_count, first_seen_global, last_seen_global)
+SELECT t.template_id, t.pattern, t.sample_log, t.normalized_sample, t.version, t.is_active, t.semantic_info, ?, t.match_count, t.first_seen, t.last_seen
+  FROM REGEX_TEMPLATE t JOIN SUMMARY_DIRTY d ON d.template_id = t.template_id WHERE 1
+ON CONFLICT(template_id) DO UPDATE SET
+  pattern=excluded.pattern,
+  sample_log=excluded.sample_log,
+  normalized_sample=excluded.normalized_sample,
+  version=excluded.version,
+  is_active=excluded.is_active,
+  semantic_info=excluded.semantic_info,
+  aggregated_at=excluded.aggregated_at,
+  total_match_count=excluded.total_match_count,
+  first_seen_global=excluded.first_seen_global,
+  last_seen_global=excluded.last_seen_global
+'''
+APPLICABILITY_SQL='''
+INSERT INTO SUMMARY_TEMPLATE_APPLICABILITY(template_id, mod, smod, total_count, first_seen_in_ctx, last_seen_in_ctx, source, last_updated)
+SELECT a.template_id, a.mod, a.smod, COALESCE(SUM(a.observed_count), 0), MIN(a.first_seen_in_ctx), MAX(a.last_seen_in_ctx), 'mixed', ?
+  FROM TEMPLATE_APPLICABILITY a WHERE a.template_id IN (SELECT template_id FROM SUMMARY_DIRTY)
+ GROUP BY a.template_id, a.mod, a.smod
+ON CONFLICT(template_id, mod, smod, source) DO UPDATE SET
+  total_count=excluded.total_count,
+  last_seen_in_ctx=excluded.last_seen_in_ctx,
+  last_updated=excluded.last_updated
+'''
+def merge_to_summary(db: Database, full: bool=False) -> Dict[str, int]:
+    """合并自上次以来有变化的模板 返回 {"templates": 合并的模板数, "contexts": 写入的适用上下文行数}"""
     now=datetime.utcnow().isoformat()
-    rows=db.query('SELECT * FROM REGEX_TEMPLATE')
-    for r in rows:
-        db.execute('''
-        INSERT INTO SUMMARY_REGEX_TEMPLATE(template_id, pattern, sample_log, normalized_sample, version, is_active, semantic_info, aggregated_at, total_match_count, first_seen_global, last_seen_global)
-        VALUES(?,?,?,?,?,?,?,?,?,?,?)
-        ON CONFLICT(template_id) DO UPDATE SET
-          pattern=excluded.pattern,
-          sample_log=excluded.sample_log,
-          normalized_sample=excluded.normalized_sample,
-          version=excluded.version,
-          is_active=excluded.is_active,
-          semantic_info=excluded.semantic_info,
-          aggregated_at=excluded.aggregated_at,
-          total_match_count=excluded.total_match_count,
-          first_seen_global=excluded.first_seen_global,
-          last_seen_global=excluded.last_seen_global
-        ''', (r['template_id'], r['pattern'], r['sample_log'], r['normalized_sample'], r['version'], r['is_active'], r['semantic_info'], now, r['match_count'], r['first_seen'], r['last_seen']))
-    a=db.query('SELECT template_id, mod, smod, SUM(observed_count) c, MIN(first_seen_in_ctx) fmin, MAX(last_seen_in_ctx) fmax FROM TEMPLATE_APPLICABILITY GROUP BY template_id, mod, smod')
-    for it in a:
-        db.execute('''
-        INSERT INTO SUMMARY_TEMPLATE_APPLICABILITY(template_id, mod, smod, total_count, first_seen_in_ctx, last_seen_in_ctx, source, last_updated)
-        VALUES(?,?,?,?,?,?,?,?)
-        ON CONFLICT(template_id, mod, smod, source) DO UPDATE SET
-          total_count=excluded.total_count,
-          last_seen_in_ctx=excluded.last_seen_in_ctx,
-          last_updated=excluded.last_updated
-        ''', (it['template_id'], it['mod'], it['smod'], it['c'] or 0, it['fmin'], it['fmax'], 'mixed', now))
+    with write_transaction(db.conn) as conn:
+        if full: conn.execute('INSERT OR IGNORE INTO SUMMARY_DIRTY(template_id) SELECT template_id FROM REGEX_TEMPLATE')
+        n=conn.execute(TEMPLATE_SQL, (now,)).rowcount
+        m=conn.execute(APPLICABILITY_SQL, (now,)).rowcount
+        conn.execute('DELETE FROM SUMMARY_DIRTY')
+    return {'templates': max(n, 0), 'contexts': max(m, 0)}
@@ -1,14 +1,34 @@
 # -*- coding: utf-8 -*-
 import json
 from datetime import datetime
-from typing import List, Dict
-from .db import Database
+from typing import Iterable, List, Dict, Tuple
+from .db import Database, bulk_upsert, write_transaction
+APP_COLS=('template_id','mod','smod','observed_count','first_seen_in_ctx','last_seen_in_ctx','source','last_updated')
+def registry_version(conn) -> int:
+    """模板注册表版本 每次模板增改 停用都会递增；表不存在（未 init-db 的旧库）时为 0"""
+    try: r=conn.execute('SELECT version FROM TEMPLATE_REGISTRY WHERE id=1').fetchone()
+    except Exception: return 0
+    return int(r[0]) if r else 0
+def bump_registry(conn, template_ids:Iterable[int]) -> int:
+    """
+    注册表版本加一 并把这些模板的 registry_version 记为新版本 匹配器据此只增量重编译变化的模板
+    在调用方事务内执行 不 commit；返回新版本
+    """
+    ids=sorted(set(int(t) for t in template_ids))
+    if not ids: return registry_version(conn)
+    now=datetime.utcnow().isoformat()
+    conn.execute('INSERT OR IGNORE INTO TEMPLATE_REGISTRY(id, version) VALUES(1, 0)')
+    conn.execute('UPDATE TEMPLATE_REGISTRY SET version=version+1, updated_at=? WHERE id=1', (now,))
+    ver=registry_version(conn)
+    conn.executemany('UPDATE REGEX_TEMPLATE SET registry_version=? WHERE template_id=?', [(ver,t) for t in ids])
+    return ver
 class TemplateManager:
     def __init__(self, db: Database): self.db=db
     def _find_by_pattern(self, pat:str):
         r=self.db.query('SELECT template_id, version FROM REGEX_TEMPLATE WHERE pattern=?', (pat,))
         return r[0] if r else None
-    def upsert_from_llm(self, buffer_id:int, llm_task_id:int, items:List[Dict]):
+    def upsert_from_llm(self, buffer_id:int, llm_task_id:int, items:List[Dict], source:str='llm'):
+        """按匹配规则新增或合并模板 source 记入 REGEX_TEMPLATE.source（llm / drain 本地挖掘）；LLM 合并到挖掘模板时改记 llm"""
         now=datetime.utcnow().isoformat(); ids=[]
         for it in items:
             pat=(it.get('匹配规则','') or '').strip()
@@ -17,13 +37,26 @@ class TemplateManager:
             sem={'分类': it.get('分类',''), '推荐方案': it.get('推荐方案','')}
             ex=self._find_by_pattern(pat)
             if ex:
-                self.db.execute('INSERT INTO TEMPLATE_HISTORY(template_id,pattern,sample_log,version,created_at,source,note) VALUES(?,?,?,?,?,?,?)', (ex['template_id'],pat,sample,ex['version'],now,'merge','LLM 合并'))
-                self.db.execute('UPDATE REGEX_TEMPLATE SET last_seen=?, semantic_info=? WHERE template_id=?', (now, json.dumps(sem, ensure_ascii=False), ex['template_id']))
+                self.db.execute('INSERT INTO TEMPLATE_HISTORY(template_id,pattern,sample_log,version,created_at,source,note) VALUES(?,?,?,?,?,?,?)', (ex['template_id'],pat,sample,ex['version'],now,'merge','LLM 合并' if source=='llm' else '本地挖掘合并'))
+                if source=='llm': self.db.execute('UPDATE REGEX_TEMPLATE SET last_seen=?, semantic_info=?, source=? WHERE template_id=?', (now, json.dumps(sem, ensure_ascii=False), source, ex['template_id']))
+                else: self.db.execute('UPDATE REGEX_TEMPLATE SET last_seen=? WHERE template_id=?', (now, ex['template_id']))
                 tpl_id=ex['template_id']
             else:
-                tpl_id=self.db.execute('INSERT INTO REGEX_TEMPLATE(pattern,sample_log,normalized_sample,match_count,first_seen,last_seen,version,is_active,semantic_info) VALUES(?,?,?,?,?,?,?,?,?)', (pat,sample,None,0,now,now,1,1,json.dumps(sem, ensure_ascii=False)))
+                tpl_id=self.db.execute('INSERT INTO REGEX_TEMPLATE(pattern,sample_log,normalized_sample,match_count,first_seen,last_seen,version,is_active,semantic_info,source) VALUES(?,?,?,?,?,?,?,?,?,?)', (pat,sample,None,0,now,now,1,1,json.dumps(sem, ensure_ascii=False),source))
             ids.append(tpl_id)
+        bump_registry(self.db.conn, ids)
         return ids
+    def set_active(self, template_ids:Iterable[int], active:bool=True, note:str='') -> int:
+        """启用 / 停用模板 记入 TEMPLATE_HISTORY 并递增注册表版本 运行中的匹配器下次轮询时摘除或加入；返回变更条数"""
+        now=datetime.utcnow().isoformat(); flag=1 if active else 0; ids=[]
+        for tid in template_ids:
+            r=self.db.query('SELECT pattern, sample_log, version, is_active FROM REGEX_TEMPLATE WHERE template_id=?', (tid,))
+            if not r or r[0]['is_active']==flag: continue
+            self.db.execute('INSERT INTO TEMPLATE_HISTORY(template_id,pattern,sample_log,version,created_at,source,note) VALUES(?,?,?,?,?,?,?)', (tid,r[0]['pattern'],r[0]['sample_log'],r[0]['version'],now,'manual',note or ('启用' if active else '停用')))
+            self.db.execute('UPDATE REGEX_TEMPLATE SET is_active=? WHERE template_id=?', (flag, tid))
+            ids.append(tid)
+        bump_registry(self.db.conn, ids)
+        return len(ids)
     def observe(self, template_id:int, mod:str, smod:str, ts_iso:str):
         self.db.execute('''
             INSERT INTO TEMPLATE_APPLICABILITY(template_id, mod, smod, observed_count, first_seen_in_ctx, last_seen_in_ctx, source, last_updated)
@@ -33,3 +66,14 @@ class TemplateManager:
               last_seen_in_ctx = excluded.last_seen_in_ctx,
               last_updated = excluded.last_updated
         ''', (template_id, mod or '', smod or '', 1, ts_iso, ts_iso, 'observed', ts_iso))
+    def observe_bulk(self, rows:Iterable[Tuple[int,str,str,int,str,str]]) -> int:
+        """批量登记适用上下文 rows 为 (template_id, mod, smod, 次数, 首次时间, 末次时间) 同键可重复 按次数累加"""
+        now=datetime.utcnow().isoformat()
+        with write_transaction(self.db.conn) as conn:
+            return bulk_upsert(conn, 'TEMPLATE_APPLICABILITY', APP_COLS,
+                ((tid, mod or '', smod or '', cnt, first, last, 'observed', now) for tid,mod,smod,cnt,first,last in rows),
+                APP_COLS[:3]+('source',),
+                'observed_count = observed_count + excluded.observed_count, '
+                'first_seen_in_ctx = min(first_seen_in_ctx, excluded.first_seen_in_ctx), '
+                'last_seen_in_ctx = max(last_seen_in_ctx, excluded.last_seen_in_ctx), '
+                'last_updated = excluded.last_updated')
@@ -0,0 +1,295 @@
+# logsys/unmatched_store.py
+"""
+pass2 未命中记录的去重存储：
+- UNMATCHED_KEY 按 (run_id, 归一化关键文本, mod, smod) 聚合 记行数 首末时间（epoch_iso 与 LOG_MATCH_SUMMARY 同格式）
+  首末行序号 表为 WITHOUT ROWID 行窄
+  聚合在内存中跨批累积 每 app.unmatched_key_flush_rows 行及 run 结束时一条 INSERT ... SELECT ... ON CONFLICT 写入
+  并在 RUN_SESSION.unmatched_key_seq 记下已计入的行序号；续跑时溢出文件中此后的已提交行先重放进内存聚合
+  因此运行中（follow 或中断未续跑）的 run UNMATCHED_KEY 最多落后这么多行 溢出文件与块索引每批都提交
+- 每个键最先到达的 app.unmatched_exemplars 条原始行只追加进 UNMATCHED_EXEMPLAR 攒满后不再写
+- 原始行连同 level thread_id 时间戳 关键文本 按到达顺序追加到 <unmatched_dir>/unmatched_<run_id>.spill
+  每条记录为 4 字节长度前缀 + 以 \\x1f 分隔的字段（原始行在最后 保持字节）；关键文本是原始行的一段时只记 \\x00偏移,长度
+  攒满 app.unmatched_block_kb 以 zlib 压缩成一块
+  块的文件偏移 压缩长度 首行序号 行数记入 UNMATCHED_SPILL 与 pass2 的断点同一事务提交；
+  提交前中断留下的文件尾不被任何块引用 续跑时从文件末尾继续追加 行序号接着已提交的块
+- 取回：read_record 按行序号定位块 只解压一块；iter_records 顺序解压一段块；key_records 取某个键的原始行
+- resolve 补入的原始关键文本记入 UNMATCHED_RESOLVED 再次 resolve 时跳过
+"""
+
+from __future__ import annotations
+import logging
+import os
+import sqlite3
+import struct
+import zlib
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from . import scanner
+from .db import bulk_upsert
+from .key_extract import normalize_key_text
+from .utils import epoch_iso, parse_ts
+
+__all__ = [
+    "SpillRecord",
+    "UnmatchedStore",
+    "iter_records",
+    "read_record",
+    "key_records",
+    "resolved_keys",
+]
+
+logger = logging.getLogger(__name__)
+
+KEY_COLS = ("run_id", "key_text", "mod", "smod", "line_count", "first_ts", "last_ts", "first_seq", "last_seq")
+# first_ts last_ts 与 LOG_MATCH_SUMMARY 一样是 epoch_iso 串 时间戳不合法时为 NULL（不参与取最小最大）
+KEY_UPDATE = ("line_count=line_count + excluded.line_count, "
+              "first_ts=min(coalesce(first_ts, excluded.first_ts), coalesce(excluded.first_ts, first_ts)), "
+              "last_ts=max(coalesce(last_ts, excluded.last_ts), coalesce(excluded.last_ts, last_ts)), "
+              "last_seq=max(last_seq, excluded.last_seq)")
+EXEMPLAR_COLS = ("run_id", "key_text", "mod", "smod", "seq", "raw_log")
+SPILL_COLS = ("run_id", "first_seq", "path", "offset", "length", "lines")
+_LEN = struct.Struct("<I")
+_SEP = b"\x1f"
+_REF = b"\x00"
+_LEVEL = 6
+
+
+class SpillRecord(NamedTuple):
+    seq: int
+    mod: str
+    smod: str
+    level: str
+    thread_id: str
+    timestamp: str
+    key_text: str
+    raw_log: str
+
+
+class UnmatchedStore:
+    """单个 run 的未命中写者：add 在内存中聚合并攒块 write 在调用方的事务内落库"""
+
+    def __init__(self, cfg: dict, conn: sqlite3.Connection, run_id: int) -> None:
+        app = cfg["app"]
+        os.makedirs(app["unmatched_dir"], exist_ok=True)
+        self.run_id = run_id
+        self.path = os.path.join(app["unmatched_dir"], f"unmatched_{run_id}.spill")
+        self.block_bytes = max(int(float(app.get("unmatched_block_kb", 256)) * 1024), 1)
+        self.exemplars = int(app.get("unmatched_exemplars", 3))
+        self.key_flush = int(app.get("unmatched_key_flush_rows", 100000))
+        # 各键已有的样例数 续跑时从库中取回 攒满的键不再收集
+        self._ex_count: Dict[Tuple[str, str, str], int] = {
+            (k, m, sm): c for k, m, sm, c in conn.execute(
+                "SELECT key_text, mod, smod, COUNT(*) FROM UNMATCHED_EXEMPLAR WHERE run_id=? GROUP BY 1, 2, 3", (run_id,))}
+        self._ex_rows: List[Tuple] = []
+        row = conn.execute("SELECT MAX(first_seq + lines) FROM UNMATCHED_SPILL WHERE run_id=?", (run_id,)).fetchone()
+        self.seq = row[0] or 0
+        row = conn.execute("SELECT unmatched_key_seq FROM RUN_SESSION WHERE run_id=?", (run_id,)).fetchone()
+        self.key_seq = (row[0] if row else None) or 0
+        self._f = None
+        self._buf = bytearray()
+        self._buf_first = self.seq
+        self._blocks: List[Tuple] = []
+        # (归一化关键文本, mod, smod) → [行数, 首时间, 末时间, 首序号, 末序号]
+        self._keys: Dict[Tuple[str, str, str], list] = {}
+        self._norm: Dict[str, str] = {}
+        self._ts_s: Optional[str] = None
+        self._ts_ok = False
+        self.bytes_written = 0
+        if self.seq > self.key_seq:
+            self._replay(conn)
+
+    def add(self, items: Iterable[Tuple]) -> None:
+        """
+        items 为 part['unmatched'] 的 (原始行字节, mod, smod, level, thread_id, 时间戳, 关键文本, 归一化键)
+        归一化键为 None（匹配缓存关闭时）才在这里计算
+        """
+        norm_cache, keys, buf = self._norm, self._keys, self._buf
+        ex_count, ex_max = self._ex_count, self.exemplars
+        for raw, mod, smod, lvl, th, ts, key, norm in items:
+            mod = mod or ""; smod = smod or ""; key = key or ""
+            kb = key.encode(scanner.ENCODING, "replace")
+            p = raw.find(kb) if kb else -1
+            if p >= 0:
+                kb = b"%s%d,%d" % (_REF, p, len(kb))
+            rec = "\x1f".join((mod, smod, lvl or "", th or "", ts or "")).encode(scanner.ENCODING, "replace") + _SEP + kb
+            buf += _LEN.pack(len(rec) + 1 + len(raw))
+            buf += rec
+            buf += _SEP
+            buf += raw
+            if norm is None:
+                norm = norm_cache.get(key)
+                if norm is None:
+                    if len(norm_cache) > 100000:
+                        norm_cache.clear()
+                    norm = norm_cache[key] = normalize_key_text(key)
+            gk = (norm, mod, smod)
+            self._count(gk, ts, self.seq)
+            c = ex_count.get(gk, 0)
+            if c < ex_max:
+                ex_count[gk] = c + 1
+                self._ex_rows.append((self.run_id, norm, mod, smod, self.seq, raw.decode(scanner.ENCODING, scanner.ERRORS)))
+            self.seq += 1
+            if len(buf) >= self.block_bytes:
+                self._seal()
+
+    def _count(self, gk: Tuple[str, str, str], ts: Optional[str], seq: int) -> None:
+        """
+        内存中首末时间保持原始 YYYYMMDD_HHMMSS（定宽数字 字符串序即时间序） 写出时转为 epoch_iso
+        只在要更新首末时间时才校验取值 不合法的时间戳不参与
+        """
+        k = self._keys.get(gk)
+        if k is None:
+            ts = ts if self._valid(ts) else None
+            self._keys[gk] = [1, ts, ts, seq, seq]
+            return
+        k[0] += 1
+        if ts is not None:
+            if (k[1] is None or ts < k[1]) and self._valid(ts): k[1] = ts
+            if (k[2] is None or ts > k[2]) and self._valid(ts): k[2] = ts
+        k[4] = seq
+
+    def _valid(self, ts: Optional[str]) -> bool:
+        # 相邻行多为同一秒 记住上一次的结果
+        if ts != self._ts_s:
+            self._ts_s, self._ts_ok = ts, parse_ts(ts) is not None
+        return self._ts_ok
+
+    def _replay(self, conn: sqlite3.Connection) -> None:
+        """续跑：已提交但尚未计入 UNMATCHED_KEY 的行重新聚合（时间戳空串即原来的 None）"""
+        norm_cache = self._norm
+        for r in iter_records(conn, self.run_id, self.key_seq, self.seq):
+            norm = norm_cache.get(r.key_text)
+            if norm is None:
+                norm = norm_cache[r.key_text] = normalize_key_text(r.key_text)
+            self._count((norm, r.mod, r.smod), r.timestamp or None, r.seq)
+        logger.info("未命中 run=%s 重放行序号 %d..%d 进聚合", self.run_id, self.key_seq, self.seq)
+
+    @property
+    def pending(self) -> bool:
+        return bool(self._buf or self._keys or self._ex_rows)
+
+    def _seal(self) -> None:
+        if not self._buf:
+            return
+        if self._f is None:
+            self._f = open(self.path, "ab")
+        data = zlib.compress(bytes(self._buf), _LEVEL)
+        off = self._f.tell()
+        self._f.write(data)
+        self.bytes_written += len(data)
+        self._blocks.append((self.run_id, self._buf_first, self.path, off, len(data), self.seq - self._buf_first))
+        self._buf.clear()
+        self._buf_first = self.seq
+
+    def write(self, conn: sqlite3.Connection, final: bool = False) -> int:
+        """
+        在调用方的事务内写入：未满的块也压缩写出 块索引与新样例每次都写
+        聚合行累积满 key_flush 行或 final 时才写 同时推进 RUN_SESSION.unmatched_key_seq；返回写入行数
+        """
+        self._seal()
+        if self._f is not None:
+            self._f.flush()
+        n = bulk_upsert(conn, "UNMATCHED_SPILL", SPILL_COLS, self._blocks)
+        n += bulk_upsert(conn, "UNMATCHED_EXEMPLAR", EXEMPLAR_COLS, self._ex_rows)
+        self._blocks.clear()
+        self._ex_rows.clear()
+        if self._keys and (final or self.seq - self.key_seq >= self.key_flush):
+            n += bulk_upsert(conn, "UNMATCHED_KEY", KEY_COLS,
+                             ((self.run_id, norm, mod, smod, c, _iso(f), _iso(la), fs, ls)
+                              for (norm, mod, smod), (c, f, la, fs, ls) in self._keys.items()),
+                             KEY_COLS[:4], KEY_UPDATE)
+            conn.execute("UPDATE RUN_SESSION SET unmatched_key_seq=? WHERE run_id=?", (self.seq, self.run_id))
+            self._keys.clear()
+            self.key_seq = self.seq
+        return n
+
+    def close(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+def _iso(ts: Optional[str]) -> Optional[str]:
+    return None if ts is None else epoch_iso(parse_ts(ts))
+
+
+def _parse_block(data: bytes, first_seq: int) -> Iterator[SpillRecord]:
+    buf = zlib.decompress(data)
+    pos, seq, end = 0, first_seq, len(buf)
+    while pos < end:
+        (n,) = _LEN.unpack_from(buf, pos)
+        pos += 4
+        f = buf[pos:pos + n].split(_SEP, 6)
+        pos += n
+        raw, kb = f[6], f[5]
+        if kb[:1] == _REF:
+            p, ln = map(int, kb[1:].split(b","))
+            kb = raw[p:p + ln]
+        meta = [x.decode(scanner.ENCODING, "replace") for x in f[:5]]
+        yield SpillRecord(seq, *meta, kb.decode(scanner.ENCODING, "replace"), raw.decode(scanner.ENCODING, scanner.ERRORS))
+        seq += 1
+
+
+def _blocks(conn: sqlite3.Connection, run_id: int, start: int, stop: Optional[int]) -> List[Tuple]:
+    # 从包含 start 的块起 走主键 (run_id, first_seq) 范围扫描
+    sql = ("SELECT path, offset, length, first_seq FROM UNMATCHED_SPILL WHERE run_id=? AND first_seq >= COALESCE("
+           "(SELECT MAX(first_seq) FROM UNMATCHED_SPILL WHERE run_id=? AND first_seq <= ?), 0)")
+    args = [run_id, run_id, start]
+    if stop is not None:
+        sql += " AND first_seq < ?"
+        args.append(stop)
+    return conn.execute(sql + " ORDER BY first_seq", args).fetchall()
+
+
+def iter_records(conn: sqlite3.Connection, run_id: int, start: int = 0, stop: Optional[int] = None) -> Iterator[SpillRecord]:
+    """按到达顺序读出行序号 [start, stop) 的未命中记录"""
+    files: Dict[str, object] = {}
+    try:
+        for path, off, length, first in _blocks(conn, run_id, start, stop):
+            f = files.get(path)
+            if f is None:
+                f = files[path] = open(path, "rb")
+            f.seek(off)
+            for r in _parse_block(f.read(length), first):
+                if r.seq < start:
+                    continue
+                if stop is not None and r.seq >= stop:
+                    return
+                yield r
+    finally:
+        for f in files.values():
+            f.close()
+
+
+def read_record(conn: sqlite3.Connection, run_id: int, seq: int) -> Optional[SpillRecord]:
+    """按行序号取一条 只解压所在的块"""
+    return next(iter_records(conn, run_id, seq, seq + 1), None)
+
+
+def key_records(conn: sqlite3.Connection, run_id: int, norm_key: str, mod: Optional[str] = None,
+                smod: Optional[str] = None, limit: Optional[int] = None) -> List[SpillRecord]:
+    """某个归一化关键文本（可限定 mod smod）的原始记录 只解压其首末行序号之间的块"""
+    where, args = "run_id=? AND key_text=?", [run_id, norm_key]
+    for col, v in (("mod", mod), ("smod", smod)):
+        if v is not None:
+            where += f" AND {col}=?"
+            args.append(v)
+    lo, hi = conn.execute(f"SELECT MIN(first_seq), MAX(last_seq) FROM UNMATCHED_KEY WHERE {where}", args).fetchone()
+    out: List[SpillRecord] = []
+    if lo is None:
+        return out
+    norm_cache: Dict[str, str] = {}
+    for r in iter_records(conn, run_id, lo, hi + 1):
+        norm = norm_cache.get(r.key_text)
+        if norm is None:
+            norm = norm_cache[r.key_text] = normalize_key_text(r.key_text)
+        if norm == norm_key and (mod is None or r.mod == mod) and (smod is None or r.smod == smod):
+            out.append(r)
+            if limit is not None and len(out) >= limit:
+                break
+    return out
+
+
+def resolved_keys(conn: sqlite3.Connection, run_id: int) -> set:
+    """已由 resolve 补入统计的原始关键文本"""
+    return {k for (k,) in conn.execute("SELECT key_text FROM UNMATCHED_RESOLVED WHERE run_id=?", (run_id,))}
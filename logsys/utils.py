@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
-from datetime import datetime
+import re, time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
 def iso(ts: str) -> str:
     return ts if ts else datetime.utcnow().isoformat()
 def floor_bucket(ts_iso: str, granularity: str) -> str:
@@ -15,3 +17,61 @@ def floor_bucket(ts_iso: str, granularity: str) -> str:
     return dt.replace(second=0, microsecond=0).isoformat()
 def inc(d: dict, key, delta=1):
     d[key] = d.get(key, 0) + delta
+
+# === 整数 epoch 时间戳：日志时间按 UTC 解释 只在输出时格式化为 ISO 字符串 ===
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_ORD = date(1970, 1, 1).toordinal()
+_DAY_CACHE: Dict[str, int] = {}
+def _day_seconds(ymd: str) -> Optional[int]:
+    d = _DAY_CACHE.get(ymd)
+    if d is None:
+        if not (ymd.isascii() and ymd.isdigit()):
+            return None
+        try:
+            d = (date(int(ymd[:4]), int(ymd[4:6]), int(ymd[6:])).toordinal() - _EPOCH_ORD) * 86400
+        except ValueError:
+            return None
+        if len(_DAY_CACHE) > 4096:
+            _DAY_CACHE.clear()
+        _DAY_CACHE[ymd] = d
+    return d
+def parse_ts(ts: Optional[str]) -> Optional[int]:
+    """定宽解析 'YYYYMMDD_HHMMSS' → epoch 秒 日期部分按天缓存；格式或取值不合法返回 None"""
+    if not ts or len(ts) != 15 or ts[8] != '_':
+        return None
+    d = _day_seconds(ts[:8])
+    hms = ts[9:]
+    if d is None or not (hms.isascii() and hms.isdigit()):
+        return None
+    h, r = divmod(int(hms), 10000)
+    m, s = divmod(r, 100)
+    if h > 23 or m > 59 or s > 59:
+        return None
+    return d + h * 3600 + m * 60 + s
+def now_epoch() -> int:
+    return int(time.time())
+def epoch_iso(ep: int) -> str:
+    """epoch 秒 → 'YYYY-MM-DDTHH:MM:SS' 与 datetime.isoformat 一致"""
+    return (_EPOCH + timedelta(seconds=int(ep))).isoformat()
+
+_GRAN_ALIAS = {'hour': 3600, 'day': 86400}
+_GRAN_RE = re.compile(r'^(\d+)(s|min|h|d)$')
+_GRAN_UNIT = {'s': 1, 'min': 60, 'h': 3600, 'd': 86400}
+def gran_seconds(granularity: str) -> int:
+    """粒度名 → 秒：hour day 及 <n>s <n>min <n>h <n>d 如 1min 5min 15min"""
+    if granularity in _GRAN_ALIAS:
+        return _GRAN_ALIAS[granularity]
+    m = _GRAN_RE.match(granularity)
+    if not m or int(m.group(1)) <= 0:
+        raise ValueError(f'不支持的时间粒度: {granularity}')
+    return int(m.group(1)) * _GRAN_UNIT[m.group(2)]
+def time_buckets(cfg: dict) -> List[str]:
+    """app.time_bucket 可为单个粒度或列表 去重保序"""
+    g = cfg['app'].get('time_bucket', '5min')
+    out = []
+    for x in ([g] if isinstance(g, str) else list(g)):
+        gran_seconds(x)
+        if x not in out:
+            out.append(x)
+    return out
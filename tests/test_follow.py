@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""follow：追加 截断 轮转 以及末行无换行 都在 latency 内计入 KEY_TIME_BUCKET 与 LOG_MATCH_SUMMARY"""
+import json
+import os
+import threading
+import time
+
+from logsys.db import Database
+from logsys.follow import run_follow
+from logsys.main import init_db
+
+TEMPLATES = [("get lane err size \\d+ id \\w+", "车道"), ("sensor timeout after \\d+ ms", "超时")]
+GRANS = ["5min", "hour"]
+LATENCY = 0.3
+SLACK = 0.2          # 测试轮询 与 每次新开连接查询的开销
+BUCKET = "2024-01-05T12:00:00"
+
+
+def rec(sec: int, msg: str, mod: str = "PNC") -> str:
+    return f"[20240105_1200{sec:02d}][101][E][MOD:{mod}][SMOD:planner] {msg}\n"
+
+
+def query(db_path: str, sql: str) -> dict:
+    db = Database(db_path)
+    try:
+        return {tuple(r[:-1]): r[-1] for r in db.conn.execute(sql)}
+    finally:
+        db.close()
+
+
+def buckets(db_path: str) -> dict:
+    return query(db_path, "SELECT bucket_granularity, bucket_start, template_id, mod, SUM(count_in_bucket) "
+                          "FROM KEY_TIME_BUCKET GROUP BY 1, 2, 3, 4")
+
+
+def summary(db_path: str) -> dict:
+    return query(db_path, "SELECT template_id, mod, SUM(line_count) FROM LOG_MATCH_SUMMARY GROUP BY 1, 2")
+
+
+def per_gran(want: dict) -> dict:
+    return {(g, BUCKET) + k: n for g in GRANS for k, n in want.items()}
+
+
+def wait_buckets(db_path: str, want: dict, limit: float = 2.0):
+    """轮询 KEY_TIME_BUCKET 直到各粒度计数与 want 一致 返回 (最后一次结果, 耗时)"""
+    t0 = time.monotonic()
+    while True:
+        got = buckets(db_path)
+        dt = time.monotonic() - t0
+        if got == per_gran(want) or dt > limit:
+            return got, dt
+        time.sleep(0.01)
+
+
+def check_visible(db_path: str, want: dict) -> None:
+    got, dt = wait_buckets(db_path, want)
+    assert got == per_gran(want)
+    assert dt <= LATENCY + SLACK, f"{dt:.2f}s 后才可见 上限 {LATENCY}s"
+    assert summary(db_path) == want
+
+
+def test_follow_append_truncate_rotate(tmp_path):
+    db_path = str(tmp_path / "follow.db")
+    cfg = {"app": {"db_path": db_path, "time_bucket": GRANS, "pass2_batch_rows": 1000,
+                   "unmatched_dir": str(tmp_path / "unmatched"), "follow_buffer": False}}
+    db = Database(db_path)
+    init_db(db)
+    for p, cls in TEMPLATES:
+        db.execute("INSERT INTO REGEX_TEMPLATE(pattern, is_active, semantic_info) VALUES(?, 1, ?)",
+                   (p, json.dumps({"分类": cls}, ensure_ascii=False)))
+    db.commit()
+
+    log = tmp_path / "live.log"
+    log.write_text(rec(0, "get lane err size 1 id v1") + rec(1, "unexpected gap 3") + "  detail 1\n"
+                   + rec(2, "sensor timeout after 5 ms"), encoding="utf-8")
+    stop = threading.Event()
+    res = {}
+    t = threading.Thread(target=lambda: res.update(run_follow(cfg, Database(db_path), str(log), latency=LATENCY,
+                                                              stop=stop)))
+    t.start()
+    try:
+        # 初始内容含启动开销 只核对计数
+        want = {(1, "PNC"): 1, (2, "PNC"): 1}
+        assert wait_buckets(db_path, want)[0] == per_gran(want)
+
+        # 追加
+        with open(log, "a", encoding="utf-8") as f:
+            f.write(rec(3, "get lane err size 2 id v2") + rec(4, "get lane err size 3 id v3"))
+        want = {(1, "PNC"): 3, (2, "PNC"): 1}
+        check_visible(db_path, want)
+
+        # 截断后写入更短的内容 从头读取
+        log.write_text(rec(5, "sensor timeout after 9 ms", "PER"), encoding="utf-8")
+        want[(2, "PER")] = 1
+        check_visible(db_path, want)
+
+        # 旧文件末行没有换行 随即轮转：半行按完整记录处理 不与新文件首条记录拼接
+        with open(log, "a", encoding="utf-8") as f:
+            f.write(rec(6, "get lane err size 5 id v5", "PER").rstrip("\n"))
+        os.rename(log, tmp_path / "live.log.1")
+        log.write_text(rec(7, "get lane err size 4 id v4", "MAP"), encoding="utf-8")
+        want[(1, "PER")] = 1
+        want[(1, "MAP")] = 1
+        check_visible(db_path, want)
+
+        # 末行没有换行：停止时按完整记录处理
+        with open(log, "a", encoding="utf-8") as f:
+            f.write(rec(8, "sensor timeout after 1 ms", "MAP").rstrip("\n"))
+        time.sleep(LATENCY)
+    finally:
+        stop.set()
+        t.join(10)
+    want[(2, "MAP")] = 1
+    assert buckets(db_path) == per_gran(want)
+    assert summary(db_path) == want
+    assert res["records"] == 9 and res["matched"] == 8
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""llm-drain：本地桩服务上 超时 与 错误响应 的重试 失败缓冲的状态 以及下次 drain 重新提交"""
+import pytest
+
+from benchmarks.llm_stub import StubServer, cluster
+from logsys.db import Database
+from logsys.llm_tasks import drain_buffers, pending_buffers
+from logsys.main import init_db
+
+# 每个缓冲一种形状 各自聚成一个模板
+SHAPES = ["lane gap {} id {}", "sensor timeout {} after {}", "planner retry {} frame {}", "map tile {} miss {}"]
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "llm.db"))
+    init_db(db)
+    yield db
+    db.close()
+
+
+def add_buffers(db):
+    out = []
+    for shape in SHAPES:
+        keys = [shape.format(i, i * 7) for i in range(5)]
+        bid = db.execute("INSERT INTO BUFFER_GROUP(scope, size_threshold, current_size, created_at, status) "
+                         "VALUES('全局', 5, 5, CURRENT_TIMESTAMP, '收集中')")
+        db.conn.executemany("INSERT INTO BUFFER_ITEM(buffer_id, key_text, raw_log) VALUES(?,?,?)",
+                            [(bid, k, k) for k in keys])
+        out.append((bid, keys))
+    db.commit()
+    return out
+
+
+def status(db):
+    return dict(db.conn.execute("SELECT buffer_id, status FROM BUFFER_GROUP").fetchall())
+
+
+def patterns(db):
+    return {r[0] for r in db.conn.execute("SELECT pattern FROM REGEX_TEMPLATE")}
+
+
+def cfg_for(srv, prompt, **kw):
+    llm = {"enabled": True, "api_base": srv.api_base, "api_key_env": "LLM_STUB_KEY", "model": "stub",
+           "prompt_path": prompt, "n_samples_per_task": 5, "max_prompt_samples": 5, "concurrency": 1,
+           "retries": 1, "backoff_s": 0.01, "timeout_sec": 0.3, "reduce": False}
+    llm.update(kw)
+    return {"app": {"db_path": ""}, "llm": llm}
+
+
+def test_drain_timeout_error_and_resubmit(db, tmp_path, monkeypatch):
+    monkeypatch.setenv("LLM_STUB_KEY", "stub")
+    prompt = tmp_path / "prompt.txt"
+    prompt.write_text("对下列样本聚类 输出 JSON 数组：\n<samples>\n{SAMPLES}\n", encoding="utf-8")
+    bufs = add_buffers(db)
+    (a, ka), (b, kb), (c, kc), (d, kd) = bufs
+    want = {bid: {it["匹配规则"] for it in cluster(keys)} for bid, keys in bufs}
+
+    # 并发 1 时请求按缓冲顺序到达：2 3 为 b 的两次尝试（均超时） 4 为 c 的 500（重试成功） 6 为 d 的 400（不重试）
+    srv = StubServer(0, faults={2: "timeout", 3: "timeout", 4: 500, 6: 400}, stall_s=1.0).start()
+    try:
+        st = drain_buffers(cfg_for(srv, str(prompt)), db)
+        assert (st["tasks"], st["ok"], st["failed"]) == (4, 2, 2), st
+        assert status(db) == {a: "已处理", b: "失败", c: "已处理", d: "失败"}
+        assert patterns(db) == want[a] | want[c]
+        tasks = {r[0]: tuple(r[1:]) for r in db.conn.execute(
+            "SELECT buffer_id, status, attempts, http_status, error FROM LLM_TASK ORDER BY llm_task_id")}
+        assert tasks[b][:2] == ("失败", 2) and "Timeout" in tasks[b][3]
+        assert tasks[c][:3] == ("成功", 2, 200)
+        assert tasks[d][:3] == ("失败", 1, 400)
+        assert sorted(pending_buffers(db)) == [b, d]
+
+        # 失败的缓冲下次 drain 重新提交
+        st = drain_buffers(cfg_for(srv, str(prompt)), db)
+        assert (st["buffers"], st["ok"], st["failed"]) == (2, 2, 0), st
+        assert set(status(db).values()) == {"已处理"} and not pending_buffers(db)
+        assert patterns(db) == set().union(*want.values())
+        n_result = db.conn.execute("SELECT buffer_id, SUM(occurrences) FROM BUFFER_RESULT GROUP BY 1").fetchall()
+        assert dict(n_result) == {bid: len(keys) for bid, keys in bufs}
+    finally:
+        srv.shutdown()
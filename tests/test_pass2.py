@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""pass2：运行中注册表改动已有模板的分类 轮询换快照后按新分类计数"""
+import gzip
+import json
+
+import pytest
+
+from logsys import pass2, scanner
+from logsys.db import Database
+from logsys.main import init_db
+from logsys.template_mgr import TemplateManager
+
+LOG = b"".join(b"[20240105_1200%02d][1][E][MOD:PNC][SMOD:p] sensor timeout after %d ms\n" % (i, i)
+               for i in range(6))
+
+
+@pytest.fixture
+def gz(tmp_path):
+    path = tmp_path / "a.gz"
+    with gzip.open(path, "wb") as f:
+        f.write(LOG)
+    return str(path)
+
+
+def test_reclassified_template_applies_mid_run(tmp_path, gz, monkeypatch):
+    db_path = str(tmp_path / "db.db")
+    db = Database(db_path)
+    init_db(db)
+    db.execute("INSERT INTO REGEX_TEMPLATE(pattern, is_active, semantic_info) VALUES(?, 1, ?)",
+               ("sensor timeout after \\d+ ms", json.dumps({"分类": "超时"}, ensure_ascii=False)))
+    db.commit()
+    cfg = {"app": {"db_path": db_path, "time_bucket": ["hour"], "pass2_batch_rows": 1000,
+                   "unmatched_dir": str(tmp_path / "um"), "gz_index_span_mb": 0, "template_poll_s": 1e-9}}
+    orig = scanner.iter_blocks_at
+
+    def blocks(chunks, block_size=scanner.BLOCK_SIZE, end=None, offset=0):
+        # 每行一块 处理三行后另一进程（如 llm-drain）改写该模板的分类
+        small = (c[i:i + 40] for c in chunks for i in range(0, len(c), 40))
+        for i, item in enumerate(orig(small, 1, end, offset)):
+            if i == 3:
+                other = Database(db_path)
+                TemplateManager(other).upsert_from_llm(0, 0, [{"匹配规则": "sensor timeout after \\d+ ms",
+                                                               "分类": "传感器"}])
+                other.commit()
+                other.close()
+            yield item
+
+    monkeypatch.setattr(pass2.scanner, "iter_blocks_at", blocks)
+    rid = pass2.run_pass2(cfg, db, gz)
+    got = dict(db.conn.execute("SELECT classification, SUM(line_count) FROM LOG_MATCH_SUMMARY WHERE run_id=? "
+                               "GROUP BY 1", (rid,)).fetchall())
+    assert sum(got.values()) == 6
+    assert got.get("传感器", 0) > 0 and got.get("超时", 0) > 0
+    db.close()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""process：未命中按批写入溢出文件 统计与 pass2 一致；运行期间注册表有新模板时收尾后从溢出文件补算"""
+import gzip
+import json
+
+import pytest
+
+from logsys import process
+from logsys.db import Database
+from logsys.main import init_db
+from logsys.pass2 import run_pass2
+from logsys.template_mgr import TemplateManager
+
+LOG = b"".join(
+    b"[20240105_1200%02d][1][E][MOD:PNC][SMOD:p] %s\n" % (i, msg)
+    for i, msg in enumerate([b"sensor timeout after 5 ms", b"frame gap 1", b"lidar drop 7", b"frame gap 2",
+                             b"sensor timeout after 6 ms", b"frame gap 3", b"lidar drop 8"]))
+
+
+@pytest.fixture
+def gz(tmp_path):
+    path = tmp_path / "a.gz"
+    with gzip.open(path, "wb") as f:
+        f.write(LOG)
+    return str(path)
+
+
+def open_db(tmp_path, name):
+    db_path = str(tmp_path / f"{name}.db")
+    db = Database(db_path)
+    init_db(db)
+    db.execute("INSERT INTO REGEX_TEMPLATE(pattern, is_active, semantic_info) VALUES(?, 1, ?)",
+               ("sensor timeout after \\d+ ms", json.dumps({"分类": "超时"}, ensure_ascii=False)))
+    db.commit()
+    # 每两行一批：未命中跨批写入溢出文件
+    cfg = {"app": {"db_path": db_path, "time_bucket": ["hour"], "pass2_batch_rows": 2, "unmatched_key_flush_rows": 2,
+                   "unmatched_dir": str(tmp_path / f"um_{name}"), "gz_index_span_mb": 0, "merge_summary": False}}
+    return cfg, db
+
+
+def rows(db, run_id):
+    c = db.conn
+    summ = c.execute("SELECT template_id, line_count FROM LOG_MATCH_SUMMARY WHERE run_id=? ORDER BY 1",
+                     (run_id,)).fetchall()
+    keys = c.execute("SELECT key_text, line_count FROM UNMATCHED_KEY WHERE run_id=? ORDER BY 1", (run_id,)).fetchall()
+    counts = c.execute("SELECT matched_lines, unmatched_lines FROM RUN_SESSION WHERE run_id=?", (run_id,)).fetchone()
+    return [tuple(r) for r in summ], [tuple(r) for r in keys], tuple(counts)
+
+
+def pass2_run(db):
+    return db.conn.execute("SELECT MAX(run_id) FROM RUN_SESSION WHERE pass_type='PASS2'").fetchone()[0]
+
+
+def test_process_spills_like_pass2(tmp_path, gz):
+    cfg, db = open_db(tmp_path, "proc")
+    st = process.run_process(cfg, db, gz)
+    assert st == {"records": 7, "matched": 2, "unmatched": 5, "resolved": 0}
+    got = rows(db, pass2_run(db))
+    assert got == ([(1, 2)], [("frame gap <NUM>", 3), ("lidar drop <NUM>", 2)], (2, 5))
+    assert db.conn.execute("SELECT SUM(lines) FROM UNMATCHED_SPILL").fetchone()[0] == 5
+
+    cfg2, db2 = open_db(tmp_path, "p2")
+    rid = run_pass2(cfg2, db2, gz)
+    assert rows(db2, rid) == got
+    db.close()
+    db2.close()
+
+
+def test_process_resolves_templates_added_during_run(tmp_path, gz, monkeypatch):
+    cfg, db = open_db(tmp_path, "proc")
+    match_unique = process.match_unique
+
+    def add_template_elsewhere(*args):
+        # 扫描结束时 另一进程（如 llm-drain）落库新模板
+        other = Database(cfg["app"]["db_path"])
+        TemplateManager(other).upsert_from_llm(0, 0, [{"匹配规则": "frame gap \\d+", "分类": "帧"}])
+        other.commit()
+        other.close()
+        return match_unique(*args)
+
+    monkeypatch.setattr(process, "match_unique", add_template_elsewhere)
+    st = process.run_process(cfg, db, gz)
+    assert st == {"records": 7, "matched": 5, "unmatched": 2, "resolved": 3}
+    assert rows(db, pass2_run(db)) == ([(1, 2), (2, 3)], [("lidar drop <NUM>", 2)], (5, 2))
+    db.close()
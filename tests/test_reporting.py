@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""跨 run 汇总表：失败的 run 扣除 续跑时加回 --force 重算后旧 run 被取代 汇总只计一次"""
+import gzip
+import json
+
+import pytest
+
+from logsys import pass2, scanner
+from logsys.db import Database
+from logsys.main import init_db
+from logsys.reporting import rebuild_rollups
+
+LOG = b"".join(
+    b"[20240105_%02d%02d00][1][E][MOD:%s][SMOD:p] %s\n" % (h, m, mod, msg)
+    for h in (12, 13) for m, mod, msg in [(0, b"PNC", b"sensor timeout after 5 ms"), (10, b"PER", b"lane gap 1"),
+                                         (20, b"PNC", b"lane gap 2"), (30, b"PNC", b"sensor timeout after 6 ms")])
+
+
+@pytest.fixture
+def gz(tmp_path):
+    path = tmp_path / "a.gz"
+    with gzip.open(path, "wb") as f:
+        f.write(LOG)
+    return str(path)
+
+
+def open_db(tmp_path, name):
+    db_path = str(tmp_path / f"{name}.db")
+    db = Database(db_path)
+    init_db(db)
+    for p, cls in [("sensor timeout after \\d+ ms", "超时"), ("lane gap \\d+", "车道")]:
+        db.execute("INSERT INTO REGEX_TEMPLATE(pattern, is_active, semantic_info) VALUES(?, 1, ?)",
+                   (p, json.dumps({"分类": cls}, ensure_ascii=False)))
+    db.commit()
+    cfg = {"app": {"db_path": db_path, "time_bucket": ["5min", "hour"], "pass2_batch_rows": 2,
+                   "unmatched_dir": str(tmp_path / f"um_{name}"), "gz_index_span_mb": 0}}
+    return cfg, db
+
+
+def rollups(db):
+    c = db.conn
+    return {t: {tuple(r[:-1]): r[-1] for r in c.execute(f"SELECT * FROM {t}")}
+            for t in ("ROLLUP_HOUR", "ROLLUP_DAY")}
+
+
+def run_totals(db):
+    return dict(db.conn.execute("SELECT run_id, SUM(line_count) FROM ROLLUP_RUN GROUP BY 1").fetchall())
+
+
+def status(db):
+    return dict(db.conn.execute("SELECT run_id, status FROM RUN_SESSION").fetchall())
+
+
+@pytest.fixture
+def want(tmp_path, gz):
+    cfg, db = open_db(tmp_path, "clean")
+    pass2.run_pass2(cfg, db, gz)
+    out = rollups(db)
+    db.close()
+    assert sum(out["ROLLUP_DAY"].values()) == 8
+    return out
+
+
+def fail_after(monkeypatch, n_blocks):
+    """切成小块 处理 n_blocks 块后抛错：已写入的批次留在库中"""
+    orig = scanner.iter_blocks_at
+
+    def blocks(chunks, block_size=scanner.BLOCK_SIZE, end=None, offset=0):
+        small = (c[i:i + 40] for c in chunks for i in range(0, len(c), 40))
+        for i, item in enumerate(orig(small, 1, end, offset)):
+            if i == n_blocks:
+                raise RuntimeError("中途失败")
+            yield item
+
+    monkeypatch.setattr(pass2.scanner, "iter_blocks_at", blocks)
+
+
+def test_failed_run_retracted_then_rerun(tmp_path, gz, want, monkeypatch):
+    cfg, db = open_db(tmp_path, "db")
+    fail_after(monkeypatch, 5)
+    with pytest.raises(RuntimeError):
+        pass2.run_pass2(cfg, db, gz)
+    monkeypatch.undo()
+    # 失败前已有批次写入明细 汇总表中已扣除
+    assert 0 < db.conn.execute("SELECT SUM(count_in_bucket) FROM KEY_TIME_BUCKET "
+                               "WHERE bucket_granularity='hour'").fetchone()[0] < 8
+    assert rollups(db) == {"ROLLUP_HOUR": {}, "ROLLUP_DAY": {}} and run_totals(db) == {}
+
+    rid = pass2.run_pass2(cfg, db, gz)
+    assert rollups(db) == want and run_totals(db) == {rid: 8}
+    assert rebuild_rollups(db) and rollups(db) == want
+    db.close()
+
+
+def test_failed_run_restored_on_resume(tmp_path, gz, want, monkeypatch):
+    cfg, db = open_db(tmp_path, "db")
+    fail_after(monkeypatch, 5)
+    with pytest.raises(RuntimeError):
+        pass2.run_pass2(cfg, db, gz)
+    monkeypatch.undo()
+    assert db.conn.execute("SELECT ckpt_out_offset FROM RUN_SESSION").fetchone()[0] > 0
+    assert run_totals(db) == {}
+
+    rid = pass2.run_pass2(cfg, db, gz, resume=True)
+    assert status(db) == {rid: "成功"}
+    assert rollups(db) == want and run_totals(db) == {rid: 8}
+    db.close()
+
+
+def test_force_reingest_supersedes(tmp_path, gz, want):
+    cfg, db = open_db(tmp_path, "db")
+    r1 = pass2.run_pass2(cfg, db, gz)
+    r2 = pass2.run_pass2(cfg, db, gz, force=True)
+    assert status(db) == {r1: "已取代", r2: "成功"}
+    assert rollups(db) == want and run_totals(db) == {r2: 8}
+    assert rebuild_rollups(db) and rollups(db) == want and run_totals(db) == {r2: 8}
+    db.close()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""scanner 与原链路（read_gz_lines → normalize_lines → parse_line → extract_key_text）逐字段一致 固定边角记录"""
+import gzip
+
+import pytest
+
+from logsys import scanner
+from logsys.ingest import read_gz_chunks, read_gz_lines
+from logsys.key_extract import extract_key_text
+from logsys.parser import parse_line
+from logsys.preprocess import normalize_lines
+
+CASES = {
+    "continuation": (b"[20240105_120000][101][E][MOD:PNC][SMOD:planner] get lane err size 3\n"
+                     b"   continuation detail 7  \n"
+                     b"\t \n"
+                     b"\xe3\x80\x80\xe7\xbb\xad\xe8\xa1\x8c \xe5\x85\xa8\xe8\xa7\x92\xe7\xa9\xba\xe7\x99\xbd\xe3\x80\x80\n"
+                     b"[20240105_120001][101][W][MOD:PNC][SMOD:planner] next\n"),
+    "no_smod": (b"[20240105_120000][101][E][MOD:PNC] sensor timeout after 5 ms\n"
+                b"[20240105_120001][MOD:PER][] lidar drop\n"),
+    "crlf": (b"[20240105_120000][101][I][MOD:PNC][SMOD:planner] crlf line\r\n"
+             b"  cont\r\n"
+             b"[20240105_120001][101][D][MOD:PNC][SMOD:planner] lone cr\r"
+             b"[20240105_120002][101][D][MOD:PNC][SMOD:planner] last\r\n"),
+    "malformed": (b"header line before first record\n\n"
+                  b"[2024010_120000][101][E][MOD:PNC][SMOD:planner] seven digit date\n"
+                  b"[20240105_120000][101][X][SMOD:a][MOD:PNC SMOD:ax] bad level\n"
+                  b"[20240105_12000a][101][E][MOD:PNC][SMOD:planner] letter in time\n"
+                  b"[20240105_120001][101][E][MOD:PNC][SMOD:planner] obj [MOD:BODY] moved [] and [x]\n"
+                  b"[20240105_120002]\n"),
+    "non_utf8": (b"[20240105_120000][101][E][MOD:P\xffNC][SMOD:plan\xfe] bad \xff\xfe bytes\n"
+                 b"  cont \xc3\n"
+                 b"[20240105_120001][101][E][MOD:PNC][SMOD:planner] \xe8\xa7\x84\xe5\x88\x92 \xff\n"),
+}
+
+
+def old_chain(path):
+    for line in normalize_lines(read_gz_lines(path)):
+        p = parse_line(line)
+        yield p["timestamp"], p["level"], p["mod"], p["smod"], extract_key_text(p["raw"]), line
+
+
+def decoded(recs):
+    return [(ts, lvl, mod, smod, key, raw.decode("utf-8", "ignore")) for ts, lvl, mod, smod, key, raw in recs]
+
+
+@pytest.fixture(params=sorted(CASES))
+def case(request, tmp_path):
+    path = tmp_path / f"{request.param}.gz"
+    with gzip.open(path, "wb") as f:
+        f.write(CASES[request.param])
+    return request.param, str(path)
+
+
+def test_same_as_old_chain(case):
+    _, path = case
+    new = decoded(scanner.iter_records(read_gz_chunks(path)))
+    assert new == list(old_chain(path))
+    # 极小切块：记录跨块时切块仍落在记录首行上
+    assert decoded(scanner.iter_records(read_gz_chunks(path, size=7), block_size=16)) == new
+
+
+def test_fields():
+    recs = {name: decoded(scanner.scan_block(data)) for name, data in CASES.items()}
+    ts, lvl, mod, smod, key, _ = recs["continuation"][0]
+    assert (ts, lvl, mod, smod) == ("20240105_120000", "E", "PNC", "planner")
+    assert key == "get lane err size 3 continuation detail 7 续行 全角空白"
+    assert recs["no_smod"][0][2:4] == ("PNC", None)
+    assert [r[4] for r in recs["crlf"]] == ["crlf line cont", "lone cr", "last"]
+    # 非记录首行的头部并入上一条记录 首条记录前的杂行丢弃
+    assert [r[0] for r in recs["malformed"]] == ["20240105_120000", "20240105_120001", "20240105_120002"]
+    # 级别非 EWID 时为空；并入的续行里的 [SMOD:planner] 按“最后一次出现”覆盖头部的值
+    assert recs["malformed"][0][1:4] == (None, "PNC", "planner")
+    assert recs["malformed"][1][2] == "BODY"
+    assert recs["non_utf8"][0][2:5] == ("PNC", "plan", "bad  bytes cont")
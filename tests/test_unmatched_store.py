@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""UNMATCHED_KEY 的首末时间与 LOG_MATCH_SUMMARY 同为 epoch_iso 串 跨批与不合法时间戳时取值正确"""
+import gzip
+import json
+
+from logsys.db import Database
+from logsys.main import init_db
+from logsys.pass2 import run_pass2
+
+LOG = (b"[20240105_235959][1][E][MOD:PNC][SMOD:p] sensor timeout after 5 ms\n"
+       b"[20240105_235959][1][E][MOD:PNC][SMOD:p] frame gap 1\n"
+       b"[20240106_000010][1][E][MOD:PNC][SMOD:p] frame gap 2\n"
+       b"[20241399_000000][1][E][MOD:PNC][SMOD:p] frame gap 3\n"
+       b"[20240106_000020][1][E][MOD:PNC][SMOD:p] sensor timeout after 6 ms\n")
+
+
+def test_unmatched_key_iso_timestamps(tmp_path):
+    gz = tmp_path / "a.gz"
+    with gzip.open(gz, "wb") as f:
+        f.write(LOG)
+    db = Database(str(tmp_path / "a.db"))
+    init_db(db)
+    db.execute("INSERT INTO REGEX_TEMPLATE(pattern, is_active, semantic_info) VALUES(?, 1, ?)",
+               ("sensor timeout after \\d+ ms", json.dumps({"分类": "超时"}, ensure_ascii=False)))
+    db.commit()
+    # 每行一批 且每行都写 UNMATCHED_KEY：跨批 upsert 走 min/max
+    cfg = {"app": {"db_path": str(tmp_path / "a.db"), "time_bucket": ["hour"], "pass2_batch_rows": 1,
+                   "unmatched_key_flush_rows": 1, "unmatched_dir": str(tmp_path / "um"), "gz_index_span_mb": 0}}
+    rid = run_pass2(cfg, db, str(gz))
+    db.commit()
+    c = db.conn
+    summ = c.execute("SELECT first_ts, last_ts FROM LOG_MATCH_SUMMARY WHERE run_id=?", (rid,)).fetchone()
+    assert tuple(summ) == ("2024-01-05T23:59:59", "2024-01-06T00:00:20")
+    key = c.execute("SELECT key_text, line_count, first_ts, last_ts FROM UNMATCHED_KEY WHERE run_id=?",
+                    (rid,)).fetchall()
+    # 月份 13 的时间戳不合法 计行数但不参与首末时间
+    assert [tuple(r) for r in key] == [("frame gap <NUM>", 3, "2024-01-05T23:59:59", "2024-01-06T00:00:10")]
+    db.close()